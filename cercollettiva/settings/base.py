@@ -232,10 +232,122 @@ MQTT_SETTINGS = {
     'QOS_LEVEL': int(os.getenv('MQTT_QOS', 1)),
     'KEEPALIVE': int(os.getenv('MQTT_KEEPALIVE', 60)),
     'TLS_ENABLED': os.getenv('MQTT_TLS', 'False') == 'True',
-    'CLEAN_SESSION': True,
+    # Sessione persistente (False): client id stabile, conferme dopo la
+    # scrittura nel DB e messaggi conservati dal broker per SESSION_EXPIRY
+    # secondi. run_mqtt_ingestor usa sempre la sessione persistente.
+    'CLEAN_SESSION': os.getenv('MQTT_CLEAN_SESSION', 'True') == 'True',
+    'CLIENT_ID': os.getenv('MQTT_CLIENT_ID', ''),
+    'SESSION_EXPIRY': int(os.getenv('MQTT_SESSION_EXPIRY', 3600)),  # secondi
     'TOPIC_PREFIX': 'CerCollettiva/',
     'STATUS_TOPIC': 'CerCollettiva/status',
     'ERROR_TOPIC': 'CerCollettiva/errors',
+    # Avvio dell'ingestione nei processi web (False = solo run_mqtt_ingestor)
+    'AUTOSTART': os.getenv('MQTT_AUTOSTART', 'True') == 'True',
+    # Gruppo per le sottoscrizioni condivise $share/<gruppo>/ tra più ingestori.
+    # Contatori di energia e compressione hanno stato per dispositivo in
+    # memoria: usarlo solo se il broker instrada i messaggi di un dispositivo
+    # sempre alla stessa replica (routing per dispositivo "sticky")
+    'SHARED_GROUP': os.getenv('MQTT_SHARED_GROUP', ''),
+    # Micro-batching delle scritture delle misurazioni
+    'BATCH_MAX_ROWS': int(os.getenv('MQTT_BATCH_MAX_ROWS', 500)),
+    'BATCH_MAX_DELAY': float(os.getenv('MQTT_BATCH_MAX_DELAY', 0.25)),  # secondi
+    # Dettagli di fase: 'rows' (righe DeviceMeasurementDetail) o 'packed'
+    # (compattati in DeviceMeasurement.phase_data, vedi pack_phase_details)
+    'PHASE_STORAGE': os.getenv('MQTT_PHASE_STORAGE', 'rows'),
+    # Worker di ingestione (0 = uno per core, max 8)
+    'INGEST_WORKERS': int(os.getenv('MQTT_INGEST_WORKERS', 0)),
+    'INGEST_QUEUE_SIZE': int(os.getenv('MQTT_INGEST_QUEUE_SIZE', 10000)),  # per worker
+    # Coda piena: 'block', 'drop-oldest' o 'spill' (log su disco con replay in ordine)
+    'INGEST_OVERLOAD_POLICY': os.getenv('MQTT_INGEST_OVERLOAD_POLICY', 'spill'),
+    'INGEST_BLOCK_TIMEOUT': float(os.getenv('MQTT_INGEST_BLOCK_TIMEOUT', 5)),  # secondi
+    'SPILL_DIR': os.getenv('MQTT_SPILL_DIR', str(BASE_DIR / 'spool' / 'mqtt')),
+    'SPILL_SEGMENT_BYTES': int(os.getenv('MQTT_SPILL_SEGMENT_BYTES', 64 * 1024 * 1024)),
+    'SPILL_FSYNC_INTERVAL': float(os.getenv('MQTT_SPILL_FSYNC_INTERVAL', 0.1)),  # secondi
+    # Righe in attesa oltre le quali il batch writer rallenta i worker
+    'BATCH_MAX_PENDING_ROWS': int(os.getenv('MQTT_BATCH_MAX_PENDING_ROWS', 50000)),
+    # Deduplicazione in memoria (la cache condivisa è usata solo con SHARED_GROUP)
+    'DEDUP_WINDOW': int(os.getenv('MQTT_DEDUP_WINDOW', 300)),  # secondi
+    'DEDUP_MAX_ENTRIES': int(os.getenv('MQTT_DEDUP_MAX_ENTRIES', 100000)),
+    'DEDUP_BLOOM': os.getenv('MQTT_DEDUP_BLOOM', 'False') == 'True',
+    # Scrittura differita di DeviceConfiguration.last_seen
+    'PRESENCE_FLUSH_INTERVAL': float(os.getenv('MQTT_PRESENCE_FLUSH_INTERVAL', 5)),  # secondi
+    # Scrittura differita dello stato dei contatori di energia
+    'COUNTER_FLUSH_INTERVAL': float(os.getenv('MQTT_COUNTER_FLUSH_INTERVAL', 5)),  # secondi
+    # Compressione delle misurazioni di potenza per tipo di dispositivo
+    # ('deadband' o 'swinging_door'); COMPRESSION_PROFILES sovrascrive i
+    # parametri per tipo, es. {'SHELLY_PRO_3EM': {'method': 'deadband', 'power': 5}}
+    'COMPRESSION_DEVICE_TYPES': [t for t in os.getenv('MQTT_COMPRESSION_DEVICE_TYPES', '').split(',') if t],
+    'COMPRESSION_METHOD': os.getenv('MQTT_COMPRESSION_METHOD', 'swinging_door'),
+    'COMPRESSION_POWER_TOLERANCE': float(os.getenv('MQTT_COMPRESSION_POWER_TOLERANCE', 10)),  # W
+    'COMPRESSION_VOLTAGE_TOLERANCE': float(os.getenv('MQTT_COMPRESSION_VOLTAGE_TOLERANCE', 2)),  # V
+    'COMPRESSION_CURRENT_TOLERANCE': float(os.getenv('MQTT_COMPRESSION_CURRENT_TOLERANCE', 0.05)),  # A
+    'COMPRESSION_MAX_INTERVAL': float(os.getenv('MQTT_COMPRESSION_MAX_INTERVAL', 60)),  # secondi
+    'COMPRESSION_PROFILES': {},
+    # Scrittura degli istogrammi di latenza per topic in TopicMetrics
+    'METRICS_FLUSH_INTERVAL': float(os.getenv('MQTT_METRICS_FLUSH_INTERVAL', 60)),  # secondi
+    # Sottoscrizioni incrementali: topic per pacchetto e raggruppamento delle modifiche
+    'SUBSCRIBE_BATCH_SIZE': int(os.getenv('MQTT_SUBSCRIBE_BATCH_SIZE', 100)),
+    'SUBSCRIBE_DEBOUNCE': float(os.getenv('MQTT_SUBSCRIBE_DEBOUNCE', 0.5)),  # secondi
+    'SUBSCRIBE_MAX_DELAY': float(os.getenv('MQTT_SUBSCRIBE_MAX_DELAY', 5)),  # secondi
+    # Backend HTTP auth/ACL del broker: host ammessi e controllo della versione in cache
+    'AUTH_ALLOWED_HOSTS': [h for h in os.getenv('MQTT_AUTH_ALLOWED_HOSTS', '127.0.0.1,::1').split(',') if h],
+    'ACL_VERSION_CHECK_INTERVAL': float(os.getenv('MQTT_ACL_VERSION_CHECK_INTERVAL', 1)),  # secondi
+    # Log di audit: scrittura differita e frazione registrata delle operazioni ad alto volume
+    'AUDIT_FLUSH_INTERVAL': float(os.getenv('MQTT_AUDIT_FLUSH_INTERVAL', 5)),  # secondi
+    'AUDIT_SAMPLE_RATES': {
+        'MESSAGE': float(os.getenv('MQTT_AUDIT_MESSAGE_SAMPLE_RATE', 0.001)),
+        'ACL_CHECK': float(os.getenv('MQTT_AUDIT_ACL_SAMPLE_RATE', 0.01)),
+    },
+}
+
+# Collector Modbus-TCP degli inverter (run_modbus_collector)
+MODBUS_SETTINGS = {
+    # Letture contemporanee per gateway (SDongle/SmartLogger) e poll in corso in totale
+    'MAX_CONNECTIONS_PER_GATEWAY': int(os.getenv('MODBUS_MAX_CONNECTIONS_PER_GATEWAY', 1)),
+    'MAX_CONCURRENT_POLLS': int(os.getenv('MODBUS_MAX_CONCURRENT_POLLS', 200)),
+    'TIMEOUT': float(os.getenv('MODBUS_TIMEOUT', 5)),  # secondi
+    # Registri non usati letti pur di unire due letture in una sola richiesta
+    'MAX_REGISTER_GAP': int(os.getenv('MODBUS_MAX_REGISTER_GAP', 20)),
+    # Intervallo massimo tra i tentativi verso un inverter che non risponde
+    'MAX_BACKOFF': float(os.getenv('MODBUS_MAX_BACKOFF', 300)),  # secondi
+}
+
+# Poller RPC HTTP dei dispositivi Shelly Gen2 senza MQTT (run_shelly_poller)
+SHELLY_POLLER_SETTINGS = {
+    # Connessioni keep-alive per dispositivo e poll in corso in totale
+    'MAX_CONNECTIONS_PER_HOST': int(os.getenv('SHELLY_MAX_CONNECTIONS_PER_HOST', 1)),
+    'MAX_CONCURRENT_POLLS': int(os.getenv('SHELLY_MAX_CONCURRENT_POLLS', 500)),
+    # Intervallo minimo tra due richieste allo stesso dispositivo
+    'MIN_REQUEST_INTERVAL': float(os.getenv('SHELLY_MIN_REQUEST_INTERVAL', 0.1)),  # secondi
+    'TIMEOUT': float(os.getenv('SHELLY_TIMEOUT', 5)),  # secondi
+    # Intervallo massimo tra i tentativi verso un dispositivo che non risponde
+    'MAX_BACKOFF': float(os.getenv('SHELLY_MAX_BACKOFF', 300)),  # secondi
+}
+
+# Partizioni mensili delle misurazioni (PostgreSQL, manage_measurement_partitions)
+MEASUREMENT_PARTITION_SETTINGS = {
+    # Mesi futuri per cui tenere pronte le partizioni
+    'PREMAKE_MONTHS': int(os.getenv('MEASUREMENT_PARTITION_PREMAKE_MONTHS', 3)),
+    # Mesi di misurazioni da conservare, mese corrente incluso (0 = nessuna scadenza)
+    'RETENTION_MONTHS': int(os.getenv('MEASUREMENT_RETENTION_MONTHS', 0)),
+    # Le partizioni scadute vengono eliminate invece che solo staccate
+    'DROP_EXPIRED': os.getenv('MEASUREMENT_PARTITION_DROP_EXPIRED', 'False') == 'True',
+}
+
+# Retention a livelli: misurazioni grezze, rollup a 1 minuto, rollup a 15 minuti senza scadenza
+# (apply_measurement_retention; 0 giorni = nessuna scadenza)
+MEASUREMENT_RETENTION_SETTINGS = {
+    # Giorni di misurazioni grezze da conservare
+    'RAW_DAYS': int(os.getenv('MQTT_DATA_RETENTION_DAYS', 30)),
+    # Giorni di rollup a 1 minuto da conservare
+    'ROLLUP_1M_DAYS': int(os.getenv('MEASUREMENT_ROLLUP_1M_DAYS', 180)),
+    # Ore di dati aggregate o cancellate per transazione
+    'CHUNK_HOURS': int(os.getenv('MEASUREMENT_RETENTION_CHUNK_HOURS', 6)),
+    # Ritardo prima di aggregare un minuto, per le misurazioni in arrivo
+    'SETTLE_MINUTES': int(os.getenv('MEASUREMENT_ROLLUP_SETTLE_MINUTES', 5)),
+    # Intervalli oltre i quali i grafici leggono i rollup a 1 e a 15 minuti
+    'RAW_MAX_SPAN_HOURS': int(os.getenv('MEASUREMENT_RAW_MAX_SPAN_HOURS', 48)),
+    'ROLLUP_1M_MAX_SPAN_DAYS': int(os.getenv('MEASUREMENT_ROLLUP_1M_MAX_SPAN_DAYS', 7)),
 }
 
 # Logging
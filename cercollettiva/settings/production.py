@@ -134,6 +134,10 @@ MQTT_SETTINGS = {
     'ERROR_TOPIC': 'CerCollettiva/errors',
     'LAST_WILL_TOPIC': 'CerCollettiva/status',
     'LAST_WILL_MESSAGE': 'offline',
+    # In produzione l'ingestione gira nel processo dedicato run_mqtt_ingestor
+    'AUTOSTART': os.getenv('MQTT_AUTOSTART', 'False') == 'True',
+    # Disattivato: vedi la nota su SHARED_GROUP in base.py
+    'SHARED_GROUP': os.getenv('MQTT_SHARED_GROUP', ''),
 }
 
 # Rest Framework produzione
@@ -3,12 +3,12 @@
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.db.models import Sum
+from django.db.models import OuterRef, Subquery, Sum
 from datetime import timedelta
 import logging
 
 from ...models import CERConfiguration, Plant
-from energy.models import DeviceMeasurement
+from energy.models import DeviceConfiguration, DeviceLatestState
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +27,23 @@ def cer_power_api(request):
                 memberships__is_active=True
             )
             
+        # Potenza attuale del primo dispositivo di ogni impianto (plant.devices.first(),
+        # il più recente): una query per i dispositivi e una per gli stati
+        newest_device = DeviceConfiguration.objects.filter(plant=OuterRef('pk')).values('pk')[:1]
+        device_plants = dict(
+            Plant.objects.filter(cer_configuration__in=cer_list, is_active=True)
+            .annotate(device_pk=Subquery(newest_device))
+            .filter(device_pk__isnull=False)
+            .values_list('device_pk', 'pk')
+        )
+        plant_power = {
+            device_plants[device_id]: power
+            for device_id, power in DeviceLatestState.objects.filter(
+                device_id__in=list(device_plants),
+                timestamp__gte=time_threshold
+            ).values_list('device_id', 'power')
+        }
+
         cer_data = []
         for cer in cer_list:
             # Calcola potenze
@@ -39,18 +56,12 @@ def cer_power_api(request):
             )
             
             for plant in plants:
-                device = plant.devices.first()
-                if device:
-                    measurement = DeviceMeasurement.objects.filter(
-                        device=device,
-                        timestamp__gte=time_threshold
-                    ).order_by('-timestamp').first()
-                    
-                    if measurement:
-                        if plant.plant_type == 'PRODUCER' and measurement.power > 0:
-                            producer_power += measurement.power
-                        elif plant.plant_type == 'CONSUMER':
-                            consumer_power += abs(measurement.power)
+                power = plant_power.get(plant.id)
+                if power is not None:
+                    if plant.plant_type == 'PRODUCER' and power > 0:
+                        producer_power += power
+                    elif plant.plant_type == 'CONSUMER':
+                        consumer_power += abs(power)
             
             # Converti in kW
             producer_power_kw = round(producer_power / 1000.0, 2)
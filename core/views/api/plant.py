@@ -10,7 +10,8 @@ from datetime import timedelta
 import logging
 
 from ...models import Plant
-from energy.models import DeviceConfiguration, DeviceMeasurement
+from energy.models import DeviceConfiguration, DeviceLatestState, DeviceMeasurement
+from energy.retention import read_measurements
 
 logger = logging.getLogger(__name__)
 
@@ -45,10 +46,11 @@ def get_plant_data(request, pk):
                 'detail': 'Non esistono dispositivi configurati per questo impianto'
             }, status=404)
             
-        # Recupera ultima misurazione per potenza attuale
-        last_measurement = DeviceMeasurement.objects.filter(
-            device=device
-        ).order_by('-timestamp').first()
+        # Recupera ultima misurazione per potenza attuale (stato del dispositivo)
+        last_measurement = DeviceLatestState.objects.filter(
+            device=device,
+            timestamp__isnull=False
+        ).first()
         
         # Recupera misurazioni per il grafico
         measurements = DeviceMeasurement.objects.filter(
@@ -113,7 +115,7 @@ def get_plant_data(request, pk):
 
 @login_required
 def plant_measurements_api(request, plant_id):
-    """API per le misurazioni di un impianto"""
+    """API per le misurazioni di un impianto (grezze o rollup, secondo l'intervallo)"""
     try:
         # Verifica permessi con la stessa logica ottimizzata
         if request.user.is_staff:
@@ -136,35 +138,31 @@ def plant_measurements_api(request, plant_id):
                 'detail': 'Non esistono dispositivi configurati per questo impianto'
             }, status=404)
             
-        # Parametri temporali
-        hours = min(int(request.GET.get('hours', 24)), 48)  # Max 48h
+        # Parametri temporali: oltre le 48h si leggono i rollup
+        hours = min(int(request.GET.get('hours', 24)), 24 * 31)  # Max 31 giorni
         time_threshold = timezone.now() - timedelta(hours=hours)
         
         # Recupera misurazioni
-        measurements = DeviceMeasurement.objects.filter(
-            device=device,
-            timestamp__gte=time_threshold
-        ).order_by('timestamp')
+        points = read_measurements(time_threshold, device=device)
         
         return JsonResponse({
             'data': [{
-                'timestamp': m.timestamp.isoformat(),
-                'power': float(m.power),
-                'voltage': float(m.voltage),
-                'current': float(m.current),
-                'energy_total': float(m.energy_total),
-                'quality': m.quality
-            } for m in measurements],
+                'timestamp': p.timestamp.isoformat(),
+                'power': float(p.power),
+                'voltage': float(p.voltage),
+                'current': float(p.current),
+                'energy_total': float(p.energy_total),
+                'quality': p.quality,
+                'resolution': p.resolution
+            } for p in points],
             'plant_info': {
                 'name': plant.name,
                 'type': plant.plant_type,
                 'pod': plant.pod_code
             },
             'stats': {
-                'total_points': measurements.count(),
-                'avg_power': float(measurements.aggregate(
-                    avg=Avg('power')
-                )['avg'] or 0)
+                'total_points': len(points),
+                'avg_power': float(sum(p.power for p in points) / len(points)) if points else 0.0
             }
         })
         
@@ -8,7 +8,12 @@ from .models import (
     EnergyAggregate,
     EnergyInterval,
     DeviceConfiguration,
-    MQTTBroker
+    MQTTBroker,
+    ModbusConfiguration,
+    ShellyRPCConfiguration,
+    MeasurementRollup,
+    DeviceLatestState,
+    TopicMetrics
 )
 from .models.device import DeviceType, Device
 
@@ -60,9 +65,18 @@ class DeviceMeasurementAdmin(admin.ModelAdmin):
     list_filter = ['quality', 'device', 'plant']
     search_fields = ['device__device_id', 'plant__name']
     date_hierarchy = 'timestamp'
-    readonly_fields = ['apparent_power', 'reactive_power']
+    readonly_fields = ['apparent_power', 'reactive_power', 'packed_phases']
     inlines = [DeviceMeasurementDetailInline]
 
+    def packed_phases(self, obj):
+        if not obj.phase_data:
+            return "-"
+        return ", ".join(
+            f"{detail.phase.upper()}: {detail.voltage}V {detail.current}A {detail.power}W"
+            for detail in obj.phases
+        )
+    packed_phases.short_description = "Fasi (compattate)"
+
     def device_id(self, obj):
         return obj.device.device_id
     device_id.short_description = "Device ID"
@@ -172,4 +186,95 @@ class MQTTBrokerAdmin(admin.ModelAdmin):
             'fields': ('notes', 'created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
-    )
\ No newline at end of file
+    )
+@admin.register(ModbusConfiguration)
+class ModbusConfigurationAdmin(admin.ModelAdmin):
+    list_display = [
+        'device',
+        'host',
+        'port',
+        'unit_id',
+        'poll_interval',
+        'is_active'
+    ]
+    list_filter = ['is_active']
+    search_fields = ['device__device_id', 'host']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(ShellyRPCConfiguration)
+class ShellyRPCConfigurationAdmin(admin.ModelAdmin):
+    list_display = [
+        'device',
+        'host',
+        'port',
+        'poll_interval',
+        'is_active'
+    ]
+    list_filter = ['is_active']
+    search_fields = ['device__device_id', 'host']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(MeasurementRollup)
+class MeasurementRollupAdmin(admin.ModelAdmin):
+    list_display = [
+        'device',
+        'measurement_type',
+        'resolution',
+        'bucket_start',
+        'power_avg',
+        'sample_count'
+    ]
+    list_filter = ['resolution', 'measurement_type']
+    search_fields = ['device__device_id']
+    date_hierarchy = 'bucket_start'
+
+
+@admin.register(DeviceLatestState)
+class DeviceLatestStateAdmin(admin.ModelAdmin):
+    list_display = [
+        'device',
+        'plant',
+        'power',
+        'voltage',
+        'timestamp',
+        'energy_timestamp'
+    ]
+    search_fields = ['device__device_id']
+    readonly_fields = ['updated_at']
+
+@admin.register(TopicMetrics)
+class TopicMetricsAdmin(admin.ModelAdmin):
+    list_display = [
+        'topic',
+        'device_type',
+        'period_start',
+        'messages_count',
+        'errors_count',
+        'avg_processing_time',
+        'p50_processing_time',
+        'p95_processing_time',
+        'p99_processing_time',
+        'parse_p95',
+        'persist_p95',
+        'lag_p95'
+    ]
+    list_filter = ['period_type', 'device_type']
+    search_fields = ['topic', 'device__device_id']
+    date_hierarchy = 'period_start'
+    ordering = ['-period_start', '-p95_processing_time']
+    raw_id_fields = ['device']
+    readonly_fields = ['latency_stats', 'created_at', 'updated_at']
+
+    def parse_p95(self, obj):
+        return f"{obj.stage_percentile('parse'):.1f} ms"
+    parse_p95.short_description = "Decodifica p95"
+
+    def persist_p95(self, obj):
+        return f"{obj.stage_percentile('persist'):.1f} ms"
+    persist_p95.short_description = "Scrittura p95"
+
+    def lag_p95(self, obj):
+        return f"{obj.stage_percentile('lag'):.1f} ms"
+    lag_p95.short_description = "Ritardo dispositivo p95"
@@ -74,7 +74,7 @@ class DeviceMeasurementDetailSerializer(serializers.ModelSerializer):
         ]
 
 class DeviceMeasurementSerializer(serializers.ModelSerializer):
-    phase_details = DeviceMeasurementDetailSerializer(many=True, read_only=True)
+    phase_details = DeviceMeasurementDetailSerializer(source='phases', many=True, read_only=True)
     device = DeviceConfigurationSerializer(read_only=True)
     apparent_power = serializers.FloatField(read_only=True)
     reactive_power = serializers.FloatField(read_only=True)
@@ -9,6 +9,16 @@ from functools import partial
 
 logger = logging.getLogger('energy.apps')
 
+def mqtt_autostart_enabled():
+    """
+    Indica se avviare l'ingestione MQTT all'interno del processo web.
+    Con MQTT_AUTOSTART=False l'ingestione gira solo nel processo dedicato
+    avviato con `manage.py run_mqtt_ingestor`.
+    """
+    if getattr(settings, 'TESTING', False):
+        return False
+    return getattr(settings, 'MQTT_SETTINGS', {}).get('AUTOSTART', True)
+
 def init_mqtt_after_ready(sender, **kwargs):
     """Inizializza MQTT dopo che tutte le app sono pronte"""
     from energy.services.signals import delayed_mqtt_connect
@@ -16,11 +26,9 @@ def init_mqtt_after_ready(sender, **kwargs):
     print("\n=========== MQTT INIT =============")
     print(" Inizializzazione MQTT in corso...")
     
-    # Controlla solo se siamo in modalità test
-    is_testing = getattr(settings, 'TESTING', False)
-    
-    if is_testing:
-        print(" | ✗ Test mode - MQTT disabilitato  |")
+    # Controlla se siamo in modalità test o se l'ingestione gira in un processo dedicato
+    if not mqtt_autostart_enabled():
+        print(" | ✗ Avvio automatico MQTT disabilitato |")
         print("==================================\n")
         return
         
@@ -44,15 +52,14 @@ class EnergyConfig(AppConfig):
                 print(" | ✓ Log rotation configurata      |")
                 
                 # Inizializza MQTT una sola volta
-                is_testing = getattr(settings, 'TESTING', False)
-                if not is_testing:
+                if mqtt_autostart_enabled():
                     # Import qui per evitare import circolari
                     from .mqtt.client import init_mqtt_connection
                     print(" | Avvio diretto thread MQTT...    |")
                     threading.Thread(target=init_mqtt_connection, daemon=True).start()
                     print(" | ✓ Thread MQTT avviato           |")
                 else:
-                    print(" | ✗ Test mode - MQTT disabilitato |")
+                    print(" | ✗ Avvio automatico MQTT disabilitato |")
                     
                 print("==================================\n")
                     
@@ -1,9 +1,10 @@
 # energy/devices/base/device.py
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from dataclasses import dataclass
 from datetime import datetime
 import logging
+import math
 
 @dataclass
 class MeasurementData:
@@ -20,7 +21,22 @@ class MeasurementData:
     extra_data: Optional[Dict[str, Any]] = None
 
 class BaseDevice(ABC):
-    """Classe base per tutti i dispositivi"""
+    """
+    Classe base per tutti i dispositivi.
+
+    I driver sono stateless e condivisi: il DeviceRegistry ne crea una sola
+    istanza per classe, quindi non vanno salvati dati per-dispositivo
+    sull'istanza.
+
+    Contratto con la pipeline di ingestione MQTT (energy/mqtt/pipeline.py):
+    `get_topics` indica i topic da sottoscrivere, il payload viene decodificato
+    con il mapping del tipo di dispositivo (DeviceType.mqtt_payload_format o
+    mapping integrato) e `validate_record` decide se il MeasurementRecord
+    risultante può essere salvato.
+    """
+
+    # Nomi alternativi del modello accettati dal DeviceRegistry
+    aliases: Tuple[str, ...] = ()
 
     def __init__(self):
         self.logger = logging.getLogger(f'energy.devices.{self.__class__.__name__}')
@@ -117,6 +133,24 @@ class BaseDevice(ABC):
             self.logger.error(f"Error validating measurement: {str(e)}", exc_info=True)
             return False
 
+    def validate_record(self, record) -> bool:
+        """
+        Valida un MeasurementRecord decodificato dalla pipeline di ingestione.
+        Può essere sovrascritto dalle classi figlie per validazioni specifiche.
+        """
+        values = (record.power, record.energy_total, record.voltage, record.current)
+        if not all(isinstance(value, (int, float)) and math.isfinite(value) for value in values):
+            self.logger.warning(f"Record validation failed: non-numeric values on {record.topic}")
+            return False
+        if not (
+            -1000000 <= record.power <= 1000000 and  # ±1MW
+            0 <= record.voltage <= 500 and           # 0-500V
+            -1000 <= record.current <= 1000         # ±1000A
+        ):
+            self.logger.warning(f"Record validation failed: values out of range on {record.topic}")
+            return False
+        return True
+
     def log_measurement(self, measurement: MeasurementData) -> None:
         """Logga i dettagli di una misurazione per debug"""
         if measurement:
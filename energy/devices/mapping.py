@@ -0,0 +1,426 @@
+# energy/devices/mapping.py
+"""
+Mapping dichiarativi dei payload MQTT.
+
+Un mapping descrive dove si trovano i valori di misura nel payload JSON di
+un dispositivo e viene compilato una sola volta in una funzione di
+estrazione: percorsi, chiavi di fase e fattori di scala sono risolti in
+compilazione, quindi per ogni messaggio restano solo pochi accessi a
+dizionario.
+
+Formato (DeviceType.mqtt_payload_format)::
+
+    {
+        "messages": {
+            "status/em:0": {
+                "kind": "POWER",
+                "fields": {
+                    "power": "total_act_power",
+                    "energy_total": {"path": "total_act", "unit": "Wh"},
+                    "voltage": "a_voltage",
+                    "current": {"path": "a_current", "scale": 1.0},
+                    "power_factor": {"path": "total_pf", "default": 1.0}
+                },
+                "phases": {
+                    "names": ["a", "b", "c"],
+                    "fields": {
+                        "voltage": "{phase}_voltage",
+                        "current": "{phase}_current",
+                        "power": "{phase}_act_power",
+                        "power_factor": "{phase}_pf",
+                        "frequency": "{phase}_freq"
+                    }
+                }
+            }
+        }
+    }
+
+Le chiavi di "messages" sono suffissi del topic. I percorsi annidati usano
+il punto ("ENERGY.Power"), gli indici numerici accedono alle liste. Le
+unità vengono convertite in W, Wh, V, A e Hz.
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger('energy.mqtt')
+
+KIND_POWER = 'POWER'
+KIND_ENERGY = 'ENERGY'
+KINDS = (KIND_POWER, KIND_ENERGY)
+
+# Campi del record in ordine, con il valore predefinito
+RECORD_FIELDS = (
+    ('power', 0.0),
+    ('energy_total', 0.0),
+    ('voltage', 0.0),
+    ('current', 0.0),
+    ('power_factor', 1.0),
+)
+PHASE_FIELDS = (
+    ('voltage', 0.0),
+    ('current', 0.0),
+    ('power', 0.0),
+    ('power_factor', 1.0),
+    ('frequency', 50.0),
+)
+DEFAULT_PHASE_REQUIRED = ('voltage', 'current', 'power')
+
+# Fattori di conversione verso le unità canoniche
+UNIT_FACTORS = {
+    None: 1.0,
+    'W': 1.0, 'kW': 1000.0, 'MW': 1000000.0,
+    'Wh': 1.0, 'kWh': 1000.0, 'MWh': 1000000.0,
+    'V': 1.0, 'kV': 1000.0,
+    'A': 1.0, 'mA': 0.001,
+    'Hz': 1.0,
+    '%': 0.01,
+}
+
+# Dizionario vuoto condiviso per i lookup senza allocazioni
+_EMPTY: Dict = {}
+
+# Estrattore compilato: payload -> (power, energy_total, voltage, current, power_factor, phases)
+Extractor = Callable[[dict], tuple]
+
+
+class MappingError(ValueError):
+    """Specifica di mapping non valida"""
+
+
+def _parse_path(path: str) -> Tuple[Any, ...]:
+    if not isinstance(path, str) or not path:
+        raise MappingError(f"Percorso non valido: {path!r}")
+    return tuple(int(part) if part.isdigit() else part for part in path.split('.'))
+
+
+def _compile_getter(spec: Any, default: float, phase: Optional[str] = None) -> Callable[[dict], float]:
+    """Compila la specifica di un campo in una funzione payload -> float"""
+    if isinstance(spec, str):
+        spec = {'path': spec}
+    if not isinstance(spec, dict) or 'path' not in spec:
+        raise MappingError(f"Specifica di campo non valida: {spec!r}")
+
+    path = spec['path']
+    if phase is not None:
+        path = path.replace('{phase}', phase)
+    keys = _parse_path(path)
+
+    unit = spec.get('unit')
+    if unit not in UNIT_FACTORS:
+        raise MappingError(f"Unità non supportata: {unit!r}")
+    try:
+        factor = UNIT_FACTORS[unit] * float(spec.get('scale', 1.0))
+        default = float(spec.get('default', default))
+    except (TypeError, ValueError):
+        raise MappingError(f"Scala o default non numerici: {spec!r}")
+
+    if len(keys) == 1:
+        key = keys[0]
+        if factor == 1.0:
+            def getter(payload):
+                value = payload.get(key)
+                return default if value is None else float(value)
+        else:
+            def getter(payload):
+                value = payload.get(key)
+                return default if value is None else float(value) * factor
+        return getter
+
+    def nested_getter(payload):
+        value = payload
+        try:
+            for key in keys:
+                value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return default
+        return default if value is None else float(value) * factor
+    return nested_getter
+
+
+def _compile_presence(path: str) -> Callable[[dict], bool]:
+    keys = _parse_path(path)
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda payload: key in payload
+
+    def present(payload):
+        value = payload
+        try:
+            for key in keys:
+                value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return False
+        return True
+    return present
+
+
+def _field_path(spec: Any) -> str:
+    return spec if isinstance(spec, str) else spec.get('path', '')
+
+
+def _compile_phases(spec: Dict[str, Any]) -> Callable[[dict], tuple]:
+    names = spec.get('names', ())
+    fields = spec.get('fields', {})
+    required = spec.get('required', DEFAULT_PHASE_REQUIRED)
+    if not isinstance(names, (list, tuple)) or not isinstance(fields, dict):
+        raise MappingError("Gruppo di fasi non valido: servono 'names' e 'fields'")
+    unknown = set(fields) - {name for name, _ in PHASE_FIELDS}
+    if unknown:
+        raise MappingError(f"Campi di fase sconosciuti: {sorted(unknown)}")
+    missing = [name for name in required if name not in fields]
+    if missing:
+        raise MappingError(f"Campi di fase obbligatori senza percorso: {missing}")
+
+    compiled = []
+    for phase in names:
+        checks = tuple(
+            _compile_presence(_field_path(fields[name]).replace('{phase}', phase))
+            for name in required
+        )
+        getters = tuple(
+            _compile_getter(fields[name], default, phase) if name in fields else (lambda payload, d=default: d)
+            for name, default in PHASE_FIELDS
+        )
+        compiled.append((phase, checks, *getters))
+    compiled = tuple(compiled)
+
+    def extract_phases(payload):
+        phases = []
+        for phase, checks, voltage, current, power, power_factor, frequency in compiled:
+            for check in checks:
+                if not check(payload):
+                    break
+            else:
+                phases.append((phase, voltage(payload), current(payload), power(payload),
+                               power_factor(payload), frequency(payload)))
+        return tuple(phases)
+    return extract_phases
+
+
+def compile_message(spec: Dict[str, Any]) -> Tuple[str, Extractor]:
+    """Compila la specifica di un tipo di messaggio in (kind, estrattore)"""
+    if not isinstance(spec, dict):
+        raise MappingError(f"Specifica di messaggio non valida: {spec!r}")
+    kind = spec.get('kind', KIND_POWER)
+    if kind not in KINDS:
+        raise MappingError(f"Tipo di messaggio non supportato: {kind!r}")
+    fields = spec.get('fields', {})
+    if not isinstance(fields, dict):
+        raise MappingError("'fields' deve essere un oggetto")
+    unknown = set(fields) - {name for name, _ in RECORD_FIELDS}
+    if unknown:
+        raise MappingError(f"Campi sconosciuti: {sorted(unknown)}")
+
+    power, energy, voltage, current, power_factor = (
+        _compile_getter(fields[name], default) if name in fields else (lambda payload, d=default: d)
+        for name, default in RECORD_FIELDS
+    )
+    phases = _compile_phases(spec['phases']) if spec.get('phases') else (lambda payload: ())
+
+    def extract(payload):
+        return (power(payload), energy(payload), voltage(payload), current(payload),
+                power_factor(payload), phases(payload))
+    return kind, extract
+
+
+class PayloadMapping:
+    """Mapping compilato di un tipo di dispositivo: suffisso del topic -> estrattore"""
+
+    def __init__(self, spec: Dict[str, Any], name: str = ''):
+        self.name = name
+        messages = spec.get('messages') if isinstance(spec, dict) else None
+        if not isinstance(messages, dict) or not messages:
+            raise MappingError("Il mapping deve definire almeno un messaggio in 'messages'")
+        # I suffissi più lunghi hanno la precedenza
+        self._messages: List[Tuple[str, str, Extractor]] = sorted(
+            ((suffix, *compile_message(message)) for suffix, message in messages.items()),
+            key=lambda item: len(item[0]),
+            reverse=True
+        )
+
+    def match(self, topic: str) -> Optional[Tuple[str, Extractor]]:
+        """(kind, estrattore) del messaggio che corrisponde al topic"""
+        for suffix, kind, extract in self._messages:
+            if topic.endswith(suffix):
+                return kind, extract
+        return None
+
+    def __repr__(self) -> str:
+        return f"<PayloadMapping {self.name} {[suffix for suffix, _, _ in self._messages]}>"
+
+
+def _shelly_phase_fields() -> Dict[str, Any]:
+    return {
+        'names': ['a', 'b', 'c'],
+        'fields': {
+            'voltage': '{phase}_voltage',
+            'current': '{phase}_current',
+            'power': '{phase}_act_power',
+            'power_factor': '{phase}_pf',
+            'frequency': '{phase}_freq',
+        },
+    }
+
+
+# Mapping integrati (usati se il DeviceType non definisce mqtt_payload_format)
+SHELLY_GEN2_SPEC = {
+    'messages': {
+        'em:0': {
+            'kind': KIND_POWER,
+            'fields': {
+                'power': 'total_act_power',
+                'energy_total': {'path': 'total_act', 'unit': 'Wh'},
+                'voltage': 'a_voltage',
+                'current': 'a_current',
+                'power_factor': 'total_pf',
+            },
+            'phases': _shelly_phase_fields(),
+        },
+        'emdata:0': {
+            'kind': KIND_ENERGY,
+            'fields': {
+                'energy_total': {'path': 'total_act', 'unit': 'Wh'},
+            },
+        },
+    }
+}
+
+TASMOTA_SENSOR_SPEC = {
+    'messages': {
+        'tele/SENSOR': {
+            'kind': KIND_POWER,
+            'fields': {
+                'power': {'path': 'ENERGY.Power', 'unit': 'W'},
+                'energy_total': {'path': 'ENERGY.Total', 'unit': 'kWh'},
+                'voltage': {'path': 'ENERGY.Voltage', 'unit': 'V'},
+                'current': {'path': 'ENERGY.Current', 'unit': 'A'},
+                'power_factor': 'ENERGY.Factor',
+            },
+        },
+    }
+}
+
+# Shelly Pro EM (componenti EM1 monofase)
+SHELLY_EM1_SPEC = {
+    'messages': {
+        'em1:0': {
+            'kind': KIND_POWER,
+            'fields': {
+                'power': 'act_power',
+                'voltage': 'voltage',
+                'current': 'current',
+                'power_factor': 'pf',
+            },
+        },
+        'em1data:0': {
+            'kind': KIND_ENERGY,
+            'fields': {
+                'energy_total': {'path': 'total_act_energy', 'unit': 'Wh'},
+            },
+        },
+    }
+}
+
+# Shelly Plus con misura sul relè (Plus Plug S, Plus PM)
+SHELLY_SWITCH_SPEC = {
+    'messages': {
+        'switch:0': {
+            'kind': KIND_POWER,
+            'fields': {
+                'power': 'apower',
+                'energy_total': {'path': 'aenergy.total', 'unit': 'Wh'},
+                'voltage': 'voltage',
+                'current': 'current',
+                'power_factor': 'pf',
+            },
+        },
+    }
+}
+
+BUILTIN_SPECS = {
+    ('TASMOTA', 'POWER_METER'): TASMOTA_SENSOR_SPEC,
+    ('SHELLY', 'PRO_EM'): SHELLY_EM1_SPEC,
+    ('SHELLY', 'PLUS_PLUG_S'): SHELLY_SWITCH_SPEC,
+    ('SHELLY', 'PLUS_PM'): SHELLY_SWITCH_SPEC,
+}
+
+DEFAULT_MAPPING = PayloadMapping(SHELLY_GEN2_SPEC, name='SHELLY_GEN2')
+
+
+class PayloadMappingRegistry:
+    """
+    Mapping compilati per tipo di dispositivo (vendor, model).
+
+    I mapping definiti in DeviceType.mqtt_payload_format vengono caricati
+    con una query e compilati una sola volta; `invalidate()` li fa
+    ricaricare al prossimo accesso. Senza mapping specifico si usa quello
+    integrato del vendor/modello o, in mancanza, DEFAULT_MAPPING.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mappings: Optional[Dict[Tuple[str, str], PayloadMapping]] = None
+        # vendor -> model così come configurati -> mapping (memo)
+        self._resolved: Dict[str, Dict[str, PayloadMapping]] = {}
+        self._builtin = {
+            key: PayloadMapping(spec, name='_'.join(key)) for key, spec in BUILTIN_SPECS.items()
+        }
+
+    def reload(self) -> int:
+        """Ricarica e compila i mapping dei DeviceType attivi"""
+        from ..models.device import DeviceType
+
+        mappings = {}
+        rows = DeviceType.objects.filter(is_active=True).values_list('vendor', 'model', 'mqtt_payload_format')
+        for vendor, model, spec in rows:
+            if not spec:
+                continue
+            key = (vendor.strip().upper(), model.strip().upper())
+            try:
+                mappings[key] = PayloadMapping(spec, name=f"{key[0]}_{key[1]}")
+            except MappingError as e:
+                logger.error(f"Mapping payload non valido per {vendor} {model}: {e}")
+        with self._lock:
+            self._mappings = mappings
+            self._resolved = {}
+        return len(mappings)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._mappings = None
+            self._resolved = {}
+
+    def get(self, vendor: Optional[str], model: Optional[str]) -> PayloadMapping:
+        """Mapping compilato per vendor/modello"""
+        mapping = self._resolved.get(vendor, _EMPTY).get(model)
+        if mapping is not None:
+            return mapping
+
+        mappings = self._mappings
+        if mappings is None:
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Errore caricamento mapping payload: {e}")
+                with self._lock:
+                    self._mappings = {}
+            mappings = self._mappings
+        key = ((vendor or '').strip().upper(), (model or '').strip().upper())
+        mapping = mappings.get(key) or self._builtin.get(key) or DEFAULT_MAPPING
+        self._resolved.setdefault(vendor, {})[model] = mapping
+        return mapping
+
+
+# Singleton instance
+_mapping_registry = None
+_mapping_registry_lock = threading.Lock()
+
+def get_mapping_registry() -> PayloadMappingRegistry:
+    """Ottiene l'istanza singleton del registro dei mapping"""
+    global _mapping_registry
+    if _mapping_registry is None:
+        with _mapping_registry_lock:
+            if _mapping_registry is None:
+                _mapping_registry = PayloadMappingRegistry()
+    return _mapping_registry
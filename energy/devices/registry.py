@@ -3,6 +3,7 @@ from typing import Dict, Type, Optional, List, Tuple
 from .base.device import BaseDevice
 from ..models.device import DeviceConfiguration
 import logging
+import threading
 
 # Importazione dei dispositivi supportati
 from .vendors.shelly.pro_3em import ShellyPro3EM
@@ -10,13 +11,42 @@ from .vendors.shelly.pro_em import ShellyProEM
 from .vendors.shelly.em_3 import ShellyEM3
 from .vendors.shelly.em import ShellyEM
 from .vendors.shelly.plus_plug_s import ShellyPlusPlugS
+from .vendors.huawei.sun2000 import HuaweiSUN2000
 
 logger = logging.getLogger(__name__)
 
+# Dizionario vuoto condiviso per i lookup senza allocazioni
+_EMPTY: Dict = {}
+# Marcatore dei lookup già risolti senza corrispondenza
+_MISSING = object()
+
+
+def _normalize(value: str) -> str:
+    """Normalizza vendor/model: maiuscolo, spazi e trattini come underscore"""
+    return value.strip().upper().replace(' ', '_').replace('-', '_')
+
+
 class DeviceRegistry:
-    """Registry centralizzato per tutti i dispositivi supportati"""
+    """
+    Registry centralizzato per tutti i dispositivi supportati.
+
+    I driver sono stateless: ogni classe viene istanziata una sola volta alla
+    registrazione e tutte le ricerche restituiscono la stessa istanza.
+    Le tabelle di lookup (device_type, vendor/model normalizzati e alias)
+    sono costruite alla registrazione, così le ricerche sul percorso dei
+    messaggi sono accessi a dizionario senza allocazioni.
+    """
     
     _devices: Dict[str, Type[BaseDevice]] = {}
+    _instances: Dict[str, BaseDevice] = {}
+    # (vendor, model) normalizzati, anche senza underscore e per alias -> driver
+    _lookup: Dict[Tuple[str, str], BaseDevice] = {}
+    # vendor -> model così come richiesti dai chiamanti -> driver (memo)
+    _resolved: Dict[str, Dict[str, object]] = {}
+    _vendors: List[str] = []
+    _models: Dict[str, List[str]] = {}
+    _choices: List[Tuple[str, str]] = []
+    _lock = threading.RLock()
     
     @classmethod
     def register(cls, device_class: Type[BaseDevice]) -> None:
@@ -25,7 +55,10 @@ class DeviceRegistry:
             key = '_'.join([device.vendor, device.model]).upper()
             if not key:
                 raise ValueError(f"Device {device_class.__name__} non ha un device_type valido")
-            cls._devices[key] = device_class
+            with cls._lock:
+                cls._devices[key] = device_class
+                cls._instances[key] = device
+                cls._rebuild()
             # Riduci i log a una sola riga per dispositivo registrato
             #logger.info(f"Registrato dispositivo: {key}")
         except Exception as e:
@@ -40,14 +73,38 @@ class DeviceRegistry:
         Args:
             device_type: Tipo di dispositivo da rimuovere
         """
-        if device_type in cls._devices:
-            del cls._devices[device_type]
-            logger.debug(f"Rimosso dispositivo: {device_type}")
+        with cls._lock:
+            if device_type in cls._devices:
+                del cls._devices[device_type]
+                cls._instances.pop(device_type, None)
+                cls._rebuild()
+                logger.debug(f"Rimosso dispositivo: {device_type}")
+
+    @classmethod
+    def _rebuild(cls) -> None:
+        """Ricostruisce le tabelle di lookup (chiamare con cls._lock)"""
+        lookup = {}
+        models: Dict[str, List[str]] = {}
+        for device in cls._instances.values():
+            vendor = _normalize(device.vendor)
+            names = [device.model, *getattr(device, 'aliases', ())]
+            for name in names:
+                model = _normalize(name)
+                lookup.setdefault((vendor, model), device)
+                lookup.setdefault((vendor, model.replace('_', '')), device)
+            models.setdefault(device.vendor.upper(), []).append(device.model)
+
+        # Sostituzione atomica: i lettori non prendono il lock
+        cls._lookup = lookup
+        cls._resolved = {}
+        cls._vendors = sorted({device.vendor for device in cls._instances.values()})
+        cls._models = {vendor: sorted(names) for vendor, names in models.items()}
+        cls._choices = [(key, device.get_display_name()) for key, device in cls._instances.items()]
     
     @classmethod
     def get_device(cls, device_type: str, vendor: str = None, model: str = None) -> Optional[BaseDevice]:
         """
-        Ottiene un'istanza di dispositivo dal registro
+        Ottiene l'istanza (condivisa) di un dispositivo dal registro
         
         Args:
             device_type: Tipo di dispositivo o vendor
@@ -60,8 +117,7 @@ class DeviceRegistry:
         if vendor and model:
             return cls.get_device_by_vendor_model(vendor, model)
         
-        device_class = cls._devices.get(device_type)
-        return device_class() if device_class else None
+        return cls._instances.get(device_type)
 
     @classmethod
     def list_devices(cls) -> List[Tuple[str, str]]:
@@ -71,8 +127,7 @@ class DeviceRegistry:
         Returns:
             List[Tuple[str, str]]: Lista di tuple (device_type, display_name)
         """
-        return [(key, device().get_display_name()) 
-                for key, device in cls._devices.items()]
+        return list(cls._choices)
     
     @classmethod
     def get_device_by_key(cls, key: str) -> Optional[BaseDevice]:
@@ -89,32 +144,21 @@ class DeviceRegistry:
 
     @classmethod
     def get_device_by_vendor_model(cls, vendor: str, model: str) -> Optional[BaseDevice]:
+        # Percorso veloce: coppia già risolta, nessuna allocazione
+        device = cls._resolved.get(vendor, _EMPTY).get(model, None)
+        if device is not None:
+            return None if device is _MISSING else device
+
         try:
-            vendor = vendor.strip().upper()
-            model = model.strip().upper()
-            
-            #logger.info(f"DEBUG - Input: vendor={vendor}, model={model}")
-            # logger.info(f"DEBUG - Devices registered: {cls._devices.keys()}")
-            
-            # Prova match diretto
-            key = f"{vendor}_{model}"
-            if key in cls._devices:
-                return cls._devices[key]()
-
-            # Prova match con model senza underscore
-            key_no_underscore = f"{vendor}_{model.replace('_', '')}"
-            if key_no_underscore in cls._devices:
-                return cls._devices[key_no_underscore]()
-
-            # Se nessun match, prova con device_type
-            for device_class in cls._devices.values():
-                device = device_class()
-                if (device.vendor.upper() == vendor and 
-                    device.model.upper() == model):
-                    return device_class()
-
-            logger.warning(f"No match found for {key}")
-            return None
+            key = (_normalize(vendor), _normalize(model))
+            device = cls._lookup.get(key)
+            if device is None:
+                device = cls._lookup.get((key[0], key[1].replace('_', '')))
+            if device is None:
+                logger.warning(f"No match found for {key[0]}_{key[1]}")
+
+            cls._resolved.setdefault(vendor, {})[model] = device if device is not None else _MISSING
+            return device
         except Exception as e:
             logger.error(f"Error in get_device_by_vendor_model: {e}")
             return None
@@ -144,7 +188,7 @@ class DeviceRegistry:
         Returns:
             List[str]: Lista dei vendor supportati
         """
-        return sorted(set(device().vendor for device in cls._devices.values()))
+        return list(cls._vendors)
 
     @classmethod
     def get_supported_models(cls, vendor: str) -> List[str]:
@@ -157,11 +201,7 @@ class DeviceRegistry:
         Returns:
             List[str]: Lista dei modelli supportati
         """
-        return sorted([
-            device().model
-            for device in cls._devices.values()
-            if device().vendor.upper() == vendor.upper()
-        ])
+        return list(cls._models.get(vendor.upper(), ()))
 
 
 def register_devices():
@@ -176,6 +216,9 @@ def register_devices():
         DeviceRegistry.register(ShellyEM3)          # Trifase prima generazione
         DeviceRegistry.register(ShellyEM)           # Monofase prima generazione
         DeviceRegistry.register(ShellyPlusPlugS)    # Smart plug con misurazione
+
+        # Huawei (letti via Modbus-TCP dal collector)
+        DeviceRegistry.register(HuaweiSUN2000)      # Inverter fotovoltaici SUN2000
         
         #logger.info("Dispositivi registrati con successo")
     except Exception as e:
@@ -0,0 +1,6 @@
+# energy/devices/vendors/huawei/__init__.py
+from .sun2000 import HuaweiSUN2000
+
+__all__ = [
+    'HuaweiSUN2000',
+]
\ No newline at end of file
@@ -0,0 +1,136 @@
+# energy/devices/vendors/huawei/sun2000.py
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, List, Mapping
+from django.utils import timezone
+import logging
+
+from ...base.inverter import BaseInverter
+from ...base.device import MeasurementData
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RegisterSpec:
+    """Registro holding dell'inverter: indirizzo, numero di word, segno e guadagno"""
+    name: str
+    address: int
+    count: int = 1
+    signed: bool = False
+    gain: float = 1.0
+
+    @property
+    def end(self) -> int:
+        return self.address + self.count
+
+    def decode(self, words: Mapping[int, int]) -> Optional[float]:
+        """Valore in unità ingegneristiche dalle word lette (big-endian), None se mancanti"""
+        value = 0
+        for offset in range(self.count):
+            word = words.get(self.address + offset)
+            if word is None:
+                return None
+            value = (value << 16) | word
+        if self.signed and value >= 1 << (16 * self.count - 1):
+            value -= 1 << (16 * self.count)
+        return value / self.gain
+
+
+# Registri del Modbus Interface Definitions SUN2000 (V3/M1) usati per le misurazioni
+SUN2000_REGISTERS = (
+    RegisterSpec('input_power', 32064, 2, signed=True, gain=1000),          # kW
+    RegisterSpec('phase_a_voltage', 32069, gain=10),                        # V
+    RegisterSpec('phase_b_voltage', 32070, gain=10),
+    RegisterSpec('phase_c_voltage', 32071, gain=10),
+    RegisterSpec('phase_a_current', 32072, 2, signed=True, gain=1000),      # A
+    RegisterSpec('phase_b_current', 32074, 2, signed=True, gain=1000),
+    RegisterSpec('phase_c_current', 32076, 2, signed=True, gain=1000),
+    RegisterSpec('active_power', 32080, 2, signed=True, gain=1000),         # kW
+    RegisterSpec('reactive_power', 32082, 2, signed=True, gain=1000),       # kvar
+    RegisterSpec('power_factor', 32084, signed=True, gain=1000),
+    RegisterSpec('grid_frequency', 32085, gain=100),                        # Hz
+    RegisterSpec('internal_temperature', 32087, signed=True, gain=10),      # °C
+    RegisterSpec('device_status', 32089),
+    RegisterSpec('accumulated_yield', 32106, 2, gain=100),                  # kWh
+    RegisterSpec('daily_yield', 32114, 2, gain=100),                        # kWh
+)
+
+
+class HuaweiSUN2000(BaseInverter):
+    """
+    Inverter Huawei SUN2000 letto via Modbus-TCP (direttamente o tramite
+    SDongle/SmartLogger) dal collector di energy/modbus.
+
+    Il driver descrive i registri da leggere e converte le word lette in
+    MeasurementData; la lettura e la pianificazione dei poll sono del
+    collector.
+    """
+
+    _vendor = "HUAWEI"
+    _model = "SUN2000"
+
+    registers = SUN2000_REGISTERS
+
+    @property
+    def vendor(self) -> str:
+        return self._vendor
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    def get_topics(self, base_topic: str) -> List[str]:
+        """Topic interni con cui il collector inoltra le letture alla pipeline"""
+        return [
+            f"{base_topic}/status/modbus/power",
+            f"{base_topic}/status/modbus/energy",
+        ]
+
+    def parse_message(self, topic: str, payload: Dict[str, Any]) -> Optional[MeasurementData]:
+        """Payload {'registers': {indirizzo: word}} come prodotto dal collector"""
+        registers = payload.get('registers') if isinstance(payload, dict) else None
+        if not registers:
+            return None
+        return self.parse_registers({int(address): word for address, word in registers.items()})
+
+    def parse_registers(self, words: Mapping[int, int], timestamp=None) -> Optional[MeasurementData]:
+        """Converte le word lette in una misurazione standardizzata"""
+        values = {spec.name: spec.decode(words) for spec in self.registers}
+        if values['active_power'] is None or values['accumulated_yield'] is None:
+            logger.warning("Registri SUN2000 incompleti: potenza attiva o energia mancante")
+            return None
+
+        power_factor = values['power_factor']
+        frequency = values['grid_frequency']
+        phase_data = {}
+        for phase in ('a', 'b', 'c'):
+            voltage = values[f'phase_{phase}_voltage']
+            current = values[f'phase_{phase}_current'] or 0.0
+            # Modelli monofase: fasi B e C a zero
+            if voltage:
+                # L'inverter non espone la potenza di fase: stima V·I·cosφ
+                phase_data[phase] = {
+                    'voltage': voltage,
+                    'current': current,
+                    'power': voltage * current * (power_factor if power_factor is not None else 1.0),
+                }
+
+        voltages = [data['voltage'] for data in phase_data.values()]
+        measurement = MeasurementData(
+            timestamp=timestamp or timezone.now(),
+            power=values['active_power'] * 1000,  # kW -> W
+            voltage=sum(voltages) / len(voltages) if voltages else 0.0,
+            current=sum(data['current'] for data in phase_data.values()),
+            energy=values['accumulated_yield'],  # kWh
+            power_factor=power_factor,
+            frequency=frequency if frequency else 50.0,
+            phase_data=phase_data or None,
+            extra_data={
+                'input_power': (values['input_power'] or 0.0) * 1000,
+                'reactive_power': (values['reactive_power'] or 0.0) * 1000,
+                'internal_temperature': values['internal_temperature'],
+                'device_status': values['device_status'],
+                'daily_yield': values['daily_yield'],
+            },
+        )
+        return measurement if self.validate_measurement(measurement) else None
@@ -7,6 +7,8 @@ from ...base.device import MeasurementData
 class ShellyEM3(BaseShellyMeter):
     """Shelly 3EM - Misuratore trifase di prima generazione"""
 
+    aliases = ("3EM",)
+
     @property
     def vendor(self) -> str:
         return "SHELLY"
@@ -0,0 +1,58 @@
+# energy/management/commands/apply_measurement_retention.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError
+
+from energy.retention import RetentionPolicy, apply_retention
+
+
+def _format_bytes(value):
+    if value is None:
+        return 'n/d'
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if value < 1024:
+            return f"{value:.0f} {unit}" if unit == 'B' else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TB"
+
+
+class Command(BaseCommand):
+    help = ('Applica la retention a livelli delle misurazioni: aggiorna i rollup a 1 e 15 minuti '
+            'e cancella le misurazioni grezze e i rollup a 1 minuto scaduti. '
+            'Da pianificare (es. cron ogni 15 minuti); --dry-run stima righe e byte liberabili.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Non modifica nulla: riporta righe e byte che verrebbero liberati'
+        )
+        parser.add_argument(
+            '--max-chunks',
+            type=int,
+            help="Blocchi massimi per livello in questa esecuzione (le successive riprendono da dove si è fermata)"
+        )
+
+    def handle(self, *args, **options):
+        if options['max_chunks'] is not None and options['max_chunks'] < 1:
+            raise CommandError("--max-chunks deve essere >= 1")
+
+        policy = RetentionPolicy.from_settings()
+        try:
+            report = apply_retention(policy, dry_run=options['dry_run'], max_chunks=options['max_chunks'])
+        except NotSupportedError as e:
+            raise CommandError(str(e))
+
+        for resolution, rows in report.rollups.items():
+            self.stdout.write(f"Rollup {resolution}: {rows} righe aggiornate")
+        for level, cutoff in report.cutoffs.items():
+            self.stdout.write(f"Livello {level}: scadute le righe precedenti a {cutoff.isoformat()}")
+        action = 'Liberabili' if report.dry_run else 'Cancellate'
+        for expired in report.expired:
+            line = f"{action} {expired.rows} righe da {expired.table}"
+            if report.dry_run:
+                line += f" (~{_format_bytes(expired.bytes)})"
+            self.stdout.write(line)
+        if report.dry_run:
+            total = sum(item.bytes or 0 for item in report.expired)
+            self.stdout.write(self.style.SUCCESS(f"Totale stimato: {_format_bytes(total)}"))
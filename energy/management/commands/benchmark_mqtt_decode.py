@@ -0,0 +1,95 @@
+# energy/management/commands/benchmark_mqtt_decode.py
+
+import hashlib
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from energy.mqtt import codec
+from energy.mqtt.dedup import MessageDeduplicator
+
+POWER_TOPIC = 'cercollettiva/IT001E00000001/shellypro3em-bench/status/em:0'
+ENERGY_TOPIC = 'cercollettiva/IT001E00000001/shellypro3em-bench/status/emdata:0'
+
+
+def sample_messages(count):
+    """Payload tipici Shelly Pro 3EM (em:0 e emdata:0 alternati)"""
+    messages = []
+    for i in range(count):
+        if i % 2:
+            payload = {'id': 0, 'total_act': 123456.7 + i, 'total_act_ret': 12.3,
+                       'a_total_act_energy': 41152.2, 'b_total_act_energy': 41152.2,
+                       'c_total_act_energy': 41152.3}
+            messages.append((ENERGY_TOPIC, json.dumps(payload).encode('utf-8')))
+        else:
+            payload = {'id': 0, 'total_act_power': 1523.4 + i, 'total_act': 123456.7,
+                       'total_pf': 0.97, 'total_current': 6.6}
+            for phase in ('a', 'b', 'c'):
+                payload.update({
+                    f'{phase}_voltage': 230.1, f'{phase}_current': 2.2,
+                    f'{phase}_act_power': 507.8, f'{phase}_aprt_power': 510.0,
+                    f'{phase}_pf': 0.97, f'{phase}_freq': 50.0,
+                })
+            messages.append((POWER_TOPIC, json.dumps(payload).encode('utf-8')))
+    return messages
+
+
+def decode_before(topic, raw):
+    """Percorso precedente: decodifica nel client e nel manager, impronta del dict serializzato"""
+    data = json.loads(raw.decode('utf-8'))
+    payload = json.loads(json.dumps(data))  # seconda decodifica (MQTTService/_parse_payload)
+    hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    if 'emdata:0' in topic:
+        return float(payload.get('total_act', 0))
+    values = (
+        float(payload.get('total_act_power', 0)), float(payload.get('total_act', 0)),
+        float(payload.get('a_voltage', 0)), float(payload.get('a_current', 0)),
+        float(payload.get('total_pf', 1.0)),
+    )
+    for phase in ('a', 'b', 'c'):
+        if all(key in payload for key in [f'{phase}_voltage', f'{phase}_current', f'{phase}_act_power']):
+            payload.get(f'{phase}_voltage', 0), payload.get(f'{phase}_current', 0)
+            payload.get(f'{phase}_act_power', 0), payload.get(f'{phase}_pf', 1.0)
+            payload.get(f'{phase}_freq', 50.0)
+    return values
+
+
+class Command(BaseCommand):
+    help = 'Misura il costo CPU per messaggio della decodifica dei payload MQTT (prima/dopo)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20000,
+                            help='Numero di messaggi per ripetizione')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Ripetizioni (si riporta la migliore)')
+
+    def handle(self, *args, **options):
+        messages = sample_messages(options['messages'])
+        dedup = MessageDeduplicator(window=300, max_entries=10, shared=False)
+
+        def after(topic, raw):
+            record = codec.decode_message(topic, raw)
+            dedup.key_for_record('shellypro3em-bench', record)
+            return record
+
+        before_us = self._measure(decode_before, messages, options['repeat'])
+        after_us = self._measure(after, messages, options['repeat'])
+
+        self.stdout.write(f"Backend JSON: {codec.JSON_BACKEND}")
+        self.stdout.write(f"Messaggi: {len(messages)} x {options['repeat']} ripetizioni")
+        self.stdout.write(f"Prima: {before_us:.2f} us CPU/messaggio")
+        self.stdout.write(f"Dopo:  {after_us:.2f} us CPU/messaggio")
+        if after_us:
+            self.stdout.write(self.style.SUCCESS(f"Speedup: {before_us / after_us:.2f}x"))
+
+    @staticmethod
+    def _measure(func, messages, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.process_time()
+            for topic, raw in messages:
+                func(topic, raw)
+            elapsed = time.process_time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best / len(messages) * 1e6
@@ -0,0 +1,71 @@
+# energy/management/commands/manage_measurement_partitions.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from energy.partitioning import (
+    convert_tables, ensure_partitions, expire_partitions, is_partitioned, partitioned_tables
+)
+
+
+class Command(BaseCommand):
+    help = ('Gestisce le partizioni mensili delle misurazioni (PostgreSQL): crea in anticipo '
+            'le partizioni dei prossimi mesi e stacca o elimina quelle oltre la retention. '
+            'Da pianificare (es. cron giornaliero); --convert converte una volta le tabelle esistenti.')
+
+    def add_arguments(self, parser):
+        partition_settings = getattr(settings, 'MEASUREMENT_PARTITION_SETTINGS', {})
+        parser.add_argument(
+            '--convert',
+            action='store_true',
+            help='Converte le tabelle non partizionate copiandone i dati (finestra di manutenzione)'
+        )
+        parser.add_argument(
+            '--keep-legacy',
+            action='store_true',
+            help='Con --convert conserva le tabelle originali come <tabella>_legacy'
+        )
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=partition_settings.get('PREMAKE_MONTHS', 3),
+            help='Mesi futuri per cui creare le partizioni'
+        )
+        parser.add_argument(
+            '--retention-months',
+            type=int,
+            default=partition_settings.get('RETENTION_MONTHS', 0),
+            help='Mesi da conservare, mese corrente incluso (0 = nessuna scadenza)'
+        )
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            default=partition_settings.get('DROP_EXPIRED', False),
+            help='Elimina le partizioni scadute invece di staccarle soltanto'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Il partizionamento delle misurazioni richiede PostgreSQL")
+        if options['months_ahead'] < 0 or options['retention_months'] < 0:
+            raise CommandError("--months-ahead e --retention-months devono essere >= 0")
+
+        tables = partitioned_tables()
+        with transaction.atomic(), connection.cursor() as cursor:
+            if options['convert']:
+                converted = convert_tables(cursor, tables, options['months_ahead'],
+                                           keep_legacy=options['keep_legacy'])
+                for table in converted:
+                    self.stdout.write(self.style.SUCCESS(f"Convertita in tabella partizionata: {table}"))
+            else:
+                missing = [spec.table for spec in tables if not is_partitioned(cursor, spec.table)]
+                if missing:
+                    raise CommandError(f"Tabelle non partizionate: {', '.join(missing)} (usare --convert)")
+
+            for name in ensure_partitions(cursor, tables, options['months_ahead']):
+                self.stdout.write(f"Creata partizione {name}")
+            if options['retention_months']:
+                action = 'Eliminata' if options['drop'] else 'Staccata'
+                for name in expire_partitions(cursor, tables, options['retention_months'], drop=options['drop']):
+                    self.stdout.write(f"{action} partizione {name}")
@@ -0,0 +1,48 @@
+# energy/management/commands/pack_phase_details.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from energy.phase_storage import DEFAULT_PACK_BATCH_SIZE, pack_existing_details
+
+
+class Command(BaseCommand):
+    help = ("Converte i dettagli di fase esistenti (righe DeviceMeasurementDetail) nel formato compatto "
+            "DeviceMeasurement.phase_data e cancella le righe. Da usare con MQTT_PHASE_STORAGE=packed; "
+            "interrompibile, le esecuzioni successive riprendono dalle righe rimaste.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_PACK_BATCH_SIZE,
+            help='Misurazioni convertite per transazione'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            help='Blocchi massimi in questa esecuzione'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Non modifica nulla: riporta misurazioni e righe da convertire'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size deve essere >= 1")
+        if options['max_batches'] is not None and options['max_batches'] < 1:
+            raise CommandError("--max-batches deve essere >= 1")
+
+        report = pack_existing_details(
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            dry_run=options['dry_run']
+        )
+        if report.dry_run:
+            self.stdout.write(f"Da convertire: {report.details} righe di dettaglio "
+                              f"in {report.measurements} misurazioni")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Convertite {report.details} righe di dettaglio in {report.measurements} misurazioni"
+            ))
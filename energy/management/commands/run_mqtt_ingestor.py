@@ -0,0 +1,88 @@
+# energy/management/commands/run_mqtt_ingestor.py
+
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from energy.models import MQTTBroker
+from energy.mqtt.client import get_mqtt_client
+from energy.mqtt.routing import get_config_version
+
+
+class Command(BaseCommand):
+    help = ('Avvia il processo di ingestione MQTT: connessione al broker, '
+            'worker di ingestione e scrittura delle misurazioni')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--config-poll-interval',
+            type=float,
+            default=5.0,
+            help='Secondi tra i controlli di modifica delle configurazioni dispositivi'
+        )
+        parser.add_argument(
+            '--client-id',
+            default=None,
+            help='Client id della sessione MQTT persistente (default MQTT_CLIENT_ID o hostname)'
+        )
+        parser.add_argument(
+            '--clean-session',
+            action='store_true',
+            help='Non usare la sessione persistente (i messaggi ricevuti durante il riavvio vanno persi)'
+        )
+
+    def handle(self, *args, **options):
+        poll_interval = options['config_poll_interval']
+
+        # Receiver dei signal (routing index, sottoscrizioni) attivi in questo processo
+        from energy.services import signals  # noqa: F401
+
+        broker = MQTTBroker.objects.filter(is_active=True).first()
+        if not broker:
+            raise CommandError("Nessun broker MQTT attivo configurato")
+
+        client = get_mqtt_client()
+        if not client.configure(
+            host=broker.host,
+            port=broker.port,
+            username=broker.username,
+            password=broker.password,
+            use_tls=broker.use_tls,
+            client_id=options['client_id'],
+            clean_session=options['clean_session']
+        ):
+            raise CommandError(f"Configurazione del client MQTT fallita per {broker.host}:{broker.port}")
+
+        stop_event = threading.Event()
+
+        def request_stop(signum, frame):
+            self.stdout.write(f"Ricevuto segnale {signum}, arresto in corso...")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        self.stdout.write(f"Connessione al broker {broker.host}:{broker.port}")
+        if client.start():
+            self.stdout.write(self.style.SUCCESS("Ingestione MQTT avviata"))
+        else:
+            # paho ritenta la connessione in background
+            self.stdout.write(self.style.WARNING("Broker non raggiungibile, riconnessione in corso"))
+
+        config_version = get_config_version()
+        try:
+            while not stop_event.wait(poll_interval):
+                current_version = get_config_version()
+                if current_version != config_version:
+                    config_version = current_version
+                    self.stdout.write("Configurazioni dispositivi modificate, ricarico")
+                    client.refresh_configurations()
+        finally:
+            # Arresto ordinato: elabora le code dei worker e scrive i batch pendenti
+            started = time.monotonic()
+            client.stop()
+            self.stdout.write(self.style.SUCCESS(
+                f"Ingestione MQTT arrestata ({time.monotonic() - started:.1f}s)"
+            ))
@@ -0,0 +1,139 @@
+# energy/management/commands/run_shelly_poller.py
+
+import asyncio
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from energy.models import DeviceConfiguration, ShellyRPCConfiguration
+from energy.mqtt.batching import get_batch_writer
+from energy.mqtt.audit import get_audit_writer
+from energy.mqtt.counters import get_counter_store
+from energy.mqtt.latency import get_latency_tracker
+from energy.mqtt.pipeline import get_ingest_pipeline
+from energy.mqtt.presence import get_presence_tracker
+from energy.mqtt.routing import get_config_version, get_routing_index
+from energy.mqtt.workers import IngestionWorkerPool
+from energy.shelly.poller import ShellyPoller, ShellyTarget
+
+
+def load_targets():
+    """Dispositivi attivi da leggere e aggiornamento dell'indice di routing"""
+    close_old_connections()
+    get_routing_index().rebuild(
+        DeviceConfiguration.objects.filter(is_active=True).select_related('plant')
+    )
+    configs = ShellyRPCConfiguration.objects.filter(
+        is_active=True, device__is_active=True
+    ).select_related('device__plant')
+    return [ShellyTarget.from_config(config) for config in configs]
+
+
+class Command(BaseCommand):
+    help = ('Avvia il poller RPC HTTP dei dispositivi Shelly Gen2 senza MQTT: '
+            'letture salvate dalla stessa pipeline di ingestione dei messaggi MQTT')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--config-poll-interval',
+            type=float,
+            default=5.0,
+            help='Secondi tra i controlli di modifica delle configurazioni dispositivi'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Legge una volta tutti i dispositivi e termina'
+        )
+
+    def handle(self, *args, **options):
+        # Receiver dei signal (routing index) attivi in questo processo
+        from energy.services import signals  # noqa: F401
+
+        targets = load_targets()
+        if not targets:
+            raise CommandError("Nessun dispositivo Shelly RPC attivo configurato")
+
+        pipeline = get_ingest_pipeline()
+        workers = IngestionWorkerPool(
+            handler=pipeline.process,
+            key_func=self._partition_key,
+            pass_received_at=True
+        )
+        workers.start()
+        get_batch_writer().start()
+        get_presence_tracker().start()
+        get_counter_store().start()
+        get_latency_tracker().start()
+        get_audit_writer().start()
+
+        poller = ShellyPoller(targets, sink=workers.submit)
+        started = time.monotonic()
+        try:
+            if options['once']:
+                results = asyncio.run(self._poll_once(poller))
+                read = sum(1 for payloads in results.values() if payloads is not None)
+                self.stdout.write(f"Letti {read}/{len(results)} dispositivi")
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Poller Shelly avviato: {len(targets)} dispositivi"
+                ))
+                asyncio.run(self._run(poller, options['config_poll_interval']))
+        finally:
+            # Arresto ordinato: elabora le code dei worker e scrive i batch pendenti
+            workers.stop()
+            pipeline.release()
+            get_batch_writer().stop()
+            get_presence_tracker().stop()
+            get_counter_store().stop()
+            get_latency_tracker().stop()
+            get_audit_writer().stop()
+            self.stdout.write(self.style.SUCCESS(
+                f"Poller Shelly arrestato ({time.monotonic() - started:.1f}s)"
+            ))
+
+    @staticmethod
+    def _partition_key(topic: str):
+        config = get_routing_index().match(topic)
+        return config.device_id if config else None
+
+    @staticmethod
+    async def _poll_once(poller: ShellyPoller):
+        try:
+            return await poller.poll_all()
+        finally:
+            await poller.close()
+
+    async def _run(self, poller: ShellyPoller, poll_interval: float) -> None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def request_stop(signum):
+            self.stdout.write(f"Ricevuto segnale {signum}, arresto in corso...")
+            stop_event.set()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, request_stop, signum)
+
+        async def watch_configurations():
+            config_version = get_config_version()
+            while not stop_event.is_set():
+                try:
+                    await asyncio.wait_for(stop_event.wait(), poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                current_version = get_config_version()
+                if current_version != config_version and not stop_event.is_set():
+                    config_version = current_version
+                    self.stdout.write("Configurazioni dispositivi modificate, ricarico")
+                    # ORM fuori dal loop asyncio
+                    poller.update_targets(await asyncio.to_thread(load_targets))
+
+        watcher = asyncio.ensure_future(watch_configurations())
+        try:
+            await poller.run(stop_event)
+        finally:
+            stop_event.set()
+            await watcher
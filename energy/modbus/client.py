@@ -0,0 +1,157 @@
+# energy/modbus/client.py
+import asyncio
+import logging
+import struct
+from typing import List, Optional, Sequence, Tuple
+
+logger = logging.getLogger('energy.modbus')
+
+DEFAULT_PORT = 502
+DEFAULT_TIMEOUT = 5.0  # secondi
+# Limite del protocollo per una lettura di holding register (funzione 0x03)
+MAX_READ_REGISTERS = 125
+
+FUNC_READ_HOLDING_REGISTERS = 0x03
+
+# MBAP: transaction id, protocol id (0), lunghezza dei byte successivi, unit id
+MBAP_HEADER = struct.Struct('>HHHB')
+
+# Codici di eccezione Modbus
+EXCEPTION_MESSAGES = {
+    0x01: 'funzione non supportata',
+    0x02: 'indirizzo non valido',
+    0x03: 'valore non valido',
+    0x04: 'errore del dispositivo',
+    0x06: 'dispositivo occupato',
+    0x0A: 'gateway: percorso non disponibile',
+    0x0B: 'gateway: il dispositivo non risponde',
+}
+
+ReadBlock = Tuple[int, int]  # (indirizzo iniziale, numero di registri)
+
+
+class ModbusError(Exception):
+    """Errore di comunicazione Modbus (rete, timeout o risposta non valida)"""
+
+
+class ModbusExceptionResponse(ModbusError):
+    """Risposta di eccezione del dispositivo (funzione | 0x80)"""
+
+    def __init__(self, function: int, code: int):
+        self.function = function
+        self.code = code
+        super().__init__(f"Eccezione Modbus 0x{code:02X} ({EXCEPTION_MESSAGES.get(code, 'sconosciuta')}) "
+                         f"sulla funzione 0x{function:02X}")
+
+
+def coalesce_reads(ranges: Sequence[Tuple[int, int]], max_gap: int = 0,
+                   max_count: int = MAX_READ_REGISTERS) -> List[ReadBlock]:
+    """
+    Unisce gli intervalli di registri [inizio, fine) in letture contigue.
+
+    Due intervalli finiscono nella stessa lettura se il buco tra loro è al
+    più `max_gap` registri e la lettura resta entro `max_count` registri:
+    leggere qualche registro inutile costa meno di un'altra richiesta.
+    """
+    blocks: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if blocks:
+            block = blocks[-1]
+            block_end = block[0] + block[1]
+            if start - block_end <= max_gap and max(end, block_end) - block[0] <= max_count:
+                block[1] = max(end, block_end) - block[0]
+                continue
+        blocks.append([start, end - start])
+    return [(start, count) for start, count in blocks]
+
+
+class ModbusTCPClient:
+    """
+    Client Modbus-TCP asincrono minimale (solo lettura di holding register).
+
+    Una richiesta alla volta per connessione: molti gateway (SDongle,
+    SmartLogger) non gestiscono richieste in pipeline. In caso di timeout o
+    risposta non coerente la connessione viene chiusa e riaperta alla
+    richiesta successiva, così una risposta tardiva non viene attribuita
+    alla richiesta sbagliata.
+    """
+
+    def __init__(self, host: str, port: int = DEFAULT_PORT, timeout: float = DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._transaction_id = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> None:
+        if self.connected:
+            return
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ModbusError(f"Connessione a {self.host}:{self.port} fallita: {e!r}") from e
+        logger.debug(f"Connesso al gateway Modbus {self.host}:{self.port}")
+
+    async def close(self) -> None:
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is None:
+            return
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (OSError, asyncio.CancelledError):
+            pass
+
+    def _next_transaction_id(self) -> int:
+        self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+        return self._transaction_id
+
+    async def read_holding_registers(self, unit_id: int, address: int, count: int) -> List[int]:
+        """Legge `count` holding register a partire da `address` (funzione 0x03)"""
+        if not 1 <= count <= MAX_READ_REGISTERS:
+            raise ValueError(f"Numero di registri non valido: {count}")
+        async with self._lock:
+            await self.connect()
+            transaction_id = self._next_transaction_id()
+            pdu = struct.pack('>BHH', FUNC_READ_HOLDING_REGISTERS, address, count)
+            request = MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, unit_id) + pdu
+            try:
+                self._writer.write(request)
+                await self._writer.drain()
+                payload = await asyncio.wait_for(self._read_response(transaction_id, unit_id), self.timeout)
+            except asyncio.TimeoutError as e:
+                await self.close()
+                raise ModbusError(f"Timeout in lettura da {self.host}:{self.port} unit {unit_id}") from e
+            except (OSError, asyncio.IncompleteReadError) as e:
+                await self.close()
+                raise ModbusError(f"Connessione con {self.host}:{self.port} interrotta: {e!r}") from e
+            except ModbusError:
+                await self.close()
+                raise
+
+        function = payload[0]
+        if function & 0x80:
+            raise ModbusExceptionResponse(function & 0x7F, payload[1] if len(payload) > 1 else 0)
+        if function != FUNC_READ_HOLDING_REGISTERS or len(payload) < 2 or payload[1] != 2 * count \
+                or len(payload) != 2 + 2 * count:
+            await self.close()
+            raise ModbusError(f"Risposta non valida da {self.host}:{self.port} unit {unit_id}")
+        return list(struct.unpack(f'>{count}H', payload[2:]))
+
+    async def _read_response(self, transaction_id: int, unit_id: int) -> bytes:
+        header = await self._reader.readexactly(MBAP_HEADER.size)
+        response_id, protocol_id, length, response_unit = MBAP_HEADER.unpack(header)
+        if length < 2:
+            raise ModbusError(f"Lunghezza MBAP non valida: {length}")
+        payload = await self._reader.readexactly(length - 1)
+        if response_id != transaction_id or protocol_id != 0 or response_unit != unit_id:
+            raise ModbusError(f"Risposta fuori sequenza (transaction {response_id}, "
+                              f"attesa {transaction_id})")
+        return payload
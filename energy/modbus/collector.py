@@ -0,0 +1,223 @@
+# energy/modbus/collector.py
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..devices.mapping import KIND_ENERGY, KIND_POWER
+from ..devices.registry import DeviceRegistry
+from ..devices.base.device import MeasurementData
+from ..mqtt.codec import MeasurementRecord
+from ..polling import PollingCollector, PollSchedule, device_base_topic
+from .client import DEFAULT_TIMEOUT, ModbusError, ModbusTCPClient, ReadBlock, coalesce_reads
+
+logger = logging.getLogger('energy.modbus')
+
+DEFAULT_MAX_CONNECTIONS_PER_GATEWAY = 1
+DEFAULT_MAX_CONCURRENT_POLLS = 200
+DEFAULT_MAX_REGISTER_GAP = 20  # registri non usati letti pur di unire due letture
+DEFAULT_MAX_BACKOFF = 300  # secondi
+
+# Suffissi dei topic interni con cui le letture entrano nella pipeline di ingestione
+POWER_TOPIC_SUFFIX = '/status/modbus/power'
+ENERGY_TOPIC_SUFFIX = '/status/modbus/energy'
+
+# Destinazione delle letture: (topic, record), es. IngestionWorkerPool.submit
+Sink = Callable[[str, MeasurementRecord], Any]
+
+
+@dataclass
+class ModbusTarget:
+    """Dispositivo da leggere: gateway, unit id, intervallo e topic base"""
+    device_id: str
+    host: str
+    port: int
+    unit_id: int
+    poll_interval: float
+    base_topic: str
+    vendor: str
+    model: str
+
+    @property
+    def gateway(self) -> Tuple[str, int]:
+        return (self.host, self.port)
+
+    @classmethod
+    def from_config(cls, config) -> 'ModbusTarget':
+        """Costruisce il target da una ModbusConfiguration (con device e plant caricati)"""
+        device = config.device
+        return cls(
+            device_id=device.device_id,
+            host=config.host,
+            port=config.port,
+            unit_id=config.unit_id,
+            poll_interval=float(config.poll_interval),
+            base_topic=device_base_topic(device),
+            vendor=device.vendor,
+            model=device.model,
+        )
+
+
+class GatewayConnectionPool:
+    """
+    Connessioni verso un gateway Modbus (host e porta).
+
+    Al più `max_connections` letture contemporanee verso lo stesso gateway:
+    gli inverter dietro un SDongle o uno SmartLogger condividono la stessa
+    interfaccia seriale e non reggono molte richieste in parallelo.
+    """
+
+    def __init__(self, host: str, port: int, max_connections: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self._idle: List[ModbusTCPClient] = []
+        self._clients: List[ModbusTCPClient] = []
+
+    async def acquire(self) -> ModbusTCPClient:
+        await self._semaphore.acquire()
+        if self._idle:
+            return self._idle.pop()
+        client = ModbusTCPClient(self.host, self.port, self.timeout)
+        self._clients.append(client)
+        return client
+
+    def release(self, client: ModbusTCPClient) -> None:
+        self._idle.append(client)
+        self._semaphore.release()
+
+    async def close(self) -> None:
+        for client in self._clients:
+            await client.close()
+        self._idle.clear()
+        self._clients.clear()
+
+
+class _ModbusSchedule(PollSchedule):
+    """Pianificazione di un inverter con driver e letture coalescenti"""
+    __slots__ = ('driver', 'blocks')
+
+    def __init__(self, target: ModbusTarget, driver, blocks: List[ReadBlock], next_due: float):
+        super().__init__(target, next_due)
+        self.driver = driver
+        self.blocks = blocks
+
+
+class ModbusCollector(PollingCollector):
+    """
+    Collector asincrono delle letture Modbus-TCP degli inverter.
+
+    Le letture di un poll sono i registri del driver uniti in blocchi
+    contigui (`coalesce_reads`), eseguite su un pool di connessioni per
+    gateway; pianificazione, backoff e limite dei poll in corso sono quelli
+    di PollingCollector.
+
+    Ogni lettura diventa MeasurementData (driver del dispositivo) e poi due
+    MeasurementRecord, potenza ed energia, consegnati a `sink` con i topic
+    interni del dispositivo: da lì seguono la stessa pipeline dei messaggi
+    MQTT (routing, validazione, dedup, batch writer).
+    """
+
+    stats_component = 'modbus'
+    transport_errors = (ModbusError,)
+    log = logger
+
+    def __init__(self, targets: Iterable[ModbusTarget], sink: Sink,
+                 max_connections_per_gateway: Optional[int] = None,
+                 max_concurrent_polls: Optional[int] = None,
+                 max_register_gap: Optional[int] = None,
+                 timeout: Optional[float] = None,
+                 max_backoff: Optional[float] = None):
+        modbus_settings = getattr(settings, 'MODBUS_SETTINGS', {})
+        self.max_connections_per_gateway = max_connections_per_gateway or modbus_settings.get(
+            'MAX_CONNECTIONS_PER_GATEWAY', DEFAULT_MAX_CONNECTIONS_PER_GATEWAY)
+        if max_register_gap is None:
+            max_register_gap = modbus_settings.get('MAX_REGISTER_GAP', DEFAULT_MAX_REGISTER_GAP)
+        self.max_register_gap = max_register_gap
+        self.timeout = timeout or modbus_settings.get('TIMEOUT', DEFAULT_TIMEOUT)
+
+        self._sink = sink
+        self._pools: Dict[Tuple[str, int], GatewayConnectionPool] = {}
+        super().__init__(
+            targets,
+            max_concurrent_polls=max_concurrent_polls or modbus_settings.get(
+                'MAX_CONCURRENT_POLLS', DEFAULT_MAX_CONCURRENT_POLLS),
+            max_backoff=max_backoff or modbus_settings.get('MAX_BACKOFF', DEFAULT_MAX_BACKOFF),
+        )
+        self._stats['reads'] = 0
+
+    def build_schedule(self, target: ModbusTarget, next_due: float) -> Optional[_ModbusSchedule]:
+        driver = DeviceRegistry.get_device_by_vendor_model(target.vendor, target.model)
+        registers = getattr(driver, 'registers', None)
+        if not registers:
+            logger.warning(f"Nessun driver Modbus per {target.device_id} ({target.vendor} {target.model})")
+            return None
+        blocks = coalesce_reads([(spec.address, spec.end) for spec in registers],
+                                max_gap=self.max_register_gap)
+        return _ModbusSchedule(target, driver, blocks, next_due)
+
+    def update_targets(self, targets: Iterable[ModbusTarget]) -> None:
+        super().update_targets(targets)
+        logger.info(f"Collector Modbus: {len(self._schedules)} dispositivi su "
+                    f"{len({s.target.gateway for s in self._schedules.values()})} gateway")
+
+    def _pool(self, target: ModbusTarget) -> GatewayConnectionPool:
+        pool = self._pools.get(target.gateway)
+        if pool is None:
+            pool = GatewayConnectionPool(target.host, target.port,
+                                         self.max_connections_per_gateway, self.timeout)
+            self._pools[target.gateway] = pool
+        return pool
+
+    async def read_device(self, schedule: _ModbusSchedule) -> Dict[int, int]:
+        """Esegue le letture coalescenti del dispositivo; restituisce indirizzo -> word"""
+        target = schedule.target
+        pool = self._pool(target)
+        client = await pool.acquire()
+        try:
+            words: Dict[int, int] = {}
+            for start, count in schedule.blocks:
+                values = await client.read_holding_registers(target.unit_id, start, count)
+                self._stats['reads'] += 1
+                words.update(zip(range(start, start + count), values))
+            return words
+        finally:
+            pool.release(client)
+
+    async def poll(self, schedule: _ModbusSchedule) -> Optional[MeasurementData]:
+        """Legge l'inverter e ne consegna le misurazioni"""
+        words = await self.read_device(schedule)
+        received_at = time.time()
+        measurement = schedule.driver.parse_registers(words, timezone.now())
+        if measurement is not None:
+            self._emit(schedule.target, measurement, received_at)
+        return measurement
+
+    def _emit(self, target: ModbusTarget, measurement: MeasurementData, received_at: float) -> None:
+        """Consegna potenza ed energia alla pipeline di ingestione"""
+        reported_ts = measurement.timestamp.timestamp()
+        for suffix, kind in ((POWER_TOPIC_SUFFIX, KIND_POWER), (ENERGY_TOPIC_SUFFIX, KIND_ENERGY)):
+            topic = f"{target.base_topic}{suffix}"
+            record = MeasurementRecord.from_measurement(topic, kind, measurement, reported_ts)
+            record.received_at = received_at
+            try:
+                self._sink(topic, record)
+                self._stats['emitted'] += 1
+            except Exception as e:
+                logger.error(f"Errore nell'inoltro della lettura di {target.device_id}: {e}", exc_info=True)
+
+    async def close_transports(self) -> None:
+        for pool in self._pools.values():
+            await pool.close()
+        self._pools.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Restituisce le metriche del collector"""
+        stats = super().get_stats()
+        stats['gateways'] = len({schedule.target.gateway for schedule in self._schedules.values()})
+        return stats
@@ -12,7 +12,12 @@ from .energy import (
     EnergyInterval  # Aggiunto il nuovo modello
 )
 from .mqtt import MQTTBroker, MQTTConfiguration
+from .modbus import ModbusConfiguration
+from .shelly import ShellyRPCConfiguration
+from .retention import MeasurementRollup, RollupCheckpoint
+from .latest import DeviceLatestState
 from .audit import MQTTAuditLog
+from .metrics import TopicMetrics
 
 __all__ = [
     'Device',
@@ -25,5 +30,11 @@ __all__ = [
     'EnergyInterval',  # Aggiunto il nuovo modello
     'MQTTBroker',
     'MQTTConfiguration',
+    'ModbusConfiguration',
+    'ShellyRPCConfiguration',
+    'MeasurementRollup',
+    'RollupCheckpoint',
+    'DeviceLatestState',
     'MQTTAuditLog',
+    'TopicMetrics',
 ]
\ No newline at end of file
@@ -2,6 +2,10 @@
 from django.db import models
 from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+# Conservazione predefinita dei log di audit
+AUDIT_RETENTION_DAYS = 180
 
 class MQTTAuditLog(models.Model):
     OPERATION_TYPES = [
@@ -14,6 +18,7 @@ class MQTTAuditLog(models.Model):
         ('CREDENTIALS_UPDATE', 'Aggiornamento Credenziali'),
         ('CREDENTIALS_DELETE', 'Eliminazione Credenziali'),
         ('ACL_CHECK', 'Verifica ACL'),
+        ('MESSAGE', 'Messaggio'),
     ]
 
     timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -44,13 +49,17 @@ class MQTTAuditLog(models.Model):
         return f"{self.operation} - {self.mqtt_username} - {self.timestamp}"
 
     def save(self, *args, **kwargs):
+        self.prepare()
+        super().save(*args, **kwargs)
+
+    def prepare(self):
+        """Retention e pulizia del topic, anche per le righe scritte con bulk_create"""
         # Imposta la data di retention se non specificata (6 mesi di default)
         if not self.retention_date:
-            self.retention_date = timezone.now() + timezone.timedelta(days=180)
+            self.retention_date = timezone.now() + timezone.timedelta(days=AUDIT_RETENTION_DAYS)
         # Pulisci eventuali dati sensibili nel topic prima di salvare
         if self.topic:
             self.clean_topic()
-        super().save(*args, **kwargs)
 
     def clean_topic(self):
         """Pulisce eventuali dati sensibili dal topic"""
@@ -6,8 +6,9 @@ from .base import BaseTimestampModel, BaseMeasurementModel
 #from core.models import Plant
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.cache import cache
-import time 
+import math
+import struct
+from typing import List, Optional
 
 import logging
 
@@ -54,6 +55,16 @@ class DeviceType(models.Model):
     def __str__(self):
         return f"{self.vendor} {self.model}"
 
+    def clean(self):
+        """Verifica che il formato del payload MQTT sia un mapping compilabile"""
+        super().clean()
+        if self.mqtt_payload_format:
+            from ..devices.mapping import PayloadMapping, MappingError
+            try:
+                PayloadMapping(self.mqtt_payload_format)
+            except MappingError as e:
+                raise ValidationError({'mqtt_payload_format': str(e)})
+
 class Device(models.Model):
     """
     Modello per i dispositivi installati
@@ -114,10 +125,12 @@ class DeviceConfiguration(BaseTimestampModel):
     
     # Costanti per vendor
     VENDOR_SHELLY = 'SHELLY'
+    VENDOR_HUAWEI = 'HUAWEI'
     VENDOR_CUSTOM = 'CUSTOM'
     
     VENDOR_CHOICES = [
         (VENDOR_SHELLY, 'Shelly'),
+        (VENDOR_HUAWEI, 'Huawei'),
         (VENDOR_CUSTOM, 'Custom'),
     ]
     
@@ -127,6 +140,8 @@ class DeviceConfiguration(BaseTimestampModel):
         ('SHELLY_EM3', 'Shelly 3EM'),
         ('SHELLY_EM', 'Shelly EM'),
         ('SHELLY_PLUS_PM', 'Shelly Plus PM'),
+        ('SHELLY_PLUS_PLUG_S', 'Shelly Plus Plug S'),
+        ('HUAWEI_SUN2000', 'Huawei SUN2000'),
         ('CUSTOM', 'Custom'),
     ]
 
@@ -136,6 +151,8 @@ class DeviceConfiguration(BaseTimestampModel):
         'SHELLY_EM3': {'vendor': VENDOR_SHELLY, 'model': 'em3'},
         'SHELLY_EM': {'vendor': VENDOR_SHELLY, 'model': 'em'},
         'SHELLY_PLUS_PM': {'vendor': VENDOR_SHELLY, 'model': 'plus_pm'},
+        'SHELLY_PLUS_PLUG_S': {'vendor': VENDOR_SHELLY, 'model': 'plus_plug_s'},
+        'HUAWEI_SUN2000': {'vendor': VENDOR_HUAWEI, 'model': 'sun2000'},
         'CUSTOM': {'vendor': VENDOR_CUSTOM, 'model': 'custom'},
     }
     
@@ -165,6 +182,11 @@ class DeviceConfiguration(BaseTimestampModel):
         null=True, 
         blank=True
     )
+    last_energy_at = models.DateTimeField(
+        help_text="Timestamp dell'ultimo valore di energia totale ricevuto",
+        null=True,
+        blank=True
+    )
     
     # Configurazione e stato
     mqtt_topic_template = models.CharField(max_length=255, blank=True, null=True)
@@ -209,12 +231,22 @@ class DeviceConfiguration(BaseTimestampModel):
         from ..devices.registry import DeviceRegistry
         return DeviceRegistry.get_device(self.device_type)
 
+    @property
+    def current_last_seen(self):
+        """last_seen, o il valore in memoria del presence tracker se più recente"""
+        from ..mqtt.presence import get_presence_tracker
+        tracked = get_presence_tracker().last_seen(self.pk)
+        if tracked and (not self.last_seen or tracked > self.last_seen):
+            return tracked
+        return self.last_seen
+
     @property
     def is_online(self) -> bool:
         """Verifica se il dispositivo è online (ultimi 5 minuti)"""
-        if not self.last_seen:
+        last_seen = self.current_last_seen
+        if not last_seen:
             return False
-        return (timezone.now() - self.last_seen).total_seconds() < 300
+        return (timezone.now() - last_seen).total_seconds() < 300
 
     def update_last_seen(self):
         """Aggiorna il timestamp dell'ultima comunicazione"""
@@ -340,6 +372,14 @@ class DeviceMeasurement(BaseMeasurementModel):
         null=True,
         blank=True  # Permette il campo vuoto nei form
     )
+    # Dettagli di fase compattati (MQTT_SETTINGS['PHASE_STORAGE'] = 'packed'):
+    # sostituiscono le righe DeviceMeasurementDetail, vedi `phases`
+    phase_data = models.BinaryField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Valori per fase compattati (fase, tensione, corrente, potenza, PF, frequenza)"
+    )
 
     class Meta:
         verbose_name = "Misurazione Dispositivo"
@@ -386,6 +426,32 @@ class DeviceMeasurement(BaseMeasurementModel):
         """Restituisce la potenza in kW"""
         return self.power / 1000.0 if self.power else 0
 
+    @property
+    def phases(self) -> List['DeviceMeasurementDetail']:
+        """
+        Dettagli di fase qualunque sia la modalità di salvataggio: decodificati
+        da phase_data (istanze non salvate) o letti dalle righe
+        DeviceMeasurementDetail (usa il prefetch di phase_details se presente).
+        """
+        if self.phase_data:
+            return [
+                DeviceMeasurementDetail(
+                    measurement=self,
+                    timestamp=self.timestamp,
+                    quality=self.quality,
+                    phase=phase,
+                    voltage=voltage,
+                    current=current,
+                    power=power,
+                    power_factor=power_factor,
+                    frequency=frequency
+                )
+                for phase, voltage, current, power, power_factor, frequency in unpack_phase_details(self.phase_data)
+            ]
+        if self.pk is None:
+            return []
+        return list(self.phase_details.all())
+
     def get_measurement_direction(self) -> str:
         """Determina la direzione del flusso di potenza"""
         if not self.power:
@@ -446,7 +512,9 @@ class DeviceMeasurementDetail(BaseMeasurementModel):
     class Meta:
         verbose_name = "Dettaglio Fase"
         verbose_name_plural = "Dettagli Fase"
-        unique_together = ['measurement', 'phase']
+        # Il timestamp (quello della misurazione) è la chiave di partizione:
+        # PostgreSQL lo richiede nei vincoli UNIQUE delle tabelle partizionate
+        unique_together = ['measurement', 'phase', 'timestamp']
         ordering = ['phase']  # Ordina per identificativo di fase
         indexes = [
             models.Index(fields=['measurement', 'phase']),
@@ -506,30 +574,78 @@ class DeviceMeasurementDetail(BaseMeasurementModel):
         except Exception:
             return False
 
+
+# Formato di DeviceMeasurement.phase_data: un byte di versione seguito da un
+# record a larghezza fissa per fase (fase, tensione, corrente, potenza, PF,
+# frequenza); i valori mancanti sono salvati come NaN
+PHASE_DATA_VERSION = 1
+_PHASE_HEADER = struct.Struct('<B')
+_PHASE_RECORD = struct.Struct('<c5d')
+
+
+def _packed_float(value) -> float:
+    return math.nan if value is None else value
+
+
+def _unpacked_float(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+def pack_phase_details(details) -> Optional[bytes]:
+    """Compatta i dettagli di fase per phase_data (None se non ci sono fasi)"""
+    if not details:
+        return None
+    parts = [_PHASE_HEADER.pack(PHASE_DATA_VERSION)]
+    for detail in details:
+        parts.append(_PHASE_RECORD.pack(
+            detail.phase.encode('ascii'),
+            *(_packed_float(getattr(detail, name))
+              for name in ('voltage', 'current', 'power', 'power_factor', 'frequency'))
+        ))
+    return b''.join(parts)
+
+
+def unpack_phase_details(data) -> List[tuple]:
+    """Decodifica phase_data in tuple (fase, tensione, corrente, potenza, PF, frequenza)"""
+    data = bytes(data)
+    version, = _PHASE_HEADER.unpack_from(data)
+    if version != PHASE_DATA_VERSION:
+        raise ValueError(f"Versione di phase_data non supportata: {version}")
+    return [
+        (phase.decode('ascii'), *(_unpacked_float(value) for value in values))
+        for phase, *values in _PHASE_RECORD.iter_unpack(data[_PHASE_HEADER.size:])
+    ]
+
+
 @receiver([post_save, post_delete], sender=DeviceConfiguration)
 def handle_device_configuration_change(sender, instance, created=False, **kwargs):
-    """Gestisce i cambiamenti nelle configurazioni dei dispositivi"""
+    """
+    Notifica il processo di ingestione (run_mqtt_ingestor) del cambiamento.
+
+    Nel processo corrente l'aggiornamento è incrementale e riguarda il solo
+    dispositivo (receiver in energy/services/signals.py); qui non si ricarica
+    l'intero insieme delle configurazioni.
+    """
     try:
-        # Evita refresh per aggiornamenti frequenti
-        cache_key = f"device_config_refresh_{instance.id}"
-        last_refresh = cache.get(cache_key)
-        
-        if last_refresh and time.time() - last_refresh < 60:
-            logger.debug("Skipping refresh - too soon")
-            return
-            
-        # Evita refresh per gli aggiornamenti di last_seen e updated_at
+        # Gli aggiornamenti di last_seen e updated_at non cambiano le configurazioni
         if kwargs.get('update_fields') in [{'last_seen'}, {'last_seen', 'updated_at'}, {'updated_at', 'last_seen'}]:
             return
-            
-        from ..mqtt.client import get_mqtt_client
-        client = get_mqtt_client()
-        if client and client.is_connected:
-            client.refresh_configurations()
-            logger.info(f"MQTT configurations refreshed after device change: {instance.device_id}")
-            
-        # Aggiorna timestamp ultimo refresh
-        cache.set(cache_key, time.time(), 300)
-        
+
+        from ..mqtt.routing import bump_config_version
+        bump_config_version()
+
+    except Exception as e:
+        logger.error(f"Error handling device configuration change: {e}")
+
+
+@receiver([post_save, post_delete], sender=DeviceType)
+def handle_device_type_change(sender, instance, **kwargs):
+    """Ricompila i mapping dei payload dopo la modifica di un tipo di dispositivo"""
+    try:
+        from ..devices.mapping import get_mapping_registry
+        from ..mqtt.routing import bump_config_version
+        get_mapping_registry().invalidate()
+        # Il processo di ingestione ricarica configurazioni e mapping
+        bump_config_version()
     except Exception as e:
-        logger.error(f"Error handling device configuration change: {e}")
\ No newline at end of file
+        logger.error(f"Error handling device type change: {e}")
@@ -0,0 +1,125 @@
+# energy/models/latest.py
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.db import models
+from django.utils import timezone
+
+# Valori per fase conservati nello stato (stessi campi di DeviceMeasurementDetail)
+PHASE_FIELDS = ('voltage', 'current', 'power', 'power_factor', 'frequency')
+ONLINE_WINDOW = timedelta(minutes=5)
+
+
+class DeviceLatestState(models.Model):
+    """
+    Ultimi valori di un dispositivo, una riga per dispositivo.
+
+    Aggiornata in blocco dal batch writer dell'ingestione nella stessa
+    transazione delle misurazioni: le viste che mostrano il valore attuale
+    leggono questa tabella (per chiave o con una join) invece di cercare
+    l'ultima riga della tabella delle misurazioni per ogni dispositivo.
+    """
+    device = models.OneToOneField(
+        'energy.DeviceConfiguration',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='latest_state'
+    )
+    plant = models.ForeignKey(
+        'core.Plant',
+        on_delete=models.CASCADE,
+        related_name='device_latest_states'
+    )
+
+    # Ultima misurazione istantanea
+    timestamp = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Timestamp dell'ultima misurazione istantanea"
+    )
+    power = models.FloatField(default=0, help_text="Potenza attiva in W")
+    voltage = models.FloatField(default=0, help_text="Tensione in V")
+    current = models.FloatField(default=0, help_text="Corrente in A")
+    power_factor = models.FloatField(null=True, blank=True, help_text="Fattore di potenza")
+    energy_total = models.FloatField(default=0, help_text="Totale del contatore riportato con la misurazione")
+    quality = models.CharField(max_length=10, default='GOOD')
+    phases = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Valori per fase: {fase: {voltage, current, power, power_factor, frequency}}"
+    )
+
+    # Ultimo delta di energia (misurazioni ENERGY)
+    energy_delta = models.FloatField(default=0, help_text="Ultimo delta di energia in kWh")
+    energy_timestamp = models.DateTimeField(null=True, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Stato Attuale Dispositivo"
+        verbose_name_plural = "Stati Attuali Dispositivi"
+        db_table = "energy_device_latest_state"
+        indexes = [
+            models.Index(fields=['plant', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} - {self.power}W @ {self.timestamp}"
+
+    def apply_measurement(self, measurement, details=()) -> None:
+        """Copia i valori istantanei di una misurazione e dei suoi dettagli di fase"""
+        self.plant_id = measurement.plant_id
+        self.timestamp = measurement.timestamp
+        self.power = measurement.power
+        self.voltage = measurement.voltage
+        self.current = measurement.current
+        self.power_factor = measurement.power_factor
+        self.energy_total = measurement.energy_total
+        self.quality = measurement.quality
+        self.phases = {
+            detail.phase: {name: getattr(detail, name) for name in PHASE_FIELDS}
+            for detail in details
+        }
+
+    def apply_energy(self, measurement) -> None:
+        """Copia il delta di una misurazione ENERGY"""
+        self.plant_id = measurement.plant_id
+        self.energy_delta = measurement.energy_total
+        self.energy_timestamp = measurement.timestamp
+
+    def is_recent(self, now=None, window: timedelta = ONLINE_WINDOW) -> bool:
+        """Vero se l'ultima misurazione istantanea è più recente di `window`"""
+        return self.timestamp is not None and self.timestamp >= (now or timezone.now()) - window
+
+    @property
+    def phase_details(self) -> List['DeviceMeasurementDetail']:
+        """Dettagli di fase (non salvati) compatibili con DeviceMeasurementDetail"""
+        from .device import DeviceMeasurementDetail
+        return [
+            DeviceMeasurementDetail(phase=phase, timestamp=self.timestamp, **values)
+            for phase, values in sorted(self.phases.items())
+        ]
+
+    @property
+    def apparent_power(self) -> float:
+        """Calcola la potenza apparente in VA"""
+        return abs(self.voltage * self.current)
+
+    @property
+    def reactive_power(self) -> float:
+        """Calcola la potenza reattiva in VAR"""
+        if self.power_factor:
+            return self.apparent_power * (1 - self.power_factor ** 2) ** 0.5
+        return 0
+
+
+def latest_states(devices) -> Dict[int, DeviceLatestState]:
+    """Stati attuali dei dispositivi indicati (istanze o pk), in una query"""
+    ids = [getattr(device, 'pk', device) for device in devices]
+    return DeviceLatestState.objects.in_bulk(ids)
+
+
+def recent_state(device, now=None) -> Optional[DeviceLatestState]:
+    """Stato attuale del dispositivo se aggiornato negli ultimi minuti"""
+    state = getattr(device, 'latest_state', None)
+    return state if state is not None and state.is_recent(now) else None
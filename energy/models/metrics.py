@@ -10,9 +10,16 @@ class TopicMetrics(BaseTimestampModel):
         on_delete=models.CASCADE,
         related_name='topic_metrics'
     )
+    device_type = models.CharField(max_length=50, blank=True, db_index=True)
     messages_count = models.IntegerField(default=0)
     errors_count = models.IntegerField(default=0)
-    avg_processing_time = models.FloatField(default=0)  # in millisecondi
+    # Tempi ricezione -> scrittura, in millisecondi
+    avg_processing_time = models.FloatField(default=0)
+    p50_processing_time = models.FloatField(default=0)
+    p95_processing_time = models.FloatField(default=0)
+    p99_processing_time = models.FloatField(default=0)
+    # Istogrammi per fase (parse, persist, total, lag) usati per unire i flush
+    latency_stats = models.JSONField(default=dict, blank=True)
     period_start = models.DateTimeField()
     period_end = models.DateTimeField()
     period_type = models.CharField(
@@ -30,4 +37,11 @@ class TopicMetrics(BaseTimestampModel):
         indexes = [
             models.Index(fields=['period_type', 'period_start']),
             models.Index(fields=['device', 'period_type']),
-        ]
\ No newline at end of file
+        ]
+
+    def __str__(self):
+        return f"{self.topic} ({self.period_type} {self.period_start})"
+
+    def stage_percentile(self, stage, quantile=95):
+        """Percentile (ms) di una fase dagli istogrammi salvati"""
+        return (self.latency_stats or {}).get(stage, {}).get(f'p{quantile}', 0)
@@ -0,0 +1,65 @@
+# energy/models/modbus.py
+from django.db import models
+from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+
+class ModbusConfiguration(models.Model):
+    """
+    Connessione Modbus-TCP di un dispositivo letto in polling (inverter).
+    Più dispositivi possono condividere lo stesso gateway (host e porta,
+    es. SmartLogger o SDongle) con unit id diversi.
+    """
+    device = models.OneToOneField(
+        'energy.DeviceConfiguration',
+        on_delete=models.CASCADE,
+        related_name='modbus_config',
+        verbose_name="Dispositivo"
+    )
+    host = models.CharField(
+        "Host",
+        max_length=255
+    )
+    port = models.IntegerField(
+        "Porta",
+        validators=[
+            MinValueValidator(1),
+            MaxValueValidator(65535)
+        ],
+        default=502
+    )
+    unit_id = models.PositiveSmallIntegerField(
+        "Unit ID",
+        validators=[MaxValueValidator(247)],
+        default=1
+    )
+    poll_interval = models.PositiveIntegerField(
+        "Intervallo di lettura (s)",
+        validators=[MinValueValidator(1)],
+        default=30
+    )
+    is_active = models.BooleanField(
+        "Attivo",
+        default=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Configurazione Modbus Dispositivo"
+        verbose_name_plural = "Configurazioni Modbus Dispositivi"
+        db_table = "energy_modbus_configuration"
+        indexes = [
+            models.Index(fields=['host', 'port']),
+        ]
+
+    def __str__(self):
+        return f"Modbus Config: {self.device.device_id} ({self.host}:{self.port}/{self.unit_id})"
+
+
+@receiver([post_save, post_delete], sender=ModbusConfiguration)
+def bump_modbus_config_version(sender, instance, **kwargs):
+    """Segnala al collector Modbus che le configurazioni sono cambiate"""
+    from ..mqtt.routing import bump_config_version
+    bump_config_version()
@@ -2,6 +2,8 @@
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 from encrypted_model_fields.fields import EncryptedCharField
 
@@ -144,4 +146,16 @@ class MQTTConfiguration(models.Model):
 
     def generate_client_id(self):
         """Genera un ID cliente univoco per la connessione MQTT"""
-        return f"cercollettiva-{self.device.device_id}-{timezone.now().timestamp()}"
\ No newline at end of file
+        return f"cercollettiva-{self.device.device_id}-{timezone.now().timestamp()}"
+
+@receiver([post_save, post_delete], sender=MQTTConfiguration)
+@receiver([post_save, post_delete], sender=MQTTBroker)
+@receiver([post_save, post_delete], sender='energy.DeviceConfiguration')
+@receiver([post_save, post_delete], sender='core.Plant')
+def invalidate_mqtt_access_index(sender, instance, update_fields=None, **kwargs):
+    """Ricostruisce l'indice di autenticazione/ACL del broker dopo le modifiche"""
+    # Gli aggiornamenti di last_seen/last_connected non cambiano i permessi
+    if update_fields and set(update_fields) <= {'last_seen', 'last_connected', 'updated_at'}:
+        return
+    from ..mqtt.acl import invalidate_access_index
+    invalidate_access_index()
@@ -0,0 +1,83 @@
+# energy/models/retention.py
+from django.db import models
+
+
+class MeasurementRollup(models.Model):
+    """
+    Misurazioni aggregate per intervallo (min/media/max), prodotte dal
+    motore di retention a partire dalle misurazioni grezze (1 minuto) e dai
+    rollup a 1 minuto (15 minuti).
+    """
+
+    RESOLUTION_1M = '1M'
+    RESOLUTION_15M = '15M'
+    RESOLUTION_CHOICES = [
+        (RESOLUTION_1M, '1 Minuto'),
+        (RESOLUTION_15M, '15 Minuti'),
+    ]
+
+    device = models.ForeignKey(
+        'energy.DeviceConfiguration',
+        on_delete=models.CASCADE,
+        related_name='measurement_rollups'
+    )
+    plant = models.ForeignKey(
+        'core.Plant',
+        on_delete=models.CASCADE,
+        related_name='measurement_rollups'
+    )
+    measurement_type = models.CharField(max_length=20)
+    resolution = models.CharField(
+        max_length=3,
+        choices=RESOLUTION_CHOICES,
+        help_text="Ampiezza dell'intervallo"
+    )
+    bucket_start = models.DateTimeField(
+        help_text="Inizio dell'intervallo (UTC)"
+    )
+    sample_count = models.PositiveIntegerField(
+        help_text="Misurazioni grezze aggregate"
+    )
+    power_min = models.FloatField(help_text="Potenza minima in W")
+    power_avg = models.FloatField(help_text="Potenza media in W")
+    power_max = models.FloatField(help_text="Potenza massima in W")
+    voltage_avg = models.FloatField(help_text="Tensione media in V")
+    current_avg = models.FloatField(help_text="Corrente media in A")
+    energy_total = models.FloatField(
+        help_text="Energia in kWh: somma dei delta (ENERGY) o ultimo totale"
+    )
+
+    class Meta:
+        verbose_name = "Rollup Misurazioni"
+        verbose_name_plural = "Rollup Misurazioni"
+        db_table = "energy_measurement_rollup"
+        unique_together = ['device', 'measurement_type', 'resolution', 'bucket_start']
+        indexes = [
+            models.Index(fields=['resolution', 'bucket_start']),
+            models.Index(fields=['plant', 'resolution', 'bucket_start']),
+        ]
+        ordering = ['bucket_start']
+
+    def __str__(self):
+        return f"{self.device_id} - {self.resolution} - {self.bucket_start:%Y-%m-%d %H:%M}"
+
+
+class RollupCheckpoint(models.Model):
+    """Intervalli già aggregati per risoluzione: i rollup ripartono da qui"""
+    resolution = models.CharField(
+        max_length=3,
+        choices=MeasurementRollup.RESOLUTION_CHOICES,
+        unique=True
+    )
+    processed_until = models.DateTimeField(
+        help_text="Fine (esclusa) dell'ultimo intervallo aggregato"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Checkpoint Rollup"
+        verbose_name_plural = "Checkpoint Rollup"
+        db_table = "energy_rollup_checkpoint"
+
+    def __str__(self):
+        return f"{self.resolution}: {self.processed_until:%Y-%m-%d %H:%M}"
@@ -0,0 +1,56 @@
+# energy/models/shelly.py
+from django.db import models
+from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+
+class ShellyRPCConfiguration(models.Model):
+    """
+    Indirizzo HTTP di un dispositivo Shelly Gen2 letto in polling tramite
+    RPC, per i dispositivi su reti senza MQTT.
+    """
+    device = models.OneToOneField(
+        'energy.DeviceConfiguration',
+        on_delete=models.CASCADE,
+        related_name='shelly_rpc_config',
+        verbose_name="Dispositivo"
+    )
+    host = models.CharField(
+        "Host",
+        max_length=255
+    )
+    port = models.IntegerField(
+        "Porta",
+        validators=[
+            MinValueValidator(1),
+            MaxValueValidator(65535)
+        ],
+        default=80
+    )
+    poll_interval = models.PositiveIntegerField(
+        "Intervallo di lettura (s)",
+        validators=[MinValueValidator(1)],
+        default=10
+    )
+    is_active = models.BooleanField(
+        "Attivo",
+        default=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Configurazione RPC Shelly"
+        verbose_name_plural = "Configurazioni RPC Shelly"
+        db_table = "energy_shelly_rpc_configuration"
+
+    def __str__(self):
+        return f"Shelly RPC Config: {self.device.device_id} ({self.host}:{self.port})"
+
+
+@receiver([post_save, post_delete], sender=ShellyRPCConfiguration)
+def bump_shelly_rpc_config_version(sender, instance, **kwargs):
+    """Segnala al poller Shelly che le configurazioni sono cambiate"""
+    from ..mqtt.routing import bump_config_version
+    bump_config_version()
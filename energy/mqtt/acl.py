@@ -1,6 +1,224 @@
 # energy/mqtt/acl.py
-from typing import Dict, Any
-from ..models import MQTTCredential, Plant
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Set
+
+from django.conf import settings
+from django.core.cache import cache
+
+from ..models import MQTTBroker, MQTTConfiguration
+
+logger = logging.getLogger('energy.mqtt')
+
+# Radice dei topic dei dispositivi: cercollettiva/<pod>/...
+TOPIC_ROOT = 'cercollettiva'
+
+# Tipi di accesso del backend HTTP di mosquitto-go-auth
+ACC_READ = 1
+ACC_WRITE = 2
+ACC_READWRITE = 3
+ACC_SUBSCRIBE = 4
+ACCESS_TYPES = frozenset((ACC_READ, ACC_WRITE, ACC_READWRITE, ACC_SUBSCRIBE))
+
+DEFAULT_VERSION_CHECK_INTERVAL = 1.0  # secondi
+
+# Versione delle credenziali condivisa in cache tra processi: chi modifica
+# credenziali, impianti o dispositivi la aggiorna, gli altri processi web
+# ricaricano l'indice alla prima richiesta successiva
+ACL_VERSION_KEY = 'mqtt_acl_version'
+
+
+def bump_acl_version() -> None:
+    """Segnala agli altri processi che credenziali o permessi sono cambiati"""
+    try:
+        cache.set(ACL_VERSION_KEY, time.time_ns(), timeout=None)
+    except Exception as e:
+        logger.debug(f"Impossibile aggiornare la versione delle ACL MQTT: {e}")
+
+
+def get_acl_version() -> Optional[int]:
+    try:
+        return cache.get(ACL_VERSION_KEY)
+    except Exception as e:
+        logger.debug(f"Impossibile leggere la versione delle ACL MQTT: {e}")
+        return None
+
+
+class _PrefixNode:
+    """Nodo del trie dei prefissi di topic, un livello per nodo"""
+    __slots__ = ('children', 'terminal')
+
+    def __init__(self):
+        self.children: Dict[str, '_PrefixNode'] = {}
+        self.terminal = False
+
+
+class TopicPrefixTrie:
+    """
+    Trie dei prefissi di topic consentiti.
+
+    Un topic è consentito se uno dei prefissi registrati ne copre i primi
+    livelli. Le wildcard `+`/`#` sono ammesse solo dopo un prefisso
+    completo: `cercollettiva/<pod>/#` sì, `cercollettiva/+/#` no.
+    """
+
+    def __init__(self, prefixes: Iterable[str] = ()):
+        self._root = _PrefixNode()
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix: str) -> None:
+        node = self._root
+        for level in prefix.strip('/').split('/'):
+            node = node.children.setdefault(level, _PrefixNode())
+        node.terminal = True
+
+    def allows(self, topic: str) -> bool:
+        node = self._root
+        for level in topic.split('/'):
+            if node.terminal:
+                return True
+            node = node.children.get(level)
+            if node is None:
+                return False
+        # Il topic coincide con un prefisso: serve almeno un livello in più
+        return False
+
+
+class MQTTAccessIndex:
+    """
+    Indice in memoria di credenziali e permessi dei dispositivi MQTT.
+
+    Risponde alle richieste di autenticazione e ACL del broker senza
+    accedere al DB: le password delle MQTTConfiguration attive sono
+    conservate solo come HMAC con una chiave casuale del processo, i topic
+    consentiti come trie dei prefissi `cercollettiva/<pod>/` degli impianti
+    del proprietario del dispositivo. L'account del broker attivo
+    (l'ingestore) è superuser.
+
+    `invalidate` (chiamato dai signal) fa ricostruire l'indice alla prima
+    richiesta successiva; gli altri processi se ne accorgono dalla versione
+    in cache, controllata al più ogni `version_check_interval` secondi.
+    """
+
+    def __init__(self, version_check_interval: Optional[float] = None):
+        mqtt_settings = getattr(settings, 'MQTT_SETTINGS', {})
+        if version_check_interval is None:
+            version_check_interval = mqtt_settings.get(
+                'ACL_VERSION_CHECK_INTERVAL', DEFAULT_VERSION_CHECK_INTERVAL)
+        self.version_check_interval = version_check_interval
+
+        self._lock = threading.Lock()
+        self._key = os.urandom(32)
+        self._passwords: Dict[str, bytes] = {}
+        self._owners: Dict[str, int] = {}  # username -> id del proprietario
+        self._tries: Dict[int, TopicPrefixTrie] = {}  # id del proprietario -> prefissi
+        self._superusers: Set[str] = set()
+        self._loaded = False
+        self._version = None
+        self._checked_at = 0.0
+        self._stats = {
+            'rebuilds': 0,
+            'auth_ok': 0,
+            'auth_denied': 0,
+            'acl_ok': 0,
+            'acl_denied': 0,
+        }
+
+    def _digest(self, password: str) -> bytes:
+        return hmac.new(self._key, password.encode('utf-8'), hashlib.sha256).digest()
+
+    def invalidate(self) -> None:
+        """Ricostruisce l'indice alla prossima richiesta"""
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self) -> None:
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < self.version_check_interval:
+            return
+        version = get_acl_version()
+        with self._lock:
+            self._checked_at = now
+            if self._loaded and version == self._version:
+                return
+            self._rebuild()
+            self._version = version
+            self._loaded = True
+
+    def _rebuild(self) -> None:
+        """Carica credenziali e prefissi (chiamare con self._lock)"""
+        from core.models import Plant
+
+        passwords, owners = {}, {}
+        configs = MQTTConfiguration.objects.filter(
+            is_active=True, device__is_active=True
+        ).select_related('device__plant')
+        for config in configs:
+            plant = config.device.plant
+            if plant is None:
+                continue
+            passwords[config.mqtt_username] = self._digest(config.mqtt_password or '')
+            owners[config.mqtt_username] = plant.owner_id
+
+        prefixes: Dict[int, list] = {}
+        for owner_id, pod_code in Plant.objects.filter(
+                owner_id__in=set(owners.values())).values_list('owner_id', 'pod_code'):
+            prefixes.setdefault(owner_id, []).append(f"{TOPIC_ROOT}/{pod_code}/")
+
+        superusers = set()
+        broker = MQTTBroker.objects.filter(is_active=True).first()
+        if broker and broker.username:
+            superusers.add(broker.username)
+            passwords[broker.username] = self._digest(broker.password or '')
+
+        self._passwords = passwords
+        self._owners = owners
+        self._tries = {owner_id: TopicPrefixTrie(items) for owner_id, items in prefixes.items()}
+        self._superusers = superusers
+        self._stats['rebuilds'] += 1
+        logger.info(f"Indice ACL MQTT ricostruito: {len(owners)} credenziali, {len(self._tries)} utenti")
+
+    def authenticate(self, username: str, password: str) -> bool:
+        """Verifica username e password di una connessione"""
+        self._ensure_loaded()
+        expected = self._passwords.get(username)
+        allowed = expected is not None and hmac.compare_digest(expected, self._digest(password or ''))
+        self._stats['auth_ok' if allowed else 'auth_denied'] += 1
+        return allowed
+
+    def is_superuser(self, username: str) -> bool:
+        self._ensure_loaded()
+        return username in self._superusers
+
+    def check_acl(self, username: str, topic: str, access: int = ACC_READ) -> bool:
+        """Verifica l'accesso al topic (lettura, scrittura o sottoscrizione)"""
+        self._ensure_loaded()
+        if username in self._superusers:
+            allowed = True
+        else:
+            owner_id = self._owners.get(username)
+            trie = self._tries.get(owner_id) if owner_id is not None else None
+            allowed = trie is not None and access in ACCESS_TYPES and trie.allows(topic)
+        self._stats['acl_ok' if allowed else 'acl_denied'] += 1
+        return allowed
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats['credentials'] = len(self._passwords)
+        return stats
+
+
+def invalidate_access_index() -> None:
+    """Invalida l'indice di questo processo e quello degli altri processi"""
+    bump_acl_version()
+    if _access_index is not None:
+        _access_index.invalidate()
+
 
 class MQTTAccessControl:
     @staticmethod
@@ -9,19 +227,19 @@ class MQTTAccessControl:
         Verifica i permessi di accesso per un topic MQTT
         access_type: 'subscribe' o 'publish'
         """
-        try:
-            cred = MQTTCredential.objects.select_related('user').get(
-                mqtt_username=username,
-                is_active=True
-            )
-            
-            # Verifica se il topic appartiene a un impianto dell'utente
-            user_plants = Plant.objects.filter(owner=cred.user)
-            for plant in user_plants:
-                if topic.startswith(f"cercollettiva/{plant.pod}/"):
-                    return True
-            
-            return False
-            
-        except MQTTCredential.DoesNotExist:
-            return False
\ No newline at end of file
+        access = ACC_SUBSCRIBE if access_type == 'subscribe' else ACC_WRITE
+        return get_access_index().check_acl(username, topic, access)
+
+
+# Singleton instance
+_access_index = None
+_access_index_lock = threading.Lock()
+
+def get_access_index() -> MQTTAccessIndex:
+    """Ottiene l'istanza singleton dell'indice ACL"""
+    global _access_index
+    if _access_index is None:
+        with _access_index_lock:
+            if _access_index is None:
+                _access_index = MQTTAccessIndex()
+    return _access_index
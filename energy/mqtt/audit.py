@@ -0,0 +1,244 @@
+# energy/mqtt/audit.py
+import atexit
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+
+from ..models import MQTTAuditLog
+from .stats import publish_stats
+
+logger = logging.getLogger('energy.mqtt')
+
+DEFAULT_AUDIT_FLUSH_INTERVAL = 5  # secondi
+DEFAULT_AUDIT_MAX_QUEUE = 10000
+# Operazioni ad alto volume registrate solo in parte (frazione 0-1)
+DEFAULT_SAMPLE_RATES = {'MESSAGE': 0.001, 'ACL_CHECK': 0.01}
+
+# Contatori degli eventi in cache, condivisi tra il processo di ingestione
+# e i processi web: mqtt_audit_count:<operazione>:<1|0>
+AUDIT_COUNTER_PREFIX = 'mqtt_audit_count'
+AUDIT_COUNTERS_SEEDED_KEY = f'{AUDIT_COUNTER_PREFIX}:seeded'
+
+CounterKey = Tuple[str, bool]
+
+
+def _counter_cache_key(operation: str, status: bool) -> str:
+    return f"{AUDIT_COUNTER_PREFIX}:{operation}:{int(bool(status))}"
+
+
+def _seed_counters() -> None:
+    """Inizializza i contatori dalla tabella (una sola query, solo se mancano in cache)"""
+    if not cache.add(AUDIT_COUNTERS_SEEDED_KEY, True, timeout=None):
+        return
+    rows = MQTTAuditLog.objects.values('operation', 'status').annotate(total=Count('id'))
+    counts = {_counter_cache_key(row['operation'], row['status']): row['total'] for row in rows}
+    if counts:
+        cache.set_many(counts, timeout=None)
+
+
+def get_audit_counters() -> Dict[CounterKey, int]:
+    """Contatori degli eventi di audit per (operazione, esito), senza COUNT sulla tabella"""
+    try:
+        _seed_counters()
+        keys = {
+            _counter_cache_key(operation, status): (operation, status)
+            for operation, _ in MQTTAuditLog.OPERATION_TYPES
+            for status in (True, False)
+        }
+        found = cache.get_many(list(keys))
+    except Exception as e:
+        logger.debug(f"Impossibile leggere i contatori di audit: {e}")
+        return {}
+    return {keys[key]: value for key, value in found.items()}
+
+
+class AuditEventWriter:
+    """
+    Scrittura differita e campionata dei log di audit MQTT.
+
+    `record` accoda l'evento in memoria; ogni `flush_interval` secondi la
+    coda viene scritta con un unico bulk_create, dal thread avviato con
+    `start` (processo di ingestione) o dalla prima `record` successiva
+    (processi web). Le operazioni ad alto volume (es. MESSAGE) vengono
+    accodate solo con probabilità `sample_rates[operazione]`; tutti gli
+    eventi, campionati o no, aggiornano i contatori in cache letti dalla
+    pagina delle impostazioni MQTT. Oltre `max_queue` eventi in attesa i
+    nuovi vengono scartati (restano nei contatori).
+    """
+
+    def __init__(self, flush_interval: Optional[float] = None,
+                 sample_rates: Optional[Dict[str, float]] = None,
+                 max_queue: Optional[int] = None):
+        mqtt_settings = getattr(settings, 'MQTT_SETTINGS', {})
+        self.flush_interval = flush_interval or mqtt_settings.get(
+            'AUDIT_FLUSH_INTERVAL', DEFAULT_AUDIT_FLUSH_INTERVAL)
+        self.sample_rates = dict(DEFAULT_SAMPLE_RATES)
+        self.sample_rates.update(mqtt_settings.get('AUDIT_SAMPLE_RATES', {}))
+        if sample_rates is not None:
+            self.sample_rates.update(sample_rates)
+        self.max_queue = max_queue or mqtt_settings.get('AUDIT_MAX_QUEUE', DEFAULT_AUDIT_MAX_QUEUE)
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._queue: deque = deque()
+        self._counts: Dict[CounterKey, int] = {}
+        self._last_flush = time.monotonic()
+
+        self._stop_event = threading.Event()
+        self._timer_thread = None
+
+        self._stats = {
+            'recorded': 0,
+            'sampled_out': 0,
+            'dropped': 0,
+            'written': 0,
+            'flushes': 0,
+            'errors': 0,
+        }
+
+    def record(self, operation: str, status: bool = True, mqtt_username: str = '',
+               topic: Optional[str] = None, client_id: Optional[str] = None,
+               ip_address: Optional[str] = None, details: Optional[Dict[str, Any]] = None,
+               user=None) -> bool:
+        """Registra un evento; True se accodato per la scrittura"""
+        rate = self.sample_rates.get(operation, 1.0)
+        sampled = rate >= 1.0 or random.random() < rate
+        if sampled and rate < 1.0:
+            # Ogni riga rappresenta circa 1/rate eventi
+            details = dict(details or {}, sample_rate=rate)
+        with self._lock:
+            key = (operation, bool(status))
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self._stats['recorded'] += 1
+            if not sampled:
+                self._stats['sampled_out'] += 1
+            elif len(self._queue) >= self.max_queue:
+                self._stats['dropped'] += 1
+                sampled = False
+            else:
+                event = MQTTAuditLog(
+                    user=user,
+                    mqtt_username=(mqtt_username or '')[:50],
+                    operation=operation,
+                    status=bool(status),
+                    topic=topic,
+                    client_id=client_id,
+                    ip_address=ip_address,
+                    details=details,
+                )
+                # bulk_create non chiama save(): retention e pulizia del topic qui
+                event.prepare()
+                self._queue.append(event)
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due and not self.is_running:
+            self.flush()
+        return sampled
+
+    @property
+    def is_running(self) -> bool:
+        return self._timer_thread is not None and self._timer_thread.is_alive()
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def flush(self) -> int:
+        """Scrive gli eventi accodati e aggiorna i contatori; restituisce le righe scritte"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._queue)
+                self._queue.clear()
+                counts, self._counts = self._counts, {}
+                self._last_flush = time.monotonic()
+            if not batch and not counts:
+                return 0
+
+            try:
+                if batch:
+                    # Contatori inizializzati prima dell'inserimento, per non contare due volte il batch
+                    _seed_counters()
+                    MQTTAuditLog.objects.bulk_create(batch)
+            except Exception as e:
+                self._stats['errors'] += 1
+                logger.error(f"Errore scrittura di {len(batch)} log di audit MQTT: {str(e)}")
+                with self._lock:
+                    # Riprova al prossimo flush, entro il limite della coda
+                    self._queue.extendleft(reversed(batch[:max(0, self.max_queue - len(self._queue))]))
+                    for key, value in counts.items():
+                        self._counts[key] = self._counts.get(key, 0) + value
+                return 0
+
+            self._publish_counts(counts)
+            self._stats['flushes'] += 1
+            self._stats['written'] += len(batch)
+            return len(batch)
+
+    @staticmethod
+    def _publish_counts(counts: Dict[CounterKey, int]) -> None:
+        for (operation, status), value in counts.items():
+            key = _counter_cache_key(operation, status)
+            try:
+                try:
+                    cache.incr(key, value)
+                except ValueError:
+                    # Chiave assente: nessun evento di questo tipo finora
+                    if not cache.add(key, value, timeout=None):
+                        cache.incr(key, value)
+            except Exception as e:
+                logger.debug(f"Impossibile aggiornare il contatore di audit {key}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Restituisce le metriche del writer di audit"""
+        stats = dict(self._stats)
+        stats['pending'] = len(self._queue)
+        return stats
+
+    def start(self) -> None:
+        """Avvia il thread di scrittura periodica"""
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._timer_thread = threading.Thread(target=self._run, name="mqtt-audit", daemon=True)
+        self._timer_thread.start()
+        atexit.register(self.stop)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+                publish_stats('audit', self.get_stats())
+            except Exception as e:
+                logger.error(f"Errore nel thread di scrittura dei log di audit: {e}")
+        connection.close()
+
+    def stop(self) -> None:
+        """Hook di arresto: ferma il timer e scrive gli eventi rimasti"""
+        self._stop_event.set()
+        if self._timer_thread and self._timer_thread is not threading.current_thread():
+            self._timer_thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+        publish_stats('audit', self.get_stats())
+
+
+# Singleton instance
+_audit_writer = None
+_audit_writer_lock = threading.Lock()
+
+def get_audit_writer() -> AuditEventWriter:
+    """Ottiene l'istanza singleton del writer di audit"""
+    global _audit_writer
+    if _audit_writer is None:
+        with _audit_writer_lock:
+            if _audit_writer is None:
+                _audit_writer = AuditEventWriter()
+                # Processi senza thread di scrittura: scrive gli eventi rimasti all'uscita
+                atexit.register(_audit_writer.flush)
+    return _audit_writer
@@ -1,28 +1,29 @@
-# energy/services/mqtt_auth.py
-import hashlib
+# energy/mqtt/auth.py
 import secrets
+import string
 from typing import Tuple
-from ..models import MQTTCredential
+from ..models import MQTTConfiguration
+from .acl import get_access_index
 
 class MQTTAuthService:
     @staticmethod
-    def create_credentials(user) -> Tuple[str, str]:
-        """Crea nuove credenziali MQTT per un utente"""
+    def create_credentials(device) -> Tuple[str, str]:
+        """Crea nuove credenziali MQTT per un dispositivo"""
         # Genera una password casuale
         password = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(16))
-        
-        # Crea o aggiorna le credenziali
-        cred, created = MQTTCredential.objects.get_or_create(user=user)
-        cred.mqtt_password = hashlib.sha256(password.encode()).hexdigest()
-        cred.save()
-        
+
+        # Crea o aggiorna le credenziali (password cifrata nel DB)
+        cred, created = MQTTConfiguration.objects.get_or_create(
+            device=device,
+            defaults={'mqtt_username': device.device_id, 'mqtt_password': password}
+        )
+        if not created:
+            cred.mqtt_password = password
+            cred.save()
+
         return cred.mqtt_username, password
 
     @staticmethod
     def validate_credentials(username: str, password: str) -> bool:
-        """Valida le credenziali MQTT"""
-        try:
-            cred = MQTTCredential.objects.get(mqtt_username=username, is_active=True)
-            return cred.mqtt_password == hashlib.sha256(password.encode()).hexdigest()
-        except MQTTCredential.DoesNotExist:
-            return False
\ No newline at end of file
+        """Valida le credenziali MQTT (dall'indice in memoria, senza query)"""
+        return get_access_index().authenticate(username, password)
@@ -0,0 +1,320 @@
+# energy/mqtt/batching.py
+import atexit
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from ..models import DeviceMeasurement, DeviceMeasurementDetail
+from ..models.device import pack_phase_details
+from ..phase_storage import PHASE_STORAGE_PACKED, get_phase_storage
+from .latency import get_latency_tracker
+from .latest import update_latest_states
+from .stats import publish_stats
+
+logger = logging.getLogger('energy.mqtt')
+
+DEFAULT_BATCH_MAX_ROWS = 500
+DEFAULT_BATCH_MAX_DELAY = 0.25  # secondi
+DEFAULT_BATCH_MAX_PENDING_ROWS = 50000
+RETRY_BACKOFF_MAX = 30  # secondi
+
+
+@dataclass
+class PendingMeasurement:
+    """Misurazione in attesa di scrittura, con gli eventuali dettagli di fase"""
+    measurement: DeviceMeasurement
+    details: List[DeviceMeasurementDetail] = field(default_factory=list)
+    # MeasurementRecord di origine, per le metriche di latenza
+    trace: Optional[Any] = None
+    # Token di conferma MQTT, rilasciato dopo la scrittura
+    ack: Optional[Any] = None
+    # Dettagli compattati in phase_data invece che in righe separate
+    packed: bool = False
+
+    @property
+    def rows(self) -> int:
+        return 1 if self.packed else 1 + len(self.details)
+
+
+class MeasurementBatchWriter:
+    """
+    Stadio di micro-batching tra la coda dei messaggi MQTT e il database.
+
+    Le misurazioni vengono accumulate in memoria e scritte con bulk_create
+    (prima le DeviceMeasurement, poi i DeviceMeasurementDetail) in un'unica
+    transazione, insieme all'upsert di DeviceLatestState, quando il batch
+    raggiunge `max_rows` righe o quando la misurazione più vecchia supera
+    `max_delay` secondi. Il last_seen dei dispositivi è gestito dal
+    PresenceTracker. Con `phase_storage` 'packed' i dettagli di fase sono
+    compattati in DeviceMeasurement.phase_data e non generano righe.
+
+    Se la scrittura fallisce (es. database non raggiungibile) il batch viene
+    trattenuto e riprovato con backoff esponenziale. Oltre `max_pending_rows`
+    righe in attesa `add()` si blocca, così i worker rallentano e la
+    pressione risale fino alla politica di sovraccarico delle code.
+
+    Il token di conferma (`ack`) di una misurazione viene trattenuto fino al
+    commit della transazione che la contiene: il messaggio MQTT di origine
+    viene confermato al broker solo quando i dati sono nel DB.
+    """
+
+    def __init__(self, max_rows: Optional[int] = None, max_delay: Optional[float] = None,
+                 max_pending_rows: Optional[int] = None, phase_storage: Optional[str] = None):
+        mqtt_settings = getattr(settings, 'MQTT_SETTINGS', {})
+        self.max_rows = max_rows or mqtt_settings.get('BATCH_MAX_ROWS', DEFAULT_BATCH_MAX_ROWS)
+        self.max_delay = max_delay or mqtt_settings.get('BATCH_MAX_DELAY', DEFAULT_BATCH_MAX_DELAY)
+        self.max_pending_rows = max_pending_rows or mqtt_settings.get(
+            'BATCH_MAX_PENDING_ROWS', DEFAULT_BATCH_MAX_PENDING_ROWS
+        )
+        self.phase_storage = phase_storage or get_phase_storage()
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._pending: List[PendingMeasurement] = []
+        self._pending_rows = 0
+        self._oldest = None
+
+        # Backoff dei tentativi dopo un errore di scrittura
+        self._failures = 0
+        self._retry_at = 0.0
+
+        self._stop_event = threading.Event()
+        self._timer_thread = None
+
+        # Metriche
+        self._stats = {
+            'batches': 0,
+            'rows': 0,
+            'errors': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'retained_batches': 0,
+            'blocked_adds': 0,
+        }
+
+    def add(self, measurement: DeviceMeasurement,
+            details: Sequence[DeviceMeasurementDetail] = (), trace: Optional[Any] = None,
+            ack: Optional[Any] = None) -> None:
+        """Accoda una misurazione (non salvata) con i relativi dettagli di fase"""
+        pending = PendingMeasurement(measurement, list(details), trace,
+                                     ack.retain() if ack is not None else None,
+                                     packed=self.phase_storage == PHASE_STORAGE_PACKED)
+        self._wait_for_space()
+        with self._space:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(pending)
+            self._pending_rows += pending.rows
+            full = self._pending_rows >= self.max_rows and time.monotonic() >= self._retry_at
+        if full:
+            self.flush()
+
+    def _wait_for_space(self) -> None:
+        """Blocca finché le righe in attesa non scendono sotto `max_pending_rows`"""
+        blocked = False
+        while True:
+            with self._space:
+                if self._pending_rows < self.max_pending_rows or self._stop_event.is_set():
+                    return
+                if not blocked:
+                    blocked = True
+                    self._stats['blocked_adds'] += 1
+                delay = self._retry_at - time.monotonic()
+                if delay > 0:
+                    self._space.wait(timeout=min(delay, self.max_delay))
+                    continue
+            self.flush()
+
+    @property
+    def pending_rows(self) -> int:
+        return self._pending_rows
+
+    def flush(self) -> int:
+        """Scrive il batch corrente; restituisce il numero di righe inserite"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._pending_rows = 0
+                self._oldest = None
+
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                rows = self._write(batch)
+            except Exception as e:
+                self._stats['errors'] += 1
+                self._retain(batch)
+                logger.error(f"Errore scrittura batch di {len(batch)} misurazioni, nuovo tentativo "
+                             f"tra {self._retry_at - time.monotonic():.1f}s: {str(e)}")
+                return 0
+
+            with self._space:
+                self._failures = 0
+                self._retry_at = 0.0
+                self._space.notify_all()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self._record_flush(rows, elapsed_ms)
+            self._cache_latest(batch)
+            self._observe_latency(batch)
+            self._release_acks(batch)
+            return rows
+
+    def _retain(self, batch: List[PendingMeasurement]) -> None:
+        """Rimette in testa il batch non scritto e programma il nuovo tentativo"""
+        for item in batch:
+            # bulk_create può aver assegnato i pk prima del rollback
+            item.measurement.pk = None
+            item.measurement._state.adding = True
+            for detail in item.details:
+                detail.pk = None
+                detail._state.adding = True
+        with self._space:
+            self._pending = batch + self._pending
+            self._pending_rows += sum(item.rows for item in batch)
+            self._oldest = time.monotonic()
+            self._failures += 1
+            self._retry_at = time.monotonic() + min(RETRY_BACKOFF_MAX, self.max_delay * 2 ** self._failures)
+            self._stats['retained_batches'] += 1
+
+    def _write(self, batch: List[PendingMeasurement]) -> int:
+        measurements = [item.measurement for item in batch]
+        with transaction.atomic():
+            for item in batch:
+                if item.packed:
+                    item.measurement.phase_data = pack_phase_details(item.details)
+            DeviceMeasurement.objects.bulk_create(measurements, batch_size=self.max_rows)
+
+            details = []
+            for item in batch:
+                if item.packed:
+                    continue
+                for detail in item.details:
+                    # Il pk del padre è disponibile dopo il bulk_create; stesso
+                    # timestamp del padre (stessa partizione mensile)
+                    detail.measurement = item.measurement
+                    detail.timestamp = item.measurement.timestamp
+                    details.append(detail)
+            if details:
+                DeviceMeasurementDetail.objects.bulk_create(details, batch_size=self.max_rows)
+
+            update_latest_states((item.measurement, item.details) for item in batch)
+
+        return len(measurements) + len(details)
+
+    def _record_flush(self, rows: int, elapsed_ms: float) -> None:
+        stats = self._stats
+        stats['batches'] += 1
+        stats['rows'] += rows
+        stats['last_batch_size'] = rows
+        stats['max_batch_size'] = max(stats['max_batch_size'], rows)
+        stats['last_flush_ms'] = round(elapsed_ms, 2)
+        stats['max_flush_ms'] = round(max(stats['max_flush_ms'], elapsed_ms), 2)
+        stats['total_flush_ms'] += elapsed_ms
+        logger.debug(f"Batch scritto: {rows} righe in {elapsed_ms:.1f} ms")
+
+    @staticmethod
+    def _cache_latest(batch: List[PendingMeasurement]) -> None:
+        """Replica la cache last_measurement_* del signal post_save, non inviato da bulk_create"""
+        latest = {}
+        for item in batch:
+            m = item.measurement
+            latest[f"last_measurement_{m.device_id}"] = {
+                'power': m.power,
+                'voltage': m.voltage,
+                'current': m.current,
+                'timestamp': m.timestamp.isoformat()
+            }
+        if latest:
+            try:
+                cache.set_many(latest, timeout=3600)
+            except Exception as e:
+                logger.debug(f"Errore aggiornamento cache ultime misurazioni: {e}")
+
+    @staticmethod
+    def _observe_latency(batch: List[PendingMeasurement]) -> None:
+        """Registra la latenza fino alla scrittura delle misurazioni tracciate"""
+        traced = [(item.trace, item.measurement.device) for item in batch if item.trace is not None]
+        if traced:
+            try:
+                get_latency_tracker().observe_persisted(traced)
+            except Exception as e:
+                logger.debug(f"Errore registrazione latenza: {e}")
+
+    @staticmethod
+    def _release_acks(batch: List[PendingMeasurement]) -> None:
+        """Conferma i messaggi MQTT le cui misurazioni sono state scritte"""
+        for item in batch:
+            if item.ack is not None:
+                item.ack.release()
+                item.ack = None
+
+    def get_stats(self) -> Dict[str, float]:
+        """Restituisce le metriche del batch writer"""
+        stats = dict(self._stats)
+        total_ms = stats.pop('total_flush_ms')
+        stats['avg_flush_ms'] = round(total_ms / stats['batches'], 2) if stats['batches'] else 0.0
+        stats['avg_batch_size'] = round(stats['rows'] / stats['batches'], 1) if stats['batches'] else 0.0
+        stats['pending_rows'] = self._pending_rows
+        stats['retrying'] = self._failures > 0
+        return stats
+
+    def start(self) -> None:
+        """Avvia il thread che scrive i batch scaduti per età"""
+        if self._timer_thread and self._timer_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._timer_thread = threading.Thread(target=self._run, daemon=True)
+        self._timer_thread.start()
+        atexit.register(self.stop)
+
+    def _run(self) -> None:
+        interval = max(self.max_delay / 2, 0.01)
+        last_publish = 0.0
+        while not self._stop_event.wait(interval):
+            try:
+                oldest = self._oldest
+                now = time.monotonic()
+                if oldest is not None and now - oldest >= self.max_delay and now >= self._retry_at:
+                    self.flush()
+                now = time.monotonic()
+                if now - last_publish >= 10:
+                    publish_stats('batch', self.get_stats())
+                    last_publish = now
+            except Exception as e:
+                logger.error(f"Errore nel thread di flush dei batch: {e}")
+
+    def stop(self) -> None:
+        """Hook di arresto: ferma il timer e scrive le misurazioni rimaste"""
+        self._stop_event.set()
+        with self._space:
+            self._space.notify_all()
+        if self._timer_thread and self._timer_thread is not threading.current_thread():
+            self._timer_thread.join(timeout=self.max_delay * 4)
+        self.flush()
+        publish_stats('batch', self.get_stats())
+
+
+# Singleton instance
+_batch_writer = None
+_batch_writer_lock = threading.Lock()
+
+def get_batch_writer() -> MeasurementBatchWriter:
+    """Ottiene l'istanza singleton del batch writer"""
+    global _batch_writer
+    if _batch_writer is None:
+        with _batch_writer_lock:
+            if _batch_writer is None:
+                _batch_writer = MeasurementBatchWriter()
+    return _batch_writer
@@ -3,21 +3,45 @@ import logging
 import threading
 from typing import Optional
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from django.conf import settings
 from django.utils import timezone
 from .manager import DeviceManager
 from ..models import MQTTBroker, MQTTAuditLog
-from .core import get_mqtt_service, MQTTMessage
+from .core import CONNACK_ERRORS, create_mqtt_client, session_client_id
+from .batching import get_batch_writer
+from .presence import get_presence_tracker
+from .counters import get_counter_store
+from .latency import get_latency_tracker
+from .audit import get_audit_writer
+from .routing import get_routing_index
+from .workers import IngestionWorkerPool
+from .pipeline import get_ingest_pipeline
+from .subscriptions import SubscriptionManager
+from .inflight import InflightTracker
+from .codec import MeasurementRecord
 import time
 import json
-from queue import Queue
 from collections import deque
 
 
 logger = logging.getLogger('energy.mqtt')
 
+DEFAULT_SESSION_EXPIRY = 3600  # secondi
+
 class EnergyMQTTClient:
-    """Client MQTT per la gestione dei dispositivi energetici"""
+    """
+    Client MQTT per la gestione dei dispositivi energetici.
+
+    Con una sessione persistente (clean_session=False) il client usa un
+    client id stabile e chiede al broker di conservare sottoscrizioni e
+    messaggi QoS 1/2 per SESSION_EXPIRY secondi dopo la disconnessione. I
+    messaggi vengono confermati manualmente dall'InflightTracker solo dopo
+    la scrittura nel DB: quelli non confermati alla caduta della connessione
+    vengono riconsegnati dal broker. La riconnessione è gestita solo dal
+    loop di rete di paho (backoff tra reconnect_delay_set min e max).
+    """
     
     def __init__(self):
         """Initialize MQTT client with thread-safe message handling"""
@@ -28,35 +52,50 @@ class EnergyMQTTClient:
         self._username = None
         self._password = None
         self._use_tls = False
+        self._client_id = None
+        self._clean_session = True
         self._initialized = False
         
         # State management 
         self._is_connected = False
-        self._service = get_mqtt_service()
         self._last_message_time = None
         self._last_values = {}
         self._message_count = 0
-        self._retry_delay = 1
-        self._max_retry_delay = 60
         
         # Thread safety
         self._lock = threading.Lock()
-        self._subscription_lock = threading.Lock()
-        self._subscribed_topics = set()
+
+        # Sottoscrizioni incrementali (diff tra topic desiderati e attivi)
+        self._subscriptions = SubscriptionManager(lambda: self._client)
+
+        # Conferme manuali dei messaggi QoS 1/2 (solo con sessione persistente)
+        self._inflight: Optional[InflightTracker] = None
+        self._accepting = True
         
         # Message processing
-        self._message_queue = Queue(maxsize=10000) # Limita coda
         self._message_buffer = deque(maxlen=1000)
         self._device_manager = DeviceManager()
+        self._pipeline = get_ingest_pipeline()
+        self._pipeline.add_listener(self._on_measurement)
         
-        # Start worker threads
-        self._processing_thread = threading.Thread(target=self._process_queue, daemon=True)
-        self._processing_thread.start()
+        # Worker di ingestione partizionati per dispositivo (avviati da start())
+        self._workers = IngestionWorkerPool(
+            handler=self._process_message,
+            key_func=self._partition_key,
+            pass_received_at=True
+        )
         self._start_heartbeat()
 
     def configure(self, host: str, port: int, username: str = None, 
-                password: str = None, use_tls: bool = False):
-        """Configura il client con i parametri di connessione"""
+                password: str = None, use_tls: bool = False,
+                client_id: Optional[str] = None, clean_session: Optional[bool] = None):
+        """
+        Configura il client con i parametri di connessione.
+
+        `clean_session` (default MQTT_SETTINGS['CLEAN_SESSION']) False attiva
+        la sessione persistente; `client_id` ne fissa l'identificativo
+        (default MQTT_SETTINGS['CLIENT_ID'] o l'hostname).
+        """
         try:
             # Validazione dell'host
             import socket
@@ -71,6 +110,10 @@ class EnergyMQTTClient:
             self._username = username
             self._password = password
             self._use_tls = use_tls
+            if clean_session is None:
+                clean_session = getattr(settings, 'MQTT_SETTINGS', {}).get('CLEAN_SESSION', True)
+            self._clean_session = clean_session
+            self._client_id = session_client_id(not clean_session, client_id)
             self._setup_client()
             self._initialized = True
             logger.info(f"MQTT client configured with host: {host}, port: {port}")
@@ -85,8 +128,9 @@ class EnergyMQTTClient:
             if not self._host:
                 raise ValueError("Host not configured. Call configure() first.")
             
-            client_id = f"CerCollettiva-{timezone.now().timestamp()}"
-            self._client = mqtt.Client(client_id=client_id, clean_session=False)
+            manual_ack = not self._clean_session
+            self._client = create_mqtt_client(self._client_id, manual_ack=manual_ack)
+            self._inflight = InflightTracker(self._client.ack) if manual_ack else None
             
             # Imposta timeout più breve per la connessione
             self._client.connect_timeout = 5.0  # 5 secondi
@@ -96,6 +140,7 @@ class EnergyMQTTClient:
             self._client.on_connect = self._on_connect
             self._client.on_disconnect = self._on_disconnect
             self._client.on_message = self._on_message
+            self._client.on_subscribe = self._subscriptions.on_subscribe
             
             # Auth
             if self._username:
@@ -117,42 +162,25 @@ class EnergyMQTTClient:
             logger.error(f"MQTT client setup error: {e}")
             raise
 
-    def _process_queue(self):
-        """Thread dedicato al processing dei messaggi"""
-        while True:
-            try:
-                msg = self._message_queue.get()
-                # Aggiungi al buffer circolare
-                self._message_buffer.append(msg)
-                # Processa il messaggio
-                self._process_message(msg)
-                self._message_queue.task_done()
-            except Exception as e:
-                logger.error(f"Error processing message from queue: {e}")
+    @staticmethod
+    def _partition_key(topic: str) -> Optional[str]:
+        """Chiave di partizione dei worker: il device_id associato al topic"""
+        config = get_routing_index().match(topic)
+        return config.device_id if config else None
 
-    def _process_message(self, msg):
-        """Processa un singolo messaggio"""
+    def _process_message(self, topic: str, payload: bytes, received_at: Optional[float] = None,
+                         ack=None) -> None:
+        """Processa un singolo messaggio (eseguito dal worker del dispositivo)"""
         try:
-            # Evita refresh troppo frequenti usando una cache
-            cache_key = f"last_refresh_{msg.topic}"
-            last_refresh = getattr(self, '_last_refresh_time', {})
-            current_time = time.time()
-            
-            if cache_key in last_refresh and current_time - last_refresh[cache_key] < 60:
-                # Skip refresh se è passato meno di 1 minuto
-                return
-                
-            payload = json.loads(msg.payload.decode('utf-8'))
-            self._device_manager.process_message(msg.topic, payload)
-            
-            # Aggiorna timestamp ultimo refresh
-            self._last_refresh_time = getattr(self, '_last_refresh_time', {})
-            self._last_refresh_time[cache_key] = current_time
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Error decoding JSON from {msg.topic}: {e}")
+            self._message_buffer.append((topic, payload))
+            self._pipeline.process(topic, payload, received_at, ack)
+
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
+            logger.error(f"Error processing message on {topic}: {str(e)}")
+
+    def _on_measurement(self, device_config, record: MeasurementRecord, topic: str) -> None:
+        """Consumatore della pipeline: log dei valori accettati"""
+        self._log_message_values(record)
 
     def start(self) -> None:
         """Avvia il client MQTT"""
@@ -161,24 +189,31 @@ class EnergyMQTTClient:
                 raise ValueError("Client not configured. Call configure() first.")
                     
             logger.info(f"Connessione al broker MQTT {self._host}:{self._port}")
+
+            # Pipeline di ingestione: worker per dispositivo, batch writer e last_seen
+            self._accepting = True
+            self._workers.start()
+            get_batch_writer().start()
+            get_presence_tracker().start()
+            get_counter_store().start()
+            get_latency_tracker().start()
+            get_audit_writer().start()
             
             try:
-                #logger.info("prima di connect")            
-                self._client.connect(
+                # Connessione e riconnessioni nel thread di rete di paho
+                self._client.connect_async(
                     self._host,
                     self._port,
-                    keepalive=60
+                    keepalive=getattr(settings, 'MQTT_SETTINGS', {}).get('KEEPALIVE', 60),
+                    clean_start=self._clean_session,
+                    properties=self._connect_properties()
                 )
-                #logger.info("dopo connect")
-                
                 self._client.loop_start()
-                #logger.info("dopo loop_start")
                 
-                # Invece di usare is_connected, usa un metodo di check interno
                 connection_timeout = 10  # 10 secondi
                 start_time = time.time()
                 
-                while not self._check_connection_status():  # Nuovo metodo
+                while not self._check_connection_status():
                     if time.time() - start_time > connection_timeout:
                         raise TimeoutError("Connection timeout")
                     time.sleep(0.1)
@@ -186,20 +221,26 @@ class EnergyMQTTClient:
                 return True
 
             except TimeoutError:
-                logger.error("MQTT connection timed out")
-                self._reconnect_with_backoff()
+                # Il loop di paho continua a ritentare con backoff
+                logger.error("MQTT connection timed out, retrying in background")
                 return False
                     
             except Exception as e:
                 logger.error(f"MQTT client start error: {str(e)}")
-                self._reconnect_with_backoff()
                 return False
 
         except Exception as e:
             logger.error(f"Error starting MQTT client: {str(e)}")
             return False
 
-    # Aggiungi questo nuovo metodo interno
+    def _connect_properties(self) -> Properties:
+        """Proprietà CONNECT: durata della sessione dopo la disconnessione"""
+        properties = Properties(PacketTypes.CONNECT)
+        if not self._clean_session:
+            properties.SessionExpiryInterval = int(getattr(settings, 'MQTT_SETTINGS', {}).get(
+                'SESSION_EXPIRY', DEFAULT_SESSION_EXPIRY))
+        return properties
+
     def _check_connection_status(self) -> bool:
         """Metodo interno per verificare lo stato della connessione"""
         with self._lock:
@@ -216,6 +257,8 @@ class EnergyMQTTClient:
 
     def stop(self) -> None:
         """Ferma il client MQTT"""
+        self._subscriptions.cancel()
+        self._drain()
         if self._client:
             try:
                 self._client.publish(
@@ -224,195 +267,168 @@ class EnergyMQTTClient:
                     qos=1,
                     retain=True
                 )
-                self._client.loop_stop()
                 self._client.disconnect()
+                self._client.loop_stop()
                 
             except Exception as e:
                 logger.error(f"MQTT client stop error: {e}")
 
-    def _on_connect(self, client, userdata, flags, rc):
+        get_presence_tracker().stop()
+        get_counter_store().stop()
+        get_latency_tracker().stop()
+        get_audit_writer().stop()
+
+    def _drain(self) -> None:
+        """
+        Elabora i messaggi in coda e scrive le misurazioni pendenti prima di
+        disconnettersi, così le conferme partono sulla connessione ancora
+        attiva. I messaggi ricevuti nel frattempo non vengono confermati e
+        il broker li riconsegna alla prossima sessione.
+        """
+        self._accepting = False
+        self._workers.stop()
+        self._pipeline.release()
+        get_batch_writer().stop()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
         """Callback per la connessione"""
-        if rc == 0:
+        if reason_code == 0:
             with self._lock:  # Thread safety
                 self._is_connected = True
                 #print("\n=============== MQTT ==================")
                 print(f" | Connessione al broker stabilita!    |")
                 logger.info(f"Broker: {self._host}:{self._port}")
                 logger.info(f"Client ID: {client._client_id.decode()}")
+                get_audit_writer().record('CONNECT', mqtt_username=self._username or '',
+                                          client_id=self._client_id,
+                                          details={'session_present': bool(flags.session_present)})
                 
-                if self._subscribed_topics:
-                    print(" | Topic sottoscritti:                |")
-                    for topic in self._subscribed_topics:
-                        print(f" | - {topic}")
+                # Senza sessione sul broker i topic desiderati vengono
+                # risottoscritti; con la sessione ripresa si invia solo il diff
+                if not flags.session_present:
+                    self._subscriptions.reset()
+                self._subscribe_topics()
+                if self.subscribed_topics:
+                    print(f" | Topic sottoscritti: {len(self.subscribed_topics)}")
                 else:
                     print(" | Nessun topic sottoscritto         |")
-                
-                self._subscribe_topics()
+
                 self._publish_status("online")
                 #print("========================================\n")
         else:
-            error_msgs = {
-                1: "Versione protocollo non corretta", 
-                2: "Identificativo client non valido",
-                3: "Server non disponibile",
-                4: "Username o password non validi",
-                5: "Non autorizzato"
-            }
-            error_msg = error_msgs.get(rc, f'Errore sconosciuto ({rc})')
+            error_msg = CONNACK_ERRORS.get(reason_code.value, f'Errore sconosciuto ({reason_code})')
             print("\n============== ERRORE ==================")
             print(f" | Connessione MQTT fallita!            |")
             print(f" | Motivo: {error_msg}")
             print("========================================\n")
             logger.error(f"MQTT connection failed: {error_msg}")
+            get_audit_writer().record('CONNECT', status=False, mqtt_username=self._username or '',
+                                      client_id=self._client_id, details={'message': error_msg})
             with self._lock:
                 self._is_connected = False
         
-    def _on_disconnect(self, client, userdata, rc):
-        """Gestione disconnessione migliorata"""
-        self._is_connected = False
-        if rc != 0:
-            logger.warning("Unexpected disconnection from broker")
-            self._reconnect_with_backoff()
-
-    def _reconnect_with_backoff(self):
-        def reconnect_thread():
-            while not self.check_connection():  # usa il nuovo metodo rinominato
-                try:
-                    logger.info(f"Tentativo di riconnessione tra {self._retry_delay}s...")
-                    time.sleep(self._retry_delay)
-                    
-                    if self._client.reconnect() == 0:  # verifica il risultato della riconnessione
-                        logger.info("Riconnessione riuscita")
-                        break
-                    else:
-                        raise Exception("Riconnessione fallita")
-                        
-                except Exception as e:
-                    logger.error(f"Tentativo di riconnessione fallito: {e}")
-                    self._retry_delay = min(self._retry_delay * 2, self._max_retry_delay)
-
-        threading.Thread(target=reconnect_thread, daemon=True).start()
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        """Disconnessione: la riconnessione è gestita dal loop di paho"""
+        with self._lock:
+            self._is_connected = False
+        # I messaggi non confermati verranno riconsegnati sulla nuova connessione
+        if self._inflight is not None:
+            self._inflight.discard()
+        get_audit_writer().record('DISCONNECT', status=reason_code == 0, mqtt_username=self._username or '',
+                                  client_id=self._client_id, details={'reason': str(reason_code)})
+        if reason_code != 0:
+            logger.warning(f"Unexpected disconnection from broker ({reason_code}), reconnecting")
                 
     def _on_message(self, client, userdata, msg):
-        """Callback per i messaggi ricevuti"""
-        try:
-            data = json.loads(msg.payload.decode('utf-8'))
+        """Callback per i messaggi ricevuti: accoda al worker del dispositivo"""
+        if not self._accepting:
+            # Arresto in corso: senza conferma il broker lo riconsegnerà
+            return
+        self._message_count += 1
+        self._last_message_time = timezone.now()
+        ack = self._inflight.track(msg.mid, msg.qos) if self._inflight is not None else None
+        self._workers.submit(msg.topic, msg.payload, ack=ack)
+
+    def _log_message_values(self, record: MeasurementRecord) -> None:
+        """Log dei valori principali del messaggio"""
+        topic = record.topic
+        if topic.endswith('/em:0'):
+            device_id = topic.split('/')[2]
+            current_power = record.power
             
-            if msg.topic.endswith('/em:0'):
-                device_id = msg.topic.split('/')[2]
-                current_power = data.get('total_act_power')
-                
-                last_value = self._last_values.get(device_id)
-                
-                if current_power is not None:
-                    # Se riceviamo uno 0 e abbiamo un valore precedente valido
-                    if current_power == 0 and last_value:
-                        time_diff = (timezone.now() - last_value['timestamp']).seconds
-                        # Se sono passati meno di 5 minuti, manteniamo il valore precedente
-                        if time_diff < 300:  # 300 secondi = 5 minuti
-                            current_power = last_value['power']
-                            logger.info(f"  Ignorato valore zero, mantenuto precedente: {current_power:.1f}W")
-                    
-                    self._last_values[device_id] = {
-                        'power': current_power,
-                        'timestamp': timezone.now()
-                    }
-                    logger.info(f"  Potenza Totale [W]: {current_power:.1f}")
-                    
-                elif last_value and (timezone.now() - last_value['timestamp']).seconds < 120:
-                    logger.info(f"  Potenza Totale [W]: {last_value['power']:.1f} (mantenuto)")
+            last_value = self._last_values.get(device_id)
             
-            elif msg.topic.endswith('/emdata:0'):
-                logger.info(f"  Energia Attiva Totale [kWh]: {data.get('total_act', 'N/A'):.2f}")
+            if current_power is not None:
+                # Se riceviamo uno 0 e abbiamo un valore precedente valido
+                if current_power == 0 and last_value:
+                    time_diff = (timezone.now() - last_value['timestamp']).seconds
+                    # Se sono passati meno di 5 minuti, manteniamo il valore precedente
+                    if time_diff < 300:  # 300 secondi = 5 minuti
+                        current_power = last_value['power']
+                        logger.info(f"  Ignorato valore zero, mantenuto precedente: {current_power:.1f}W")
                 
-            self._device_manager.process_message(msg.topic, msg.payload)
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Error decoding JSON from {msg.topic}: {e}")
-            logger.error(f"Raw payload: {msg.payload}")
-        except Exception as e:
-            logger.error(f"Error processing message on {msg.topic}: {str(e)}")    
+                self._last_values[device_id] = {
+                    'power': current_power,
+                    'timestamp': timezone.now()
+                }
+                logger.info(f"  Potenza Totale [W]: {current_power:.1f}")
+                
+            elif last_value and (timezone.now() - last_value['timestamp']).seconds < 120:
+                logger.info(f"  Potenza Totale [W]: {last_value['power']:.1f} (mantenuto)")
+        
+        elif topic.endswith('/emdata:0'):
+            logger.info(f"  Energia Attiva Totale [kWh]: {record.energy_total:.2f}")
 
 
     def _subscribe_topics(self) -> None:
-        """Gestisce le sottoscrizioni ai topic MQTT"""
+        """Allinea le sottoscrizioni ai topic dei dispositivi attivi (solo le differenze)"""
         try:
-            # Prima annulla tutte le sottoscrizioni esistenti
-            for topic in list(self._subscribed_topics):
-                try:
-                    self.unsubscribe(topic)
-                except Exception as e:
-                    logger.error(f"Error unsubscribing from {topic}: {e}")
-            
-            # Ottieni i topic dei dispositivi attivi
-            topics = self._device_manager.get_subscription_topics()
-            
-            # Se non ci sono dispositivi attivi, non sottoscrivere a nessun topic
-            if not topics:
+            # Topic dei dispositivi registrati, tramite $share/<group>/ se è
+            # configurato un gruppo di ingestione
+            self._subscriptions.replace(self._device_manager.get_device_topics())
+            if not self._subscriptions.desired:
                 logger.info("No active devices found, no topics to subscribe")
-                return
-
-            # Sottoscrivi solo ai topic dei dispositivi registrati
-            for topic in topics:
-                try:
-                    result, mid = self._client.subscribe(topic, qos=1)
-                    if result == 0:
-                        self._subscribed_topics.add(topic)
-                        #logger.info(f"Successfully subscribed to {topic}")
-                    else:
-                        logger.error(f"Failed to subscribe to {topic}")
-                except Exception as e:
-                    logger.error(f"Subscribe error for {topic}: {e}")
+            if self._is_connected:
+                self._subscriptions.sync()
 
         except Exception as e:
             logger.error(f"Error in _subscribe_topics: {e}")
 
+    @property
+    def subscribed_topics(self) -> frozenset:
+        """Topic sottoscritti sul broker"""
+        return self._subscriptions.active
+
     def subscribe(self, topic: str) -> None:
         """Sottoscrive ad un topic MQTT"""
+        self._subscriptions.add_topic(topic)
         if self._client and self._is_connected:
-            try:
-                result, mid = self._client.subscribe(topic, qos=1)
-                if result == 0:
-                    self._subscribed_topics.add(topic)
-                    #logger.info(f"Successfully subscribed to {topic}")
-                else:
-                    logger.error(f"Failed to subscribe to {topic}")
-            except Exception as e:
-                logger.error(f"Subscribe error for {topic}: {e}")
+            self._subscriptions.sync()
 
     def unsubscribe(self, topic: str) -> None:
         """Annulla la sottoscrizione da un topic MQTT"""
+        self._subscriptions.discard_topic(topic)
         if self._client and self._is_connected:
-            try:
-                result, mid = self._client.unsubscribe(topic)
-                if result == 0:
-                    self._subscribed_topics.discard(topic)
-                    #logger.info(f"Successfully unsubscribed from {topic}")
-                else:
-                    logger.error(f"Failed to unsubscribe from {topic}")
-            except Exception as e:
-                logger.error(f"Unsubscribe error for {topic}: {e}")
+            self._subscriptions.sync()
+
+    def update_device(self, config) -> None:
+        """Aggiorna le sottoscrizioni di un dispositivo modificato (sincronizzazione raggruppata)"""
+        topics = self._device_manager.update_device(config)
+        if self._subscriptions.set_owner(config.device_id, topics):
+            self._subscriptions.schedule()
+
+    def remove_device(self, device_id: str) -> None:
+        """Rimuove le sottoscrizioni di un dispositivo eliminato"""
+        self._device_manager.remove_device(device_id)
+        if self._subscriptions.remove_owner(device_id):
+            self._subscriptions.schedule()
 
     def refresh_subscriptions(self) -> None:
         """Aggiorna tutte le sottoscrizioni"""
         if not self._client or not self._is_connected:
             logger.warning("Cannot refresh subscriptions: client not connected")
             return
-            
-        try:
-            #logger.info("Refreshing MQTT subscriptions...")
-            
-            # Annulla tutte le sottoscrizioni esistenti
-            for topic in list(self._subscribed_topics):
-                self.unsubscribe(topic)
-            
-            # Usa il metodo esistente per sottoscrivere ai nuovi topic
-            self._subscribe_topics()
-            
-            #logger.info(f"Subscriptions refreshed. Active topics: {len(self._subscribed_topics)}")
-            
-        except Exception as e:
-            logger.error(f"Error refreshing subscriptions: {e}")
+        self._subscribe_topics()
 
     def _publish_status(self, status: str) -> None:
         """Pubblica lo stato del client"""
@@ -420,7 +436,7 @@ class EnergyMQTTClient:
             message = json.dumps({
                 "status": status,
                 "timestamp": timezone.now().isoformat(),
-                "topics": len(self._subscribed_topics)
+                "topics": len(self.subscribed_topics)
             })
             
             self._client.publish(
@@ -436,14 +452,19 @@ class EnergyMQTTClient:
     def cleanup(self):
         """Pulizia risorse alla chiusura"""
         try:
+            self._subscriptions.cancel()
+            # Elabora le code e scrive le misurazioni prima di disconnettersi
+            self._drain()
             if self._client:
                 self._publish_status("offline")
-                self._client.loop_stop()
                 self._client.disconnect()
-                
-            # Arresta i thread
-            if hasattr(self, '_processing_thread'):
-                self._processing_thread.join(timeout=1.0)
+                self._client.loop_stop()
+
+            # Scrive last_seen e contatori pendenti
+            get_presence_tracker().stop()
+            get_counter_store().stop()
+            get_latency_tracker().stop()
+            get_audit_writer().stop()
                 
         except Exception as e:
             logger.error(f"Error during cleanup: {e}")
@@ -487,12 +508,7 @@ class EnergyMQTTClient:
         
         self._device_manager.refresh_configurations()
         if self._is_connected:
-            # Annulla le vecchie sottoscrizioni
-            for topic in self._subscribed_topics:
-                self._client.unsubscribe(topic)
-            self._subscribed_topics.clear()
-            
-            # Sottoscrivi ai nuovi topic
+            # Sottoscrive i nuovi topic e annulla solo quelli non più usati
             self._subscribe_topics()
             
             # Ripristina i valori precedenti
@@ -506,7 +522,7 @@ class EnergyMQTTClient:
                     Stato: {'Connesso' if self._is_connected else 'Disconnesso'}
                     Messaggi ricevuti: {self._message_count}
                     Ultimo messaggio: {self._last_message_time or 'Mai'}
-                    Topics sottoscritti: {len(self._subscribed_topics)}
+                    Topics sottoscritti: {len(self.subscribed_topics)}
                     Host: {self._host}:{self._port}
                 """)
                 time.sleep(60)
@@ -534,6 +550,11 @@ def init_mqtt_connection():
     """
     try:
         time.sleep(5)  # Delay iniziale per permettere al DB di essere pronto
+
+        # Registra i receiver dei signal (routing index, sottoscrizioni)
+        # nel processo che gestisce la connessione MQTT
+        from ..services import signals  # noqa: F401
+
         #print("\n=========== MQTT Startup ===========")
         print(" Inizializzazione connessione MQTT")
         #print("===================================")
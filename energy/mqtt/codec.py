@@ -0,0 +1,157 @@
+# energy/mqtt/codec.py
+import json
+import logging
+from typing import Any, Optional, Tuple
+
+from ..devices.mapping import DEFAULT_MAPPING, KIND_ENERGY, KIND_POWER, PayloadMapping
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - backend opzionale
+    orjson = None
+
+logger = logging.getLogger('energy.mqtt')
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+# Eccezioni di decodifica di entrambi i backend
+if orjson is not None:
+    DecodeError = (orjson.JSONDecodeError, json.JSONDecodeError, UnicodeDecodeError)
+else:
+    DecodeError = (json.JSONDecodeError, UnicodeDecodeError)
+
+# Campi del payload con il timestamp riportato dal dispositivo
+REPORTED_TIMESTAMP_FIELDS = ('ts', 'timestamp', 'unixtime')
+
+# Dettaglio di fase: (fase, tensione, corrente, potenza, fattore di potenza, frequenza)
+PhaseValues = Tuple[str, Any, Any, Any, Any, Any]
+
+
+def loads(data: Any) -> Any:
+    """Decodifica JSON da bytes/str con il backend più veloce disponibile"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode('utf-8')
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Codifica JSON in bytes con il backend più veloce disponibile"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, default=str, separators=(',', ':')).encode('utf-8')
+
+
+def reported_timestamp(payload: dict) -> Optional[Any]:
+    """Timestamp riportato dal dispositivo, se presente nel payload"""
+    for field in REPORTED_TIMESTAMP_FIELDS:
+        value = payload.get(field)
+        if value is not None:
+            return value
+    params = payload.get('params')
+    if isinstance(params, dict):
+        return params.get('ts')
+    return None
+
+
+class MeasurementRecord:
+    """
+    Misurazione estratta da un messaggio MQTT.
+
+    Il payload viene decodificato una sola volta in `decode_message` e ridotto
+    ai soli campi usati a valle dal mapping compilato del dispositivo; il
+    dizionario JSON non viene conservato. `received_at` e `parsed_at` (epoch)
+    sono impostati dal client per le metriche di latenza; `ack` è il token
+    di conferma MQTT (InflightMessage) del messaggio, se da confermare.
+    """
+
+    __slots__ = ('topic', 'kind', 'power', 'energy_total', 'voltage', 'current',
+                 'power_factor', 'phases', 'reported_ts', 'raw', 'received_at', 'parsed_at', 'ack')
+
+    def __init__(self, topic: str, kind: Optional[str], power: float = 0.0,
+                 energy_total: float = 0.0, voltage: float = 0.0, current: float = 0.0,
+                 power_factor: float = 1.0, phases: Tuple[PhaseValues, ...] = (),
+                 reported_ts: Optional[Any] = None, raw: Optional[bytes] = None):
+        self.topic = topic
+        self.kind = kind
+        self.power = power
+        self.energy_total = energy_total
+        self.voltage = voltage
+        self.current = current
+        self.power_factor = power_factor
+        self.phases = phases
+        self.reported_ts = reported_ts
+        self.raw = raw
+        self.received_at: Optional[float] = None
+        self.parsed_at: Optional[float] = None
+        self.ack = None
+
+    @classmethod
+    def from_payload(cls, topic: str, payload: dict, raw: Optional[bytes] = None,
+                     mapping: Optional[PayloadMapping] = None) -> 'MeasurementRecord':
+        """Costruisce il record da un payload già decodificato"""
+        matched = (mapping or DEFAULT_MAPPING).match(topic)
+        if matched is None:
+            return cls(topic, None, reported_ts=reported_timestamp(payload), raw=raw)
+        kind, extract = matched
+        power, energy_total, voltage, current, power_factor, phases = extract(payload)
+        return cls(topic, kind, power, energy_total, voltage, current, power_factor, phases,
+                   reported_timestamp(payload), raw)
+
+    @classmethod
+    def from_measurement(cls, topic: str, kind: str, data: Any,
+                         reported_ts: Optional[Any] = None) -> 'MeasurementRecord':
+        """Costruisce il record da un MeasurementData (letture in polling, es. Modbus)"""
+        phases = tuple(
+            (phase, values.get('voltage', 0.0), values.get('current', 0.0), values.get('power', 0.0),
+             values.get('power_factor', data.power_factor), data.frequency)
+            for phase, values in (data.phase_data or {}).items()
+        )
+        return cls(topic, kind, data.power, data.energy * 1000.0,  # kWh -> Wh
+                   data.voltage, data.current,
+                   data.power_factor if data.power_factor is not None else 1.0,
+                   phases, reported_ts)
+
+    def __repr__(self) -> str:
+        return f"<MeasurementRecord {self.kind} {self.topic} power={self.power} energy={self.energy_total}>"
+
+
+def decode_message(topic: str, data: Any,
+                   mapping: Optional[PayloadMapping] = None) -> Optional[MeasurementRecord]:
+    """
+    Decodifica un messaggio (bytes, str o dict) in un MeasurementRecord
+    usando il mapping compilato del dispositivo (predefinito: Shelly Gen2).
+
+    Restituisce None se il payload non è JSON valido o non è un oggetto.
+    """
+    if isinstance(data, MeasurementRecord):
+        return data
+    raw = None
+    if isinstance(data, dict):
+        payload = data
+    else:
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            raw = bytes(data)
+        elif isinstance(data, str):
+            raw = data.encode('utf-8')
+        else:
+            return None
+        try:
+            payload = loads(raw)
+        except DecodeError as e:
+            logger.error(f"Error decoding JSON from {topic}: {e}")
+            return None
+
+    if not isinstance(payload, dict):
+        logger.warning(f"Payload non valido su {topic}: atteso un oggetto JSON")
+        return None
+    try:
+        record = MeasurementRecord.from_payload(topic, payload, raw, mapping)
+    except (TypeError, ValueError) as e:
+        logger.error(f"Valori non validi nel payload di {topic}: {e}")
+        return None
+    if record.raw is None and record.reported_ts is None:
+        # Payload già decodificato senza timestamp: serve per l'impronta di deduplicazione
+        record.raw = dumps(payload)
+    return record
@@ -0,0 +1,250 @@
+# energy/mqtt/compression.py
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .stats import publish_stats
+
+logger = logging.getLogger('energy.mqtt')
+
+METHOD_DEADBAND = 'deadband'
+METHOD_SWINGING_DOOR = 'swinging_door'
+COMPRESSION_METHODS = (METHOD_DEADBAND, METHOD_SWINGING_DOOR)
+
+DEFAULT_POWER_TOLERANCE = 10.0  # W
+DEFAULT_VOLTAGE_TOLERANCE = 2.0  # V
+DEFAULT_CURRENT_TOLERANCE = 0.05  # A
+DEFAULT_MAX_INTERVAL = 60  # secondi
+
+STATS_PUBLISH_EVERY = 1000  # campioni
+
+
+@dataclass(frozen=True)
+class CompressionProfile:
+    """Parametri di compressione di un tipo di dispositivo"""
+    method: str = METHOD_SWINGING_DOOR
+    power: float = DEFAULT_POWER_TOLERANCE
+    voltage: float = DEFAULT_VOLTAGE_TOLERANCE
+    current: float = DEFAULT_CURRENT_TOLERANCE
+    max_interval: float = DEFAULT_MAX_INTERVAL
+
+    def tolerances(self, phases: int) -> Tuple[float, ...]:
+        """Tolleranze dei canali: totale e ogni fase (potenza, tensione, corrente)"""
+        return (self.power, self.voltage, self.current) * (1 + phases)
+
+
+@dataclass
+class Sample:
+    """Misurazione non ancora salvata con i valori dei canali confrontati"""
+    timestamp: float
+    values: Tuple[float, ...]
+    measurement: Any
+    details: List[Any] = field(default_factory=list)
+    trace: Optional[Any] = None
+
+
+def sample_values(measurement, details: Sequence[Any]) -> Tuple[float, ...]:
+    """Canali di una misurazione: potenza, tensione e corrente totali e per fase"""
+    values = [measurement.power or 0.0, measurement.voltage or 0.0, measurement.current or 0.0]
+    for detail in details:
+        values.extend((detail.power or 0.0, detail.voltage or 0.0, detail.current or 0.0))
+    return tuple(values)
+
+
+class DeviceCompressor:
+    """
+    Stato di compressione di un dispositivo.
+
+    `archived` è l'ultimo campione salvato, `held` l'ultimo scartato. Con
+    ``deadband`` un campione viene salvato quando un canale si discosta da
+    quello salvato oltre la tolleranza; con ``swinging_door`` quando la retta
+    dall'ultimo campione salvato non può più passare entro la tolleranza da
+    tutti i campioni intermedi. In entrambi i casi viene salvato prima il
+    campione trattenuto, così l'interpolazione lineare tra i punti salvati
+    ricostruisce gradini e rampe entro la tolleranza. Allo scadere di
+    `max_interval` il campione corrente viene salvato comunque (heartbeat).
+    """
+
+    __slots__ = ('profile', 'archived', 'held', 'slope_low', 'slope_high')
+
+    def __init__(self, profile: CompressionProfile):
+        self.profile = profile
+        self.archived: Optional[Sample] = None
+        self.held: Optional[Sample] = None
+        self.slope_low: List[float] = []
+        self.slope_high: List[float] = []
+
+    def offer(self, sample: Sample) -> List[Sample]:
+        """Restituisce i campioni da salvare (eventualmente nessuno)"""
+        archived = self.archived
+        if archived is None or len(sample.values) != len(archived.values):
+            return self._archive(sample, [])
+
+        tolerances = self.profile.tolerances(len(sample.values) // 3 - 1)
+        if self.profile.method == METHOD_DEADBAND:
+            if any(abs(value - base) > tol
+                   for value, base, tol in zip(sample.values, archived.values, tolerances)):
+                return self._archive(sample, [self.held] if self.held is not None else [])
+        elif not self._within_door(sample, tolerances):
+            held = self.held
+            if held is None:
+                return self._archive(sample, [])
+            # Porta chiusa: si salva il campione trattenuto e si riparte da esso
+            self._archive(held, [])
+            if not self._within_door(sample, tolerances) or self._expired(sample):
+                return self._archive(sample, [held])
+            self.held = sample
+            return [held]
+
+        if self._expired(sample):
+            return self._archive(sample, [])
+        self.held = sample
+        return []
+
+    def _expired(self, sample: Sample) -> bool:
+        return sample.timestamp - self.archived.timestamp >= self.profile.max_interval
+
+    def _within_door(self, sample: Sample, tolerances: Tuple[float, ...]) -> bool:
+        """Restringe le porte con il campione; False se si chiudono"""
+        archived = self.archived
+        elapsed = sample.timestamp - archived.timestamp
+        if elapsed <= 0:
+            return all(abs(value - base) <= tol
+                       for value, base, tol in zip(sample.values, archived.values, tolerances))
+        low = list(self.slope_low)
+        high = list(self.slope_high)
+        for index, (value, base, tol) in enumerate(zip(sample.values, archived.values, tolerances)):
+            low[index] = max(low[index], (value - tol - base) / elapsed)
+            high[index] = min(high[index], (value + tol - base) / elapsed)
+            if low[index] > high[index]:
+                return False
+        self.slope_low, self.slope_high = low, high
+        return True
+
+    def _archive(self, sample: Sample, emitted: List[Sample]) -> List[Sample]:
+        self.archived = sample
+        self.held = None
+        channels = len(sample.values)
+        self.slope_low = [float('-inf')] * channels
+        self.slope_high = [float('inf')] * channels
+        return emitted + [sample]
+
+    def release(self) -> Optional[Sample]:
+        """Campione trattenuto da salvare all'arresto (ultimo valore noto)"""
+        held, self.held = self.held, None
+        if held is not None:
+            self._archive(held, [])
+        return held
+
+
+class MeasurementCompressor:
+    """
+    Compressione delle misurazioni di potenza per tipo di dispositivo.
+
+    Attiva solo per i tipi in COMPRESSION_DEVICE_TYPES; i parametri
+    predefiniti (COMPRESSION_METHOD, COMPRESSION_*_TOLERANCE,
+    COMPRESSION_MAX_INTERVAL) possono essere sovrascritti per tipo con
+    COMPRESSION_PROFILES. I messaggi di uno stesso dispositivo sono
+    elaborati da un solo worker, quindi lo stato per dispositivo non
+    richiede lock propri.
+    """
+
+    def __init__(self, profiles: Optional[Dict[str, CompressionProfile]] = None):
+        self._profiles = profiles if profiles is not None else self._load_profiles()
+        self._lock = threading.Lock()
+        self._devices: Dict[int, DeviceCompressor] = {}
+        self._stats = {'offered': 0, 'stored': 0, 'suppressed': 0}
+
+    @staticmethod
+    def _load_profiles() -> Dict[str, CompressionProfile]:
+        mqtt_settings = getattr(settings, 'MQTT_SETTINGS', {})
+        defaults = {
+            'method': mqtt_settings.get('COMPRESSION_METHOD', METHOD_SWINGING_DOOR),
+            'power': mqtt_settings.get('COMPRESSION_POWER_TOLERANCE', DEFAULT_POWER_TOLERANCE),
+            'voltage': mqtt_settings.get('COMPRESSION_VOLTAGE_TOLERANCE', DEFAULT_VOLTAGE_TOLERANCE),
+            'current': mqtt_settings.get('COMPRESSION_CURRENT_TOLERANCE', DEFAULT_CURRENT_TOLERANCE),
+            'max_interval': mqtt_settings.get('COMPRESSION_MAX_INTERVAL', DEFAULT_MAX_INTERVAL),
+        }
+        overrides = mqtt_settings.get('COMPRESSION_PROFILES', {})
+        device_types = set(mqtt_settings.get('COMPRESSION_DEVICE_TYPES', ())) | set(overrides)
+
+        profiles = {}
+        for device_type in device_types:
+            profile = CompressionProfile(**{**defaults, **overrides.get(device_type, {})})
+            if profile.method not in COMPRESSION_METHODS:
+                raise ValueError(f"Metodo di compressione non valido per {device_type}: {profile.method}")
+            profiles[device_type] = profile
+        return profiles
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._profiles)
+
+    def offer(self, device_config, measurement, details: Sequence[Any] = (),
+              trace: Optional[Any] = None) -> List[Sample]:
+        """Restituisce le misurazioni da salvare per un nuovo campione del dispositivo"""
+        details = list(details)
+        profile = self._profiles.get(device_config.device_type)
+        sample = Sample(measurement.timestamp.timestamp(), (), measurement, details, trace)
+        if profile is None:
+            return [sample]
+
+        sample.values = sample_values(measurement, details)
+        compressor = self._devices.get(device_config.pk)
+        if compressor is None or compressor.profile != profile:
+            with self._lock:
+                compressor = self._devices[device_config.pk] = DeviceCompressor(profile)
+        emitted = compressor.offer(sample)
+
+        stats = self._stats
+        stats['offered'] += 1
+        stats['stored'] += len(emitted)
+        if not emitted:
+            stats['suppressed'] += 1
+        if stats['offered'] % STATS_PUBLISH_EVERY == 0:
+            publish_stats('compression', self.get_stats())
+        return emitted
+
+    def release(self) -> List[Sample]:
+        """Campioni trattenuti di tutti i dispositivi (all'arresto)"""
+        with self._lock:
+            compressors = list(self._devices.values())
+        released = [sample for sample in (c.release() for c in compressors) if sample is not None]
+        self._stats['stored'] += len(released)
+        return released
+
+    def get_stats(self) -> Dict[str, float]:
+        """Restituisce le metriche di compressione"""
+        stats = dict(self._stats)
+        stats['devices'] = len(self._devices)
+        stats['ratio'] = round(stats['offered'] / stats['stored'], 2) if stats['stored'] else 0.0
+        return stats
+
+
+def max_sample_interval() -> timedelta:
+    """
+    Intervallo massimo tra due campioni salvati di un dispositivo compresso
+    (il max_interval più ampio tra i profili configurati; zero senza
+    compressione): i grafici interpolano tra campioni distanti al più questo
+    tempo e dopo l'ultimo campione ne ripetono il valore per lo stesso tempo.
+    """
+    profiles = MeasurementCompressor._load_profiles()
+    return timedelta(seconds=max((profile.max_interval for profile in profiles.values()), default=0))
+
+
+# Singleton instance
+_compressor = None
+_compressor_lock = threading.Lock()
+
+def get_compressor() -> MeasurementCompressor:
+    """Ottiene l'istanza singleton del compressore delle misurazioni"""
+    global _compressor
+    if _compressor is None:
+        with _compressor_lock:
+            if _compressor is None:
+                _compressor = MeasurementCompressor()
+    return _compressor
@@ -1,6 +1,8 @@
 #energy/mqtt/core.py
 import logging
+import socket
 import threading
+import time
 from typing import Optional, List, Dict, Any
 from dataclasses import dataclass
 from datetime import datetime, timedelta
@@ -8,16 +10,77 @@ from django.utils import timezone
 import paho.mqtt.client as mqtt
 from django.conf import settings
 from django.core.cache import cache
-from ..models import DeviceConfiguration, DeviceMeasurement, MQTTAuditLog
+from ..models import DeviceConfiguration, MQTTAuditLog
 
 from ..devices.registry import DeviceRegistry
+from .workers import IngestionWorkerPool
 from typing import Dict, Optional, List, Any
 import json
-from ..models.device import DeviceConfiguration, DeviceMeasurementDetail
 import re
 
 logger = logging.getLogger('energy.mqtt')
 
+# Prefisso delle sottoscrizioni condivise MQTT v5
+SHARED_SUBSCRIPTION_PREFIX = '$share/'
+
+# Motivi di rifiuto della connessione (reason code MQTT v5)
+CONNACK_ERRORS = {
+    0x84: "Versione protocollo non corretta",
+    0x85: "Identificativo client non valido",
+    0x86: "Username o password non validi",
+    0x87: "Non autorizzato",
+    0x88: "Server non disponibile",
+}
+
+
+def create_mqtt_client(client_id: str, manual_ack: bool = False) -> mqtt.Client:
+    """Crea un client paho MQTT v5 con la callback API VERSION2"""
+    return mqtt.Client(
+        client_id=client_id,
+        protocol=mqtt.MQTTv5,
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+        manual_ack=manual_ack
+    )
+
+
+def session_client_id(persistent: bool, client_id: Optional[str] = None) -> str:
+    """
+    Client id della connessione: con una sessione persistente deve restare
+    lo stesso tra riconnessioni e riavvii (CLIENT_ID o l'hostname), perché
+    il broker associa sessione e messaggi in coda al client id.
+    """
+    if not persistent:
+        return f"CerCollettiva-{timezone.now().timestamp()}"
+    client_id = client_id or getattr(settings, 'MQTT_SETTINGS', {}).get('CLIENT_ID')
+    return client_id or f"CerCollettiva-{socket.gethostname()}"
+
+
+def get_shared_group() -> Optional[str]:
+    """
+    Gruppo delle sottoscrizioni condivise tra le repliche di ingestione.
+
+    Il delta dei contatori di energia e la compressione usano stato per
+    dispositivo nella memoria del processo: con repliche che ricevono
+    messaggi dello stesso dispositivo l'energia verrebbe contata più volte.
+    Va configurato solo con un broker che instrada ogni dispositivo sempre
+    alla stessa replica.
+    """
+    return getattr(settings, 'MQTT_SETTINGS', {}).get('SHARED_GROUP') or None
+
+
+def shared_topic(topic: str, group: Optional[str] = None) -> str:
+    """
+    Restituisce il filtro da sottoscrivere per un topic: `$share/<group>/<topic>`
+    se è configurato un gruppo, altrimenti il topic invariato. Il broker
+    distribuisce i messaggi di una sottoscrizione condivisa a un solo membro
+    del gruppo.
+    """
+    group = group or get_shared_group()
+    if not group or topic.startswith(SHARED_SUBSCRIPTION_PREFIX):
+        return topic
+    return f"{SHARED_SUBSCRIPTION_PREFIX}{group}/{topic}"
+
+
 @dataclass
 class MQTTMessage:
     """Classe per standardizzare i messaggi MQTT"""
@@ -95,7 +158,14 @@ class CircuitBreaker:
         return True  # HALF-OPEN state
 
 class MQTTService:
-    """Servizio unificato per la gestione MQTT con integrazione DeviceRegistry"""
+    """
+    Connessione MQTT con sottoscrizioni per pattern.
+
+    Il callback di rete accoda soltanto: i messaggi passano dai worker per
+    dispositivo alla pipeline di ingestione. Gli handler registrati ne sono
+    consumatori e ricevono (device_config, record, topic) quando la
+    misurazione è accodata per la scrittura.
+    """
     
     def __init__(self):
         self._client = None
@@ -108,17 +178,11 @@ class MQTTService:
         self._retry_count = 0
         self._max_retries = 3
         self._retry_delay = 5  # secondi
-        self._initialize_default_handlers()
-        
-    def _initialize_default_handlers(self):
-        """Inizializza gli handler predefiniti basati sul device registry"""
-        self.register_handler(
-            "cercollettiva/+/+/status/em:0",
-            self._handle_power_measurement
-        )
-        self.register_handler(
-            "cercollettiva/+/+/status/emdata:0", 
-            self._handle_energy_measurement
+        # Worker di ingestione partizionati per dispositivo (avviati da configure())
+        self._workers = IngestionWorkerPool(
+            handler=self._process_message,
+            key_func=self._partition_key,
+            pass_received_at=True
         )
 
     def configure(self, host: str, port: int, username: Optional[str] = None, 
@@ -127,7 +191,7 @@ class MQTTService:
         try:
             with self._lock:
                 client_id = f"CerCollettiva-{timezone.now().timestamp()}"
-                self._client = mqtt.Client(client_id=client_id)
+                self._client = create_mqtt_client(client_id)
                 
                 # Callbacks
                 self._client.on_connect = self._on_connect
@@ -149,6 +213,7 @@ class MQTTService:
                 )
                 
                 # Connessione con retry
+                self._workers.start()
                 self._connect_with_retry(host, port)
                 
         except Exception as e:
@@ -179,10 +244,10 @@ class MQTTService:
                 else:
                     raise Exception("Numero massimo di tentativi raggiunto")
 
-    def _on_connect(self, client, userdata, flags, rc):
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
         """Callback per la connessione MQTT"""
         try:
-            if rc == 0:
+            if reason_code == 0:
                 with self._lock:
                     self._connected = True
                     # Ripristina le sottoscrizioni
@@ -191,130 +256,36 @@ class MQTTService:
                     self._publish_status("online")
                 logger.info("Connesso al broker MQTT")
             else:
-                error_msgs = {
-                    1: "Versione protocollo non corretta",
-                    2: "Identificatore client non valido",
-                    3: "Server non disponibile",
-                    4: "Credenziali non valide",
-                    5: "Non autorizzato"
-                }
-                logger.error(f"Connessione fallita: {error_msgs.get(rc, f'Errore sconosciuto {rc}')}")
+                error_msg = CONNACK_ERRORS.get(reason_code.value, f'Errore sconosciuto ({reason_code})')
+                logger.error(f"Connessione fallita: {error_msg}")
                 self._circuit_breaker.record_failure()
         except Exception as e:
             logger.error(f"Errore in _on_connect: {str(e)}")
 
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
         """Callback per la disconnessione MQTT"""
         with self._lock:
             self._connected = False
-        if rc != 0:
-            logger.warning(f"Disconnessione inaspettata dal broker MQTT (rc={rc})")
+        if reason_code != 0:
+            logger.warning(f"Disconnessione inaspettata dal broker MQTT ({reason_code})")
             self._circuit_breaker.record_failure()
 
     def _on_message(self, client, userdata, msg):
-        """Gestione centralizzata dei messaggi MQTT"""
-        try:
-            #logger.info(f"\n=== MQTT Message Received ===")
-            #logger.info(f"Topic: {msg.topic}")
-            #logger.info(f"Payload: {msg.payload}")
-            
-            payload = json.loads(msg.payload.decode())
-            
-            # Gestione diretta dei messaggi di potenza ed energia
-            if 'em:0' in msg.topic:
-                logger.info("Processing power message")
-                device_config = self._find_device_for_topic(msg.topic)
-                if device_config:
-                    self._handle_power_measurement(payload, device_config, msg.topic)
-                    
-            elif 'emdata:0' in msg.topic:
-                #logger.info("Processing energy message")
-                device_config = self._find_device_for_topic(msg.topic)
-                if device_config:
-                    self._handle_energy_measurement(payload, device_config, msg.topic)
-                    
-        except json.JSONDecodeError as e:
-            logger.error(f"Error decoding JSON from {msg.topic}: {e}")
-        except Exception as e:
-            logger.error(f"Error processing message: {str(e)}")
-            logger.exception(e)
+        """Callback per i messaggi ricevuti: accoda al worker del dispositivo"""
+        self._workers.submit(msg.topic, msg.payload)
 
-    def _handle_power_measurement(self, message: MQTTMessage):
-        """Gestisce le misurazioni di potenza"""
-        try:
-            device_info = TopicMatcher.extract_device_info(message.topic)
-            if not device_info:
-                return
-                
-            device = DeviceConfiguration.objects.select_related('plant').get(
-                device_id=device_info['device_id'],
-                is_active=True
-            )
-            
-            device_instance = self._device_registry.get_device_by_vendor_model(
-                device.vendor,
-                device.model
-            )
-            
-            if device_instance:
-                # Crea misurazione principale
-                measurement = DeviceMeasurement.objects.create(
-                    device=device,
-                    plant=device.plant,
-                    timestamp=message.timestamp,
-                    power=message.payload.get('total_act_power', 0),
-                    voltage=message.payload.get('a_voltage', 0),
-                    current=message.payload.get('a_current', 0),
-                    power_factor=message.payload.get('total_pf', 1.0),
-                    energy_total=message.payload.get('total_act', 0),
-                    quality='GOOD'
-                )
-                
-                # Crea dettagli per fase se disponibili
-                phases = ['a', 'b', 'c']
-                for phase in phases:
-                    if all(key in message.payload for key in [f'{phase}_voltage', f'{phase}_current', f'{phase}_act_power']):
-                        DeviceMeasurementDetail.objects.create(
-                            measurement=measurement,
-                            phase=phase,
-                            voltage=message.payload.get(f'{phase}_voltage', 0),
-                            current=message.payload.get(f'{phase}_current', 0),
-                            power=message.payload.get(f'{phase}_act_power', 0),
-                            power_factor=message.payload.get(f'{phase}_pf', 1.0),
-                            frequency=message.payload.get(f'{phase}_freq', 50.0)
-                        )
-                
-                # Aggiorna timestamp ultimo contatto
-                device.update_last_seen()
-                
-        except Exception as e:
-            logger.error(f"Errore nella gestione della misurazione di potenza: {str(e)}")
+    @staticmethod
+    def _partition_key(topic: str) -> Optional[str]:
+        """Chiave di partizione dei worker: il device_id associato al topic"""
+        from .routing import get_routing_index
+        config = get_routing_index().match(topic)
+        return config.device_id if config else None
 
-    def _handle_energy_measurement(self, message: MQTTMessage):
-        """Gestisce le misurazioni di energia"""
-        try:
-            device_info = TopicMatcher.extract_device_info(message.topic)
-            if not device_info:
-                return
-                
-            device = DeviceConfiguration.objects.select_related('plant').get(
-                device_id=device_info['device_id'],
-                is_active=True
-            )
-            
-            DeviceMeasurement.objects.create(
-                device=device,
-                plant=device.plant,
-                timestamp=message.timestamp,
-                energy_total=message.payload.get('total_act', 0),
-                measurement_type='DRAWN_ENERGY',
-                quality='GOOD'
-            )
-            
-            device.update_last_seen()
-            
-        except Exception as e:
-            logger.error(f"Errore nella gestione della misurazione di energia: {str(e)}")
+    @staticmethod
+    def _process_message(topic: str, payload: Any, received_at: Optional[float] = None, ack=None) -> None:
+        """Inoltra il messaggio alla pipeline di ingestione (eseguito dal worker del dispositivo)"""
+        from .pipeline import get_ingest_pipeline
+        get_ingest_pipeline().process(topic, payload, received_at, ack)
 
     def _handle_state_transition(self, from_state: str, to_state: str) -> None:
         """Gestisce in modo atomico le transizioni di stato"""
@@ -324,18 +295,25 @@ class MQTTService:
                 #logger.info(f"Transizione stato: {from_state} -> {to_state}")
 
     def register_handler(self, topic_pattern: str, handler_func: callable) -> None:
-        """Registra un handler per un pattern di topic"""
+        """Registra un consumatore della pipeline per un pattern di topic e lo sottoscrive"""
+        from .pipeline import get_ingest_pipeline
+        pipeline = get_ingest_pipeline()
         with self._lock:
+            previous = self._message_handlers.get(topic_pattern)
+            if previous is not None:
+                pipeline.remove_listener(previous, topic_pattern)
             self._message_handlers[topic_pattern] = handler_func
+            pipeline.add_listener(handler_func, topic_pattern)
             if self._connected:
-                self._client.subscribe(topic_pattern, qos=1)
-                self._subscribed_topics.add(topic_pattern)
+                # Con un gruppo configurato la sottoscrizione è condivisa
+                subscription = shared_topic(topic_pattern)
+                self._client.subscribe(subscription, qos=1)
+                self._subscribed_topics.add(subscription)
 
     def _restore_subscriptions(self) -> None:
         """Ripristina tutte le sottoscrizioni"""
-        with self._lock:
-            for topic in self._subscribed_topics:
-                self._client.subscribe(topic, qos=1)
+        for topic in self._subscribed_topics:
+            self._client.subscribe(topic, qos=1)
 
     def _publish_status(self, status: str) -> None:
         """Pubblica lo stato del client"""
@@ -374,11 +352,6 @@ class MQTTService:
         except DeviceConfiguration.DoesNotExist:
             return None
 
-    def _update_metrics(self, message: MQTTMessage):
-        """Aggiorna metriche per monitoring"""
-        cache.incr('mqtt_messages_received')
-        cache.incr(f'mqtt_messages_{message.device_type}')
-
     @property
     def is_connected(self) -> bool:
         """Verifica lo stato della connessione"""
@@ -401,6 +374,9 @@ class MQTTService:
                 # Arresto del client
                 self._client.loop_stop()
                 self._client.disconnect()
+
+                # Elabora i messaggi già accodati
+                self._workers.stop()
                 
                 # Pubblica stato finale
                 self._publish_status("offline")
@@ -0,0 +1,106 @@
+# energy/mqtt/counters.py
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from ..models import DeviceConfiguration
+from .writebehind import WriteBehindStore
+
+logger = logging.getLogger('energy.mqtt')
+
+DEFAULT_COUNTER_FLUSH_INTERVAL = 5  # secondi
+
+
+@dataclass
+class CounterState:
+    """Ultima lettura del contatore di energia di un dispositivo"""
+    device_pk: int
+    total: float  # Wh, come riportato dal dispositivo
+    timestamp: Optional[datetime]
+
+
+class EnergyCounterStore(WriteBehindStore):
+    """
+    Stato persistente dei contatori di energia usato per il calcolo dei delta.
+
+    L'ultima lettura di ogni dispositivo è tenuta in memoria e scritta in
+    differita su DeviceConfiguration.last_energy_total/last_energy_at.
+    All'avvio `warm_load()` ricarica tutti i contatori con una sola query,
+    così il primo messaggio emdata:0 dopo un riavvio produce il delta
+    rispetto all'ultima lettura salvata invece di andare perso. Ricaricato
+    a ogni refresh delle configurazioni, non sostituisce mai una lettura in
+    memoria più recente di quella salvata (es. durante un flush in corso).
+    """
+
+    model = DeviceConfiguration
+    fields = ('last_energy_total', 'last_energy_at')
+    order_field = 'last_energy_at'
+    stats_component = 'counters'
+
+    def __init__(self, flush_interval: Optional[float] = None):
+        mqtt_settings = getattr(settings, 'MQTT_SETTINGS', {})
+        super().__init__(flush_interval or mqtt_settings.get(
+            'COUNTER_FLUSH_INTERVAL', DEFAULT_COUNTER_FLUSH_INTERVAL
+        ))
+        self._state: Dict[str, CounterState] = {}
+
+    def warm_load(self) -> int:
+        """Carica i contatori salvati dei dispositivi attivi (una query)"""
+        rows = DeviceConfiguration.objects.filter(
+            is_active=True,
+            last_energy_total__isnull=False
+        ).values_list('pk', 'device_id', 'last_energy_total', 'last_energy_at')
+
+        loaded = {
+            device_id: CounterState(pk, total, timestamp)
+            for pk, device_id, total, timestamp in rows
+        }
+        with self._lock:
+            for device_id, state in loaded.items():
+                if self._is_newer(state, self._state.get(device_id)):
+                    self._state[device_id] = state
+        logger.info(f"Stato contatori energia caricato per {len(loaded)} dispositivi")
+        return len(loaded)
+
+    @staticmethod
+    def _is_newer(state: CounterState, current: Optional[CounterState]) -> bool:
+        """Vero se la lettura salvata è più recente di quella in memoria"""
+        if current is None or current.device_pk != state.device_pk:
+            return True
+        if state.timestamp is None:
+            return False
+        return current.timestamp is None or state.timestamp > current.timestamp
+
+    def get(self, device_id: str) -> Optional[CounterState]:
+        """Ultima lettura nota del contatore del dispositivo"""
+        return self._state.get(device_id)
+
+    def update(self, device: DeviceConfiguration, total: float, timestamp: datetime) -> None:
+        """Registra una nuova lettura del contatore"""
+        with self._lock:
+            self._state[device.device_id] = CounterState(device.pk, total, timestamp)
+            self._mark_dirty(device.pk, (total, timestamp))
+
+    def get_stats(self) -> Dict[str, float]:
+        """Restituisce le metriche dello store dei contatori"""
+        stats = super().get_stats()
+        stats['devices'] = len(self._state)
+        return stats
+
+
+# Singleton instance
+_counter_store = None
+_counter_store_lock = threading.Lock()
+
+def get_counter_store() -> EnergyCounterStore:
+    """Ottiene l'istanza singleton dello store dei contatori"""
+    global _counter_store
+    if _counter_store is None:
+        with _counter_store_lock:
+            if _counter_store is None:
+                _counter_store = EnergyCounterStore()
+    return _counter_store
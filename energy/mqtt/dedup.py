@@ -0,0 +1,232 @@
+# energy/mqtt/dedup.py
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .codec import MeasurementRecord, reported_timestamp
+from .core import get_shared_group
+from .stats import publish_stats
+
+logger = logging.getLogger('energy.mqtt')
+
+DEFAULT_DEDUP_WINDOW = 300  # secondi
+DEFAULT_DEDUP_MAX_ENTRIES = 100000
+DEFAULT_BLOOM_ERROR_RATE = 0.001
+STATS_PUBLISH_INTERVAL = 10  # secondi
+
+DedupKey = Tuple[str, str, Any]
+
+
+class BloomFilter:
+    """Bloom filter a dimensione fissa (bitarray su bytearray, hash doppio)"""
+
+    def __init__(self, capacity: int, error_rate: float = DEFAULT_BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class MessageDeduplicator:
+    """
+    Deduplicazione dei messaggi MQTT in memoria, a memoria limitata.
+
+    La chiave è (device, topic, timestamp riportato dal dispositivo); per i
+    payload senza timestamp si usa un'impronta del payload grezzo. Le chiavi
+    restano in un LRU ordinato per tempo di inserimento e scadono dopo
+    `window` secondi o quando si supera `max_entries`.
+
+    Con `bloom=True` le chiavi espulse dall'LRU per capienza restano in due
+    bloom filter a rotazione fino alla fine della finestra: più memoria
+    storica a costo di una piccola probabilità di falsi duplicati.
+
+    Con `shared=True` (default quando è configurato un gruppo di sottoscrizioni
+    condivise, cioè con più ingestori) le chiavi non presenti in memoria
+    vengono verificate e registrate in cache con un solo `cache.add`.
+    """
+
+    def __init__(self, window: Optional[float] = None, max_entries: Optional[int] = None,
+                 bloom: Optional[bool] = None, shared: Optional[bool] = None):
+        mqtt_settings = getattr(settings, 'MQTT_SETTINGS', {})
+        self.window = window or mqtt_settings.get('DEDUP_WINDOW', DEFAULT_DEDUP_WINDOW)
+        self.max_entries = max_entries or mqtt_settings.get('DEDUP_MAX_ENTRIES', DEFAULT_DEDUP_MAX_ENTRIES)
+        if bloom is None:
+            bloom = mqtt_settings.get('DEDUP_BLOOM', False)
+        if shared is None:
+            shared = mqtt_settings.get('DEDUP_SHARED')
+            if shared is None:
+                shared = get_shared_group() is not None
+        self.shared = shared
+
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[DedupKey, float]' = OrderedDict()
+
+        self._bloom_enabled = bloom
+        self._blooms = [BloomFilter(self.max_entries), BloomFilter(self.max_entries)] if bloom else []
+        self._bloom_rotated = time.monotonic()
+
+        self._last_publish = time.monotonic()
+        self._stats = {
+            'checked': 0,
+            'duplicates': 0,
+            'bloom_hits': 0,
+            'shared_lookups': 0,
+            'shared_duplicates': 0,
+            'evicted': 0,
+        }
+
+    @staticmethod
+    def reported_timestamp(payload: Dict[str, Any]) -> Optional[Any]:
+        """Timestamp riportato dal dispositivo, se presente nel payload"""
+        if not isinstance(payload, dict):
+            return None
+        return reported_timestamp(payload)
+
+    @staticmethod
+    def fingerprint(payload: Any, raw: Optional[bytes] = None) -> str:
+        """Impronta stabile del payload (preferibilmente dei byte ricevuti)"""
+        if raw is None:
+            raw = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+    def key_for(self, device_id: str, topic: str, payload: Any,
+                raw: Optional[bytes] = None) -> DedupKey:
+        """Chiave di deduplicazione di un messaggio"""
+        reported = self.reported_timestamp(payload)
+        if reported is None:
+            reported = self.fingerprint(payload, raw)
+        return (device_id, topic, reported)
+
+    def key_for_record(self, device_id: str, record: MeasurementRecord) -> DedupKey:
+        """Chiave di deduplicazione di un messaggio già decodificato"""
+        reported = record.reported_ts
+        if reported is None:
+            reported = self.fingerprint(None, record.raw or b'')
+        return (device_id, record.topic, reported)
+
+    def check(self, key: DedupKey) -> bool:
+        """
+        Restituisce True se il messaggio è un duplicato, altrimenti lo
+        registra come visto e restituisce False.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._stats['checked'] += 1
+            self._expire(now)
+
+            if key in self._entries:
+                self._stats['duplicates'] += 1
+                return True
+
+            if self._bloom_enabled:
+                bloom_key = repr(key)
+                if any(bloom_key in bloom for bloom in self._blooms):
+                    self._stats['duplicates'] += 1
+                    self._stats['bloom_hits'] += 1
+                    return True
+
+            self._entries[key] = now
+            if self._bloom_enabled:
+                self._blooms[0].add(repr(key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+
+        if self.shared and not self._check_shared(key):
+            return True
+
+        self._maybe_publish(now)
+        return False
+
+    def forget(self, key: DedupKey) -> None:
+        """Rimuove una chiave (messaggio non elaborato, da accettare se ritrasmesso)"""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared:
+            try:
+                cache.delete(self._cache_key(key))
+            except Exception as e:
+                logger.debug(f"Errore rimozione chiave di deduplicazione: {e}")
+
+    def _expire(self, now: float) -> None:
+        # L'OrderedDict è in ordine di inserimento, quindi anche di tempo
+        cutoff = now - self.window
+        entries = self._entries
+        while entries:
+            key, inserted = next(iter(entries.items()))
+            if inserted >= cutoff:
+                break
+            entries.popitem(last=False)
+
+        if self._bloom_enabled and now - self._bloom_rotated >= self.window:
+            # La generazione più vecchia copre al massimo due finestre
+            self._blooms = [BloomFilter(self.max_entries), self._blooms[0]]
+            self._bloom_rotated = now
+
+    @staticmethod
+    def _cache_key(key: DedupKey) -> str:
+        device_id, topic, reported = key
+        return f"mqtt_dedup:{device_id}:{topic}:{reported}"
+
+    def _check_shared(self, key: DedupKey) -> bool:
+        """Registra la chiave nella cache condivisa; False se già presente"""
+        self._stats['shared_lookups'] += 1
+        try:
+            added = cache.add(self._cache_key(key), 1, timeout=int(self.window))
+        except Exception as e:
+            logger.debug(f"Cache di deduplicazione non disponibile: {e}")
+            return True
+        if not added:
+            self._stats['duplicates'] += 1
+            self._stats['shared_duplicates'] += 1
+        return added
+
+    def _maybe_publish(self, now: float) -> None:
+        if now - self._last_publish >= STATS_PUBLISH_INTERVAL:
+            self._last_publish = now
+            publish_stats('dedup', self.get_stats())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Restituisce le metriche del deduplicatore"""
+        stats = dict(self._stats)
+        stats['entries'] = len(self._entries)
+        stats['shared'] = self.shared
+        return stats
+
+
+# Singleton instance
+_deduplicator = None
+_deduplicator_lock = threading.Lock()
+
+def get_deduplicator() -> MessageDeduplicator:
+    """Ottiene l'istanza singleton del deduplicatore"""
+    global _deduplicator
+    if _deduplicator is None:
+        with _deduplicator_lock:
+            if _deduplicator is None:
+                _deduplicator = MessageDeduplicator()
+    return _deduplicator
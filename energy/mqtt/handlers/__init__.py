@@ -1,11 +0,0 @@
-# energy/mqtt/handlers/__init__.py
-from .base import BaseHandler, MQTTConfig
-from .measurement import MeasurementHandler
-from .device import DeviceHandler
-
-__all__ = [
-    'BaseHandler',
-    'MQTTConfig',
-    'MeasurementHandler',
-    'DeviceHandler'
-]
\ No newline at end of file
@@ -0,0 +1,135 @@
+# energy/mqtt/inflight.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from .stats import publish_stats
+
+logger = logging.getLogger('energy.mqtt')
+
+STATS_PUBLISH_EVERY = 1000  # conferme
+
+
+class InflightMessage:
+    """
+    Token di conferma di un messaggio QoS 1/2 ricevuto.
+
+    Chi prende in carico il messaggio (coda, pipeline, batch writer) chiama
+    `retain`; quando ha finito, o quando il messaggio è stato scritto in
+    modo durevole, chiama `release`. Il PUBACK parte quando l'ultimo
+    riferimento viene rilasciato.
+    """
+
+    __slots__ = ('mid', 'qos', 'received_at', 'generation', '_tracker', '_refs', 'done')
+
+    def __init__(self, tracker: 'InflightTracker', mid: int, qos: int, generation: int):
+        self.mid = mid
+        self.qos = qos
+        self.received_at = time.monotonic()
+        self.generation = generation
+        self._tracker = tracker
+        self._refs = 1
+        self.done = False
+
+    def retain(self) -> 'InflightMessage':
+        with self._tracker._lock:
+            self._refs += 1
+        return self
+
+    def release(self) -> None:
+        self._tracker._release(self)
+
+    def __repr__(self) -> str:
+        return f"InflightMessage(mid={self.mid}, qos={self.qos}, refs={self._refs})"
+
+
+class InflightTracker:
+    """
+    Conferma manuale dei messaggi MQTT dopo il salvataggio.
+
+    Con `manual_ack` paho non invia il PUBACK/PUBREC alla ricezione: il
+    tracker lo invia con `ack_func(mid, qos)` solo quando il messaggio è
+    stato elaborato e le misurazioni risultanti sono state scritte nel DB.
+    Le conferme seguono l'ordine di ricezione (MQTT richiede che i PUBACK
+    di una sessione siano inviati nell'ordine dei PUBLISH): un messaggio
+    completato resta in attesa finché non sono completati quelli precedenti.
+
+    Alla disconnessione `discard` abbandona i messaggi in volo: il broker
+    li riconsegna sulla sessione persistente e la deduplicazione scarta
+    quelli già salvati. I messaggi QoS 0 non vengono tracciati.
+    """
+
+    def __init__(self, ack_func: Callable[[int, int], Any]):
+        self._ack = ack_func
+        self._lock = threading.Lock()
+        self._inflight: 'OrderedDict[int, InflightMessage]' = OrderedDict()
+        self._generation = 0
+        self._stats = {
+            'tracked': 0,
+            'acked': 0,
+            'discarded': 0,
+            'ack_errors': 0,
+        }
+
+    def track(self, mid: int, qos: int) -> Optional[InflightMessage]:
+        """Registra un messaggio ricevuto; None per QoS 0 (nessuna conferma)"""
+        if not qos:
+            return None
+        with self._lock:
+            message = InflightMessage(self, mid, qos, self._generation)
+            self._inflight[id(message)] = message
+            self._stats['tracked'] += 1
+        return message
+
+    def _release(self, message: InflightMessage) -> None:
+        with self._lock:
+            message._refs -= 1
+            if message._refs > 0 or message.done:
+                return
+            message.done = True
+            if message.generation != self._generation:
+                # Connessione chiusa nel frattempo: il broker riconsegnerà il messaggio
+                return
+            # Conferma la sequenza completata in testa, nell'ordine di ricezione
+            acked = 0
+            while self._inflight:
+                head = next(iter(self._inflight.values()))
+                if not head.done:
+                    break
+                self._inflight.popitem(last=False)
+                try:
+                    self._ack(head.mid, head.qos)
+                    acked += 1
+                except Exception as e:
+                    self._stats['ack_errors'] += 1
+                    logger.error(f"Errore conferma messaggio MQTT {head.mid}: {e}")
+            self._stats['acked'] += acked
+            publish = acked and self._stats['acked'] % STATS_PUBLISH_EVERY < acked
+        if publish:
+            publish_stats('inflight', self.get_stats())
+
+    def discard(self) -> int:
+        """Abbandona i messaggi in volo (disconnessione); restituisce quanti erano"""
+        with self._lock:
+            discarded = len(self._inflight)
+            self._inflight.clear()
+            self._generation += 1
+            self._stats['discarded'] += discarded
+        if discarded:
+            logger.info(f"{discarded} messaggi MQTT non confermati: verranno riconsegnati dal broker")
+        return discarded
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Restituisce le metriche dei messaggi in volo"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._inflight)
+            oldest = next(iter(self._inflight.values()), None)
+            stats['oldest_age_seconds'] = round(time.monotonic() - oldest.received_at, 3) if oldest else 0.0
+        return stats
@@ -0,0 +1,395 @@
+# energy/mqtt/latency.py
+import atexit
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .stats import publish_stats
+
+logger = logging.getLogger('energy.mqtt')
+
+DEFAULT_METRICS_FLUSH_INTERVAL = 60  # secondi
+PERIOD_SECONDS = 3600  # righe TopicMetrics orarie
+
+# Fasi misurate (in millisecondi)
+STAGE_PARSE = 'parse'      # ricezione -> payload decodificato
+STAGE_PERSIST = 'persist'  # payload decodificato -> misurazione scritta
+STAGE_TOTAL = 'total'      # ricezione -> misurazione scritta
+STAGE_LAG = 'lag'          # timestamp del dispositivo -> misurazione scritta
+STAGES = (STAGE_PARSE, STAGE_PERSIST, STAGE_TOTAL, STAGE_LAG)
+
+QUANTILES = (50, 95, 99)
+
+# Bucket logaritmici: ~9% di errore relativo da 10 us a oltre 24 ore
+HISTOGRAM_MIN_MS = 0.01
+HISTOGRAM_GROWTH = 2 ** 0.125
+_LOG_GROWTH = math.log(HISTOGRAM_GROWTH)
+
+
+class LatencyHistogram:
+    """Istogramma sparso a bucket logaritmici (valori in millisecondi)"""
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def bucket_for(value: float) -> int:
+        if value <= HISTOGRAM_MIN_MS:
+            return 0
+        return int(math.log(value / HISTOGRAM_MIN_MS) / _LOG_GROWTH) + 1
+
+    @staticmethod
+    def bucket_value(bucket: int) -> float:
+        """Valore rappresentativo (media geometrica dei limiti) del bucket"""
+        if bucket <= 0:
+            return HISTOGRAM_MIN_MS
+        return HISTOGRAM_MIN_MS * HISTOGRAM_GROWTH ** (bucket - 0.5)
+
+    def record(self, value: float) -> None:
+        bucket = self.bucket_for(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, quantile: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * quantile / 100))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.bucket_value(bucket), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self) -> Dict[str, float]:
+        summary = {'count': self.count, 'avg': round(self.mean, 3), 'max': round(self.max, 3)}
+        for quantile in QUANTILES:
+            summary[f'p{quantile}'] = round(self.percentile(quantile), 3)
+        return summary
+
+    def to_json(self) -> Dict[str, Any]:
+        """Forma serializzabile (JSONField), unibile con `from_json`"""
+        data = self.summary()
+        data['sum'] = self.total
+        data['buckets'] = {str(bucket): count for bucket, count in self.buckets.items()}
+        return data
+
+    @classmethod
+    def from_json(cls, data: Optional[Dict[str, Any]]) -> 'LatencyHistogram':
+        histogram = cls()
+        if data:
+            histogram.buckets = {int(bucket): count for bucket, count in data.get('buckets', {}).items()}
+            histogram.count = data.get('count', 0)
+            histogram.total = data.get('sum', 0.0)
+            histogram.max = data.get('max', 0.0)
+        return histogram
+
+
+class TopicLatency:
+    """Contatori e istogrammi di un topic in un periodo"""
+
+    __slots__ = ('device_pk', 'device_type', 'messages', 'errors', 'stages')
+
+    def __init__(self, device_pk: int, device_type: str):
+        self.device_pk = device_pk
+        self.device_type = device_type
+        self.messages = 0
+        self.errors = 0
+        self.stages = {stage: LatencyHistogram() for stage in STAGES}
+
+
+def reported_epoch(value: Any) -> Optional[float]:
+    """Timestamp del dispositivo in secondi epoch (accetta anche millisecondi)"""
+    try:
+        epoch = float(value)
+    except (TypeError, ValueError):
+        return None
+    if epoch > 1e11:
+        epoch /= 1000.0
+    return epoch if epoch > 0 else None
+
+
+class IngestLatencyTracker:
+    """
+    Istogrammi di latenza in memoria per topic e per tipo di dispositivo.
+
+    Fasi misurate: ricezione -> decodifica, decodifica -> scrittura,
+    ricezione -> scrittura e ritardo rispetto al timestamp del dispositivo.
+    Ogni `flush_interval` secondi gli incrementi per topic vengono uniti alle
+    righe orarie di TopicMetrics (inserimento delle righe mancanti, SELECT
+    FOR UPDATE e upsert in blocco: più ingestori si serializzano sulle
+    stesse righe invece di sovrascriversi) e i percentili per tipo di dispositivo dell'ultimo
+    intervallo vengono pubblicati per l'endpoint delle metriche.
+    """
+
+    def __init__(self, flush_interval: Optional[float] = None):
+        mqtt_settings = getattr(settings, 'MQTT_SETTINGS', {})
+        self.flush_interval = flush_interval or mqtt_settings.get(
+            'METRICS_FLUSH_INTERVAL', DEFAULT_METRICS_FLUSH_INTERVAL
+        )
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (inizio periodo epoch, topic) -> TopicLatency
+        self._topics: Dict[Tuple[int, str], TopicLatency] = {}
+        # tipo di dispositivo -> fase -> istogramma (intervallo corrente)
+        self._device_types: Dict[str, Dict[str, LatencyHistogram]] = {}
+
+        self._stop_event = threading.Event()
+        self._timer_thread = None
+        self._stats = {'flushes': 0, 'rows': 0, 'errors': 0, 'last_flush_ms': 0.0}
+
+    # -- Registrazione ----------------------------------------------------
+
+    def _entry(self, topic: str, device) -> TopicLatency:
+        """Accumulatore del topic nel periodo corrente (chiamare con self._lock)"""
+        key = (int(time.time()) // PERIOD_SECONDS * PERIOD_SECONDS, topic)
+        entry = self._topics.get(key)
+        if entry is None:
+            entry = self._topics[key] = TopicLatency(device.pk, device.device_type or '')
+        return entry
+
+    def _record(self, entry: TopicLatency, stage: str, value: float) -> None:
+        entry.stages[stage].record(value)
+        histograms = self._device_types.get(entry.device_type)
+        if histograms is None:
+            histograms = self._device_types[entry.device_type] = {s: LatencyHistogram() for s in STAGES}
+        histograms[stage].record(value)
+
+    def observe_message(self, record, device) -> None:
+        """Messaggio elaborato: tempo di ricezione -> decodifica"""
+        with self._lock:
+            entry = self._entry(record.topic, device)
+            entry.messages += 1
+            if record.received_at is not None and record.parsed_at is not None:
+                self._record(entry, STAGE_PARSE, max(0.0, (record.parsed_at - record.received_at) * 1000))
+
+    def observe_error(self, topic: str, device) -> None:
+        """Messaggio non elaborato per errore"""
+        with self._lock:
+            self._entry(topic, device).errors += 1
+
+    def observe_persisted(self, items: Iterable[Tuple[Any, Any]], persisted_at: Optional[float] = None) -> None:
+        """Misurazioni scritte: coppie (record, dispositivo)"""
+        persisted_at = persisted_at or time.time()
+        with self._lock:
+            for record, device in items:
+                entry = self._entry(record.topic, device)
+                if record.parsed_at is not None:
+                    self._record(entry, STAGE_PERSIST, max(0.0, (persisted_at - record.parsed_at) * 1000))
+                if record.received_at is not None:
+                    self._record(entry, STAGE_TOTAL, max(0.0, (persisted_at - record.received_at) * 1000))
+                reported = reported_epoch(record.reported_ts)
+                if reported is not None:
+                    self._record(entry, STAGE_LAG, max(0.0, (persisted_at - reported) * 1000))
+
+    # -- Scrittura --------------------------------------------------------
+
+    def flush(self) -> int:
+        """Unisce gli incrementi alle righe orarie di TopicMetrics; restituisce le righe scritte"""
+        with self._flush_lock:
+            with self._lock:
+                topics, self._topics = self._topics, {}
+            if not topics:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                rows = self._write(topics)
+            except Exception as e:
+                self._stats['errors'] += 1
+                logger.error(f"Errore scrittura metriche per topic: {e}")
+                # Gli incrementi vengono riuniti e riprovati al prossimo flush
+                with self._lock:
+                    for key, entry in topics.items():
+                        current = self._topics.get(key)
+                        if current is None:
+                            self._topics[key] = entry
+                        else:
+                            self._merge_entry(current, entry)
+                return 0
+
+            self._stats['flushes'] += 1
+            self._stats['rows'] += rows
+            self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            return rows
+
+    @staticmethod
+    def _merge_entry(target: TopicLatency, source: TopicLatency) -> None:
+        target.messages += source.messages
+        target.errors += source.errors
+        for stage in STAGES:
+            target.stages[stage].merge(source.stages[stage])
+
+    def _write(self, topics: Dict[Tuple[int, str], TopicLatency]) -> int:
+        from ..models import DeviceConfiguration, TopicMetrics
+
+        # Dispositivi eliminati nel frattempo: i loro incrementi vengono scartati
+        devices = set(DeviceConfiguration.objects.filter(
+            pk__in={entry.device_pk for entry in topics.values()}
+        ).values_list('pk', flat=True))
+        topics = {key: entry for key, entry in topics.items() if entry.device_pk in devices}
+        if not topics:
+            return 0
+
+        periods = {start for start, _ in topics}
+        names = {topic for _, topic in topics}
+        period_starts = {start: datetime.fromtimestamp(start, tz=dt_timezone.utc) for start in periods}
+
+        with transaction.atomic():
+            # select_for_update blocca solo righe esistenti: le righe vuote
+            # create prima fanno attendere un secondo ingestore sulla stessa
+            # ora, che poi unisce i propri incrementi ai valori salvati
+            TopicMetrics.objects.bulk_create(
+                [
+                    self._build_row(TopicMetrics, topic, period_starts[start],
+                                    TopicLatency(entry.device_pk, entry.device_type))
+                    for (start, topic), entry in topics.items()
+                ],
+                ignore_conflicts=True
+            )
+            existing = TopicMetrics.objects.filter(
+                period_type='HOUR',
+                period_start__in=list(period_starts.values()),
+                topic__in=names
+            )
+            if connection.features.has_select_for_update:
+                existing = existing.select_for_update()
+            stored = {
+                (row.period_start, row.topic): row
+                for row in existing.only('topic', 'period_start', 'messages_count', 'errors_count', 'latency_stats')
+            }
+
+            rows = []
+            for (start, topic), entry in topics.items():
+                period_start = period_starts[start]
+                row = stored.get((period_start, topic))
+                if row is not None:
+                    previous = TopicLatency(entry.device_pk, entry.device_type)
+                    previous.messages = row.messages_count
+                    previous.errors = row.errors_count
+                    for stage in STAGES:
+                        previous.stages[stage] = LatencyHistogram.from_json(
+                            (row.latency_stats or {}).get(stage)
+                        )
+                    self._merge_entry(previous, entry)
+                    entry = previous
+                rows.append(self._build_row(TopicMetrics, topic, period_start, entry))
+
+            TopicMetrics.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['topic', 'period_start', 'period_type'],
+                update_fields=[
+                    'device', 'device_type', 'messages_count', 'errors_count', 'avg_processing_time',
+                    'p50_processing_time', 'p95_processing_time', 'p99_processing_time',
+                    'latency_stats', 'period_end', 'updated_at',
+                ]
+            )
+        return len(rows)
+
+    @staticmethod
+    def _build_row(model, topic: str, period_start: datetime, entry: TopicLatency):
+        total = entry.stages[STAGE_TOTAL]
+        now = datetime.now(tz=dt_timezone.utc)
+        return model(
+            topic=topic,
+            device_id=entry.device_pk,
+            device_type=entry.device_type,
+            messages_count=entry.messages,
+            errors_count=entry.errors,
+            avg_processing_time=round(total.mean, 3),
+            p50_processing_time=round(total.percentile(50), 3),
+            p95_processing_time=round(total.percentile(95), 3),
+            p99_processing_time=round(total.percentile(99), 3),
+            latency_stats={stage: entry.stages[stage].to_json() for stage in STAGES},
+            period_start=period_start,
+            period_end=period_start + timedelta(seconds=PERIOD_SECONDS),
+            period_type='HOUR',
+            created_at=now,
+            updated_at=now,
+        )
+
+    # -- Metriche ---------------------------------------------------------
+
+    def get_stats(self, reset: bool = False) -> Dict[str, Any]:
+        """Percentili per tipo di dispositivo dell'intervallo corrente"""
+        with self._lock:
+            device_types = self._device_types
+            if reset:
+                self._device_types = {}
+            pending = len(self._topics)
+        stats: Dict[str, Any] = dict(self._stats)
+        stats['pending_topics'] = pending
+        stats['device_types'] = {
+            device_type: {
+                stage: histogram.summary()
+                for stage, histogram in histograms.items() if histogram.count
+            }
+            for device_type, histograms in device_types.items()
+        }
+        return stats
+
+    def start(self) -> None:
+        """Avvia il thread di scrittura periodica"""
+        if self._timer_thread and self._timer_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._timer_thread = threading.Thread(target=self._run, daemon=True)
+        self._timer_thread.start()
+        atexit.register(self.stop)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+                publish_stats('latency', self.get_stats(reset=True))
+            except Exception as e:
+                logger.error(f"Errore nel thread delle metriche di latenza: {e}")
+        connection.close()
+
+    def stop(self) -> None:
+        """Hook di arresto: ferma il timer e scrive gli incrementi rimasti"""
+        self._stop_event.set()
+        if self._timer_thread and self._timer_thread is not threading.current_thread():
+            self._timer_thread.join(timeout=5)
+        self.flush()
+        publish_stats('latency', self.get_stats(reset=True))
+
+
+# Singleton instance
+_latency_tracker = None
+_latency_tracker_lock = threading.Lock()
+
+def get_latency_tracker() -> IngestLatencyTracker:
+    """Ottiene l'istanza singleton del tracker di latenza"""
+    global _latency_tracker
+    if _latency_tracker is None:
+        with _latency_tracker_lock:
+            if _latency_tracker is None:
+                _latency_tracker = IngestLatencyTracker()
+    return _latency_tracker
@@ -0,0 +1,111 @@
+# energy/mqtt/latest.py
+import logging
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from django.db import connection
+
+from ..models import DeviceLatestState, DeviceMeasurement, DeviceMeasurementDetail
+
+logger = logging.getLogger('energy.mqtt')
+
+# Campi aggiornati solo se la lettura non è più vecchia di quella salvata:
+# campo -> timestamp che ne stabilisce l'ordine
+GUARDED_FIELDS = {
+    **{name: 'timestamp' for name in (
+        'timestamp', 'power', 'voltage', 'current', 'power_factor', 'energy_total', 'quality', 'phases'
+    )},
+    'energy_delta': 'energy_timestamp',
+    'energy_timestamp': 'energy_timestamp',
+}
+
+Item = Tuple[DeviceMeasurement, Sequence[DeviceMeasurementDetail]]
+
+
+def update_latest_states(items: Iterable[Item]) -> int:
+    """
+    Aggiorna in blocco DeviceLatestState con le misurazioni di un batch.
+
+    Per ogni dispositivo vale la misurazione istantanea più recente (con i
+    dettagli di fase) e, separatamente, l'ultimo delta ENERGY; una lettura
+    più vecchia dello stato salvato (es. da un batch riprovato) non lo
+    sovrascrive. Una query per gli stati esistenti e un upsert per tutto il
+    batch; restituisce gli stati scritti. Il confronto dei timestamp è
+    ripetuto nell'upsert, così con più ingestori uno stato più recente
+    scritto da un'altra replica nel frattempo non viene sovrascritto.
+    """
+    instant: Dict[int, Item] = {}
+    energy: Dict[int, DeviceMeasurement] = {}
+    for measurement, details in items:
+        if measurement.measurement_type == 'ENERGY':
+            latest = energy.get(measurement.device_id)
+            if latest is None or measurement.timestamp >= latest.timestamp:
+                energy[measurement.device_id] = measurement
+        else:
+            latest = instant.get(measurement.device_id)
+            if latest is None or measurement.timestamp >= latest[0].timestamp:
+                instant[measurement.device_id] = (measurement, details)
+
+    device_ids = set(instant) | set(energy)
+    if not device_ids:
+        return 0
+
+    states = DeviceLatestState.objects.in_bulk(device_ids)
+    changed = []
+    for device_id in device_ids:
+        state = states.get(device_id) or DeviceLatestState(device_id=device_id)
+        updated = False
+        if device_id in instant:
+            measurement, details = instant[device_id]
+            if state.timestamp is None or measurement.timestamp >= state.timestamp:
+                state.apply_measurement(measurement, details)
+                updated = True
+        if device_id in energy:
+            measurement = energy[device_id]
+            if state.energy_timestamp is None or measurement.timestamp >= state.energy_timestamp:
+                state.apply_energy(measurement)
+                updated = True
+        if updated:
+            changed.append(state)
+
+    if changed:
+        _upsert(changed)
+    return len(changed)
+
+
+def _upsert(states: List[DeviceLatestState]) -> None:
+    """INSERT ... ON CONFLICT DO UPDATE con aggiornamento condizionato per timestamp"""
+    opts = DeviceLatestState._meta
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    fields = opts.concrete_fields
+    columns = ', '.join(qn(field.column) for field in fields)
+    row = '(' + ', '.join(['%s'] * len(fields)) + ')'
+
+    assignments = []
+    for field in fields:
+        if field.primary_key:
+            continue
+        column = qn(field.column)
+        guard = GUARDED_FIELDS.get(field.name)
+        if guard is None:
+            assignments.append(f"{column} = EXCLUDED.{column}")
+            continue
+        guard = qn(opts.get_field(guard).column)
+        assignments.append(
+            f"{column} = CASE WHEN {table}.{guard} IS NULL OR EXCLUDED.{guard} >= {table}.{guard} "
+            f"THEN EXCLUDED.{column} ELSE {table}.{column} END"
+        )
+
+    batch_size = connection.ops.bulk_batch_size(fields, states) or len(states)
+    with connection.cursor() as cursor:
+        for start in range(0, len(states), batch_size):
+            chunk = states[start:start + batch_size]
+            params = [
+                field.get_db_prep_save(field.pre_save(state, True), connection)
+                for state in chunk for field in fields
+            ]
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join([row] * len(chunk))} "
+                f"ON CONFLICT ({qn(opts.pk.column)}) DO UPDATE SET {', '.join(assignments)}",
+                params
+            )
@@ -0,0 +1,477 @@
+# energy/mqtt/pipeline.py
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import paho.mqtt.client as mqtt
+from django.utils import timezone
+
+from ..devices.mapping import get_mapping_registry
+from ..devices.registry import DeviceRegistry
+from ..models import DeviceMeasurement, DeviceMeasurementDetail
+from .batching import get_batch_writer
+from .codec import KIND_ENERGY, KIND_POWER, MeasurementRecord, decode_message
+from .compression import get_compressor
+from .counters import get_counter_store
+from .dedup import get_deduplicator
+from .audit import get_audit_writer
+from .latency import get_latency_tracker
+from .presence import get_presence_tracker
+from .routing import get_routing_index
+from .stats import publish_stats
+
+logger = logging.getLogger('energy.mqtt')
+
+# Esiti di un messaggio: il primo stadio che si ferma imposta l'esito
+OUTCOME_STORED = 'stored'
+OUTCOME_DUPLICATE = 'duplicate'
+OUTCOME_UNROUTED = 'unrouted'
+OUTCOME_INVALID = 'invalid'
+OUTCOME_UNSUPPORTED = 'unsupported'
+OUTCOME_REJECTED = 'rejected'
+OUTCOME_FAILED = 'failed'
+OUTCOME_ERROR = 'error'
+
+# Esiti per cui il messaggio è considerato elaborato
+ACCEPTED_OUTCOMES = frozenset((OUTCOME_STORED, OUTCOME_DUPLICATE))
+# Esiti conteggiati come errori del topic nelle metriche di latenza
+ERROR_OUTCOMES = frozenset((OUTCOME_INVALID, OUTCOME_UNSUPPORTED, OUTCOME_REJECTED,
+                            OUTCOME_FAILED, OUTCOME_ERROR))
+
+# Variazione massima ammessa tra due letture di energia (Wh)
+MAX_ENERGY_DELTA = 100000
+
+STATS_PUBLISH_EVERY = 1000  # messaggi
+
+# Consumatore delle misurazioni accettate: (device_config, record, topic)
+Listener = Callable[[Any, MeasurementRecord, str], Any]
+
+
+class MessageContext:
+    """Stato di un messaggio lungo gli stadi della pipeline"""
+
+    __slots__ = ('topic', 'payload', 'received_at', 'ack', 'device', 'driver', 'mapping',
+                 'record', 'dedup_key', 'outcome')
+
+    def __init__(self, topic: str, payload: Any, received_at: float, ack=None):
+        self.topic = topic
+        self.payload = payload
+        self.received_at = received_at
+        self.ack = ack
+        self.device = None
+        self.driver = None
+        self.mapping = None
+        self.record: Optional[MeasurementRecord] = None
+        self.dedup_key = None
+        self.outcome: Optional[str] = None
+
+    def stop(self, outcome: str) -> bool:
+        """Interrompe la pipeline con l'esito indicato"""
+        self.outcome = outcome
+        return False
+
+
+class Stage:
+    """
+    Stadio della pipeline di ingestione.
+
+    `process` restituisce False per interrompere la pipeline (impostando
+    l'esito con `ctx.stop`). Se un messaggio fallisce negli stadi
+    successivi, `abort` viene chiamato sugli stadi già eseguiti in ordine
+    inverso per annullarne gli effetti.
+    """
+
+    name = 'stage'
+
+    def process(self, ctx: MessageContext) -> bool:
+        raise NotImplementedError
+
+    def abort(self, ctx: MessageContext) -> None:
+        pass
+
+
+class RouteStage(Stage):
+    """Risolve dispositivo, driver e mapping del payload dal topic"""
+
+    name = 'route'
+
+    def __init__(self):
+        self._routing_index = get_routing_index()
+        self._mappings = get_mapping_registry()
+
+    def process(self, ctx: MessageContext) -> bool:
+        device = self._routing_index.match(ctx.topic)
+        if device is None:
+            logger.warning(f"No device found for topic: {ctx.topic}")
+            return ctx.stop(OUTCOME_UNROUTED)
+        ctx.device = device
+        ctx.driver = DeviceRegistry.get_device_by_vendor_model(device.vendor, device.model)
+        ctx.mapping = self._mappings.get(device.vendor, device.model)
+        return True
+
+
+class DecodeStage(Stage):
+    """Unica decodifica del payload con il mapping compilato del dispositivo"""
+
+    name = 'decode'
+
+    def process(self, ctx: MessageContext) -> bool:
+        record = decode_message(ctx.topic, ctx.payload, ctx.mapping)
+        if record is None:
+            logger.error(f"Raw payload: {ctx.payload}")
+            return ctx.stop(OUTCOME_INVALID)
+        if record.received_at is None:
+            record.received_at = ctx.received_at
+        if record.parsed_at is None:
+            record.parsed_at = time.time()
+        record.ack = ctx.ack
+        # A valle circola solo il MeasurementRecord
+        ctx.record = record
+        ctx.payload = None
+        return True
+
+
+class ValidateStage(Stage):
+    """Verifica il tipo di messaggio e i valori tramite il driver del dispositivo"""
+
+    name = 'validate'
+
+    def process(self, ctx: MessageContext) -> bool:
+        if ctx.record.kind is None:
+            logger.warning(f"Unsupported topic format: {ctx.topic}")
+            return ctx.stop(OUTCOME_UNSUPPORTED)
+        if ctx.driver is not None and not ctx.driver.validate_record(ctx.record):
+            return ctx.stop(OUTCOME_REJECTED)
+        return True
+
+
+class DedupStage(Stage):
+    """Scarta i messaggi già elaborati (ritrasmissioni QoS 1, più ingestori)"""
+
+    name = 'dedup'
+
+    def __init__(self):
+        self._deduplicator = get_deduplicator()
+
+    def process(self, ctx: MessageContext) -> bool:
+        ctx.dedup_key = self._deduplicator.key_for_record(ctx.device.device_id, ctx.record)
+        if self._deduplicator.check(ctx.dedup_key):
+            logger.debug(f"Duplicate message detected: {ctx.topic}")
+            return ctx.stop(OUTCOME_DUPLICATE)
+        return True
+
+    def abort(self, ctx: MessageContext) -> None:
+        # Il messaggio potrà essere elaborato se ritrasmesso
+        if ctx.dedup_key is not None:
+            self._deduplicator.forget(ctx.dedup_key)
+
+
+class PersistStage(Stage):
+    """
+    Prepara le misurazioni e le accoda al batch writer.
+
+    Unico punto di scrittura delle misurazioni MQTT: la potenza passa
+    dalla compressione, l'energia diventa il delta rispetto all'ultima
+    lettura del contatore. Misurazioni, last_seen e contatori vengono
+    scritti in differita. Altri tipi di messaggio si aggiungono con
+    `register_kind`.
+    """
+
+    name = 'persist'
+
+    def __init__(self):
+        self._batch_writer = get_batch_writer()
+        self._presence = get_presence_tracker()
+        self._counters = get_counter_store()
+        self._compressor = get_compressor()
+        self._handlers: Dict[str, Callable[[Any, MeasurementRecord], bool]] = {
+            KIND_POWER: self.handle_power,
+            KIND_ENERGY: self.handle_energy,
+        }
+
+    def register_kind(self, kind: str, handler: Callable[[Any, MeasurementRecord], bool]) -> None:
+        """Registra il gestore di un tipo di messaggio"""
+        self._handlers[kind] = handler
+
+    def process(self, ctx: MessageContext) -> bool:
+        handler = self._handlers.get(ctx.record.kind)
+        if handler is None:
+            logger.warning(f"Unsupported topic format: {ctx.topic}")
+            return ctx.stop(OUTCOME_UNSUPPORTED)
+        if not handler(ctx.device, ctx.record):
+            return ctx.stop(OUTCOME_FAILED)
+        return True
+
+    def handle_power(self, device_config, record: MeasurementRecord) -> bool:
+        """Misurazione di potenza con i dettagli delle fasi"""
+        try:
+            current_timestamp = timezone.now()
+            measurement = DeviceMeasurement(
+                device=device_config,
+                plant=device_config.plant,
+                timestamp=current_timestamp,
+                power=record.power,
+                voltage=record.voltage,
+                current=record.current,
+                power_factor=record.power_factor,
+                energy_total=record.energy_total,
+                measurement_type='POWER',
+                quality='GOOD'
+            )
+
+            for sample in self._compressor.offer(device_config, measurement,
+                                                 self._build_phase_details(record), record):
+                # Solo il campione corrente concorre alle metriche di latenza
+                trace = sample.trace if sample.measurement is measurement else None
+                self._batch_writer.add(sample.measurement, sample.details, trace=trace,
+                                       ack=record.ack if trace is not None else None)
+            self._presence.touch(device_config.pk, current_timestamp)
+            device_config.last_seen = current_timestamp
+            return True
+
+        except Exception as e:
+            logger.error(f"Error persisting power message: {str(e)}", exc_info=True)
+            return False
+
+    def handle_energy(self, device_config, record: MeasurementRecord) -> bool:
+        """Delta di energia rispetto all'ultima lettura del contatore (persistente tra i riavvii)"""
+        try:
+            current_timestamp = timezone.now()
+            current_energy_total = record.energy_total
+
+            counter = self._counters.get(device_config.device_id)
+            last_energy = counter.total if counter else None
+
+            if last_energy is not None:
+                energy_delta = current_energy_total - last_energy
+                if 0 <= energy_delta <= MAX_ENERGY_DELTA:
+                    self._batch_writer.add(DeviceMeasurement(
+                        device=device_config,
+                        plant=device_config.plant,
+                        timestamp=current_timestamp,
+                        power=0,  # Per i messaggi di energia, la potenza istantanea non è disponibile
+                        voltage=0,
+                        current=0,
+                        energy_total=energy_delta / 1000.0,  # Wh -> kWh
+                        measurement_type='ENERGY',
+                        quality='GOOD'
+                    ), trace=record, ack=record.ack)
+                    logger.info(
+                        f"Energy delta for device {device_config.device_id}: "
+                        f"{last_energy:.3f} -> {current_energy_total:.3f} Wh "
+                        f"({energy_delta / 1000.0:.3f} kWh)"
+                    )
+                else:
+                    logger.warning(
+                        f"Invalid energy delta for device {device_config.device_id}: "
+                        f"{last_energy:.3f} -> {current_energy_total:.3f} Wh"
+                    )
+            else:
+                logger.info(f"First energy reading for device {device_config.device_id}: {current_energy_total:.3f} Wh")
+
+            # Ultima lettura in Wh per il prossimo delta
+            self._counters.update(device_config, current_energy_total, current_timestamp)
+            self._presence.touch(device_config.pk, current_timestamp)
+            device_config.last_seen = current_timestamp
+            return True
+
+        except Exception as e:
+            logger.error(f"Error persisting energy message: {str(e)}", exc_info=True)
+            return False
+
+    @staticmethod
+    def _build_phase_details(record: MeasurementRecord) -> List[DeviceMeasurementDetail]:
+        """Dettagli delle misurazioni per fase (salvati dal batch writer)"""
+        return [
+            DeviceMeasurementDetail(
+                phase=phase,
+                voltage=voltage,
+                current=current,
+                power=power,
+                power_factor=power_factor,
+                frequency=frequency
+            )
+            for phase, voltage, current, power, power_factor, frequency in record.phases
+        ]
+
+    def release(self) -> None:
+        """Accoda i campioni trattenuti dalla compressione (all'arresto)"""
+        for sample in self._compressor.release():
+            self._batch_writer.add(sample.measurement, sample.details)
+
+
+class FanoutStage(Stage):
+    """
+    Notifica i consumatori registrati delle misurazioni accettate.
+
+    I consumatori sono chiamati dal worker del dispositivo appena
+    PersistStage ha accodato la misurazione al batch writer, quindi prima
+    del commit: se la scrittura del batch fallisce viene riprovata, ma il
+    consumatore è già stato notificato. Chi ha bisogno dei dati scritti
+    legge il DB (es. DeviceLatestState).
+    """
+
+    name = 'fanout'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners: Tuple[Tuple[Optional[str], Listener], ...] = ()
+
+    def add_listener(self, listener: Listener, pattern: Optional[str] = None) -> None:
+        """Registra un consumatore, opzionalmente filtrato per pattern di topic"""
+        with self._lock:
+            if (pattern, listener) not in self._listeners:
+                self._listeners += ((pattern, listener),)
+
+    def remove_listener(self, listener: Listener, pattern: Optional[str] = None) -> None:
+        with self._lock:
+            self._listeners = tuple(entry for entry in self._listeners if entry != (pattern, listener))
+
+    def process(self, ctx: MessageContext) -> bool:
+        for pattern, listener in self._listeners:
+            if pattern is not None and not mqtt.topic_matches_sub(pattern, ctx.topic):
+                continue
+            try:
+                listener(ctx.device, ctx.record, ctx.topic)
+            except Exception as e:
+                # Un consumatore non blocca la pipeline né gli altri consumatori
+                logger.error(f"Error in listener for {ctx.topic}: {e}", exc_info=True)
+        return True
+
+
+def default_stages() -> List[Stage]:
+    """Stadi predefiniti: route → decode → validate → dedup → persist → fan-out"""
+    return [RouteStage(), DecodeStage(), ValidateStage(), DedupStage(), PersistStage(), FanoutStage()]
+
+
+class IngestPipeline:
+    """
+    Pipeline unica di ingestione dei messaggi MQTT.
+
+    Il client riceve i messaggi e li accoda ai worker per dispositivo
+    (receive); ogni worker chiama `process`, che esegue gli stadi in
+    ordine. Il routing precede la decodifica perché il mapping del payload
+    dipende dal tipo di dispositivo. Esiti, tempi per stadio e metriche di
+    latenza vengono registrati solo qui.
+    """
+
+    def __init__(self, stages: Optional[Sequence[Stage]] = None):
+        self._stages = list(stages) if stages is not None else default_stages()
+        self._latency = get_latency_tracker()
+        self._audit = get_audit_writer()
+        # Metriche aggiornate da tutti i worker
+        self._stats_lock = threading.Lock()
+        self._outcomes: Dict[str, int] = {}
+        self._stage_time = {stage.name: 0.0 for stage in self._stages}
+        self._received = 0
+
+    def stage(self, name: str) -> Optional[Stage]:
+        """Restituisce lo stadio con il nome indicato"""
+        for stage in self._stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def add_listener(self, listener: Listener, pattern: Optional[str] = None) -> None:
+        """Registra un consumatore delle misurazioni accettate"""
+        self.stage(FanoutStage.name).add_listener(listener, pattern)
+
+    def remove_listener(self, listener: Listener, pattern: Optional[str] = None) -> None:
+        self.stage(FanoutStage.name).remove_listener(listener, pattern)
+
+    def process(self, topic: str, payload: Any, received_at: Optional[float] = None,
+                ack=None) -> bool:
+        """
+        Elabora un messaggio; True se salvato o già elaborato.
+
+        `ack` (InflightMessage) viene rilasciato al termine: il batch writer
+        lo trattiene finché le righe del messaggio non sono nel DB, quindi
+        il messaggio viene confermato al broker solo dopo la scrittura.
+        """
+        try:
+            return self._process(MessageContext(topic, payload, received_at or time.time(), ack))
+        finally:
+            if ack is not None:
+                ack.release()
+
+    def _process(self, ctx: MessageContext) -> bool:
+        topic = ctx.topic
+        executed = []
+        stage_time = []
+        try:
+            for stage in self._stages:
+                started = time.perf_counter()
+                proceed = stage.process(ctx)
+                stage_time.append((stage.name, time.perf_counter() - started))
+                executed.append(stage)
+                if not proceed:
+                    break
+            else:
+                ctx.outcome = OUTCOME_STORED
+        except Exception as e:
+            logger.error(f"Error processing message on {topic}: {str(e)}", exc_info=True)
+            ctx.outcome = OUTCOME_ERROR
+
+        if ctx.outcome not in ACCEPTED_OUTCOMES:
+            for stage in reversed(executed):
+                try:
+                    stage.abort(ctx)
+                except Exception as e:
+                    logger.error(f"Error aborting stage {stage.name}: {e}")
+        self._observe(ctx, stage_time)
+        return ctx.outcome in ACCEPTED_OUTCOMES
+
+    def _observe(self, ctx: MessageContext, stage_time: Sequence[Tuple[str, float]]) -> None:
+        """Unico punto di raccolta delle metriche di ingestione"""
+        outcome = ctx.outcome
+        with self._stats_lock:
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+            for name, elapsed in stage_time:
+                self._stage_time[name] += elapsed
+            self._received += 1
+            publish = self._received % STATS_PUBLISH_EVERY == 0
+        if outcome == OUTCOME_STORED:
+            self._latency.observe_message(ctx.record, ctx.device)
+        elif outcome in ERROR_OUTCOMES and ctx.device is not None:
+            self._latency.observe_error(ctx.topic, ctx.device)
+        # Audit campionato (MESSAGE): i contatori includono tutti i messaggi
+        self._audit.record('MESSAGE', status=outcome in ACCEPTED_OUTCOMES,
+                           mqtt_username=ctx.device.device_id if ctx.device is not None else '',
+                           topic=ctx.topic, details={'outcome': outcome})
+
+        if publish:
+            publish_stats('pipeline', self.get_stats())
+
+    def release(self) -> None:
+        """Rilascia gli stati trattenuti dagli stadi (all'arresto)"""
+        for stage in self._stages:
+            release = getattr(stage, 'release', None)
+            if release is not None:
+                release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Restituisce esiti e tempo medio per stadio"""
+        with self._stats_lock:
+            received = self._received
+            outcomes = dict(self._outcomes)
+            stage_time = dict(self._stage_time)
+        stats: Dict[str, Any] = {'received': received}
+        stats.update(outcomes)
+        for name, elapsed in stage_time.items():
+            stats[f'{name}_avg_us'] = round(elapsed * 1e6 / received, 1) if received else 0.0
+        return stats
+
+
+# Singleton instance
+_ingest_pipeline = None
+_ingest_pipeline_lock = threading.Lock()
+
+def get_ingest_pipeline() -> IngestPipeline:
+    """Ottiene l'istanza singleton della pipeline di ingestione"""
+    global _ingest_pipeline
+    if _ingest_pipeline is None:
+        with _ingest_pipeline_lock:
+            if _ingest_pipeline is None:
+                _ingest_pipeline = IngestPipeline()
+    return _ingest_pipeline
@@ -0,0 +1,70 @@
+# energy/mqtt/presence.py
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from ..models import DeviceConfiguration
+from .writebehind import WriteBehindStore
+
+logger = logging.getLogger('energy.mqtt')
+
+DEFAULT_PRESENCE_FLUSH_INTERVAL = 5  # secondi
+
+
+class PresenceTracker(WriteBehindStore):
+    """
+    Write-behind di DeviceConfiguration.last_seen.
+
+    Ogni messaggio aggiorna solo il timestamp in memoria del dispositivo;
+    ogni `flush_interval` secondi i dispositivi modificati vengono scritti
+    con un unico UPDATE, invece di un UPDATE per messaggio sulla stessa riga.
+    """
+
+    model = DeviceConfiguration
+    fields = ('last_seen',)
+    order_field = 'last_seen'
+    stats_component = 'presence'
+
+    def __init__(self, flush_interval: Optional[float] = None):
+        mqtt_settings = getattr(settings, 'MQTT_SETTINGS', {})
+        super().__init__(flush_interval or mqtt_settings.get(
+            'PRESENCE_FLUSH_INTERVAL', DEFAULT_PRESENCE_FLUSH_INTERVAL
+        ))
+        self._last_seen: Dict[int, datetime] = {}
+        self._stats['touches'] = 0
+
+    def touch(self, device_pk: int, timestamp: datetime) -> None:
+        """Registra l'ultimo contatto di un dispositivo"""
+        with self._lock:
+            self._stats['touches'] += 1
+            previous = self._last_seen.get(device_pk)
+            if previous is None or timestamp > previous:
+                self._last_seen[device_pk] = timestamp
+                self._mark_dirty(device_pk, (timestamp,))
+
+    def last_seen(self, device_pk: int) -> Optional[datetime]:
+        """Ultimo contatto noto in memoria (anche se non ancora scritto)"""
+        return self._last_seen.get(device_pk)
+
+    def get_stats(self) -> Dict[str, float]:
+        """Restituisce le metriche del presence tracker"""
+        stats = super().get_stats()
+        stats['devices'] = len(self._last_seen)
+        return stats
+
+
+# Singleton instance
+_presence_tracker = None
+_presence_tracker_lock = threading.Lock()
+
+def get_presence_tracker() -> PresenceTracker:
+    """Ottiene l'istanza singleton del presence tracker"""
+    global _presence_tracker
+    if _presence_tracker is None:
+        with _presence_tracker_lock:
+            if _presence_tracker is None:
+                _presence_tracker = PresenceTracker()
+    return _presence_tracker
@@ -0,0 +1,218 @@
+# energy/mqtt/routing.py
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Iterable
+
+from django.core.cache import cache
+
+from ..models import DeviceConfiguration
+
+logger = logging.getLogger('energy.mqtt')
+
+# Suffissi dei topic Shelly gestiti direttamente dal DeviceManager
+SHELLY_STATUS_SUFFIXES = ('/status/em:0', '/status/emdata:0')
+
+# Versione delle configurazioni condivisa in cache tra processi: i processi
+# web la aggiornano a ogni modifica, il processo di ingestione la controlla
+# periodicamente e ricarica l'indice quando cambia
+CONFIG_VERSION_KEY = 'mqtt_device_config_version'
+
+
+def bump_config_version() -> None:
+    """Segnala agli altri processi che le configurazioni sono cambiate"""
+    try:
+        cache.set(CONFIG_VERSION_KEY, time.time_ns(), timeout=None)
+    except Exception as e:
+        logger.debug(f"Impossibile aggiornare la versione delle configurazioni: {e}")
+
+
+def get_config_version() -> Optional[int]:
+    """Restituisce la versione corrente delle configurazioni"""
+    try:
+        return cache.get(CONFIG_VERSION_KEY)
+    except Exception as e:
+        logger.debug(f"Impossibile leggere la versione delle configurazioni: {e}")
+        return None
+
+
+class _TrieNode:
+    """Nodo del trie dei pattern MQTT con wildcard"""
+    __slots__ = ('children', 'device_ids')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.device_ids: List[str] = []
+
+
+class _RoutingTables:
+    """Tabelle dell'indice, sostituite in blocco da una ricostruzione"""
+    __slots__ = ('exact', 'trie', 'configs', 'device_topics')
+
+    def __init__(self):
+        self.exact: Dict[str, str] = {}
+        self.trie = _TrieNode()
+        self.configs: Dict[str, DeviceConfiguration] = {}
+        self.device_topics: Dict[str, List[str]] = {}
+
+
+class TopicRoutingIndex:
+    """
+    Indice in memoria topic -> DeviceConfiguration.
+
+    I topic concreti dei dispositivi finiscono in un dizionario (lookup O(1)),
+    i pattern con wildcard `+`/`#` in un trie per livelli. Nessun accesso al
+    DB in fase di lookup: l'indice viene aggiornato dai signal di
+    DeviceConfiguration o ricostruito al caricamento delle configurazioni.
+
+    I lookup non prendono il lock: una ricostruzione prepara tabelle nuove e
+    le sostituisce con un'unica assegnazione, così un lookup concorrente vede
+    l'indice precedente o quello nuovo, mai uno vuoto.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tables = _RoutingTables()
+
+    @staticmethod
+    def topics_for(config: DeviceConfiguration) -> List[str]:
+        """Calcola i topic (concreti e pattern) associati ad un dispositivo"""
+        topics = []
+        if config.mqtt_topic_template:
+            # Stessa logica storica di _find_device_for_topic
+            base_topic = config.mqtt_topic_template.replace('/status/em:0', '')
+            topics.extend(f"{base_topic}{suffix}" for suffix in SHELLY_STATUS_SUFFIXES)
+        for topic in config.get_mqtt_topics():
+            if topic not in topics:
+                topics.append(topic)
+        return topics
+
+    def rebuild(self, configs: Iterable[DeviceConfiguration]) -> None:
+        """Ricostruisce completamente l'indice"""
+        tables = _RoutingTables()
+        for config in configs:
+            self._add(tables, config)
+        with self._lock:
+            self._tables = tables
+        logger.info(f"Routing index ricostruito: {len(tables.configs)} dispositivi, "
+                    f"{len(tables.exact)} topic esatti")
+
+    def update_device(self, config: DeviceConfiguration) -> None:
+        """Inserisce o aggiorna un dispositivo; quelli non attivi vengono rimossi"""
+        with self._lock:
+            self._remove(self._tables, config.device_id)
+            if config.is_active:
+                self._add(self._tables, config)
+
+    def remove_device(self, device_id: str) -> None:
+        """Rimuove un dispositivo dall'indice"""
+        with self._lock:
+            self._remove(self._tables, device_id)
+
+    def match(self, topic: str) -> Optional[DeviceConfiguration]:
+        """Restituisce il dispositivo associato al topic, se presente"""
+        tables = self._tables
+        device_id = tables.exact.get(topic)
+        if device_id is None:
+            device_id = self._match_wildcard(tables.trie, topic)
+        if device_id is None:
+            return None
+        return tables.configs.get(device_id)
+
+    def get_config(self, device_id: str) -> Optional[DeviceConfiguration]:
+        return self._tables.configs.get(device_id)
+
+    def __len__(self) -> int:
+        return len(self._tables.configs)
+
+    def _add(self, tables: _RoutingTables, config: DeviceConfiguration) -> None:
+        topics = self.topics_for(config)
+        if not topics:
+            return
+        device_id = config.device_id
+        tables.configs[device_id] = config
+        tables.device_topics[device_id] = topics
+        for topic in topics:
+            if '+' in topic or '#' in topic:
+                node = tables.trie
+                for level in topic.split('/'):
+                    node = node.children.setdefault(level, _TrieNode())
+                node.device_ids.append(device_id)
+            else:
+                previous = tables.exact.setdefault(topic, device_id)
+                if previous != device_id:
+                    logger.warning(f"Topic {topic} già associato al dispositivo {previous}")
+
+    def _remove(self, tables: _RoutingTables, device_id: str) -> None:
+        topics = tables.device_topics.pop(device_id, None)
+        tables.configs.pop(device_id, None)
+        if not topics:
+            return
+        for topic in topics:
+            if '+' in topic or '#' in topic:
+                self._remove_pattern(tables.trie, topic.split('/'), device_id)
+            elif tables.exact.get(topic) == device_id:
+                del tables.exact[topic]
+
+    def _remove_pattern(self, trie: _TrieNode, levels: List[str], device_id: str) -> None:
+        path = [trie]
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        if device_id in path[-1].device_ids:
+            path[-1].device_ids.remove(device_id)
+        # Pota i rami rimasti vuoti
+        for depth in range(len(levels), 0, -1):
+            node = path[depth]
+            if node.device_ids or node.children:
+                break
+            del path[depth - 1].children[levels[depth - 1]]
+
+    def _match_wildcard(self, trie: _TrieNode, topic: str) -> Optional[str]:
+        if not trie.children:
+            return None
+        levels = topic.split('/')
+        # Come da specifica MQTT i topic di sistema ($SYS, ...) non
+        # corrispondono a wildcard di primo livello
+        if topic.startswith('$'):
+            return None
+        return self._walk(trie, levels, 0)
+
+    def _walk(self, node: _TrieNode, levels: List[str], depth: int) -> Optional[str]:
+        if depth == len(levels):
+            if node.device_ids:
+                return node.device_ids[0]
+            # "a/#" corrisponde anche ad "a"
+            hash_node = node.children.get('#')
+            if hash_node and hash_node.device_ids:
+                return hash_node.device_ids[0]
+            return None
+
+        level = levels[depth]
+        for key in (level, '+'):
+            child = node.children.get(key)
+            if child is not None:
+                found = self._walk(child, levels, depth + 1)
+                if found is not None:
+                    return found
+
+        hash_node = node.children.get('#')
+        if hash_node and hash_node.device_ids:
+            return hash_node.device_ids[0]
+        return None
+
+
+# Singleton instance
+_routing_index = None
+_routing_index_lock = threading.Lock()
+
+def get_routing_index() -> TopicRoutingIndex:
+    """Ottiene l'istanza singleton dell'indice di routing"""
+    global _routing_index
+    if _routing_index is None:
+        with _routing_index_lock:
+            if _routing_index is None:
+                _routing_index = TopicRoutingIndex()
+    return _routing_index
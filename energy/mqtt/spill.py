@@ -0,0 +1,365 @@
+# energy/mqtt/spill.py
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger('energy.mqtt')
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_FSYNC_INTERVAL = 0.1  # secondi
+
+# Record: lunghezza body, crc32 body, timestamp di scrittura | body
+RECORD_HEADER = struct.Struct('!IId')
+TOPIC_LENGTH = struct.Struct('!H')
+
+SEGMENT_NAME = 'segment-{:010d}.log'
+SEGMENT_PATTERN = re.compile(r'^segment-(\d{10})\.log$')
+CURSOR_FILE = 'cursor'
+
+
+@dataclass
+class SpillRecord:
+    """Messaggio salvato nel log su disco"""
+    topic: str
+    payload: bytes
+    timestamp: float
+    segment: int
+    end_offset: int
+
+
+class SegmentLog:
+    """
+    Coda append-only su disco divisa in segmenti.
+
+    I messaggi vengono aggiunti in coda al segmento attivo (che ruota al
+    superamento di `segment_bytes`) e riletti nello stesso ordine a partire
+    dal cursore. L'fsync è raggruppato: al più uno ogni `fsync_interval`
+    secondi durante le raffiche, più `sync()` esplicito; il callback
+    `on_sync` di un append viene chiamato dopo l'fsync che rende durevole
+    il record. I segmenti completamente riletti vengono cancellati.
+
+    La consegna è at-least-once: dopo un crash i record successivi all'ultimo
+    cursore salvato vengono riletti.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+                 fsync_interval: float = DEFAULT_FSYNC_INTERVAL):
+        self.directory = str(directory)
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._write_file = None
+        self._write_segment = 0
+        self._write_offset = 0
+        self._unsynced = False
+        self._last_sync = time.monotonic()
+        self._sync_callbacks: List[Callable[[], None]] = []
+
+        self._read_segment, self._read_offset = self._load_cursor()
+        self._pending_records = 0
+        self._pending_bytes = 0
+        self._oldest_timestamp: Optional[float] = None
+
+        self._recover()
+
+    # -- Stato ------------------------------------------------------------
+
+    @property
+    def pending_records(self) -> int:
+        return self._pending_records
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._pending_bytes
+
+    def replay_lag(self) -> float:
+        """Età in secondi del record più vecchio ancora da rileggere"""
+        if not self._pending_records or self._oldest_timestamp is None:
+            return 0.0
+        return max(0.0, time.time() - self._oldest_timestamp)
+
+    # -- Scrittura --------------------------------------------------------
+
+    def append(self, topic: str, payload: bytes, on_sync: Optional[Callable[[], None]] = None) -> None:
+        """Aggiunge un messaggio in coda al log; `on_sync` dopo l'fsync del record"""
+        topic_raw = topic.encode('utf-8')
+        body = TOPIC_LENGTH.pack(len(topic_raw)) + topic_raw + bytes(payload)
+        now = time.time()
+        record = RECORD_HEADER.pack(len(body), zlib.crc32(body), now) + body
+
+        with self._lock:
+            if self._write_file is None or self._write_offset >= self.segment_bytes:
+                self._roll()
+            self._write_file.write(record)
+            self._write_file.flush()
+            self._write_offset += len(record)
+            self._pending_records += 1
+            self._pending_bytes += len(record)
+            if self._oldest_timestamp is None:
+                self._oldest_timestamp = now
+            self._unsynced = True
+            if on_sync is not None:
+                self._sync_callbacks.append(on_sync)
+            if time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def sync(self) -> None:
+        """Forza l'fsync dei record scritti"""
+        with self._lock:
+            self._sync()
+
+    def sync_if_due(self) -> None:
+        """fsync dei record scritti se è trascorso l'intervallo di raggruppamento"""
+        if (self._unsynced or self._sync_callbacks) and time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def _sync(self) -> None:
+        if self._write_file is not None and self._unsynced:
+            os.fsync(self._write_file.fileno())
+        self._unsynced = False
+        self._last_sync = time.monotonic()
+        callbacks, self._sync_callbacks = self._sync_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Errore nel callback di sync dello spill log: {e}")
+
+    def _roll(self) -> None:
+        if self._write_file is not None:
+            self._sync()
+            self._write_file.close()
+        self._write_segment += 1
+        self._write_file = open(self._segment_path(self._write_segment), 'ab')
+        self._write_offset = 0
+
+    # -- Lettura ----------------------------------------------------------
+
+    def read_batch(self, max_records: int, start: Optional[Tuple[int, int]] = None) -> List[SpillRecord]:
+        """
+        Legge fino a `max_records` record dal cursore, senza avanzarlo; con
+        `start` (segmento, offset) legge dopo quella posizione se più avanti.
+        """
+        records = []
+        with self._lock:
+            segment, offset = max((self._read_segment, self._read_offset), start or (0, 0))
+            while len(records) < max_records and segment <= self._write_segment:
+                path = self._segment_path(segment)
+                if not os.path.exists(path):
+                    segment, offset = segment + 1, 0
+                    continue
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    while len(records) < max_records:
+                        record, offset = self._read_record(f, offset, segment)
+                        if record is None:
+                            break
+                        records.append(record)
+                if len(records) < max_records and segment < self._write_segment:
+                    segment, offset = segment + 1, 0
+                else:
+                    break
+        return records
+
+    def commit(self, records: List[SpillRecord]) -> None:
+        """Avanza il cursore dopo i record indicati e rimuove i segmenti consumati"""
+        if not records:
+            return
+        last = records[-1]
+        with self._lock:
+            consumed_bytes = sum(
+                RECORD_HEADER.size + TOPIC_LENGTH.size + len(r.topic.encode('utf-8')) + len(r.payload)
+                for r in records
+            )
+            for segment in range(self._read_segment, last.segment):
+                self._remove_segment(segment)
+            self._read_segment, self._read_offset = last.segment, last.end_offset
+            self._pending_records = max(0, self._pending_records - len(records))
+            self._pending_bytes = max(0, self._pending_bytes - consumed_bytes)
+            if self._pending_records:
+                self._oldest_timestamp = self._peek_timestamp()
+            else:
+                self._oldest_timestamp = None
+                # Log vuoto: il prossimo append apre un nuovo segmento
+                if self._read_segment == self._write_segment and self._write_file is not None:
+                    self._sync()
+                    self._write_file.close()
+                    self._write_file = None
+                    self._remove_segment(self._read_segment)
+                    self._read_segment, self._read_offset = self._write_segment + 1, 0
+            self._save_cursor()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._write_file is not None:
+                self._sync()
+                self._write_file.close()
+                self._write_file = None
+            self._save_cursor()
+
+    # -- Interni ----------------------------------------------------------
+
+    @staticmethod
+    def _read_record(f, offset: int, segment: int) -> Tuple[Optional[SpillRecord], int]:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return None, offset
+        length, crc, timestamp = RECORD_HEADER.unpack(header)
+        body = f.read(length)
+        if len(body) < length or zlib.crc32(body) != crc:
+            return None, offset
+        topic_length = TOPIC_LENGTH.unpack_from(body)[0]
+        start = TOPIC_LENGTH.size
+        topic = body[start:start + topic_length].decode('utf-8')
+        end_offset = offset + RECORD_HEADER.size + length
+        return SpillRecord(topic, body[start + topic_length:], timestamp, segment, end_offset), end_offset
+
+    def _peek_timestamp(self) -> Optional[float]:
+        path = self._segment_path(self._read_segment)
+        try:
+            with open(path, 'rb') as f:
+                f.seek(self._read_offset)
+                header = f.read(RECORD_HEADER.size)
+                if len(header) == RECORD_HEADER.size:
+                    return RECORD_HEADER.unpack(header)[2]
+        except OSError:
+            pass
+        return None
+
+    def _recover(self) -> None:
+        """Ricostruisce lo stato dai segmenti presenti (ripresa dopo un riavvio)"""
+        segments = sorted(
+            int(match.group(1))
+            for match in (SEGMENT_PATTERN.match(name) for name in os.listdir(self.directory))
+            if match
+        )
+        for segment in segments:
+            if segment < self._read_segment:
+                self._remove_segment(segment)
+                continue
+            offset = self._read_offset if segment == self._read_segment else 0
+            valid_end = offset
+            with open(self._segment_path(segment), 'rb') as f:
+                f.seek(offset)
+                while True:
+                    record, next_offset = self._read_record(f, valid_end, segment)
+                    if record is None:
+                        break
+                    self._pending_records += 1
+                    self._pending_bytes += next_offset - valid_end
+                    if self._oldest_timestamp is None:
+                        self._oldest_timestamp = record.timestamp
+                    valid_end = next_offset
+            size = os.path.getsize(self._segment_path(segment))
+            if size > valid_end:
+                # Record incompleto dopo un crash: viene scartato
+                logger.warning(f"Spill log: troncato record incompleto nel segmento {segment}")
+                with open(self._segment_path(segment), 'r+b') as f:
+                    f.truncate(valid_end)
+
+        if segments:
+            self._write_segment = max(segments[-1], self._read_segment - 1)
+        else:
+            self._write_segment = self._read_segment - 1 if self._read_segment else 0
+        if self._read_segment == 0:
+            self._read_segment = 1
+        if self._pending_records:
+            logger.info(f"Spill log: {self._pending_records} messaggi da rileggere in {self.directory}")
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, SEGMENT_NAME.format(segment))
+
+    def _remove_segment(self, segment: int) -> None:
+        try:
+            os.remove(self._segment_path(segment))
+        except FileNotFoundError:
+            pass
+
+    def _load_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def _save_cursor(self) -> None:
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(f"{self._read_segment} {self._read_offset}")
+        os.replace(tmp_path, path)
+
+
+class ReplayAck:
+    """
+    Token di conferma di un record riletto dallo spill log, con la stessa
+    interfaccia di InflightMessage (`retain`/`release`).
+    """
+
+    __slots__ = ('record', 'done', '_tracker', '_refs')
+
+    def __init__(self, tracker: 'ReplayTracker', record: SpillRecord):
+        self.record = record
+        self.done = False
+        self._tracker = tracker
+        self._refs = 1
+
+    def retain(self) -> 'ReplayAck':
+        with self._tracker._lock:
+            self._refs += 1
+        return self
+
+    def release(self) -> None:
+        self._tracker._release(self)
+
+
+class ReplayTracker:
+    """
+    Avanza il cursore dello SegmentLog solo fino ai record elaborati.
+
+    Ogni record rimesso in coda riceve un ReplayAck che segue il messaggio
+    fino al commit del batch writer; il cursore avanza sulla sequenza
+    iniziale di record completati, nell'ordine del log. Dopo un crash i
+    record rimessi in coda ma non ancora scritti vengono riletti.
+    """
+
+    def __init__(self, log: SegmentLog):
+        self._log = log
+        self._lock = threading.Lock()
+        self._pending: 'deque[ReplayAck]' = deque()
+        # Posizione dell'ultimo record rimesso in coda
+        self.position: Optional[Tuple[int, int]] = None
+
+    def track(self, record: SpillRecord) -> ReplayAck:
+        ack = ReplayAck(self, record)
+        with self._lock:
+            self._pending.append(ack)
+            self.position = (record.segment, record.end_offset)
+        return ack
+
+    def _release(self, ack: ReplayAck) -> None:
+        with self._lock:
+            ack._refs -= 1
+            if ack._refs > 0 or ack.done:
+                return
+            ack.done = True
+            completed = []
+            while self._pending and self._pending[0].done:
+                completed.append(self._pending.popleft().record)
+            if completed:
+                # Sotto il lock: commit concorrenti non possono far arretrare il cursore
+                self._log.commit(completed)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
@@ -0,0 +1,48 @@
+# energy/mqtt/stats.py
+import logging
+from typing import Dict, Any
+
+from django.core.cache import cache
+
+logger = logging.getLogger('energy.mqtt')
+
+# Componenti della pipeline di ingestione che pubblicano statistiche.
+# Il processo di ingestione le scrive in cache, l'endpoint /monitoring/metrics/
+# (processo web) le legge.
+STATS_COMPONENTS = (
+    'batch',
+    'workers',
+    'dedup',
+    'presence',
+    'counters',
+    'latency',
+    'compression',
+    'pipeline',
+    'subscriptions',
+    'inflight',
+    'audit',
+    'modbus',
+    'shelly',
+)
+
+STATS_CACHE_PREFIX = 'mqtt_ingest_stats'
+STATS_TIMEOUT = 300
+
+
+def publish_stats(component: str, stats: Dict[str, Any]) -> None:
+    """Pubblica in cache l'ultimo snapshot delle statistiche di un componente"""
+    try:
+        cache.set(f"{STATS_CACHE_PREFIX}:{component}", stats, timeout=STATS_TIMEOUT)
+    except Exception as e:
+        logger.debug(f"Impossibile pubblicare le statistiche {component}: {e}")
+
+
+def get_published_stats() -> Dict[str, Dict[str, Any]]:
+    """Restituisce gli snapshot pubblicati, indicizzati per componente"""
+    keys = {f"{STATS_CACHE_PREFIX}:{component}": component for component in STATS_COMPONENTS}
+    try:
+        found = cache.get_many(list(keys))
+    except Exception as e:
+        logger.debug(f"Impossibile leggere le statistiche di ingestione: {e}")
+        return {}
+    return {keys[key]: value for key, value in found.items()}
@@ -0,0 +1,215 @@
+# energy/mqtt/subscriptions.py
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set
+
+import paho.mqtt.client as mqtt
+from django.conf import settings
+
+from .core import shared_topic
+from .stats import publish_stats
+
+logger = logging.getLogger('energy.mqtt')
+
+DEFAULT_BATCH_SIZE = 100  # topic per pacchetto SUBSCRIBE/UNSUBSCRIBE
+DEFAULT_DEBOUNCE = 0.5  # secondi
+DEFAULT_MAX_DELAY = 5.0  # secondi
+
+# Proprietario delle sottoscrizioni richieste esplicitamente con subscribe()
+MANUAL_OWNER = '__manual__'
+
+
+class SubscriptionManager:
+    """
+    Sottoscrizioni MQTT incrementali.
+
+    Mantiene l'insieme dei topic desiderati, raggruppati per proprietario
+    (il device_id, o MANUAL_OWNER), e quello dei topic sottoscritti sul
+    broker. `sync` invia solo la differenza tra i due, con più topic per
+    pacchetto SUBSCRIBE/UNSUBSCRIBE. `schedule` raggruppa le modifiche
+    ravvicinate (es. import massivo di dispositivi): la sincronizzazione
+    parte dopo `debounce` secondi senza nuove modifiche e al più
+    `max_delay` secondi dopo la prima.
+    """
+
+    def __init__(self, client_getter: Callable[[], Optional[mqtt.Client]],
+                 qos: Optional[int] = None,
+                 batch_size: Optional[int] = None,
+                 debounce: Optional[float] = None,
+                 max_delay: Optional[float] = None):
+        mqtt_settings = getattr(settings, 'MQTT_SETTINGS', {})
+        self._get_client = client_getter
+        self.qos = qos if qos is not None else mqtt_settings.get('QOS_LEVEL', 1)
+        self.batch_size = batch_size or mqtt_settings.get('SUBSCRIBE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.debounce = debounce if debounce is not None else mqtt_settings.get(
+            'SUBSCRIBE_DEBOUNCE', DEFAULT_DEBOUNCE)
+        self.max_delay = max_delay if max_delay is not None else mqtt_settings.get(
+            'SUBSCRIBE_MAX_DELAY', DEFAULT_MAX_DELAY)
+
+        self._lock = threading.RLock()
+        self._owners: Dict[str, FrozenSet[str]] = {}
+        self._desired: Dict[str, int] = {}  # topic -> numero di proprietari
+        self._active: Set[str] = set()
+        self._pending_acks: Dict[int, List[str]] = {}  # mid -> topic in attesa di SUBACK
+        self._timer: Optional[threading.Timer] = None
+        self._first_change: Optional[float] = None
+        self._stats = {
+            'syncs': 0,
+            'subscribe_packets': 0,
+            'unsubscribe_packets': 0,
+            'subscribed': 0,
+            'unsubscribed': 0,
+            'rejected': 0,
+        }
+
+    @property
+    def active(self) -> FrozenSet[str]:
+        """Topic sottoscritti sul broker"""
+        with self._lock:
+            return frozenset(self._active)
+
+    @property
+    def desired(self) -> FrozenSet[str]:
+        """Topic da sottoscrivere"""
+        with self._lock:
+            return frozenset(self._desired)
+
+    def set_owner(self, owner: str, topics: Iterable[str]) -> bool:
+        """Imposta i topic di un proprietario; True se l'insieme desiderato è cambiato"""
+        topics = frozenset(shared_topic(topic) for topic in topics)
+        with self._lock:
+            previous = self._owners.get(owner, frozenset())
+            if topics == previous:
+                return False
+            if topics:
+                self._owners[owner] = topics
+            else:
+                self._owners.pop(owner, None)
+            for topic in previous - topics:
+                count = self._desired[topic] - 1
+                if count:
+                    self._desired[topic] = count
+                else:
+                    del self._desired[topic]
+            for topic in topics - previous:
+                self._desired[topic] = self._desired.get(topic, 0) + 1
+            return True
+
+    def remove_owner(self, owner: str) -> bool:
+        return self.set_owner(owner, ())
+
+    def replace(self, owners: Dict[str, Iterable[str]]) -> None:
+        """Sostituisce i topic di tutti i proprietari (le sottoscrizioni manuali restano)"""
+        with self._lock:
+            for owner in set(self._owners) - set(owners) - {MANUAL_OWNER}:
+                self.remove_owner(owner)
+            for owner, topics in owners.items():
+                self.set_owner(owner, topics)
+
+    def add_topic(self, topic: str) -> None:
+        with self._lock:
+            self.set_owner(MANUAL_OWNER, self._owners.get(MANUAL_OWNER, frozenset()) | {shared_topic(topic)})
+
+    def discard_topic(self, topic: str) -> None:
+        with self._lock:
+            self.set_owner(MANUAL_OWNER, self._owners.get(MANUAL_OWNER, frozenset()) - {shared_topic(topic)})
+
+    def reset(self) -> None:
+        """Nuova connessione senza sessione: nessun topic risulta sottoscritto"""
+        with self._lock:
+            self._active.clear()
+            self._pending_acks.clear()
+
+    def schedule(self) -> None:
+        """Programma una sincronizzazione raggruppando le modifiche ravvicinate"""
+        with self._lock:
+            now = time.monotonic()
+            if self._first_change is None:
+                self._first_change = now
+            if self._timer is not None:
+                self._timer.cancel()
+            delay = min(self.debounce, max(0.0, self._first_change + self.max_delay - now))
+            self._timer = threading.Timer(delay, self._run_scheduled)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run_scheduled(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._first_change = None
+        try:
+            self.sync()
+        except Exception as e:
+            logger.error(f"Error syncing MQTT subscriptions: {e}")
+
+    def cancel(self) -> None:
+        """Annulla la sincronizzazione programmata"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+            self._first_change = None
+
+    def sync(self) -> int:
+        """Invia al broker la differenza tra topic desiderati e sottoscritti; restituisce i pacchetti inviati"""
+        client = self._get_client()
+        if client is None:
+            return 0
+        with self._lock:
+            to_subscribe = sorted(self._desired.keys() - self._active)
+            to_unsubscribe = sorted(self._active - self._desired.keys())
+            if not to_subscribe and not to_unsubscribe:
+                return 0
+
+            packets = 0
+            for batch in self._batches(to_subscribe):
+                result, mid = client.subscribe([(topic, self.qos) for topic in batch])
+                if result != mqtt.MQTT_ERR_SUCCESS:
+                    logger.error(f"Failed to subscribe to {len(batch)} topics ({mqtt.error_string(result)})")
+                    break
+                self._active.update(batch)
+                self._pending_acks[mid] = batch
+                self._stats['subscribe_packets'] += 1
+                self._stats['subscribed'] += len(batch)
+                packets += 1
+
+            for batch in self._batches(to_unsubscribe):
+                result, mid = client.unsubscribe(batch)
+                if result != mqtt.MQTT_ERR_SUCCESS:
+                    logger.error(f"Failed to unsubscribe from {len(batch)} topics ({mqtt.error_string(result)})")
+                    break
+                self._active.difference_update(batch)
+                self._stats['unsubscribe_packets'] += 1
+                self._stats['unsubscribed'] += len(batch)
+                packets += 1
+
+            self._stats['syncs'] += 1
+            logger.info(f"MQTT subscriptions synced: +{len(to_subscribe)} -{len(to_unsubscribe)} "
+                        f"topics in {packets} packets, {len(self._active)} active")
+        publish_stats('subscriptions', self.get_stats())
+        return packets
+
+    def _batches(self, topics: List[str]) -> Iterable[List[str]]:
+        for start in range(0, len(topics), self.batch_size):
+            yield topics[start:start + self.batch_size]
+
+    def on_subscribe(self, client, userdata, mid, reason_code_list, properties) -> None:
+        """Callback SUBACK: i topic rifiutati dal broker tornano da sottoscrivere"""
+        with self._lock:
+            topics = self._pending_acks.pop(mid, None)
+            if not topics:
+                return
+            for topic, reason_code in zip(topics, reason_code_list):
+                if reason_code.is_failure:
+                    self._active.discard(topic)
+                    self._stats['rejected'] += 1
+                    logger.error(f"Subscription to {topic} rejected by broker: {reason_code}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Restituisce le metriche delle sottoscrizioni"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['desired'] = len(self._desired)
+            stats['active'] = len(self._active)
+        return stats
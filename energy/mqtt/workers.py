@@ -0,0 +1,384 @@
+# energy/mqtt/workers.py
+import logging
+import os
+import threading
+import time
+import zlib
+from queue import Queue, Full, Empty
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connection
+
+from .spill import ReplayTracker, SegmentLog
+from .stats import publish_stats
+
+logger = logging.getLogger('energy.mqtt')
+
+DEFAULT_INGEST_QUEUE_SIZE = 10000
+DEFAULT_BLOCK_TIMEOUT = 5.0  # secondi
+STATS_PUBLISH_INTERVAL = 10  # secondi
+REPLAY_BATCH = 500
+REPLAY_IDLE_WAIT = 0.1  # secondi
+
+# Politiche di sovraccarico quando la coda di un worker è piena
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICY_SPILL = 'spill'
+OVERLOAD_POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_SPILL)
+
+# Marcatore di arresto inserito in coda da stop()
+_STOP = object()
+
+
+def default_worker_count() -> int:
+    """Numero di worker predefinito: un worker per core, massimo 8"""
+    return max(1, min(os.cpu_count() or 1, 8))
+
+
+class IngestionWorkerPool:
+    """
+    Pool di worker di ingestione partizionati per dispositivo.
+
+    Ogni worker ha una propria coda FIFO; i messaggi vengono assegnati
+    alla coda con un hash stabile della chiave di partizione (il device_id),
+    quindi i messaggi di uno stesso dispositivo sono sempre elaborati dallo
+    stesso worker e nell'ordine di arrivo. Dispositivi diversi vengono
+    elaborati in parallelo, ciascun worker con la propria connessione al DB.
+
+    Quando la coda di un worker è piena si applica `overload_policy`:
+
+    - ``block``: attende fino a `block_timeout` secondi, poi scarta il messaggio;
+    - ``drop-oldest``: scarta il messaggio più vecchio della coda;
+    - ``spill``: da quel momento tutti i messaggi vengono scritti nel log su
+      disco (SegmentLog) e un thread di replay li rimette in coda nell'ordine
+      di arrivo man mano che i worker si liberano; quando il log è vuoto si
+      torna all'accodamento diretto. L'ordine per dispositivo è preservato.
+
+    Con `pass_received_at` l'handler riceve anche l'istante di ricezione
+    (epoch), per misurare l'attesa in coda e la latenza di elaborazione, e
+    il token di conferma MQTT del messaggio (InflightMessage o None), che
+    l'handler deve rilasciare; altrimenti il pool lo rilascia dopo l'handler.
+    Un messaggio scartato rilascia il token subito, uno scritto su disco
+    dopo l'fsync del record, perché da lì viene recuperato anche al riavvio.
+    Se la scrittura su disco fallisce il messaggio segue la politica
+    ``block``. I record riletti ricevono un token (ReplayAck) che fa
+    avanzare il cursore del log solo dopo il commit delle misurazioni.
+    """
+
+    def __init__(self, handler: Callable[[str, Any], Any],
+                 key_func: Optional[Callable[[str], Optional[str]]] = None,
+                 num_workers: Optional[int] = None,
+                 queue_size: Optional[int] = None,
+                 overload_policy: Optional[str] = None,
+                 block_timeout: Optional[float] = None,
+                 spill_dir: Optional[str] = None,
+                 pass_received_at: bool = False):
+        mqtt_settings = getattr(settings, 'MQTT_SETTINGS', {})
+        self.num_workers = num_workers or mqtt_settings.get('INGEST_WORKERS') or default_worker_count()
+        self.queue_size = queue_size or mqtt_settings.get('INGEST_QUEUE_SIZE', DEFAULT_INGEST_QUEUE_SIZE)
+        self.overload_policy = overload_policy or mqtt_settings.get('INGEST_OVERLOAD_POLICY', POLICY_BLOCK)
+        if self.overload_policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"Politica di sovraccarico non valida: {self.overload_policy}")
+        if block_timeout is None:
+            block_timeout = mqtt_settings.get('INGEST_BLOCK_TIMEOUT', DEFAULT_BLOCK_TIMEOUT)
+        self.block_timeout = block_timeout
+        self.spill_dir = spill_dir or mqtt_settings.get('SPILL_DIR') or os.path.join(
+            settings.BASE_DIR, 'spool', 'mqtt'
+        )
+        self._spill_segment_bytes = mqtt_settings.get('SPILL_SEGMENT_BYTES')
+        self._spill_fsync_interval = mqtt_settings.get('SPILL_FSYNC_INTERVAL')
+
+        self._handler = handler
+        self._pass_received_at = pass_received_at
+        self._key_func = key_func
+        self._queues: List[Queue] = [Queue(maxsize=self.queue_size) for _ in range(self.num_workers)]
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+        # Metriche per worker
+        self._enqueued = [0] * self.num_workers
+        self._processed = [0] * self.num_workers
+        self._dropped = [0] * self.num_workers
+        self._errors = [0] * self.num_workers
+
+        # Spill su disco (creato all'avvio solo con la politica 'spill')
+        self._spill: Optional[SegmentLog] = None
+        self._replay_tracker: Optional[ReplayTracker] = None
+        self._spill_lock = threading.Lock()
+        self._spilling = False
+        self._spilled = 0
+        self._replayed = 0
+        self._replay_thread = None
+        self._replay_stop = threading.Event()
+
+    def partition_for(self, topic: str) -> int:
+        """Restituisce l'indice del worker che gestisce il topic"""
+        key = None
+        if self._key_func:
+            try:
+                key = self._key_func(topic)
+            except Exception as e:
+                logger.debug(f"Errore calcolo chiave di partizione per {topic}: {e}")
+        if not key:
+            key = topic
+        return zlib.crc32(key.encode('utf-8')) % self.num_workers
+
+    def submit(self, topic: str, payload: Any, received_at: Optional[float] = None,
+               ack: Optional[Any] = None) -> bool:
+        """Accoda un messaggio al worker del dispositivo applicando la politica di sovraccarico"""
+        if received_at is None:
+            received_at = time.time()
+        if self._spilling:
+            with self._spill_lock:
+                spilled = self._spill_message(topic, payload, ack) if self._spilling else None
+            if spilled is not None:
+                return spilled
+            if self._spilling:
+                return self._block(self.partition_for(topic), (topic, payload, received_at, ack))
+
+        shard = self.partition_for(topic)
+        queue = self._queues[shard]
+        try:
+            queue.put_nowait((topic, payload, received_at, ack))
+        except Full:
+            return self._overload(shard, topic, payload, received_at, ack)
+        self._enqueued[shard] += 1
+        return True
+
+    def _overload(self, shard: int, topic: str, payload: Any, received_at: float,
+                  ack: Optional[Any] = None) -> bool:
+        queue = self._queues[shard]
+        policy = self.overload_policy
+        item = (topic, payload, received_at, ack)
+
+        if policy == POLICY_SPILL and self._spill is not None:
+            with self._spill_lock:
+                if not self._spilling:
+                    logger.warning(f"Coda worker {shard} piena: messaggi scritti su disco in {self.spill_dir}")
+                self._spilling = True
+                spilled = self._spill_message(topic, payload, ack)
+            if spilled is not None:
+                return spilled
+
+        if policy == POLICY_DROP_OLDEST:
+            while True:
+                try:
+                    dropped = queue.get_nowait()
+                    queue.task_done()
+                    self._count_drop(shard)
+                    if dropped is not _STOP:
+                        self._release(dropped[3])
+                except Empty:
+                    pass
+                try:
+                    queue.put_nowait(item)
+                    break
+                except Full:
+                    continue
+            self._enqueued[shard] += 1
+            return True
+
+        # block (e spill senza log disponibile)
+        return self._block(shard, item)
+
+    def _block(self, shard: int, item: tuple) -> bool:
+        """Attende spazio nella coda fino a `block_timeout`, poi scarta il messaggio"""
+        try:
+            self._queues[shard].put(item, timeout=self.block_timeout)
+        except Full:
+            self._count_drop(shard)
+            self._release(item[3])
+            return False
+        self._enqueued[shard] += 1
+        return True
+
+    def _count_drop(self, shard: int) -> None:
+        self._dropped[shard] += 1
+        if self._dropped[shard] % 100 == 1:
+            logger.warning(f"Coda worker {shard} piena: messaggi scartati {self._dropped[shard]}")
+
+    @staticmethod
+    def _release(ack: Optional[Any]) -> None:
+        if ack is not None:
+            ack.release()
+
+    def _spill_message(self, topic: str, payload: Any, ack: Optional[Any] = None) -> Optional[bool]:
+        """
+        Scrive il messaggio nel log su disco (chiamare con self._spill_lock);
+        il token viene rilasciato dopo l'fsync del record. None se la
+        scrittura fallisce: il chiamante applica la politica 'block'.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        try:
+            self._spill.append(topic, payload, on_sync=ack.release if ack is not None else None)
+        except Exception as e:
+            logger.error(f"Errore scrittura spill log: {e}")
+            return None
+        self._spilled += 1
+        return True
+
+    def _replay(self) -> None:
+        """Rimette in coda i messaggi del log su disco, nell'ordine di scrittura"""
+        spill = self._spill
+        tracker = self._replay_tracker
+        while not self._replay_stop.is_set():
+            try:
+                spill.sync_if_due()
+                records = spill.read_batch(REPLAY_BATCH, tracker.position)
+                if not records:
+                    with self._spill_lock:
+                        # Nessun append concorrente: tutto il log è stato rimesso in coda
+                        if not spill.read_batch(1, tracker.position):
+                            self._spilling = False
+                    self._replay_stop.wait(REPLAY_IDLE_WAIT)
+                    continue
+
+                for record in records:
+                    shard = self.partition_for(record.topic)
+                    item = (record.topic, record.payload, record.timestamp, tracker.track(record))
+                    while True:
+                        try:
+                            self._queues[shard].put_nowait(item)
+                            break
+                        except Full:
+                            if self._replay_stop.wait(REPLAY_IDLE_WAIT):
+                                # I record non ancora scritti verranno riletti al riavvio
+                                return
+                            spill.sync_if_due()
+                    self._enqueued[shard] += 1
+                    self._replayed += 1
+            except Exception as e:
+                logger.error(f"Errore nel replay dello spill log: {e}")
+                self._replay_stop.wait(1)
+
+    def replay_lag(self) -> float:
+        """Età in secondi del messaggio più vecchio ancora su disco"""
+        return self._spill.replay_lag() if self._spill is not None else 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self) -> None:
+        """Avvia i thread dei worker"""
+        with self._lock:
+            if self.is_running:
+                return
+            self._threads = [
+                threading.Thread(
+                    target=self._run,
+                    args=(shard,),
+                    name=f"mqtt-ingest-{shard}",
+                    daemon=True
+                )
+                for shard in range(self.num_workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            if self.overload_policy == POLICY_SPILL:
+                self._start_replay()
+        logger.info(f"Avviati {self.num_workers} worker di ingestione MQTT")
+
+    def _start_replay(self) -> None:
+        if self._spill is None:
+            kwargs = {}
+            if self._spill_segment_bytes:
+                kwargs['segment_bytes'] = self._spill_segment_bytes
+            if self._spill_fsync_interval:
+                kwargs['fsync_interval'] = self._spill_fsync_interval
+            try:
+                self._spill = SegmentLog(self.spill_dir, **kwargs)
+            except OSError as e:
+                logger.error(f"Spill log non disponibile in {self.spill_dir}: {e}")
+                return
+        self._replay_tracker = ReplayTracker(self._spill)
+        with self._spill_lock:
+            # Messaggi rimasti da un'esecuzione precedente: prima il replay
+            self._spilling = self._spill.pending_records > 0
+        self._replay_stop.clear()
+        self._replay_thread = threading.Thread(target=self._replay, name="mqtt-ingest-replay", daemon=True)
+        self._replay_thread.start()
+
+    def _run(self, shard: int) -> None:
+        queue = self._queues[shard]
+        last_publish = time.monotonic()
+        try:
+            while True:
+                # Il primo worker pubblica periodicamente le metriche del pool
+                if shard == 0 and time.monotonic() - last_publish >= STATS_PUBLISH_INTERVAL:
+                    publish_stats('workers', self.get_stats())
+                    last_publish = time.monotonic()
+                try:
+                    item = queue.get(timeout=STATS_PUBLISH_INTERVAL)
+                except Empty:
+                    continue
+                try:
+                    if item is _STOP:
+                        return
+                    topic, payload, received_at, ack = item
+                    if self._pass_received_at:
+                        self._handler(topic, payload, received_at, ack)
+                    else:
+                        try:
+                            self._handler(topic, payload)
+                        finally:
+                            self._release(ack)
+                    self._processed[shard] += 1
+                except Exception as e:
+                    self._errors[shard] += 1
+                    logger.error(f"Errore nel worker di ingestione {shard}: {e}")
+                finally:
+                    queue.task_done()
+        finally:
+            # Ogni worker ha la propria connessione al DB
+            connection.close()
+
+    def join(self) -> None:
+        """Attende che tutti i messaggi accodati siano stati elaborati"""
+        for queue in self._queues:
+            queue.join()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Elabora i messaggi già accodati e ferma i worker"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        if self._replay_thread is not None:
+            self._replay_stop.set()
+            self._replay_thread.join(timeout=timeout)
+            self._replay_thread = None
+        for queue in self._queues:
+            try:
+                queue.put(_STOP, timeout=timeout)
+            except Full:
+                logger.warning("Coda worker piena durante l'arresto")
+        for thread in threads:
+            thread.join(timeout=timeout)
+        if self._spill is not None:
+            # Dopo i worker: fsync dei record e conferma dei messaggi su disco
+            self._spill.close()
+        publish_stats('workers', self.get_stats())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Restituisce le metriche del pool"""
+        depths = [queue.qsize() for queue in self._queues]
+        return {
+            'workers': self.num_workers,
+            'enqueued': sum(self._enqueued),
+            'processed': sum(self._processed),
+            'dropped': sum(self._dropped),
+            'errors': sum(self._errors),
+            'queue_depth': sum(depths),
+            'max_queue_depth': max(depths) if depths else 0,
+            'policy': self.overload_policy,
+            'spilling': self._spilling,
+            'spilled': self._spilled,
+            'replayed': self._replayed,
+            'replay_in_flight': self._replay_tracker.in_flight if self._replay_tracker is not None else 0,
+            'spill_records': self._spill.pending_records if self._spill is not None else 0,
+            'spill_bytes': self._spill.pending_bytes if self._spill is not None else 0,
+            'replay_lag_seconds': round(self.replay_lag(), 3),
+        }
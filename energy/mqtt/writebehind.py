@@ -0,0 +1,159 @@
+# energy/mqtt/writebehind.py
+import atexit
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple, Type
+
+from django.db import connection, models
+from django.db.models import Case, When, Value
+
+from .stats import publish_stats
+
+logger = logging.getLogger('energy.mqtt')
+
+WRITE_BEHIND_CHUNK = 1000
+
+
+class WriteBehindStore:
+    """
+    Base per lo stato per-riga scritto in differita.
+
+    Le sottoclassi registrano i valori aggiornati con `_mark_dirty(pk, values)`;
+    ogni `flush_interval` secondi le righe modificate vengono scritte con un
+    unico UPDATE per blocco di righe (su PostgreSQL `UPDATE ... FROM (VALUES ...)`).
+    Se `order_field` è impostato, l'UPDATE non sovrascrive valori più recenti
+    già presenti nel database.
+    """
+
+    model: Type[models.Model] = None
+    fields: Tuple[str, ...] = ()
+    order_field: Optional[str] = None
+    stats_component: Optional[str] = None
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty: Dict[int, tuple] = {}
+
+        self._stop_event = threading.Event()
+        self._timer_thread = None
+
+        # Metriche
+        self._stats = {
+            'flushes': 0,
+            'rows': 0,
+            'errors': 0,
+            'last_flush_ms': 0.0,
+        }
+
+    def _mark_dirty(self, pk: int, values: tuple) -> None:
+        """Registra i valori da scrivere per una riga (chiamare con self._lock)"""
+        self._dirty[pk] = values
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    def flush(self) -> int:
+        """Scrive le righe modificate; restituisce il numero di righe"""
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+            if not dirty:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                self._write(dirty)
+            except Exception as e:
+                self._stats['errors'] += 1
+                logger.error(f"Errore scrittura differita di {len(dirty)} righe "
+                             f"{self.model._meta.db_table}: {str(e)}")
+                # Riprova al prossimo flush senza sovrascrivere valori più recenti
+                with self._lock:
+                    for pk, values in dirty.items():
+                        self._dirty.setdefault(pk, values)
+                return 0
+
+            self._stats['flushes'] += 1
+            self._stats['rows'] += len(dirty)
+            self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            return len(dirty)
+
+    def _write(self, dirty: Dict[int, tuple]) -> None:
+        items = list(dirty.items())
+        for start in range(0, len(items), WRITE_BEHIND_CHUNK):
+            chunk = items[start:start + WRITE_BEHIND_CHUNK]
+            if connection.vendor == 'postgresql':
+                self._update_postgresql(chunk)
+            else:
+                self._update_generic(chunk)
+
+    def _update_postgresql(self, chunk) -> None:
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        columns = [opts.pk.column] + [opts.get_field(name).column for name in self.fields]
+        casts = [opts.pk.cast_db_type(connection)] + [
+            opts.get_field(name).cast_db_type(connection) for name in self.fields
+        ]
+        row = '(' + ', '.join(f'%s::{cast}' for cast in casts) + ')'
+        assignments = ', '.join(f'{qn(column)} = v.{qn(column)}' for column in columns[1:])
+        where = f'd.{qn(columns[0])} = v.{qn(columns[0])}'
+        if self.order_field:
+            order = qn(opts.get_field(self.order_field).column)
+            where += f' AND (d.{order} IS NULL OR d.{order} < v.{order})'
+
+        params = [value for pk, values in chunk for value in (pk, *values)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {qn(opts.db_table)} AS d SET {assignments} "
+                f"FROM (VALUES {', '.join([row] * len(chunk))}) "
+                f"AS v({', '.join(qn(column) for column in columns)}) "
+                f"WHERE {where}",
+                params
+            )
+
+    def _update_generic(self, chunk) -> None:
+        updates = {}
+        for index, name in enumerate(self.fields):
+            updates[name] = Case(
+                *[When(pk=pk, then=Value(values[index])) for pk, values in chunk],
+                output_field=self.model._meta.get_field(name)
+            )
+        self.model._default_manager.filter(pk__in=[pk for pk, _ in chunk]).update(**updates)
+
+    def get_stats(self) -> Dict[str, float]:
+        stats = dict(self._stats)
+        stats['pending'] = len(self._dirty)
+        return stats
+
+    def start(self) -> None:
+        """Avvia il thread di scrittura periodica"""
+        if self._timer_thread and self._timer_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._timer_thread = threading.Thread(target=self._run, daemon=True)
+        self._timer_thread.start()
+        atexit.register(self.stop)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+                if self.stats_component:
+                    publish_stats(self.stats_component, self.get_stats())
+            except Exception as e:
+                logger.error(f"Errore nel thread di scrittura differita: {e}")
+        connection.close()
+
+    def stop(self) -> None:
+        """Hook di arresto: ferma il timer e scrive le righe rimaste"""
+        self._stop_event.set()
+        if self._timer_thread and self._timer_thread is not threading.current_thread():
+            self._timer_thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+        if self.stats_component:
+            publish_stats(self.stats_component, self.get_stats())
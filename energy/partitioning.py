@@ -0,0 +1,360 @@
+# energy/partitioning.py
+"""
+Partizionamento mensile (PostgreSQL) delle tabelle delle misurazioni.
+
+DeviceMeasurement e DeviceMeasurementDetail diventano tabelle partizionate
+per intervallo su `timestamp`, una partizione per mese (UTC) più una
+partizione DEFAULT per le righe fuori dagli intervalli creati. Le query
+per intervallo di tempo leggono solo le partizioni interessate e la
+retention stacca o elimina partizioni intere invece di cancellare righe.
+
+Vincoli di PostgreSQL sulle tabelle partizionate, riflessi qui:
+
+- la chiave primaria e i vincoli UNIQUE includono la chiave di partizione,
+  quindi la PK diventa (id, timestamp) e l'id è generato da una sequenza;
+- i dettagli di fase hanno lo stesso timestamp della misurazione padre e
+  la FK verso la misurazione è composta (measurement_id, timestamp);
+- le FK di altre tabelle verso le misurazioni per solo id non sono
+  possibili: vengono rimosse e l'integrità resta affidata all'ORM.
+
+La conversione delle tabelle esistenti (`convert_tables`) si esegue una
+volta sola, in una finestra di manutenzione: copia i dati nelle nuove
+tabelle in un'unica transazione. La manutenzione periodica
+(`ensure_partitions`, `expire_partitions`) è nel comando
+manage_measurement_partitions.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timezone as dt_timezone
+from typing import List, Optional, Sequence, Tuple
+
+from django.utils import timezone
+
+logger = logging.getLogger('energy.partitioning')
+
+PARTITION_KEY = 'timestamp'
+DEFAULT_PREMAKE_MONTHS = 3
+LEGACY_SUFFIX = '_legacy'
+
+_PARTITION_NAME_RE = re.compile(r'_p(\d{4})(\d{2})$')
+_UNIQUE_COLUMNS_RE = re.compile(r'UNIQUE \((.*)\)')
+
+
+@dataclass(frozen=True)
+class PartitionedTable:
+    """Tabella partizionata per mese"""
+    table: str
+    # (tabella padre, colonna FK): il timestamp delle righe è quello del padre
+    parent: Optional[Tuple[str, str]] = None
+    # (tabella, colonna) che riferiscono l'id delle righe con ON DELETE CASCADE
+    # nell'ORM: ripulite prima di staccare una partizione
+    cascades: Tuple[Tuple[str, str], ...] = ()
+
+
+def partitioned_tables() -> List[PartitionedTable]:
+    """Tabelle partizionate, i padri prima dei figli"""
+    from django.db.models import CASCADE
+    from .models import DeviceMeasurement, DeviceMeasurementDetail
+
+    measurement = DeviceMeasurement._meta.db_table
+    detail = DeviceMeasurementDetail._meta.db_table
+    cascades = tuple(
+        (relation.related_model._meta.db_table, relation.field.column)
+        for relation in DeviceMeasurement._meta.related_objects
+        if relation.related_model is not DeviceMeasurementDetail and relation.on_delete is CASCADE
+    )
+    return [
+        PartitionedTable(measurement, cascades=cascades),
+        PartitionedTable(detail, parent=(measurement, DeviceMeasurementDetail._meta.get_field('measurement').column)),
+    ]
+
+
+def quote_name(name: str) -> str:
+    return '"%s"' % name.replace('"', '""')
+
+
+def month_start(value) -> date:
+    """Primo giorno del mese (UTC) di una data o di un datetime"""
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = value.astimezone(dt_timezone.utc)
+        value = value.date()
+    return value.replace(day=1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """Mese di una partizione dal nome (None per la partizione DEFAULT)"""
+    match = _PARTITION_NAME_RE.search(name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def month_range_sql(month: date) -> Tuple[str, str]:
+    """Estremi [inizio, fine) del mese come letterali timestamptz UTC"""
+    return f"'{month:%Y-%m-%d} 00:00:00+00'", f"'{add_months(month, 1):%Y-%m-%d} 00:00:00+00'"
+
+
+def partition_bounds_sql(month: date) -> str:
+    start, end = month_range_sql(month)
+    return f"FOR VALUES FROM ({start}) TO ({end})"
+
+
+def create_partition_sql(table: str, month: date) -> str:
+    return (f"CREATE TABLE {quote_name(partition_name(table, month))} "
+            f"PARTITION OF {quote_name(table)} {partition_bounds_sql(month)}")
+
+
+def _exists(cursor, name: str) -> bool:
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [quote_name(name)])
+    return cursor.fetchone()[0]
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+        [quote_name(table)]
+    )
+    return cursor.fetchone()[0]
+
+
+def list_partitions(cursor, table: str) -> List[str]:
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname",
+        [quote_name(table)]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_partition(cursor, table: str, month: date) -> bool:
+    """
+    Crea la partizione del mese se manca; True se creata.
+
+    Le righe del mese già finite nella partizione DEFAULT vengono spostate
+    nella nuova partizione prima di agganciarla.
+    """
+    name = partition_name(table, month)
+    if _exists(cursor, name):
+        return False
+    default = default_partition_name(table)
+    start, end = month_range_sql(month)
+    key = quote_name(PARTITION_KEY)
+    misplaced = False
+    if _exists(cursor, default):
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {quote_name(default)} "
+                       f"WHERE {key} >= {start} AND {key} < {end})")
+        misplaced = cursor.fetchone()[0]
+    if not misplaced:
+        cursor.execute(create_partition_sql(table, month))
+        return True
+
+    cursor.execute(f"CREATE TABLE {quote_name(name)} (LIKE {quote_name(table)} INCLUDING DEFAULTS)")
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {quote_name(default)} WHERE {key} >= {start} AND {key} < {end} "
+        f"RETURNING *) INSERT INTO {quote_name(name)} SELECT * FROM moved"
+    )
+    logger.info(f"Spostate {cursor.rowcount} righe da {default} a {name}")
+    cursor.execute(f"ALTER TABLE {quote_name(table)} ATTACH PARTITION {quote_name(name)} "
+                   f"{partition_bounds_sql(month)}")
+    return True
+
+
+def ensure_partitions(cursor, tables: Sequence[PartitionedTable], months_ahead: int = DEFAULT_PREMAKE_MONTHS,
+                      now: Optional[datetime] = None) -> List[str]:
+    """Crea le partizioni dal mese corrente a `months_ahead` mesi in avanti"""
+    current = month_start(now or timezone.now())
+    created = []
+    for spec in tables:
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            if ensure_partition(cursor, spec.table, month):
+                created.append(partition_name(spec.table, month))
+    return created
+
+
+def expire_partitions(cursor, tables: Sequence[PartitionedTable], retention_months: int, drop: bool = False,
+                      now: Optional[datetime] = None) -> List[str]:
+    """
+    Stacca (e con `drop` elimina) le partizioni dei mesi precedenti agli
+    ultimi `retention_months`, il mese corrente incluso. I figli vengono
+    staccati prima dei padri; le tabelle staccate perdono le FK verso le
+    misurazioni, così restano consultabili come archivio.
+    """
+    cutoff = add_months(month_start(now or timezone.now()), -(retention_months - 1))
+    expired = []
+    for spec in reversed(list(tables)):
+        for name in list_partitions(cursor, spec.table):
+            month = partition_month(name)
+            if month is None or month >= cutoff:
+                continue
+            for related_table, column in spec.cascades:
+                cursor.execute(f"DELETE FROM {quote_name(related_table)} WHERE {quote_name(column)} IN "
+                               f"(SELECT id FROM {quote_name(name)})")
+            cursor.execute(f"ALTER TABLE {quote_name(spec.table)} DETACH PARTITION {quote_name(name)}")
+            if drop:
+                cursor.execute(f"DROP TABLE {quote_name(name)}")
+            else:
+                cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+                               [quote_name(name)])
+                for (constraint,) in cursor.fetchall():
+                    cursor.execute(f"ALTER TABLE {quote_name(name)} DROP CONSTRAINT {quote_name(constraint)}")
+            expired.append(name)
+    return expired
+
+
+def _legacy_name(name: str) -> str:
+    # Limite di 63 caratteri degli identificatori PostgreSQL
+    return f"{name[:63 - len(LEGACY_SUFFIX)]}{LEGACY_SUFFIX}"
+
+
+def convert_table(cursor, spec: PartitionedTable, premake_months: int = DEFAULT_PREMAKE_MONTHS,
+                  now: Optional[datetime] = None) -> Optional[str]:
+    """
+    Converte una tabella esistente in tabella partizionata per mese.
+
+    La tabella originale viene rinominata in `<tabella>_legacy` (con indici
+    e vincoli), la nuova tabella ne copia colonne, indici e FK e riceve i
+    dati; restituisce il nome della tabella legacy, None se la tabella era
+    già partizionata.
+    """
+    table = spec.table
+    if is_partitioned(cursor, table):
+        return None
+    legacy = _legacy_name(table)
+    key = quote_name(PARTITION_KEY)
+    regclass = quote_name(table)
+
+    # Definizioni da ricreare, lette prima della rinomina
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+        "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s))",
+        [table, regclass]
+    )
+    indexes = cursor.fetchall()
+    cursor.execute("SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+                   "WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'u', 'f')", [regclass])
+    constraints = cursor.fetchall()
+    cursor.execute("SELECT conname, conrelid::regclass::text FROM pg_constraint "
+                   "WHERE confrelid = to_regclass(%s) AND contype = 'f' AND conrelid <> confrelid", [regclass])
+    incoming = cursor.fetchall()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [regclass])
+    legacy_sequence = cursor.fetchone()[0]
+
+    # Le FK verso la tabella per solo id non possono riferire una tabella partizionata
+    for constraint, source in incoming:
+        logger.warning(f"Rimossa la FK {constraint} di {source} verso {table}: integrità affidata all'ORM")
+        cursor.execute(f"ALTER TABLE {source} DROP CONSTRAINT {quote_name(constraint)}")
+
+    # Libera i nomi di tabella, indici, vincoli e sequenza
+    cursor.execute(f"ALTER TABLE {quote_name(table)} RENAME TO {quote_name(legacy)}")
+    for index, _ in indexes:
+        cursor.execute(f"ALTER INDEX {quote_name(index)} RENAME TO {quote_name(_legacy_name(index))}")
+    for constraint, kind, _ in constraints:
+        if kind in ('p', 'u'):
+            cursor.execute(f"ALTER TABLE {quote_name(legacy)} RENAME CONSTRAINT {quote_name(constraint)} "
+                           f"TO {quote_name(_legacy_name(constraint))}")
+    if legacy_sequence:
+        cursor.execute(f"ALTER SEQUENCE {legacy_sequence} RENAME TO {quote_name(_legacy_name(table + '_id_seq'))}")
+
+    sequence = f"{table}_id_seq"
+    cursor.execute(f"CREATE TABLE {quote_name(table)} (LIKE {quote_name(legacy)} INCLUDING DEFAULTS) "
+                   f"PARTITION BY RANGE ({key})")
+    cursor.execute(f"CREATE SEQUENCE {quote_name(sequence)} AS bigint OWNED BY {quote_name(table)}.id")
+    cursor.execute(f"ALTER TABLE {quote_name(table)} ALTER COLUMN id SET DEFAULT nextval('{quote_name(sequence)}')")
+    cursor.execute(f"CREATE TABLE {quote_name(default_partition_name(table))} PARTITION OF {quote_name(table)} DEFAULT")
+
+    # Partizioni per i dati esistenti e per i prossimi mesi
+    cursor.execute(f"SELECT MIN({key}) FROM {quote_name(legacy)}")
+    oldest = cursor.fetchone()[0]
+    current = month_start(now or timezone.now())
+    month = month_start(oldest) if oldest is not None else current
+    last = add_months(current, premake_months)
+    while month <= last:
+        cursor.execute(create_partition_sql(table, month))
+        month = add_months(month, 1)
+
+    cursor.execute("SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attnum > 0 "
+                   "AND NOT attisdropped ORDER BY attnum", [quote_name(legacy)])
+    columns = [row[0] for row in cursor.fetchall()]
+    column_list = ', '.join(quote_name(column) for column in columns)
+    if spec.parent is None:
+        cursor.execute(f"INSERT INTO {quote_name(table)} ({column_list}) "
+                       f"SELECT {column_list} FROM {quote_name(legacy)}")
+    else:
+        # Il timestamp dei figli diventa quello del padre (stessa partizione mensile)
+        parent_table, fk_column = spec.parent
+        select_list = ', '.join(
+            f"p.{key}" if column == PARTITION_KEY else f"d.{quote_name(column)}" for column in columns
+        )
+        cursor.execute(f"INSERT INTO {quote_name(table)} ({column_list}) SELECT {select_list} "
+                       f"FROM {quote_name(legacy)} d JOIN {quote_name(parent_table)} p "
+                       f"ON p.id = d.{quote_name(fk_column)}")
+    logger.info(f"Copiate {cursor.rowcount} righe in {table}")
+    cursor.execute(f"SELECT setval('{quote_name(sequence)}', COALESCE(MAX(id), 0) + 1, false) "
+                   f"FROM {quote_name(table)}")
+
+    # Chiave primaria e vincoli UNIQUE includono la chiave di partizione
+    cursor.execute(f"ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(table + '_pkey')} "
+                   f"PRIMARY KEY (id, {key})")
+    for constraint, kind, definition in constraints:
+        if kind != 'u':
+            continue
+        columns = [column.strip() for column in _UNIQUE_COLUMNS_RE.search(definition).group(1).split(',')]
+        if PARTITION_KEY not in [column.strip('"') for column in columns]:
+            columns.append(key)
+        cursor.execute(f"ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(constraint)} "
+                       f"UNIQUE ({', '.join(columns)})")
+    for _, definition in indexes:
+        cursor.execute(definition)
+    for constraint, kind, definition in constraints:
+        if kind != 'f' or (spec.parent and f"({spec.parent[1]})" in definition.split('REFERENCES')[0]):
+            continue
+        cursor.execute(f"ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(constraint)} {definition}")
+    if spec.parent is not None:
+        parent_table, fk_column = spec.parent
+        cursor.execute(
+            f"ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(f'{table}_{fk_column}_fk')} "
+            f"FOREIGN KEY ({quote_name(fk_column)}, {key}) REFERENCES {quote_name(parent_table)} (id, {key}) "
+            f"DEFERRABLE INITIALLY DEFERRED"
+        )
+    cursor.execute(f"ANALYZE {quote_name(table)}")
+    return legacy
+
+
+def convert_tables(cursor, tables: Sequence[PartitionedTable], premake_months: int = DEFAULT_PREMAKE_MONTHS,
+                   keep_legacy: bool = False, now: Optional[datetime] = None) -> List[str]:
+    """Converte le tabelle (padri prima dei figli); restituisce quelle convertite"""
+    converted = []
+    legacy_tables = []
+    for spec in tables:
+        legacy = convert_table(cursor, spec, premake_months, now)
+        if legacy is not None:
+            converted.append(spec.table)
+            legacy_tables.append(legacy)
+    if not keep_legacy:
+        for legacy in reversed(legacy_tables):
+            cursor.execute(f"DROP TABLE {quote_name(legacy)}")
+    return converted
+
+
+def convert_measurement_tables(apps, schema_editor):
+    """Operazione per migrations.RunPython: converte le tabelle delle misurazioni"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        convert_tables(cursor, partitioned_tables())
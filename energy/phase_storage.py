@@ -0,0 +1,97 @@
+# energy/phase_storage.py
+"""
+Modalità di salvataggio dei dettagli di fase delle misurazioni.
+
+- 'rows': una riga DeviceMeasurementDetail per fase (comportamento storico);
+- 'packed': i valori per fase sono compattati in DeviceMeasurement.phase_data,
+  nella riga della misurazione. Per un trifase si scrive una riga invece di
+  quattro e spariscono le voci dei tre indici di DeviceMeasurementDetail.
+
+La lettura è indipendente dalla modalità tramite DeviceMeasurement.phases.
+`pack_existing_details` (comando pack_phase_details) converte le righe
+esistenti a blocchi: ogni blocco compatta i dettagli nelle misurazioni e
+cancella le righe nella stessa transazione, quindi è interrompibile e
+riprende da dove si è fermato.
+"""
+import logging
+from dataclasses import dataclass
+from itertools import groupby
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import DeviceMeasurement, DeviceMeasurementDetail
+from .models.device import pack_phase_details
+
+logger = logging.getLogger('energy.phase_storage')
+
+PHASE_STORAGE_ROWS = 'rows'
+PHASE_STORAGE_PACKED = 'packed'
+PHASE_STORAGE_MODES = (PHASE_STORAGE_ROWS, PHASE_STORAGE_PACKED)
+DEFAULT_PACK_BATCH_SIZE = 1000
+
+
+def get_phase_storage() -> str:
+    """Modalità configurata in MQTT_SETTINGS['PHASE_STORAGE']"""
+    mode = getattr(settings, 'MQTT_SETTINGS', {}).get('PHASE_STORAGE', PHASE_STORAGE_ROWS)
+    if mode not in PHASE_STORAGE_MODES:
+        raise ValueError(f"PHASE_STORAGE non valido: {mode!r} (ammessi: {', '.join(PHASE_STORAGE_MODES)})")
+    return mode
+
+
+@dataclass
+class PackReport:
+    """Esito della conversione dei dettagli di fase"""
+    measurements: int = 0
+    details: int = 0
+    dry_run: bool = False
+
+
+def pack_existing_details(batch_size: int = DEFAULT_PACK_BATCH_SIZE, max_batches: Optional[int] = None,
+                          dry_run: bool = False) -> PackReport:
+    """
+    Compatta in phase_data le righe DeviceMeasurementDetail esistenti e le
+    cancella, `batch_size` misurazioni per transazione. Con `dry_run`
+    conta soltanto misurazioni e righe da convertire.
+    """
+    details = DeviceMeasurementDetail.objects.all()
+    if dry_run:
+        return PackReport(
+            measurements=details.values('measurement_id').distinct().count(),
+            details=details.count(),
+            dry_run=True
+        )
+
+    report = PackReport()
+    last_id = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = list(
+            details.filter(measurement_id__gt=last_id)
+            .order_by('measurement_id')
+            .values_list('measurement_id', flat=True)
+            .distinct()[:batch_size]
+        )
+        if not ids:
+            break
+
+        with transaction.atomic():
+            rows = list(details.filter(measurement_id__in=ids).order_by('measurement_id', 'phase'))
+            grouped = {
+                measurement_id: list(group)
+                for measurement_id, group in groupby(rows, key=lambda detail: detail.measurement_id)
+            }
+            measurements = list(DeviceMeasurement.objects.filter(pk__in=ids).only('pk', 'timestamp'))
+            for measurement in measurements:
+                measurement.phase_data = pack_phase_details(grouped.get(measurement.pk))
+            DeviceMeasurement.objects.bulk_update(measurements, ['phase_data'])
+            deleted, _ = details.filter(measurement_id__in=ids).delete()
+
+        report.measurements += len(measurements)
+        report.details += deleted
+        last_id = ids[-1]
+        batches += 1
+        logger.info(f"Compattati i dettagli di {len(measurements)} misurazioni (fino all'id {last_id})")
+
+    return report
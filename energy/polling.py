@@ -0,0 +1,190 @@
+# energy/polling.py
+import asyncio
+import heapq
+import logging
+import random
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .mqtt.stats import publish_stats
+
+logger = logging.getLogger('energy.polling')
+
+STATS_PUBLISH_INTERVAL = 10  # secondi
+
+
+def device_base_topic(device) -> str:
+    """Topic base del dispositivo, lo stesso di DeviceConfiguration.get_mqtt_topics"""
+    if device.mqtt_topic_template:
+        return device.mqtt_topic_template.rstrip('/')
+    return f"{device.vendor.replace('_', '')}/{device.plant.pod_code}/{device.device_id}"
+
+
+class PollSchedule:
+    """Stato di pianificazione di un dispositivo"""
+    __slots__ = ('target', 'next_due', 'failures', 'running')
+
+    def __init__(self, target, next_due: float):
+        self.target = target
+        self.next_due = next_due
+        self.failures = 0
+        self.running = False
+
+
+class PollingCollector:
+    """
+    Base dei collector asincroni in polling (Modbus-TCP, RPC HTTP Shelly).
+
+    Ogni dispositivo ha la propria pianificazione (`poll_interval` del
+    target, con partenza sfalsata per non leggere tutti i dispositivi nello
+    stesso istante); un poll non riparte finché il precedente non è
+    terminato e dopo errori consecutivi l'intervallo raddoppia fino a
+    `max_backoff`. `max_concurrent_polls` limita i poll in corso in totale.
+
+    Le sottoclassi creano la pianificazione di un target (`build_schedule`),
+    eseguono il poll (`poll`, che solleva `transport_errors` per gli errori
+    di comunicazione attesi) e chiudono le connessioni (`close_transports`).
+    """
+
+    # Nome del componente per publish_stats
+    stats_component = 'polling'
+    # Errori di comunicazione registrati come warning, senza traceback
+    transport_errors: Tuple[type, ...] = ()
+    # Logger delle sottoclassi (es. energy.modbus)
+    log = logger
+
+    def __init__(self, targets: Iterable[Any], max_concurrent_polls: int, max_backoff: float):
+        self.max_concurrent_polls = max_concurrent_polls
+        self.max_backoff = max_backoff
+        self._schedules: Dict[str, PollSchedule] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stats = {
+            'polls': 0,
+            'errors': 0,
+            'invalid': 0,
+            'emitted': 0,
+            'skipped': 0,
+        }
+        self.update_targets(targets)
+
+    def build_schedule(self, target, next_due: float) -> Optional[PollSchedule]:
+        """Pianificazione di un nuovo target; None se il dispositivo non è supportato"""
+        return PollSchedule(target, next_due)
+
+    async def poll(self, schedule: PollSchedule) -> Any:
+        """Esegue il poll del dispositivo; None se la lettura non è valida"""
+        raise NotImplementedError
+
+    async def close_transports(self) -> None:
+        """Chiude le connessioni aperte"""
+
+    def update_targets(self, targets: Iterable[Any]) -> None:
+        """Aggiorna i dispositivi da leggere mantenendo la pianificazione di quelli invariati"""
+        now = time.monotonic()
+        schedules = {}
+        for target in targets:
+            current = self._schedules.get(target.device_id)
+            if current is not None and current.target == target:
+                schedules[target.device_id] = current
+                continue
+            schedule = self.build_schedule(target, now + random.uniform(0, target.poll_interval))
+            if schedule is not None:
+                schedules[target.device_id] = schedule
+        self._schedules = schedules
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def poll_device(self, device_id: str) -> Any:
+        """Legge un dispositivo; None se la lettura fallisce o non è valida"""
+        schedule = self._schedules.get(device_id)
+        if schedule is None:
+            return None
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_polls)
+        schedule.running = True
+        try:
+            async with self._semaphore:
+                result = await self.poll(schedule)
+        except self.transport_errors as e:
+            self._stats['errors'] += 1
+            schedule.failures += 1
+            self.log.warning(f"Poll {self.stats_component} fallito per {device_id}: {e}")
+            return None
+        except Exception as e:
+            self._stats['errors'] += 1
+            schedule.failures += 1
+            self.log.error(f"Errore nel poll {self.stats_component} di {device_id}: {e}", exc_info=True)
+            return None
+        finally:
+            schedule.running = False
+            self._stats['polls'] += 1
+
+        schedule.failures = 0
+        if result is None:
+            self._stats['invalid'] += 1
+        return result
+
+    async def poll_all(self) -> Dict[str, Any]:
+        """Legge una volta tutti i dispositivi, in parallelo"""
+        device_ids = list(self._schedules)
+        results = await asyncio.gather(*(self.poll_device(device_id) for device_id in device_ids))
+        return dict(zip(device_ids, results))
+
+    def _reschedule(self, schedule: PollSchedule, now: float) -> None:
+        interval = schedule.target.poll_interval
+        if schedule.failures:
+            interval = min(interval * 2 ** schedule.failures, max(self.max_backoff, interval))
+        # Mantiene la fase del dispositivo se il poll non è in ritardo
+        schedule.next_due = max(schedule.next_due + interval, now)
+
+    async def run(self, stop_event: asyncio.Event) -> None:
+        """Esegue i poll pianificati finché `stop_event` non viene impostato"""
+        self._wakeup = asyncio.Event()
+        last_stats = time.monotonic()
+        try:
+            while not stop_event.is_set():
+                now = time.monotonic()
+                queue = [(schedule.next_due, device_id) for device_id, schedule in self._schedules.items()]
+                heapq.heapify(queue)
+                while queue and queue[0][0] <= now:
+                    _, device_id = heapq.heappop(queue)
+                    schedule = self._schedules[device_id]
+                    if schedule.running:
+                        # Poll precedente ancora in corso (dispositivo lento): salta il turno
+                        self._stats['skipped'] += 1
+                    else:
+                        task = asyncio.ensure_future(self.poll_device(device_id))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                    self._reschedule(schedule, now)
+
+                if now - last_stats >= STATS_PUBLISH_INTERVAL:
+                    publish_stats(self.stats_component, self.get_stats())
+                    last_stats = now
+
+                next_due = min((s.next_due for s in self._schedules.values()), default=now + 1.0)
+                self._wakeup.clear()
+                waiters = [asyncio.ensure_future(stop_event.wait()), asyncio.ensure_future(self._wakeup.wait())]
+                await asyncio.wait(waiters, timeout=max(0.0, min(next_due - time.monotonic(), 1.0)),
+                                   return_when=asyncio.FIRST_COMPLETED)
+                for waiter in waiters:
+                    waiter.cancel()
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        """Attende i poll in corso e chiude le connessioni"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.close_transports()
+        self._semaphore = None
+        publish_stats(self.stats_component, self.get_stats())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Restituisce le metriche del collector"""
+        stats = dict(self._stats)
+        stats['devices'] = len(self._schedules)
+        stats['backoff'] = sum(1 for schedule in self._schedules.values() if schedule.failures)
+        return stats
@@ -0,0 +1,434 @@
+# energy/retention.py
+"""
+Retention a livelli delle misurazioni.
+
+- misurazioni grezze (DeviceMeasurement e tabelle collegate) per RAW_DAYS giorni;
+- rollup a 1 minuto (min/media/max) per ROLLUP_1M_DAYS giorni;
+- rollup a 15 minuti, conservati a tempo indeterminato.
+
+I rollup sono calcolati in SQL (INSERT ... SELECT ... GROUP BY) per blocchi
+di CHUNK_HOURS ore; ogni blocco è una transazione che aggiorna anche il
+checkpoint della risoluzione, così un'esecuzione interrotta riparte dal
+primo blocco non completato. L'inserimento è un upsert sul vincolo unico
+del rollup: ricalcolare un intervallo dà lo stesso risultato. Le righe di
+un livello vengono cancellate solo se oltre la retention e già aggregate
+nel livello successivo.
+
+Le letture per i grafici (`read_measurements`) scelgono il livello in base
+all'intervallo richiesto e completano con i livelli più fini la parte non
+ancora aggregata.
+"""
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, NotSupportedError, connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import DeviceMeasurement, MeasurementRollup, RollupCheckpoint
+from .partitioning import partitioned_tables, quote_name
+
+logger = logging.getLogger('energy.retention')
+
+RAW = 'RAW'
+DEFAULT_RAW_DAYS = 30
+DEFAULT_ROLLUP_1M_DAYS = 180
+DEFAULT_CHUNK_HOURS = 6
+# Ritardo prima di aggregare un intervallo, per le misurazioni in arrivo
+DEFAULT_SETTLE_MINUTES = 5
+# Intervalli massimi letti dai grafici sulle grezze e sui rollup a 1 minuto
+DEFAULT_RAW_MAX_SPAN_HOURS = 48
+DEFAULT_ROLLUP_1M_MAX_SPAN_DAYS = 7
+
+
+@dataclass(frozen=True)
+class RollupTier:
+    """Livello di rollup e livello da cui viene calcolato"""
+    resolution: str
+    seconds: int
+    source: str
+
+
+ROLLUP_TIERS = (
+    RollupTier(MeasurementRollup.RESOLUTION_1M, 60, RAW),
+    RollupTier(MeasurementRollup.RESOLUTION_15M, 900, MeasurementRollup.RESOLUTION_1M),
+)
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """Durate dei livelli (0 giorni = nessuna scadenza)"""
+    raw_days: int = DEFAULT_RAW_DAYS
+    rollup_1m_days: int = DEFAULT_ROLLUP_1M_DAYS
+    chunk_hours: int = DEFAULT_CHUNK_HOURS
+    settle_minutes: int = DEFAULT_SETTLE_MINUTES
+    raw_max_span_hours: int = DEFAULT_RAW_MAX_SPAN_HOURS
+    rollup_1m_max_span_days: int = DEFAULT_ROLLUP_1M_MAX_SPAN_DAYS
+
+    @classmethod
+    def from_settings(cls) -> 'RetentionPolicy':
+        retention_settings = getattr(settings, 'MEASUREMENT_RETENTION_SETTINGS', {})
+        return cls(
+            raw_days=retention_settings.get(
+                'RAW_DAYS', getattr(settings, 'MQTT_DATA_RETENTION_DAYS', DEFAULT_RAW_DAYS)),
+            rollup_1m_days=retention_settings.get('ROLLUP_1M_DAYS', DEFAULT_ROLLUP_1M_DAYS),
+            chunk_hours=retention_settings.get('CHUNK_HOURS', DEFAULT_CHUNK_HOURS),
+            settle_minutes=retention_settings.get('SETTLE_MINUTES', DEFAULT_SETTLE_MINUTES),
+            raw_max_span_hours=retention_settings.get('RAW_MAX_SPAN_HOURS', DEFAULT_RAW_MAX_SPAN_HOURS),
+            rollup_1m_max_span_days=retention_settings.get(
+                'ROLLUP_1M_MAX_SPAN_DAYS', DEFAULT_ROLLUP_1M_MAX_SPAN_DAYS),
+        )
+
+    def retention_days(self, level: str) -> int:
+        """Giorni di conservazione del livello (grezze o rollup)"""
+        if level == RAW:
+            return self.raw_days
+        if level == MeasurementRollup.RESOLUTION_1M:
+            return self.rollup_1m_days
+        return 0
+
+
+@dataclass
+class ExpiredRows:
+    """Righe (e byte stimati) di una tabella oltre la retention"""
+    table: str
+    rows: int = 0
+    bytes: Optional[int] = None
+
+
+@dataclass
+class RetentionReport:
+    """Esito di un'esecuzione: righe aggregate per risoluzione e righe scadute"""
+    rollups: Dict[str, int] = field(default_factory=dict)
+    expired: List[ExpiredRows] = field(default_factory=list)
+    cutoffs: Dict[str, datetime] = field(default_factory=dict)
+    dry_run: bool = False
+
+
+def floor_time(value: datetime, seconds: int) -> datetime:
+    """Inizio (UTC) dell'intervallo di `seconds` secondi che contiene `value`"""
+    epoch = int(value.timestamp()) // seconds * seconds
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+def bucket_sql(column: str, seconds: int) -> str:
+    """Espressione SQL dell'inizio dell'intervallo che contiene `column`"""
+    if connection.vendor == 'postgresql':
+        return f"to_timestamp(floor(extract(epoch FROM {column}) / {seconds}) * {seconds})"
+    if connection.vendor == 'sqlite':
+        return f"datetime((CAST(strftime('%%s', {column}) AS INTEGER) / {seconds}) * {seconds}, 'unixepoch')"
+    raise NotSupportedError(f"Rollup delle misurazioni non supportati su {connection.vendor}")
+
+
+def _rollup_table() -> str:
+    return quote_name(MeasurementRollup._meta.db_table)
+
+
+def _raw_table() -> str:
+    return quote_name(DeviceMeasurement._meta.db_table)
+
+
+_ROLLUP_COLUMNS = ('device_id', 'plant_id', 'measurement_type', 'resolution', 'bucket_start', 'sample_count',
+                   'power_min', 'power_avg', 'power_max', 'voltage_avg', 'current_avg', 'energy_total')
+_CONFLICT_COLUMNS = ('device_id', 'measurement_type', 'resolution', 'bucket_start')
+
+
+def rollup_sql(tier: RollupTier) -> str:
+    """
+    INSERT ... SELECT del livello `tier` per l'intervallo [%s, %s).
+
+    Le medie dai rollup sono pesate sul numero di campioni; l'energia delle
+    misurazioni ENERGY (delta) si somma, per gli altri tipi resta l'ultimo
+    totale (il massimo del contatore).
+    """
+    energy = ("CASE WHEN measurement_type = 'ENERGY' THEN SUM({col}) ELSE MAX({col}) END")
+    if tier.source == RAW:
+        timestamp = quote_name('timestamp')
+        bucket = bucket_sql(timestamp, tier.seconds)
+        select = (f"SELECT device_id, MAX(plant_id), measurement_type, '{tier.resolution}', {bucket}, COUNT(*), "
+                  f"MIN(power), AVG(power), MAX(power), AVG(voltage), AVG({quote_name('current')}), "
+                  f"{energy.format(col='energy_total')} "
+                  f"FROM {_raw_table()} WHERE {timestamp} >= %s AND {timestamp} < %s")
+    else:
+        bucket = bucket_sql('bucket_start', tier.seconds)
+        select = (f"SELECT device_id, MAX(plant_id), measurement_type, '{tier.resolution}', {bucket}, "
+                  f"SUM(sample_count), MIN(power_min), SUM(power_avg * sample_count) / SUM(sample_count), "
+                  f"MAX(power_max), SUM(voltage_avg * sample_count) / SUM(sample_count), "
+                  f"SUM(current_avg * sample_count) / SUM(sample_count), {energy.format(col='energy_total')} "
+                  f"FROM {_rollup_table()} WHERE resolution = '{tier.source}' "
+                  f"AND bucket_start >= %s AND bucket_start < %s")
+    updates = ', '.join(f"{column} = excluded.{column}" for column in _ROLLUP_COLUMNS
+                        if column not in _CONFLICT_COLUMNS)
+    return (f"INSERT INTO {_rollup_table()} ({', '.join(_ROLLUP_COLUMNS)}) {select} "
+            f"GROUP BY device_id, measurement_type, {bucket} "
+            f"ON CONFLICT ({', '.join(_CONFLICT_COLUMNS)}) DO UPDATE SET {updates}")
+
+
+def _db_value(value: datetime):
+    return connection.ops.adapt_datetimefield_value(value)
+
+
+def _chunks(start: datetime, end: datetime, step: timedelta) -> Iterator[Tuple[datetime, datetime]]:
+    while start < end:
+        chunk_end = min(start + step, end)
+        yield start, chunk_end
+        start = chunk_end
+
+
+def get_checkpoints() -> Dict[str, datetime]:
+    """Fine degli intervalli già aggregati, per risoluzione"""
+    return dict(RollupCheckpoint.objects.values_list('resolution', 'processed_until'))
+
+
+def _source_start(tier: RollupTier) -> Optional[datetime]:
+    if tier.source == RAW:
+        return DeviceMeasurement.objects.aggregate(start=Min('timestamp'))['start']
+    return MeasurementRollup.objects.filter(resolution=tier.source).aggregate(start=Min('bucket_start'))['start']
+
+
+def rollup_tier(tier: RollupTier, policy: RetentionPolicy, now: Optional[datetime] = None,
+                max_chunks: Optional[int] = None) -> int:
+    """
+    Aggrega il livello `tier` dal checkpoint fino all'ultimo intervallo
+    chiuso della sorgente. Restituisce le righe di rollup scritte.
+    """
+    now = now or timezone.now()
+    checkpoints = get_checkpoints()
+    if tier.source == RAW:
+        limit = floor_time(now - timedelta(minutes=policy.settle_minutes), tier.seconds)
+    elif tier.source in checkpoints:
+        limit = floor_time(checkpoints[tier.source], tier.seconds)
+    else:
+        return 0
+
+    start = checkpoints.get(tier.resolution)
+    if start is None:
+        start = _source_start(tier)
+        if start is None:
+            return 0
+        start = floor_time(start, tier.seconds)
+
+    sql = rollup_sql(tier)
+    written = 0
+    for count, (chunk_start, chunk_end) in enumerate(_chunks(start, limit, timedelta(hours=policy.chunk_hours))):
+        if max_chunks is not None and count >= max_chunks:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, [_db_value(chunk_start), _db_value(chunk_end)])
+            written += max(cursor.rowcount, 0)
+            RollupCheckpoint.objects.update_or_create(
+                resolution=tier.resolution, defaults={'processed_until': chunk_end})
+        logger.debug(f"Rollup {tier.resolution} {chunk_start:%Y-%m-%d %H:%M} - {chunk_end:%Y-%m-%d %H:%M}")
+    return written
+
+
+def expiry_cutoffs(policy: RetentionPolicy, now: Optional[datetime] = None,
+                   checkpoints: Optional[Dict[str, datetime]] = None) -> Dict[str, datetime]:
+    """
+    Limite (escluso) delle righe cancellabili per livello: oltre la
+    retention e già coperte dal rollup successivo (`checkpoints`; None
+    assume i rollup aggiornati, come dopo un'esecuzione completa).
+    """
+    now = now or timezone.now()
+    cutoffs = {}
+    for level, tier in ((RAW, ROLLUP_TIERS[0]), (MeasurementRollup.RESOLUTION_1M, ROLLUP_TIERS[1])):
+        days = policy.retention_days(level)
+        if not days:
+            continue
+        cutoff = floor_time(now - timedelta(days=days), tier.seconds)
+        if checkpoints is not None:
+            if tier.resolution not in checkpoints:
+                continue
+            cutoff = min(cutoff, checkpoints[tier.resolution])
+        cutoffs[level] = cutoff
+    return cutoffs
+
+
+def _expiry_statements(level: str) -> List[Tuple[str, str]]:
+    """(tabella, DELETE) per le righe del livello in [%s, %s), i figli prima"""
+    if level != RAW:
+        return [(MeasurementRollup._meta.db_table,
+                 f"FROM {_rollup_table()} WHERE resolution = '{level}' AND bucket_start >= %s AND bucket_start < %s")]
+
+    measurement, detail = partitioned_tables()
+    timestamp = quote_name('timestamp')
+    ids = f"SELECT id FROM {quote_name(measurement.table)} WHERE {timestamp} >= %s AND {timestamp} < %s"
+    statements = [
+        (table, f"FROM {quote_name(table)} WHERE {quote_name(column)} IN ({ids})")
+        for table, column in measurement.cascades
+    ]
+    statements.append((detail.table, f"FROM {quote_name(detail.table)} WHERE {quote_name(detail.parent[1])} IN ({ids})"))
+    statements.append((measurement.table, f"FROM {quote_name(measurement.table)} WHERE {timestamp} >= %s AND {timestamp} < %s"))
+    return statements
+
+
+def _level_start(level: str, cutoff: datetime) -> Optional[datetime]:
+    if level == RAW:
+        queryset = DeviceMeasurement.objects.filter(timestamp__lt=cutoff)
+        return queryset.aggregate(start=Min('timestamp'))['start']
+    queryset = MeasurementRollup.objects.filter(resolution=level, bucket_start__lt=cutoff)
+    return queryset.aggregate(start=Min('bucket_start'))['start']
+
+
+def table_size(cursor, table: str) -> Optional[Tuple[int, int]]:
+    """(byte, righe) della tabella con indici e partizioni, se disponibili"""
+    try:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT COALESCE(SUM(pg_total_relation_size(t.relid)), 0), "
+                           "COALESCE(SUM(GREATEST(c.reltuples, 0)) FILTER (WHERE t.isleaf), 0) "
+                           "FROM pg_partition_tree(%s::regclass) t JOIN pg_class c ON c.oid = t.relid",
+                           [quote_name(table)])
+            size, rows = cursor.fetchone()
+            if rows:
+                return int(size), int(rows)
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = %s OR name IN "
+                           "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s)",
+                           [table, table])
+            size = cursor.fetchone()[0]
+        else:
+            return None
+    except DatabaseError as e:
+        logger.debug(f"Dimensione di {table} non disponibile: {e}")
+        return None
+    cursor.execute(f"SELECT COUNT(*) FROM {quote_name(table)}")
+    return int(size), cursor.fetchone()[0]
+
+
+def estimate_expiry(policy: RetentionPolicy, now: Optional[datetime] = None) -> RetentionReport:
+    """
+    Righe e byte che la retention libererebbe con i rollup aggiornati. I
+    byte sono stimati dalla dimensione media delle righe (indici inclusi);
+    su PostgreSQL lo spazio torna disponibile dopo il VACUUM.
+    """
+    report = RetentionReport(cutoffs=expiry_cutoffs(policy, now), dry_run=True)
+    with connection.cursor() as cursor:
+        for level, cutoff in report.cutoffs.items():
+            start = _level_start(level, cutoff)
+            for table, statement in _expiry_statements(level):
+                expired = ExpiredRows(table)
+                if start is not None:
+                    cursor.execute(f"SELECT COUNT(*) {statement}", [_db_value(start), _db_value(cutoff)])
+                    expired.rows = cursor.fetchone()[0]
+                size = table_size(cursor, table)
+                if size is not None:
+                    total_bytes, total_rows = size
+                    expired.bytes = round(total_bytes * expired.rows / total_rows) if total_rows else 0
+                report.expired.append(expired)
+    return report
+
+
+def expire_level(level: str, cutoff: datetime, policy: RetentionPolicy,
+                 max_chunks: Optional[int] = None) -> List[ExpiredRows]:
+    """Cancella per blocchi di tempo le righe del livello precedenti a `cutoff`"""
+    statements = _expiry_statements(level)
+    expired = {table: ExpiredRows(table) for table, _ in statements}
+    start = _level_start(level, cutoff)
+    if start is None:
+        return list(expired.values())
+
+    step = timedelta(hours=policy.chunk_hours)
+    for count, (chunk_start, chunk_end) in enumerate(_chunks(floor_time(start, 60), cutoff, step)):
+        if max_chunks is not None and count >= max_chunks:
+            break
+        params = [_db_value(chunk_start), _db_value(chunk_end)]
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table, statement in statements:
+                cursor.execute(f"DELETE {statement}", params)
+                expired[table].rows += max(cursor.rowcount, 0)
+    return list(expired.values())
+
+
+def apply_retention(policy: Optional[RetentionPolicy] = None, now: Optional[datetime] = None,
+                    dry_run: bool = False, max_chunks: Optional[int] = None) -> RetentionReport:
+    """
+    Aggiorna i rollup e cancella le righe scadute. Con `dry_run` non
+    modifica nulla e stima righe e byte liberabili.
+    """
+    policy = policy or RetentionPolicy.from_settings()
+    now = now or timezone.now()
+    if dry_run:
+        return estimate_expiry(policy, now)
+
+    report = RetentionReport()
+    for tier in ROLLUP_TIERS:
+        report.rollups[tier.resolution] = rollup_tier(tier, policy, now, max_chunks)
+    report.cutoffs = expiry_cutoffs(policy, now, get_checkpoints())
+    for level, cutoff in report.cutoffs.items():
+        report.expired.extend(expire_level(level, cutoff, policy, max_chunks))
+    logger.info(f"Retention misurazioni: rollup {report.rollups}, "
+                f"righe cancellate {sum(item.rows for item in report.expired)}")
+    return report
+
+
+class SeriesPoint(NamedTuple):
+    """Punto di una serie per i grafici (misurazione grezza o rollup)"""
+    device_id: int
+    timestamp: datetime
+    power: float
+    voltage: float
+    current: float
+    energy_total: float
+    quality: Optional[str]
+    resolution: str
+
+
+def select_resolution(start: datetime, end: Optional[datetime] = None, now: Optional[datetime] = None,
+                      policy: Optional[RetentionPolicy] = None) -> str:
+    """Livello più fine adatto all'intervallo e ancora disponibile dal suo inizio"""
+    policy = policy or RetentionPolicy.from_settings()
+    now = now or timezone.now()
+    span = (end or now) - start
+    if span <= timedelta(hours=policy.raw_max_span_hours) and (
+            not policy.raw_days or start >= now - timedelta(days=policy.raw_days)):
+        return RAW
+    if span <= timedelta(days=policy.rollup_1m_max_span_days) and (
+            not policy.rollup_1m_days or start >= now - timedelta(days=policy.rollup_1m_days)):
+        return MeasurementRollup.RESOLUTION_1M
+    return MeasurementRollup.RESOLUTION_15M
+
+
+def read_measurements(start: datetime, end: Optional[datetime] = None, now: Optional[datetime] = None,
+                      policy: Optional[RetentionPolicy] = None, **filters) -> List[SeriesPoint]:
+    """
+    Punti dell'intervallo [start, end) in ordine di tempo, dal livello
+    scelto da `select_resolution`; la parte successiva al checkpoint del
+    livello si legge dal livello più fine. `filters` (es. device=...,
+    plant__owner=...) valgono sia per le misurazioni sia per i rollup.
+    """
+    resolution = select_resolution(start, end, now, policy)
+    levels = [tier.resolution for tier in reversed(ROLLUP_TIERS)] + [RAW]
+    levels = levels[levels.index(resolution):]
+    checkpoints = get_checkpoints() if resolution != RAW else {}
+
+    points: List[SeriesPoint] = []
+    position = start
+    for level in levels:
+        if level == RAW:
+            queryset = DeviceMeasurement.objects.filter(timestamp__gte=position, **filters)
+            if end is not None:
+                queryset = queryset.filter(timestamp__lt=end)
+            points.extend(
+                SeriesPoint(*row, RAW) for row in queryset.order_by('timestamp').values_list(
+                    'device_id', 'timestamp', 'power', 'voltage', 'current', 'energy_total', 'quality')
+            )
+            break
+        until = checkpoints.get(level)
+        if until is None or until <= position:
+            continue
+        if end is not None:
+            until = min(until, end)
+        queryset = MeasurementRollup.objects.filter(
+            resolution=level, bucket_start__gte=position, bucket_start__lt=until, **filters)
+        points.extend(
+            SeriesPoint(device_id, bucket_start, power, voltage, current, energy, None, level)
+            for device_id, bucket_start, power, voltage, current, energy in queryset.order_by('bucket_start').values_list(
+                'device_id', 'bucket_start', 'power_avg', 'voltage_avg', 'current_avg', 'energy_total')
+        )
+        position = until
+        if end is not None and position >= end:
+            break
+    return points
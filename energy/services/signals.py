@@ -43,8 +43,8 @@ def check_mqtt_status():
     client = get_mqtt_client()
     if client.is_connected:
         #logger.info("MQTT Status: Connected")
-        logger.info(f"Active topics: {len(client._subscribed_topics)}")
-        for topic in client._subscribed_topics:
+        logger.info(f"Active topics: {len(client.subscribed_topics)}")
+        for topic in client.subscribed_topics:
             logger.debug(f"Subscribed topic: {topic}")
     else:
         logger.warning("MQTT Status: Disconnected")
@@ -127,27 +127,19 @@ def handle_new_measurement(sender, instance, created, **kwargs):
             threading.Thread(target=init_mqtt_connection, daemon=True).start()
             
 @receiver(post_save, sender=DeviceConfiguration)
-def handle_device_configuration(sender, instance, created, **kwargs):
-    """Gestisce modifiche alle configurazioni dei dispositivi"""
+def handle_device_configuration(sender, instance, created, update_fields=None, **kwargs):
+    """Aggiorna le sottoscrizioni del solo dispositivo modificato"""
     try:
-        action = "created" if created else "updated"
-        #logger.info(f"Device {instance.device_id} {action}")
-        
-        client = get_mqtt_client()
-        if client and client.is_connected:
-            active_devices = DeviceConfiguration.objects.filter(is_active=True)
-            active_topics = []
-            
-            for device in active_devices:
-                device_topics = device.get_mqtt_topics()
-                active_topics.extend(device_topics)
-            
-            logger.info(f"Refreshing MQTT subscriptions - {len(active_topics)} active topics")
-            
-            # Aggiorna sottoscrizioni
-            client.refresh_subscriptions()
-            check_mqtt_status()
-                
+        # Gli aggiornamenti di last_seen non cambiano i topic
+        if update_fields and set(update_fields) <= {'last_seen', 'updated_at'}:
+            return
+        action = "creato" if created else "aggiornato"
+        logger.info(f"Dispositivo {action}: {instance.device_id}")
+
+        # Le modifiche ravvicinate (es. import massivo) vengono raggruppate
+        # in un'unica sincronizzazione con il broker
+        get_mqtt_client().update_device(instance)
+
     except Exception as e:
         logger.error(f"Error handling device configuration: {str(e)}")
 
@@ -169,71 +161,33 @@ def on_post_migrate(sender, **kwargs):
         init_mqtt_client(sender)
 
 
-@receiver(post_save, sender=DeviceConfiguration)
-def handle_device_created(sender, instance, created, **kwargs):
-    """Handler per la creazione/modifica di un dispositivo"""
-    try:
-        if created:
-            logger.info(f"Nuovo dispositivo creato: {instance.device_id}")
-        else:
-            logger.info(f"Dispositivo aggiornato: {instance.device_id}")
-            
-        client = get_mqtt_client()
-        if client and client.is_connected:
-            # Ottieni tutti i topic attivi
-            active_devices = DeviceConfiguration.objects.filter(is_active=True)
-            active_topics = []
-            
-            for device in active_devices:
-                device_topics = device.get_mqtt_topics()
-                active_topics.extend(device_topics)
-            
-            logger.info(f"Topics attivi: {active_topics}")
-            
-            # Annulla tutte le sottoscrizioni esistenti
-            client.unsubscribe('#')
-            
-            # Sottoscrivi i nuovi topics
-            for topic in active_topics:
-                logger.info(f"Sottoscrizione a: {topic}")
-                client.subscribe(topic)
-                
-            if not active_topics:
-                # Se non ci sono topic specifici, usa il wildcard
-                default_topic = "cercollettiva/+/+/value"
-                logger.info(f"Nessun topic specifico, sottoscrizione a: {default_topic}")
-                client.subscribe(default_topic)
-                
-    except Exception as e:
-        logger.error(f"Errore nell'aggiornamento delle sottoscrizioni MQTT: {str(e)}")
-
 @receiver(post_delete, sender=DeviceConfiguration)
 def handle_device_deleted(sender, instance, **kwargs):
     """Handler per l'eliminazione di un dispositivo"""
     try:
         logger.info(f"Dispositivo eliminato: {instance.device_id}")
-        
-        client = get_mqtt_client()
-        if client and client.is_connected:
-            # Se il dispositivo aveva dei topic specifici, annullane la sottoscrizione
-            device_topics = instance.get_mqtt_topics()
-            for topic in device_topics:
-                logger.info(f"Annullamento sottoscrizione a: {topic}")
-                client.unsubscribe(topic)
-            
-            # Aggiorna la lista completa dei topic
-            active_devices = DeviceConfiguration.objects.filter(is_active=True)
-            active_topics = []
-            
-            for device in active_devices:
-                device_topics = device.get_mqtt_topics()
-                active_topics.extend(device_topics)
-                
-            if not active_topics:
-                # Se non ci sono più dispositivi attivi, torna al wildcard
-                default_topic = "cercollettiva/+/+/value"
-                logger.info(f"Nessun topic attivo, sottoscrizione a: {default_topic}")
-                client.subscribe(default_topic)
-                
+        get_mqtt_client().remove_device(instance.device_id)
+
+    except Exception as e:
+        logger.error(f"Errore nella rimozione delle sottoscrizioni MQTT: {str(e)}")
+
+@receiver(post_save, sender=DeviceConfiguration, dispatch_uid='energy_routing_index_save')
+def update_routing_index(sender, instance, created, update_fields=None, **kwargs):
+    """Aggiorna in modo incrementale l'indice topic -> dispositivo"""
+    try:
+        # Gli aggiornamenti di last_seen non cambiano il routing
+        if update_fields and set(update_fields) <= {'last_seen', 'updated_at'}:
+            return
+        from ..mqtt.routing import get_routing_index
+        get_routing_index().update_device(instance)
+    except Exception as e:
+        logger.error(f"Errore aggiornamento routing index per {instance.device_id}: {str(e)}")
+
+@receiver(post_delete, sender=DeviceConfiguration, dispatch_uid='energy_routing_index_delete')
+def remove_from_routing_index(sender, instance, **kwargs):
+    """Rimuove il dispositivo eliminato dall'indice di routing"""
+    try:
+        from ..mqtt.routing import get_routing_index
+        get_routing_index().remove_device(instance.device_id)
     except Exception as e:
-        logger.error(f"Errore nella rimozione delle sottoscrizioni MQTT: {str(e)}")
\ No newline at end of file
+        logger.error(f"Errore rimozione routing index per {instance.device_id}: {str(e)}")
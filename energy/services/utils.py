@@ -1,6 +1,6 @@
 # energy/services/utils.py
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 from django.db.models import Avg, Max, Min, Sum, Q
 from django.utils import timezone
 from ..models import (
@@ -74,6 +74,101 @@ def calculate_period_aggregates(
 
     return aggregates
 
+def _bucket_start(timestamp: datetime, aggregation_minutes: int) -> datetime:
+    return timestamp.replace(
+        second=0,
+        microsecond=0,
+        minute=(timestamp.minute // aggregation_minutes) * aggregation_minutes
+    )
+
+def aggregate_power_series(
+    rows: Iterable[Tuple[Any, datetime, float]],
+    aggregation_minutes: int,
+    end: Optional[datetime] = None,
+    hold: Optional[timedelta] = None
+) -> List[Tuple[datetime, float]]:
+    """
+    Serie di potenza media per periodo di aggregazione.
+
+    `rows` sono tuple (dispositivo, timestamp, potenza) in ordine di tempo.
+    Con `hold` nullo il valore di un dispositivo nel periodo è la media dei
+    suoi campioni. Le misurazioni compresse all'ingestione conservano solo i
+    punti da cui il segnale si ricostruisce per interpolazione lineare, a
+    distanza di al più COMPRESSION_MAX_INTERVAL (valore predefinito di
+    `hold`): tra due campioni distanti al più `hold` il segnale è interpolato
+    linearmente e il valore del periodo è la sua media nel tempo; dopo
+    l'ultimo campione, o prima di un buco più lungo, vale l'ultimo valore
+    per al più `hold`. Il valore del periodo è la media tra i dispositivi.
+    """
+    if hold is None:
+        from ..mqtt.compression import max_sample_interval
+        hold = max_sample_interval()
+    samples: Dict[Any, List[Tuple[datetime, float]]] = {}
+    for device, timestamp, power in rows:
+        samples.setdefault(device, []).append((timestamp, power))
+
+    if not samples:
+        return []
+
+    first = min(_bucket_start(points[0][0], aggregation_minutes) for points in samples.values())
+    last = max(_bucket_start(points[-1][0], aggregation_minutes) for points in samples.values())
+    if end is not None:
+        last = max(last, _bucket_start(end.astimezone(first.tzinfo), aggregation_minutes))
+    step = timedelta(minutes=aggregation_minutes)
+    limit = end if end is not None else last + step
+
+    # Per periodo e dispositivo: integrale e durata del segnale, somma e numero dei campioni
+    buckets: Dict[datetime, Dict[Any, List[float]]] = {}
+    for device, points in samples.items():
+        for index, (timestamp, power) in enumerate(points):
+            values = buckets.setdefault(_bucket_start(timestamp, aggregation_minutes), {}).setdefault(
+                device, [0.0, 0.0, 0.0, 0]
+            )
+            values[2] += power
+            values[3] += 1
+            if not hold:
+                continue
+            if index + 1 < len(points) and points[index + 1][0] - timestamp <= hold:
+                _add_segment(buckets, device, (timestamp, power), points[index + 1], aggregation_minutes)
+            else:
+                stop = min(timestamp + hold, points[index + 1][0] if index + 1 < len(points) else limit)
+                _add_segment(buckets, device, (timestamp, power), (stop, power), aggregation_minutes)
+
+    series = []
+    bucket = first
+    while bucket <= last:
+        values = [
+            integral / seconds if seconds else power_sum / count
+            for integral, seconds, power_sum, count in buckets.get(bucket, {}).values()
+        ]
+        if values:
+            series.append((bucket, sum(values) / len(values)))
+        bucket += step
+    return series
+
+def _add_segment(
+    buckets: Dict[datetime, Dict[Any, List[float]]],
+    device: Any,
+    start: Tuple[datetime, float],
+    stop: Tuple[datetime, float],
+    aggregation_minutes: int
+) -> None:
+    """Ripartisce tra i periodi l'integrale del tratto lineare tra due punti"""
+    (start_time, start_power), (stop_time, stop_power) = start, stop
+    span = (stop_time - start_time).total_seconds()
+    step = timedelta(minutes=aggregation_minutes)
+    current = start_time
+    while current < stop_time:
+        bucket = _bucket_start(current, aggregation_minutes)
+        boundary = min(stop_time, bucket + step)
+        power_from = start_power + (stop_power - start_power) * (current - start_time).total_seconds() / span
+        power_to = start_power + (stop_power - start_power) * (boundary - start_time).total_seconds() / span
+        seconds = (boundary - current).total_seconds()
+        values = buckets.setdefault(bucket, {}).setdefault(device, [0.0, 0.0, 0.0, 0])
+        values[0] += (power_from + power_to) / 2 * seconds
+        values[1] += seconds
+        current = boundary
+
 def get_latest_measurement(device_id: str) -> Optional[DeviceMeasurement]:
     """
     Recupera l'ultima misurazione per un dispositivo
@@ -0,0 +1,159 @@
+# energy/shelly/client.py
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+from ..mqtt.codec import DecodeError, loads
+
+logger = logging.getLogger('energy.shelly')
+
+DEFAULT_PORT = 80
+DEFAULT_TIMEOUT = 5.0  # secondi
+# Limite della risposta: gli status Gen2 sono di pochi kB
+MAX_RESPONSE_SIZE = 256 * 1024
+
+
+class ShellyRPCError(Exception):
+    """Errore di una chiamata RPC Shelly (rete, timeout, HTTP o risposta non valida)"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        self.status = status
+        super().__init__(message)
+
+
+class ShellyRPCClient:
+    """
+    Client asincrono minimale per le RPC HTTP dei dispositivi Shelly Gen2
+    (GET /rpc/<Metodo>?parametri).
+
+    La connessione HTTP/1.1 resta aperta tra un poll e l'altro (keep-alive)
+    e serve una richiesta alla volta: i dispositivi accettano poche
+    connessioni contemporanee. Se il dispositivo ha chiuso una connessione
+    riutilizzata la richiesta viene ripetuta una volta su una nuova
+    connessione; dopo un timeout la connessione viene chiusa, così una
+    risposta tardiva non viene attribuita alla richiesta successiva.
+    """
+
+    def __init__(self, host: str, port: int = DEFAULT_PORT, timeout: float = DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._host_header = host if port == DEFAULT_PORT else f"{host}:{port}"
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> None:
+        if self.connected:
+            return
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, limit=MAX_RESPONSE_SIZE), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ShellyRPCError(f"Connessione a {self.host}:{self.port} fallita: {e!r}") from e
+
+    async def close(self) -> None:
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is None:
+            return
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (OSError, asyncio.CancelledError):
+            pass
+
+    async def call(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Esegue la RPC `method` e restituisce il risultato JSON decodificato"""
+        path = f"/rpc/{method}"
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        request = (f"GET {path} HTTP/1.1\r\nHost: {self._host_header}\r\n"
+                   f"Accept: application/json\r\nConnection: keep-alive\r\n\r\n").encode('ascii')
+
+        async with self._lock:
+            for attempt in (1, 2):
+                reused = self.connected
+                await self.connect()
+                try:
+                    self._writer.write(request)
+                    await self._writer.drain()
+                    status, headers, body = await asyncio.wait_for(self._read_response(), self.timeout)
+                    break
+                except asyncio.TimeoutError as e:
+                    await self.close()
+                    raise ShellyRPCError(f"Timeout della RPC {method} su {self.host}:{self.port}") from e
+                except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+                    await self.close()
+                    if reused and attempt == 1:
+                        # Connessione keep-alive chiusa dal dispositivo: riprova su una nuova
+                        continue
+                    raise ShellyRPCError(f"Connessione con {self.host}:{self.port} interrotta: {e!r}") from e
+                except ShellyRPCError:
+                    await self.close()
+                    raise
+            if headers.get('connection', '').lower() == 'close':
+                await self.close()
+
+        try:
+            result = loads(body) if body else None
+        except DecodeError as e:
+            raise ShellyRPCError(f"Risposta non JSON alla RPC {method} da {self.host}", status) from e
+        if status != 200:
+            message = result.get('message') if isinstance(result, dict) else None
+            if status == 401:
+                message = 'autenticazione richiesta (non supportata)'
+            raise ShellyRPCError(f"RPC {method} su {self.host}: HTTP {status} {message or ''}".rstrip(), status)
+        if not isinstance(result, dict):
+            raise ShellyRPCError(f"Risposta non valida alla RPC {method} da {self.host}", status)
+        return result
+
+    async def _read_response(self) -> Tuple[int, Dict[str, str], bytes]:
+        head = await self._reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            status = int(lines[0].split(' ', 2)[1])
+        except (IndexError, ValueError):
+            raise ShellyRPCError(f"Risposta HTTP non valida da {self.host}: {lines[0]!r}")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self._read_chunked()
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length > MAX_RESPONSE_SIZE:
+                raise ShellyRPCError(f"Risposta troppo grande da {self.host}: {length} byte")
+            body = await self._reader.readexactly(length)
+        else:
+            # Corpo delimitato dalla chiusura della connessione
+            body = await self._reader.read(MAX_RESPONSE_SIZE)
+            headers['connection'] = 'close'
+        return status, headers, body
+
+    async def _read_chunked(self) -> bytes:
+        chunks = []
+        size = 0
+        while True:
+            line = await self._reader.readuntil(b'\r\n')
+            try:
+                length = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise ShellyRPCError(f"Chunk HTTP non valido da {self.host}")
+            if length == 0:
+                # Trailer eventuali fino alla riga vuota
+                while await self._reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                return b''.join(chunks)
+            size += length
+            if size > MAX_RESPONSE_SIZE:
+                raise ShellyRPCError(f"Risposta troppo grande da {self.host}")
+            chunks.append(await self._reader.readexactly(length))
+            await self._reader.readexactly(2)
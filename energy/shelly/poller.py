@@ -0,0 +1,211 @@
+# energy/shelly/poller.py
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from ..polling import PollingCollector, PollSchedule, device_base_topic
+from .client import DEFAULT_TIMEOUT, ShellyRPCClient, ShellyRPCError
+
+logger = logging.getLogger('energy.shelly')
+
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 1
+DEFAULT_MAX_CONCURRENT_POLLS = 500
+DEFAULT_MIN_REQUEST_INTERVAL = 0.1  # secondi tra due richieste allo stesso host
+DEFAULT_MAX_BACKOFF = 300  # secondi
+
+# Metodi RPC per modello: (metodo, componente). Il risultato di
+# <Metodo>.GetStatus?id=0 coincide con il payload MQTT status/<componente>,
+# quindi viene decodificato dai mapping dei messaggi MQTT.
+RPC_COMPONENTS: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    'PRO_3EM': (('EM.GetStatus', 'em:0'), ('EMData.GetStatus', 'emdata:0')),
+    'PRO_EM': (('EM1.GetStatus', 'em1:0'), ('EM1Data.GetStatus', 'em1data:0')),
+    'PLUS_PLUG_S': (('Switch.GetStatus', 'switch:0'),),
+    'PLUS_PM': (('Switch.GetStatus', 'switch:0'),),
+}
+
+# Destinazione dei payload: (topic, payload, received_at), es. IngestionWorkerPool.submit
+Sink = Callable[[str, Dict[str, Any], float], Any]
+
+
+@dataclass
+class ShellyTarget:
+    """Dispositivo Shelly da leggere via RPC HTTP"""
+    device_id: str
+    host: str
+    port: int
+    poll_interval: float
+    base_topic: str
+    model: str
+
+    @classmethod
+    def from_config(cls, config) -> 'ShellyTarget':
+        """Costruisce il target da una ShellyRPCConfiguration (con device e plant caricati)"""
+        device = config.device
+        return cls(
+            device_id=device.device_id,
+            host=config.host,
+            port=config.port,
+            poll_interval=float(config.poll_interval),
+            base_topic=device_base_topic(device),
+            model=(device.model or '').upper(),
+        )
+
+
+class HostConnectionPool:
+    """
+    Connessioni keep-alive verso un dispositivo (host e porta).
+
+    Al più `max_connections` richieste contemporanee e almeno
+    `min_interval` secondi tra l'inizio di due richieste: i dispositivi
+    Shelly hanno poche risorse e rallentano (o rispondono 503) se
+    interrogati troppo spesso.
+    """
+
+    def __init__(self, host: str, port: int, max_connections: int, min_interval: float, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self._idle: List[ShellyRPCClient] = []
+        self._clients: List[ShellyRPCClient] = []
+        self._next_slot = 0.0
+
+    async def acquire(self) -> ShellyRPCClient:
+        await self._semaphore.acquire()
+        if self._idle:
+            return self._idle.pop()
+        client = ShellyRPCClient(self.host, self.port, self.timeout)
+        self._clients.append(client)
+        return client
+
+    def release(self, client: ShellyRPCClient) -> None:
+        self._idle.append(client)
+        self._semaphore.release()
+
+    async def throttle(self) -> None:
+        """Attende il prossimo turno di richiesta libero verso l'host"""
+        if not self.min_interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.min_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def close(self) -> None:
+        for client in self._clients:
+            await client.close()
+        self._idle.clear()
+        self._clients.clear()
+
+
+class _ShellySchedule(PollSchedule):
+    """Pianificazione di un dispositivo con i metodi RPC del modello"""
+    __slots__ = ('components',)
+
+    def __init__(self, target: ShellyTarget, components: Tuple[Tuple[str, str], ...], next_due: float):
+        super().__init__(target, next_due)
+        self.components = components
+
+
+class ShellyPoller(PollingCollector):
+    """
+    Poller asincrono delle RPC HTTP dei dispositivi Shelly Gen2 senza MQTT.
+
+    Per ogni dispositivo chiama i metodi GetStatus del modello
+    (`RPC_COMPONENTS`) su una connessione keep-alive del pool dell'host e
+    consegna ogni risultato a `sink` sul topic MQTT equivalente
+    (`{base}/status/em:0`, ...): routing, mapping del payload, dedup e
+    persistenza restano quelli dei messaggi MQTT. Il payload riceve il
+    timestamp del poll (`ts`), come i messaggi MQTT che lo riportano, così
+    letture identiche in poll successivi non vengono scartate come duplicati.
+    """
+
+    stats_component = 'shelly'
+    transport_errors = (ShellyRPCError,)
+    log = logger
+
+    def __init__(self, targets: Iterable[ShellyTarget], sink: Sink,
+                 max_connections_per_host: Optional[int] = None,
+                 max_concurrent_polls: Optional[int] = None,
+                 min_request_interval: Optional[float] = None,
+                 timeout: Optional[float] = None,
+                 max_backoff: Optional[float] = None):
+        shelly_settings = getattr(settings, 'SHELLY_POLLER_SETTINGS', {})
+        self.max_connections_per_host = max_connections_per_host or shelly_settings.get(
+            'MAX_CONNECTIONS_PER_HOST', DEFAULT_MAX_CONNECTIONS_PER_HOST)
+        if min_request_interval is None:
+            min_request_interval = shelly_settings.get('MIN_REQUEST_INTERVAL', DEFAULT_MIN_REQUEST_INTERVAL)
+        self.min_request_interval = min_request_interval
+        self.timeout = timeout or shelly_settings.get('TIMEOUT', DEFAULT_TIMEOUT)
+
+        self._sink = sink
+        self._pools: Dict[Tuple[str, int], HostConnectionPool] = {}
+        super().__init__(
+            targets,
+            max_concurrent_polls=max_concurrent_polls or shelly_settings.get(
+                'MAX_CONCURRENT_POLLS', DEFAULT_MAX_CONCURRENT_POLLS),
+            max_backoff=max_backoff or shelly_settings.get('MAX_BACKOFF', DEFAULT_MAX_BACKOFF),
+        )
+        self._stats['requests'] = 0
+
+    def build_schedule(self, target: ShellyTarget, next_due: float) -> Optional[_ShellySchedule]:
+        components = RPC_COMPONENTS.get(target.model)
+        if not components:
+            logger.warning(f"Modello Shelly {target.model} senza RPC Gen2 per {target.device_id}")
+            return None
+        return _ShellySchedule(target, components, next_due)
+
+    def update_targets(self, targets: Iterable[ShellyTarget]) -> None:
+        super().update_targets(targets)
+        logger.info(f"Poller Shelly: {len(self._schedules)} dispositivi")
+
+    def _pool(self, target: ShellyTarget) -> HostConnectionPool:
+        key = (target.host, target.port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = HostConnectionPool(target.host, target.port, self.max_connections_per_host,
+                                      self.min_request_interval, self.timeout)
+            self._pools[key] = pool
+        return pool
+
+    async def poll(self, schedule: _ShellySchedule) -> Dict[str, Dict[str, Any]]:
+        """Chiama i metodi RPC del dispositivo e ne consegna i risultati"""
+        target = schedule.target
+        pool = self._pool(target)
+        results: Dict[str, Dict[str, Any]] = {}
+        client = await pool.acquire()
+        try:
+            for method, component in schedule.components:
+                await pool.throttle()
+                results[component] = await client.call(method, {'id': 0})
+                self._stats['requests'] += 1
+        finally:
+            pool.release(client)
+
+        received_at = time.time()
+        for component, payload in results.items():
+            payload.setdefault('ts', received_at)
+            topic = f"{target.base_topic}/status/{component}"
+            try:
+                self._sink(topic, payload, received_at)
+                self._stats['emitted'] += 1
+            except Exception as e:
+                logger.error(f"Errore nell'inoltro della lettura di {target.device_id}: {e}", exc_info=True)
+        return results
+
+    async def close_transports(self) -> None:
+        for pool in self._pools.values():
+            await pool.close()
+        self._pools.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Restituisce le metriche del poller"""
+        stats = super().get_stats()
+        stats['hosts'] = len({(s.target.host, s.target.port) for s in self._schedules.values()})
+        return stats
@@ -18,7 +18,14 @@ from .views.device_views import (
     MeasurementDetailView, 
     device_delete
 )
-from .views.mqtt_views import mqtt_settings, mqtt_control, save_mqtt_settings
+from .views.mqtt_views import (
+    mqtt_settings,
+    mqtt_control,
+    save_mqtt_settings,
+    mqtt_auth_user,
+    mqtt_auth_superuser,
+    mqtt_auth_acl
+)
 from .views.api import PlantViewSet, DeviceConfigurationViewSet, DeviceMeasurementViewSet
 
 app_name = 'energy'
@@ -54,6 +61,11 @@ urlpatterns = [
     path('settings/mqtt/save/', save_mqtt_settings, name='save_mqtt_settings'),
     path('settings/mqtt/control/', mqtt_control, name='mqtt_control'),
 
+    # Autenticazione/ACL del broker (backend HTTP di mosquitto-go-auth)
+    path('mqtt/auth/user/', mqtt_auth_user, name='mqtt-auth-user'),
+    path('mqtt/auth/superuser/', mqtt_auth_superuser, name='mqtt-auth-superuser'),
+    path('mqtt/auth/acl/', mqtt_auth_acl, name='mqtt-auth-acl'),
+
     # API MQTT Data - Messo al livello principale
     path('api/plants/<int:plant_id>/mqtt-data/', plant_mqtt_data, name='plant-mqtt-data'),
     path('api/plants/mqtt-data/', plant_mqtt_data, name='mqtt-data'),
@@ -9,11 +9,11 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.throttling import UserRateThrottle
-from django.db.models import Avg, Max, Min, Count
+from django.db.models import Avg, Max, Min, Count, Sum
 from django.utils import timezone
 from datetime import timedelta
 
-from energy.models import DeviceConfiguration, DeviceMeasurement
+from energy.models import DeviceConfiguration, DeviceLatestState, DeviceMeasurement
 from core.models import Plant
 
 from ..api.serializers import (
@@ -175,19 +175,23 @@ class PlantViewSet(viewsets.ModelViewSet):
             plant = self.get_object()
             now = timezone.now()
             
-            # Get active devices and their latest measurements
+            # Get active devices and their latest state
             devices = DeviceConfiguration.objects.filter(plant=plant)
-            latest_measurements = DeviceMeasurement.objects.filter(
-                device__in=devices,
+            latest = DeviceLatestState.objects.filter(
+                plant=plant,
                 timestamp__gte=now - timedelta(minutes=5)
-            ).select_related('device')
+            ).aggregate(
+                total_power=Sum('power'),
+                active_devices=Count('device'),
+                last_update=Max('timestamp')
+            )
 
             # Calculate current power statistics
             current_stats = {
-                'total_power': latest_measurements.aggregate(Sum('power'))['power__sum'] or 0,
-                'active_devices': latest_measurements.count(),
+                'total_power': latest['total_power'] or 0,
+                'active_devices': latest['active_devices'],
                 'total_devices': devices.count(),
-                'last_update': latest_measurements.aggregate(Max('timestamp'))['timestamp__max']
+                'last_update': latest['last_update']
             }
 
             # Calculate daily production
@@ -235,27 +239,24 @@ class PlantViewSet(viewsets.ModelViewSet):
         """
         try:
             plant = self.get_object()
-            devices = DeviceConfiguration.objects.filter(plant=plant)
+            devices = DeviceConfiguration.objects.filter(plant=plant).select_related('latest_state')
             
             device_statuses = []
             for device in devices:
-                try:
-                    latest = DeviceMeasurement.objects.filter(
-                        device=device
-                    ).latest('timestamp')
-                    
+                latest = getattr(device, 'latest_state', None)
+                if latest is not None and latest.timestamp is not None:
                     device_statuses.append({
                         'device_id': device.id,
-                        'name': device.name,
+                        'name': device.device_id,
                         'is_online': latest.timestamp > timezone.now() - timedelta(minutes=5),
                         'last_seen': latest.timestamp,
                         'current_power': latest.power,
                         'status': 'active' if latest.power > 0 else 'idle'
                     })
-                except DeviceMeasurement.DoesNotExist:
+                else:
                     device_statuses.append({
                         'device_id': device.id,
-                        'name': device.name,
+                        'name': device.device_id,
                         'is_online': False,
                         'last_seen': None,
                         'current_power': 0,
@@ -11,6 +11,9 @@ from datetime import timedelta
 import logging
 from core.models import Plant
 from ..models import DeviceConfiguration, DeviceMeasurement
+from ..models.latest import recent_state
+from ..services.utils import aggregate_power_series
+from ..retention import read_measurements
 from ..mqtt.client import get_mqtt_client
 
 logger = logging.getLogger(__name__)
@@ -19,7 +22,7 @@ logger = logging.getLogger(__name__)
 def total_power_data(request):
     """
     Recupera e formatta i dati di potenza per il grafico, con supporto per vari intervalli temporali
-    e aggregazione dei dati.
+    e aggregazione dei dati. Gli intervalli lunghi leggono i rollup delle misurazioni.
     """
     try:
         now = timezone.localtime()
@@ -38,45 +41,33 @@ def total_power_data(request):
         elif time_range == '48h':
             time_threshold = now - timedelta(days=2)
             aggregation_minutes = 30
+        elif time_range == '7d':
+            time_threshold = now - timedelta(days=7)
+            aggregation_minutes = 60
+        elif time_range == '30d':
+            time_threshold = now - timedelta(days=30)
+            aggregation_minutes = 240
         else:
             time_threshold = now - timedelta(minutes=5)
             aggregation_minutes = 1
 
-        # Query base per le misurazioni
-        measurements = DeviceMeasurement.objects.filter(
-            timestamp__gte=time_threshold
-        ).select_related('device', 'device__plant').order_by('timestamp')
+        # Misurazioni grezze o rollup, secondo l'intervallo richiesto
+        filters = {} if request.user.is_staff else {'plant__owner': request.user}
+        points = read_measurements(time_threshold, now=now, **filters)
 
-        if not request.user.is_staff:
-            measurements = measurements.filter(plant__owner=request.user)
-
-        # Aggregazione dei dati
-        data_points = {}
-        for measurement in measurements:
-            # Arrotonda il timestamp al periodo di aggregazione più vicino
-            rounded_time = measurement.timestamp.replace(
-                second=0, 
-                microsecond=0,
-                minute=(measurement.timestamp.minute // aggregation_minutes) * aggregation_minutes
-            )
-            
-            if rounded_time not in data_points:
-                data_points[rounded_time] = {
-                    'power_sum': 0,
-                    'count': 0
-                }
-            
-            data_points[rounded_time]['power_sum'] += measurement.power
-            data_points[rounded_time]['count'] += 1
+        # Aggregazione dei dati (media per periodo, interpolando le
+        # misurazioni compresse dei dispositivi)
+        series = aggregate_power_series(
+            ((point.device_id, point.timestamp, point.power) for point in points),
+            aggregation_minutes,
+            end=now
+        )
 
         # Prepara i dati per il grafico
         timestamps = []
         values = []
         
-        for timestamp in sorted(data_points.keys()):
-            point = data_points[timestamp]
-            avg_power = point['power_sum'] / point['count']
-            
+        for timestamp, avg_power in series:
             timestamps.append(timestamp.isoformat())
             values.append(round(avg_power / 1000.0, 2))  # Converti in kW
 
@@ -86,7 +77,7 @@ def total_power_data(request):
             'last_update': now.strftime('%H:%M:%S')
         }
 
-        if measurements.exists():
+        if points:
             logger.info(f"Found {len(timestamps)} aggregated points for range {time_range}")
             logger.info(f"First timestamp: {timestamps[0] if timestamps else 'none'}")
             logger.info(f"First value: {values[0] if values else 'none'}")
@@ -125,7 +116,7 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         for plant in plants:
              logger.info(f"\nPlant: {plant.name} (ID: {plant.id})")
              logger.info(f"Timestamp threshold: {time_threshold}")
-             plant_devices = DeviceConfiguration.objects.filter(plant=plant).select_related('plant')
+             plant_devices = DeviceConfiguration.objects.filter(plant=plant).select_related('plant', 'latest_state')
              all_plant_devices.extend(plant_devices)
              logger.info(f"\nDispositivi configurati per impianto:")
              
@@ -135,11 +126,8 @@ class DashboardView(LoginRequiredMixin, TemplateView):
                  logger.info(f"- Topic template: {device.mqtt_topic_template}")
                  logger.info(f"- Is active: {device.is_active}")
                  
-                 # Verifica ultime misurazioni
-                 last_measurement = DeviceMeasurement.objects.filter(
-                     device=device,
-                     timestamp__gte=time_threshold
-                 ).order_by('-timestamp').first()
+                 # Verifica ultime misurazioni (stato attuale del dispositivo)
+                 last_measurement = recent_state(device, now)
 
                  if last_measurement:
                      logger.info(f"  Ultima misurazione:")
@@ -155,13 +143,9 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         try:
             # Query ottimizzata per dispositivi attivi e online
             active_devices = list(filter(lambda x: x.is_active, all_plant_devices))
-            online_devices = DeviceMeasurement.objects.filter(
-                device__in=active_devices,
-                timestamp__gte=time_threshold
-            ).values('device').distinct()
 
             total_active = len(active_devices)
-            online_count = online_devices.count()
+            online_count = sum(1 for device in active_devices if recent_state(device, now))
             
             logger.info(f"\nStatistiche dispositivi:")
             logger.info(f"- Totali: {len(all_plant_devices)}")
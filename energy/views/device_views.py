@@ -13,7 +13,7 @@ from django.http import JsonResponse
 from django.views.generic import ListView, DetailView, CreateView, UpdateView
 
 from core.models import Plant
-from ..models import DeviceConfiguration, DeviceMeasurement
+from ..models import DeviceConfiguration, DeviceLatestState, DeviceMeasurement
 from ..devices.registry import DeviceRegistry
 
 logger = logging.getLogger(__name__)
@@ -216,11 +216,11 @@ class DeviceDetailView(LoginRequiredMixin, UpdateView):
             now = timezone.now()
             time_threshold = now - timedelta(minutes=5)
             
-            # Ottieni l'ultima misurazione
-            latest_measurement = DeviceMeasurement.objects.filter(
+            # Ottieni l'ultima misurazione (stato attuale del dispositivo)
+            latest_measurement = DeviceLatestState.objects.filter(
                 device=device,
                 timestamp__gte=time_threshold
-            ).order_by('-timestamp').first()
+            ).first()
             
             # Prepara i dati per la risposta JSON
             data = {
@@ -279,18 +279,18 @@ class DeviceDetailView(LoginRequiredMixin, UpdateView):
             ]
         }
         
-        # Ottieni l'ultima misurazione con una query efficiente
-        latest_measurement = DeviceMeasurement.objects.filter(
+        # Ottieni l'ultima misurazione dallo stato attuale (fasi incluse)
+        latest_measurement = DeviceLatestState.objects.filter(
             device=device,
             timestamp__gte=time_threshold
-        ).select_related('device').prefetch_related('phase_details').order_by('-timestamp').first()
+        ).first()
         
         if latest_measurement:
             context.update({
                 'current_power': round(latest_measurement.power / 1000.0, 2),  # Converti in kW
                 'current_voltage': round(latest_measurement.voltage, 1),
                 'current_current': round(latest_measurement.current, 1),
-                'phase_details': latest_measurement.phase_details.all(),
+                'phase_details': latest_measurement.phase_details,
                 'apparent_power': round(getattr(latest_measurement, 'apparent_power', 0) / 1000.0, 2), # kVA
                 'reactive_power': round(getattr(latest_measurement, 'reactive_power', 0) / 1000.0, 2), # kVAR
                 'is_online': True,
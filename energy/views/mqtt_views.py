@@ -1,12 +1,19 @@
 #energy/views/mqtt_views.py
+import json
 import logging
+from functools import wraps
 
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
 from ..models import MQTTBroker, MQTTAuditLog
+from ..mqtt.acl import get_access_index
+from ..mqtt.audit import get_audit_counters, get_audit_writer
 from ..mqtt.client import get_mqtt_client
 
 logger = logging.getLogger(__name__)
@@ -102,13 +109,15 @@ def mqtt_settings(request):
     mqtt_status = "Connesso" if client.is_connected else "Disconnesso"
     logger.info(f"Stato connessione MQTT: {mqtt_status}")
 
+    # Contatori mantenuti dal writer di audit: nessun COUNT sulla tabella
+    counters = get_audit_counters()
     context = {
         'mqtt_config': MQTTBroker.objects.filter(is_active=True).first(),
         'system_logs': recent_logs,
         'stats': {
-            'total_connections': MQTTAuditLog.objects.filter(operation='CONNECT', status=True).count(),
-            'failed_connections': MQTTAuditLog.objects.filter(operation='CONNECT', status=False).count(),
-            'total_messages': MQTTAuditLog.objects.filter(operation='MESSAGE').count()
+            'total_connections': counters.get(('CONNECT', True), 0),
+            'failed_connections': counters.get(('CONNECT', False), 0),
+            'total_messages': counters.get(('MESSAGE', True), 0) + counters.get(('MESSAGE', False), 0)
         },
         'is_connected': client.is_connected,
         'mqtt_status': mqtt_status
@@ -172,4 +181,60 @@ def mqtt_control(request):
             logger.error(f'Errore durante {action}: {str(e)}')
             messages.error(request, f'Errore durante l\'operazione: {str(e)}')
     
-    return redirect('energy:mqtt_settings')
\ No newline at end of file
+    return redirect('energy:mqtt_settings')
+
+# Backend HTTP di autenticazione/ACL per mosquitto-go-auth
+# (auth_opt_http_response_mode status: 200 = consentito, 403 = negato).
+# Le risposte arrivano dall'indice in memoria, senza query al DB.
+
+def broker_auth_endpoint(operation=None):
+    """
+    Accetta solo POST dagli host del broker e passa i parametri (JSON o
+    form); con `operation` l'esito viene registrato nel log di audit.
+    """
+    def decorator(view):
+        @csrf_exempt
+        @require_http_methods(["POST"])
+        @wraps(view)
+        def wrapper(request):
+            allowed_hosts = getattr(settings, 'MQTT_SETTINGS', {}).get('AUTH_ALLOWED_HOSTS', ['127.0.0.1', '::1'])
+            if request.META.get('REMOTE_ADDR') not in allowed_hosts:
+                return HttpResponse(status=403)
+            if request.content_type == 'application/json':
+                try:
+                    params = json.loads(request.body or b'{}')
+                except ValueError:
+                    return HttpResponse(status=400)
+                if not isinstance(params, dict):
+                    return HttpResponse(status=400)
+            else:
+                params = request.POST
+            allowed = view(params)
+            if operation:
+                get_audit_writer().record(
+                    operation,
+                    status=allowed,
+                    mqtt_username=params.get('username', ''),
+                    topic=params.get('topic'),
+                    client_id=params.get('clientid'),
+                    ip_address=request.META.get('REMOTE_ADDR')
+                )
+            return HttpResponse('ok' if allowed else 'denied', status=200 if allowed else 403)
+        return wrapper
+    return decorator
+
+@broker_auth_endpoint('AUTH')
+def mqtt_auth_user(params):
+    return get_access_index().authenticate(params.get('username', ''), params.get('password', ''))
+
+@broker_auth_endpoint()
+def mqtt_auth_superuser(params):
+    return get_access_index().is_superuser(params.get('username', ''))
+
+@broker_auth_endpoint('ACL_CHECK')
+def mqtt_auth_acl(params):
+    try:
+        access = int(params.get('acc', 0))
+    except (TypeError, ValueError):
+        return False
+    return get_access_index().check_acl(params.get('username', ''), params.get('topic', ''), access)
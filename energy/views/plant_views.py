@@ -8,11 +8,14 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Sum, Max
+from django.db.models import Sum
 from django.contrib.auth import get_user_model
 from django import forms
 from core.models import Plant
 from ..models import DeviceConfiguration, DeviceMeasurement
+from ..models.latest import recent_state
+from ..services.utils import aggregate_power_series
+from ..retention import read_measurements
 from django.views.generic import ListView, CreateView, DetailView
 
 logger = logging.getLogger(__name__)
@@ -66,34 +69,21 @@ class PlantListView(LoginRequiredMixin, ListView):
 
             # Iteriamo sugli impianti per raccogliere i dati dei dispositivi
             for plant in plants:
-                devices = DeviceConfiguration.objects.filter(plant=plant)
+                # Dispositivi con il loro stato attuale (join su DeviceLatestState)
+                devices = DeviceConfiguration.objects.filter(plant=plant).select_related('latest_state')
                 logger.info(f"Elaborazione impianto: {plant.name}")
 
-                # Otteniamo i dati delle ultime misurazioni per questo impianto
-                latest_measurements = DeviceMeasurement.objects.filter(
-                    device__plant=plant,
-                    timestamp__gte=time_threshold
-                ).values('device').annotate(
-                    latest_power=Max('power'),
-                    latest_timestamp=Max('timestamp')
-                )
-
                 # Raccogli i dati dei dispositivi
                 for device in devices:
-                    device_measurement = next(
-                        (m for m in latest_measurements if m['device'] == device.id),
-                        None
-                    )
+                    state = recent_state(device, now)
                     
                     devices_data.append({
                         'id': device.id,
                         'device_id': device.device_id,
                         'device_type': device.get_device_type_display(),
-                        'power': device_measurement['latest_power'] if device_measurement else 0,
-                        'is_online': bool(device_measurement),
-                        'last_seen': timezone.localtime(device_measurement['latest_timestamp']) 
-                                if device_measurement and device_measurement['latest_timestamp'] 
-                                else None
+                        'power': state.power if state else 0,
+                        'is_online': bool(state),
+                        'last_seen': timezone.localtime(state.timestamp) if state else None
                     })
 
             # Calcola l'energia totale giornaliera
@@ -200,29 +190,20 @@ class PlantDetailView(LoginRequiredMixin, DetailView):
         now = timezone.localtime()
         time_threshold = now - timedelta(minutes=5)
 
-        devices = DeviceConfiguration.objects.filter(plant=plant)
+        # Dispositivi con il loro stato attuale (join su DeviceLatestState)
+        devices = list(DeviceConfiguration.objects.filter(plant=plant).select_related('latest_state'))
         devices_data = []
 
         logger.info(f"\nCalcolo potenza per impianto: {plant.name}")
         logger.info(f"Timestamp threshold: {time_threshold}")
 
-        latest_measurements = DeviceMeasurement.objects.filter(
-            device__plant=plant,
-            timestamp__gte=time_threshold
-        ).values('device').annotate(
-            latest_power=Max('power'),
-            latest_timestamp=Max('timestamp')
-        )
-
-        total_power = sum(m['latest_power'] for m in latest_measurements if m['latest_power'] is not None)
-        logger.info(f"Trovati {len(latest_measurements)} dispositivi attivi")
+        states = {device.id: recent_state(device, now) for device in devices}
+        total_power = sum(state.power for state in states.values() if state)
+        logger.info(f"Trovati {sum(1 for state in states.values() if state)} dispositivi attivi")
         logger.info(f"Potenza totale calcolata: {total_power}W")
 
         for device in devices:
-            device_measurement = next(
-                (m for m in latest_measurements if m['device'] == device.id), 
-                None
-            )
+            state = states[device.id]
 
             device_data = {
                 'id': device.id,
@@ -233,13 +214,13 @@ class PlantDetailView(LoginRequiredMixin, DetailView):
                 'last_seen': None
             }
 
-            if device_measurement:
-                logger.info(f"Dispositivo {device.device_id}: {device_measurement['latest_power']}W")
+            if state:
+                logger.info(f"Dispositivo {device.device_id}: {state.power}W")
 
                 device_data.update({
-                    'power': device_measurement['latest_power'],
+                    'power': state.power,
                     'is_online': True,
-                    'last_seen': timezone.localtime(device_measurement['latest_timestamp'])
+                    'last_seen': timezone.localtime(state.timestamp)
                 })
 
             devices_data.append(device_data)
@@ -259,7 +240,7 @@ class PlantDetailView(LoginRequiredMixin, DetailView):
                 'drawn_power': round(total_power / 1000.0, 2),
             },
             'plantTotalPower': round(total_power / 1000.0, 2),
-            'plantDeviceCount': devices.filter(is_active=True).count(),
+            'plantDeviceCount': sum(1 for device in devices if device.is_active),
             'plantTodayEnergy': round(total_energy, 2),
             'plantLastUpdate': now if devices_data else None
         })
@@ -319,6 +300,12 @@ def plant_mqtt_data(request, plant_id=None):
         elif time_range == '24h':
             time_threshold = now - timedelta(days=1)
             aggregation_minutes = 15
+        elif time_range == '7d':
+            time_threshold = now - timedelta(days=7)
+            aggregation_minutes = 60
+        elif time_range == '30d':
+            time_threshold = now - timedelta(days=30)
+            aggregation_minutes = 240
         else:
             time_threshold = now - timedelta(minutes=5)
             aggregation_minutes = 1
@@ -338,33 +325,19 @@ def plant_mqtt_data(request, plant_id=None):
         response_data = {}
 
         for plant in plants:
-            devices = DeviceConfiguration.objects.filter(plant=plant)
-            device_ids = list(devices.values_list('id', flat=True))
-
-            # Ottieni dati per il grafico
-            measurements = DeviceMeasurement.objects.filter(
-                device__in=device_ids,
-                timestamp__gte=time_threshold
-            ).order_by('timestamp')
-
-            # Aggregazione dei dati per il grafico
-            data_points = {}
-            for measurement in measurements:
-                # Arrotonda il timestamp al periodo di aggregazione più vicino
-                rounded_time = measurement.timestamp.replace(
-                    second=0, 
-                    microsecond=0,
-                    minute=(measurement.timestamp.minute // aggregation_minutes) * aggregation_minutes
-                )
-                
-                if rounded_time not in data_points:
-                    data_points[rounded_time] = {
-                        'power_sum': 0,
-                        'count': 0
-                    }
-                
-                data_points[rounded_time]['power_sum'] += measurement.power
-                data_points[rounded_time]['count'] += 1
+            devices = list(DeviceConfiguration.objects.filter(plant=plant).select_related('latest_state'))
+            device_ids = [device.id for device in devices]
+
+            # Ottieni dati per il grafico (misurazioni grezze o rollup)
+            points = read_measurements(time_threshold, now=now, device__in=device_ids)
+
+            # Aggregazione dei dati per il grafico (interpolando le
+            # misurazioni compresse dei dispositivi)
+            series = aggregate_power_series(
+                ((point.device_id, point.timestamp, point.power) for point in points),
+                aggregation_minutes,
+                end=now
+            )
 
             # Prepara i dati del grafico
             chart_data = {
@@ -372,24 +345,15 @@ def plant_mqtt_data(request, plant_id=None):
                 'values': []
             }
 
-            for timestamp in sorted(data_points.keys()):
-                point = data_points[timestamp]
-                avg_power = point['power_sum'] / point['count']
-                
+            for timestamp, avg_power in series:
                 chart_data['timestamps'].append(timestamp.isoformat())
                 chart_data['values'].append(round(avg_power / 1000.0, 2))  # Converti in kW
 
-            # Calcola i dati attuali dell'impianto
-            latest_measurements = DeviceMeasurement.objects.filter(
-                device__in=device_ids,
-                timestamp__gte=now - timedelta(minutes=5)
-            ).select_related('device')
-
-            # Prepara i dati dei dispositivi
+            # Prepara i dati dei dispositivi dal loro stato attuale
             devices_data = []
             total_power = 0
             for device in devices:
-                device_measurement = latest_measurements.filter(device=device).order_by('-timestamp').first()
+                device_measurement = recent_state(device, now)
                 
                 device_data = {
                     'id': device.id,
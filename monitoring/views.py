@@ -439,7 +439,37 @@ class MetricsView(View):
         except Exception as e:
             # Log error but don't fail the metrics endpoint
             pass
-        
+
+        # MQTT ingestion metrics (published in cache by the ingestion process)
+        try:
+            from energy.mqtt.stats import get_published_stats
+
+            published = get_published_stats()
+            for component, stats in sorted(published.items()):
+                for key, value in sorted(stats.items()):
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    name = f'mqtt_ingest_{component}_{key}'
+                    metrics.append(f'# TYPE {name} gauge')
+                    metrics.append(f'{name} {value}')
+
+            # Latency percentiles per device type and pipeline stage (last flush interval)
+            device_types = published.get('latency', {}).get('device_types', {})
+            if device_types:
+                metrics.append('# HELP mqtt_ingest_latency_ms Ingest latency by device type and stage')
+                metrics.append('# TYPE mqtt_ingest_latency_ms summary')
+                for device_type, stages in sorted(device_types.items()):
+                    for stage, summary in sorted(stages.items()):
+                        labels = f'device_type="{device_type or "unknown"}",stage="{stage}"'
+                        for quantile in ('50', '95', '99'):
+                            metrics.append(
+                                f'mqtt_ingest_latency_ms{{{labels},quantile="0.{quantile}"}} {summary[f"p{quantile}"]}'
+                            )
+                        metrics.append(f'mqtt_ingest_latency_ms_count{{{labels}}} {summary["count"]}')
+
+        except Exception as e:
+            pass
+
         return JsonResponse(
             '\n'.join(metrics),
             safe=False,
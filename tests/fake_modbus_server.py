@@ -0,0 +1,101 @@
+"""
+Minimal asyncio Modbus-TCP server used by the Modbus collector tests
+"""
+import asyncio
+import struct
+
+MBAP_HEADER = struct.Struct('>HHHB')
+
+
+class FakeModbusServer:
+    """
+    Simulatore Modbus-TCP (gateway con più unit id): risponde alla
+    funzione 0x03 dai registri di ciascuna unità, con eccezione 0x02 per
+    indirizzi non definiti e 0x0B per unità sconosciute. Registra le
+    richieste ricevute e il massimo di connessioni aperte insieme;
+    `delay` ritarda ogni risposta.
+    """
+
+    def __init__(self, units=None, delay=0.0):
+        self.units = {unit: dict(registers) for unit, registers in (units or {}).items()}
+        self.delay = delay
+        self.requests = []
+        self.connections = 0
+        self.max_connections = 0
+        self.port = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def set_registers(self, unit, registers):
+        self.units.setdefault(unit, {}).update(registers)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self.max_connections = max(self.max_connections, self.connections)
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                transaction_id, _, length, unit = MBAP_HEADER.unpack(header)
+                pdu = await reader.readexactly(length - 1)
+                function, address, count = struct.unpack('>BHH', pdu[:5])
+                self.requests.append((unit, address, count))
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(self._respond(transaction_id, unit, function, address, count))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    def _respond(self, transaction_id, unit, function, address, count):
+        registers = self.units.get(unit)
+        if function != 0x03:
+            body = struct.pack('>BB', function | 0x80, 0x01)
+        elif registers is None:
+            body = struct.pack('>BB', function | 0x80, 0x0B)
+        elif any(address + offset not in registers for offset in range(count)):
+            body = struct.pack('>BB', function | 0x80, 0x02)
+        else:
+            words = [registers[address + offset] for offset in range(count)]
+            body = struct.pack(f'>BB{count}H', function, 2 * count, *words)
+        return MBAP_HEADER.pack(transaction_id, 0, len(body) + 1, unit) + body
+
+
+def sun2000_registers(power_w=4200, energy_kwh=1234.56, voltage=230.0, current=6.1, power_factor=0.99):
+    """Registri SUN2000 di un inverter trifase (32064-32115, buchi a zero)"""
+    registers = {address: 0 for address in range(32064, 32116)}
+
+    def put(address, value, words=1):
+        value = int(round(value)) & ((1 << (16 * words)) - 1)
+        for offset in range(words):
+            registers[address + offset] = (value >> (16 * (words - 1 - offset))) & 0xFFFF
+
+    put(32064, power_w * 1.02, 2)
+    for address in (32069, 32070, 32071):
+        put(address, voltage * 10)
+    for address in (32072, 32074, 32076):
+        put(address, current * 1000, 2)
+    put(32080, power_w, 2)
+    put(32084, power_factor * 1000)
+    put(32085, 5000)
+    put(32087, 415)
+    put(32089, 0x0200)
+    put(32106, energy_kwh * 100, 2)
+    put(32114, 1250, 2)
+    return registers
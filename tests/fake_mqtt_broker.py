@@ -0,0 +1,237 @@
+"""
+Minimal in-process MQTT v5 broker used by the MQTT client tests
+"""
+import socket
+import struct
+import threading
+
+
+def encode_varint(value):
+    data = bytearray()
+    while True:
+        byte = value % 128
+        value //= 128
+        if value:
+            byte |= 0x80
+        data.append(byte)
+        if not value:
+            return bytes(data)
+
+
+def decode_varint(data, offset=0):
+    multiplier, value = 1, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return value, offset
+        multiplier *= 128
+
+
+def encode_string(value):
+    raw = value.encode('utf-8')
+    return struct.pack('!H', len(raw)) + raw
+
+
+def decode_string(data, offset):
+    length = struct.unpack_from('!H', data, offset)[0]
+    offset += 2
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+class FakeMQTTBroker:
+    """
+    Broker MQTT v5 minimale: accetta le connessioni, registra le
+    sottoscrizioni e consegna i messaggi pubblicati con publish().
+    Supporta CONNECT, SUBSCRIBE, UNSUBSCRIBE, PUBLISH (QoS 0/1), PUBACK e
+    PINGREQ. `session_present` è il flag riportato nel CONNACK.
+    """
+
+    def __init__(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(5)
+        self.port = self._server.getsockname()[1]
+
+        self._lock = threading.Lock()
+        self._connections = []
+        self.connects = []
+        self.subscriptions = []
+        self.unsubscriptions = []
+        # Topic di ogni pacchetto SUBSCRIBE/UNSUBSCRIBE ricevuto
+        self.subscribe_packets = []
+        self.unsubscribe_packets = []
+        self.published = []
+        # Packet id dei PUBACK ricevuti dai client
+        self.pubacks = []
+        self.session_present = False
+        self.subscribed = threading.Event()
+        self._running = True
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._server.close()
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except OSError:
+                    pass
+
+    def drop_connections(self):
+        """Chiude le connessioni dei client senza DISCONNECT (caduta di rete)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
+            except OSError:
+                pass
+
+    def publish(self, topic, payload, qos=0, packet_id=1):
+        """Invia un PUBLISH a tutti i client connessi"""
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        header = 0x30 | (qos << 1)
+        body = encode_string(topic)
+        if qos:
+            body += struct.pack('!H', packet_id)
+        body += encode_varint(0) + payload
+        packet = bytes([header]) + encode_varint(len(body)) + body
+        with self._lock:
+            for conn in self._connections:
+                conn.sendall(packet)
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._connections.append(conn)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _recv_exact(self, conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('connection closed')
+            data += chunk
+        return data
+
+    def _read_packet(self, conn):
+        header = self._recv_exact(conn, 1)[0]
+        multiplier, length = 1, 0
+        while True:
+            byte = self._recv_exact(conn, 1)[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        return header, self._recv_exact(conn, length) if length else b''
+
+    def _handle(self, conn):
+        try:
+            while self._running:
+                header, body = self._read_packet(conn)
+                packet_type = header >> 4
+                if packet_type == 1:
+                    self._on_connect(conn, body)
+                elif packet_type == 3:
+                    self._on_publish(conn, header, body)
+                elif packet_type == 4:
+                    self.pubacks.append(struct.unpack_from('!H', body)[0])
+                elif packet_type == 8:
+                    self._on_subscribe(conn, body)
+                elif packet_type == 10:
+                    self._on_unsubscribe(conn, body)
+                elif packet_type == 12:
+                    conn.sendall(bytes([0xD0, 0x00]))
+                elif packet_type == 14:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+            conn.close()
+
+    def _on_connect(self, conn, body):
+        protocol_name, offset = decode_string(body, 0)
+        level = body[offset]
+        flags = body[offset + 1]
+        props_length, props_offset = decode_varint(body, offset + 4)
+        session_expiry = 0
+        # Proprietà a lunghezza fissa inviate dal client; ci interessa solo 0x11
+        sizes = {0x11: 4, 0x21: 2, 0x22: 2, 0x27: 4, 0x17: 1, 0x19: 1}
+        cursor, end = props_offset, props_offset + props_length
+        while cursor < end and body[cursor] in sizes:
+            identifier = body[cursor]
+            if identifier == 0x11:
+                session_expiry = struct.unpack_from('!I', body, cursor + 1)[0]
+            cursor += 1 + sizes[identifier]
+        client_id, _ = decode_string(body, end)
+        self.connects.append({
+            'protocol': protocol_name,
+            'level': level,
+            'clean_start': bool(flags & 0x02),
+            'client_id': client_id,
+            'session_expiry': session_expiry,
+        })
+        # CONNACK v5: ack flags, reason code, proprietà vuote
+        conn.sendall(bytes([0x20, 0x03, int(self.session_present), 0x00, 0x00]))
+
+    def _on_publish(self, conn, header, body):
+        qos = (header >> 1) & 0x03
+        topic, offset = decode_string(body, 0)
+        packet_id = None
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+        props_length, offset = decode_varint(body, offset)
+        self.published.append((topic, body[offset + props_length:]))
+        if qos == 1:
+            conn.sendall(bytes([0x40, 0x02]) + packet_id)
+
+    def _on_subscribe(self, conn, body):
+        packet_id = body[:2]
+        props_length, offset = decode_varint(body, 2)
+        offset += props_length
+        codes = bytearray()
+        topics = []
+        while offset < len(body):
+            topic, offset = decode_string(body, offset)
+            options = body[offset]
+            offset += 1
+            topics.append(topic)
+            codes.append(options & 0x03)
+        self.subscriptions.extend(topics)
+        self.subscribe_packets.append(topics)
+        payload = packet_id + encode_varint(0) + bytes(codes)
+        conn.sendall(bytes([0x90]) + encode_varint(len(payload)) + payload)
+        self.subscribed.set()
+
+    def _on_unsubscribe(self, conn, body):
+        packet_id = body[:2]
+        props_length, offset = decode_varint(body, 2)
+        offset += props_length
+        codes = bytearray()
+        topics = []
+        while offset < len(body):
+            topic, offset = decode_string(body, offset)
+            topics.append(topic)
+            codes.append(0x00)
+        self.unsubscriptions.extend(topics)
+        self.unsubscribe_packets.append(topics)
+        payload = packet_id + encode_varint(0) + bytes(codes)
+        conn.sendall(bytes([0xB0]) + encode_varint(len(payload)) + payload)
@@ -0,0 +1,108 @@
+"""
+Minimal asyncio HTTP server emulating the Shelly Gen2 RPC API for the poller tests
+"""
+import asyncio
+import json
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeShellyServer:
+    """
+    Simulatore HTTP di un dispositivo Shelly Gen2: GET /rpc/<Metodo>
+    restituisce `statuses[Metodo]` (404 con errore RPC se sconosciuto).
+    Registra le richieste (metodo, parametri, istante) e le connessioni
+    aperte; `delay` ritarda ogni risposta, `chunked` usa Transfer-Encoding
+    chunked, `drop_after_response` chiude la connessione keep-alive dopo
+    ogni risposta senza avvisare, `error_status` risponde sempre con quel
+    codice HTTP.
+    """
+
+    def __init__(self, statuses=None, delay=0.0, chunked=False, drop_after_response=False, error_status=None):
+        self.statuses = dict(statuses or {})
+        self.delay = delay
+        self.chunked = chunked
+        self.drop_after_response = drop_after_response
+        self.error_status = error_status
+        self.requests = []
+        self.connections_opened = 0
+        self.port = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _handle(self, reader, writer):
+        self.connections_opened += 1
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                target = head.split(b' ', 2)[1].decode('ascii')
+                url = urlsplit(target)
+                method = url.path.rsplit('/', 1)[-1]
+                self.requests.append((method, dict(parse_qsl(url.query)), time.monotonic()))
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(self._respond(method))
+                await writer.drain()
+                if self.drop_after_response:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _respond(self, method):
+        if self.error_status:
+            status, body = self.error_status, {'code': -1, 'message': 'Errore simulato'}
+        elif method in self.statuses:
+            status, body = 200, self.statuses[method]
+        else:
+            status, body = 404, {'code': -114, 'message': f'Method {method} failed: No handler!'}
+        payload = json.dumps(body).encode('utf-8')
+        headers = f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+        if self.chunked:
+            middle = len(payload) // 2
+            body_bytes = b''.join(
+                f"{len(part):x}\r\n".encode('ascii') + part + b'\r\n'
+                for part in (payload[:middle], payload[middle:])
+            ) + b'0\r\n\r\n'
+            return (headers + "Transfer-Encoding: chunked\r\n\r\n").encode('ascii') + body_bytes
+        return (headers + f"Content-Length: {len(payload)}\r\n\r\n").encode('ascii') + payload
+
+
+def pro_3em_statuses(power=1500.0, energy_wh=10000.0, voltage=230.0):
+    """Risposte di EM.GetStatus ed EMData.GetStatus di un Pro 3EM"""
+    em = {'id': 0, 'total_act_power': power, 'total_current': round(power / voltage, 3),
+          'total_aprt_power': power, 'total_pf': 1.0}
+    for phase in ('a', 'b', 'c'):
+        em.update({
+            f'{phase}_voltage': voltage,
+            f'{phase}_current': round(power / 3 / voltage, 3),
+            f'{phase}_act_power': power / 3,
+            f'{phase}_pf': 1.0,
+            f'{phase}_freq': 50.0,
+        })
+    emdata = {'id': 0, 'total_act': energy_wh, 'total_act_ret': 0.0}
+    return {'EM.GetStatus': em, 'EMData.GetStatus': emdata}
+
+
+def plus_plug_s_statuses(power=60.0, energy_wh=250.0):
+    """Risposta di Switch.GetStatus di un Plus Plug S"""
+    return {'Switch.GetStatus': {
+        'id': 0, 'source': 'init', 'output': True, 'apower': power, 'voltage': 231.0,
+        'current': round(power / 231.0, 3), 'aenergy': {'total': energy_wh, 'by_minute': [0, 0, 0]},
+        'temperature': {'tC': 35.2, 'tF': 95.4},
+    }}
@@ -0,0 +1,161 @@
+"""
+Test suite for the per-device latest state maintained at ingest
+"""
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from energy.models import DeviceConfiguration, DeviceLatestState, DeviceMeasurement, DeviceMeasurementDetail
+from energy.models.latest import recent_state
+from energy.mqtt.batching import MeasurementBatchWriter
+from energy.mqtt.latest import update_latest_states
+from core.models import Plant, CERConfiguration
+
+User = get_user_model()
+
+
+class DeviceLatestStateTest(TestCase):
+    """Test cases for DeviceLatestState upserts from the batch writer"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='stateowner',
+            email='state@example.com',
+            password='TestPass123!',
+            first_name='State',
+            last_name='Owner'
+        )
+        self.cer = CERConfiguration.objects.create(
+            name='State CER',
+            code='CER_STATE',
+            primary_substation='Cabina Primaria Test'
+        )
+        self.plant = Plant.objects.create(
+            name='State Plant',
+            pod_code='IT001E00000010',
+            plant_type='CONSUMER',
+            nominal_power=6.0,
+            connection_voltage='230V',
+            installation_date='2023-01-01',
+            owner=self.user,
+            cer_configuration=self.cer
+        )
+        self.devices = [
+            DeviceConfiguration.objects.create(
+                device_id=f'shellypro3em-state{i}',
+                device_type='SHELLY_PRO_3EM',
+                plant=self.plant,
+                mqtt_topic_template=f'cercollettiva/IT001E00000010/shellypro3em-state{i}'
+            )
+            for i in range(2)
+        ]
+        self.writer = MeasurementBatchWriter(max_rows=1000, max_delay=60)
+
+    def _measurement(self, device, timestamp, power, measurement_type='POWER', energy=0.0):
+        return DeviceMeasurement(
+            device=device,
+            plant=self.plant,
+            timestamp=timestamp,
+            power=power,
+            voltage=230.0,
+            current=power / 230.0,
+            energy_total=energy,
+            measurement_type=measurement_type
+        )
+
+    def _details(self, power):
+        return [
+            DeviceMeasurementDetail(phase=phase, voltage=230.0, current=1.0, power=power, power_factor=0.9)
+            for phase in ('a', 'b', 'c')
+        ]
+
+    def test_flush_upserts_latest_state(self):
+        """Test that one flush keeps the newest reading of each device"""
+        now = timezone.now()
+        first, second = self.devices
+        self.writer.add(self._measurement(first, now - timedelta(seconds=2), 100.0), self._details(33.0))
+        self.writer.add(self._measurement(first, now, 300.0, energy=1234.0), self._details(100.0))
+        self.writer.add(self._measurement(second, now, 50.0))
+        self.writer.add(self._measurement(first, now, 0.0, 'ENERGY', 0.25))
+        self.writer.flush()
+
+        state = DeviceLatestState.objects.get(device=first)
+        self.assertEqual((state.power, state.energy_total, state.timestamp), (300.0, 1234.0, now))
+        self.assertEqual(state.plant_id, self.plant.pk)
+        self.assertEqual(state.phases['b'], {
+            'voltage': 230.0, 'current': 1.0, 'power': 100.0, 'power_factor': 0.9, 'frequency': 50
+        })
+        self.assertEqual([detail.phase for detail in state.phase_details], ['a', 'b', 'c'])
+        # Il delta ENERGY non sovrascrive i valori istantanei
+        self.assertEqual((state.energy_delta, state.energy_timestamp), (0.25, now))
+        self.assertEqual(DeviceLatestState.objects.get(device=second).power, 50.0)
+
+        # Un batch successivo aggiorna la riga esistente, una lettura più vecchia no
+        self.writer.add(self._measurement(first, now + timedelta(seconds=5), 400.0))
+        self.writer.add(self._measurement(second, now - timedelta(minutes=1), 10.0))
+        self.writer.flush()
+        self.assertEqual(DeviceLatestState.objects.count(), 2)
+        self.assertEqual(DeviceLatestState.objects.get(device=first).power, 400.0)
+        self.assertEqual(DeviceLatestState.objects.get(device=first).phases, {})
+        self.assertEqual(DeviceLatestState.objects.get(device=second).power, 50.0)
+
+    def test_concurrent_newer_state_is_kept(self):
+        """Test that the upsert does not overwrite a newer state written by another ingestor"""
+        now = timezone.now()
+        first = self.devices[0]
+        self.writer.add(self._measurement(first, now, 300.0))
+        self.writer.add(self._measurement(first, now, 0.0, 'ENERGY', 0.5))
+        self.writer.flush()
+
+        # Stato letto prima che l'altra replica scrivesse: il confronto avviene nel DB
+        with mock.patch.object(DeviceLatestState.objects, 'in_bulk', return_value={}):
+            update_latest_states([
+                (self._measurement(first, now - timedelta(seconds=5), 100.0), []),
+                (self._measurement(first, now + timedelta(seconds=5), 0.0, 'ENERGY', 0.7), []),
+            ])
+
+        state = DeviceLatestState.objects.get(device=first)
+        self.assertEqual((state.power, state.timestamp), (300.0, now))
+        # Il delta ENERGY più recente viene comunque applicato
+        self.assertEqual((state.energy_delta, state.energy_timestamp), (0.7, now + timedelta(seconds=5)))
+
+    def test_recent_state_join(self):
+        """Test that current values are read with a single join"""
+        now = timezone.now()
+        first, second = self.devices
+        self.writer.add(self._measurement(first, now, 300.0))
+        self.writer.add(self._measurement(second, now - timedelta(minutes=10), 50.0))
+        self.writer.flush()
+
+        with self.assertNumQueries(1):
+            devices = list(DeviceConfiguration.objects.filter(plant=self.plant)
+                           .select_related('latest_state').order_by('id'))
+            states = [recent_state(device, now) for device in devices]
+        self.assertEqual(states[0].power, 300.0)
+        # Dispositivo non aggiornato negli ultimi minuti: nessun valore attuale
+        self.assertIsNone(states[1])
+
+    def test_cer_power_uses_newest_device(self):
+        """Test that the CER power reads the newest device of a plant, as plant.devices.first()"""
+        now = timezone.now()
+        older, newer = self.devices
+        DeviceConfiguration.objects.filter(pk=older.pk).update(created_at=now - timedelta(days=2))
+        DeviceConfiguration.objects.filter(pk=newer.pk).update(created_at=now - timedelta(days=1))
+        self.writer.add(self._measurement(older, now, 3000.0))
+        self.writer.add(self._measurement(newer, now, 500.0))
+        self.writer.flush()
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('core:cer-power-api'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'][0]['consumer_power'], 0.5)
+
+        # Senza una lettura recente del dispositivo più nuovo non si ripiega sugli altri
+        DeviceLatestState.objects.filter(device=newer).update(timestamp=now - timedelta(minutes=10))
+        response = self.client.get(reverse('core:cer-power-api'))
+        self.assertEqual(response.json()['data'][0]['consumer_power'], 0)
@@ -0,0 +1,110 @@
+"""
+Test suite for the compiled declarative payload mappings
+"""
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, TestCase
+from energy.devices import mapping
+from energy.devices.mapping import (
+    DEFAULT_MAPPING, KIND_POWER, MappingError, PayloadMapping, PayloadMappingRegistry
+)
+from energy.models import DeviceType
+from energy.mqtt.codec import decode_message
+
+TASMOTA_PAYLOAD = (
+    b'{"Time": "2024-05-01T10:00:00", "ENERGY": {"Total": 12.5, "Power": 800, '
+    b'"Voltage": 231, "Current": 3.6, "Factor": 0.96}}'
+)
+
+
+class PayloadMappingTest(SimpleTestCase):
+    """Test cases for the mapping compiler"""
+
+    def test_default_shelly_mapping(self):
+        """Test that the built-in Shelly mapping extracts scalars and complete phases"""
+        kind, extract = DEFAULT_MAPPING.match('cercollettiva/POD/dev/status/em:0')
+        self.assertEqual(kind, KIND_POWER)
+        power, energy, voltage, current, power_factor, phases = extract({
+            'total_act_power': 100, 'total_act': 5.0, 'a_voltage': 230, 'a_current': 0.5,
+            'a_act_power': 100, 'b_voltage': 231,
+        })
+        self.assertEqual((power, energy, voltage, current, power_factor), (100.0, 5.0, 230.0, 0.5, 1.0))
+        self.assertEqual(phases, (('a', 230.0, 0.5, 100.0, 1.0, 50.0),))
+        self.assertIsNone(DEFAULT_MAPPING.match('cercollettiva/POD/dev/status/switch:0'))
+
+    def test_nested_paths_units_and_scale(self):
+        """Test nested paths, list indexes, unit conversion and scale factors"""
+        compiled = PayloadMapping({'messages': {'tele/SENSOR': {
+            'fields': {
+                'power': {'path': 'ENERGY.Power', 'unit': 'kW'},
+                'energy_total': {'path': 'ENERGY.Total', 'unit': 'kWh'},
+                'voltage': {'path': 'ENERGY.Voltage', 'scale': 0.1},
+                'current': {'path': 'Meters.1', 'unit': 'mA'},
+                'power_factor': {'path': 'ENERGY.Missing', 'default': 0.5},
+            },
+        }}})
+        kind, extract = compiled.match('tasmota/plug/tele/SENSOR')
+        values = extract({'ENERGY': {'Power': 1.5, 'Total': 2, 'Voltage': 2300}, 'Meters': [0, 250]})
+        self.assertEqual(values, (1500.0, 2000.0, 230.0, 0.25, 0.5, ()))
+
+    def test_invalid_specs(self):
+        """Test that invalid specs are rejected at compile time"""
+        invalid = [
+            {},
+            {'messages': {'em:0': {'kind': 'GAS'}}},
+            {'messages': {'em:0': {'fields': {'temperature': 'temp'}}}},
+            {'messages': {'em:0': {'fields': {'power': {'path': 'p', 'unit': 'BTU'}}}}},
+            {'messages': {'em:0': {'phases': {'names': ['a'], 'fields': {'voltage': '{phase}_v'}}}}},
+        ]
+        for spec in invalid:
+            with self.subTest(spec=spec), self.assertRaises(MappingError):
+                PayloadMapping(spec)
+
+
+class PayloadMappingRegistryTest(TestCase):
+    """Test cases for the per device type mapping registry"""
+
+    def setUp(self):
+        registry = PayloadMappingRegistry()
+        self.addCleanup(setattr, mapping, '_mapping_registry', mapping._mapping_registry)
+        mapping._mapping_registry = registry
+        self.registry = registry
+
+    def test_builtin_tasmota_mapping(self):
+        """Test that Tasmota tele/SENSOR is decoded without a DeviceType row"""
+        compiled = self.registry.get('TASMOTA', 'POWER_METER')
+        record = decode_message('tasmota/plug-1/tele/SENSOR', TASMOTA_PAYLOAD, compiled)
+        self.assertEqual(record.kind, KIND_POWER)
+        self.assertEqual(record.power, 800.0)
+        self.assertEqual(record.energy_total, 12500.0)
+        self.assertEqual(record.power_factor, 0.96)
+        self.assertIs(self.registry.get('SHELLY', 'PRO_3EM'), DEFAULT_MAPPING)
+
+    def test_device_type_mapping_is_loaded_and_invalidated(self):
+        """Test that DeviceType.mqtt_payload_format is compiled and reloaded on change"""
+        device_type = DeviceType.objects.create(
+            name='Huawei SUN2000', vendor='HUAWEI', model='SUN2000',
+            mqtt_topic_template='huawei/{serial}',
+            mqtt_payload_format={'messages': {'/data': {
+                'fields': {'power': {'path': 'active_power', 'unit': 'kW'}},
+            }}}
+        )
+        compiled = self.registry.get('HUAWEI', 'SUN2000')
+        self.assertEqual(compiled.match('huawei/123/data')[1]({'active_power': 2.5})[0], 2500.0)
+        self.assertIs(self.registry.get('HUAWEI', 'SUN2000'), compiled)
+
+        device_type.mqtt_payload_format = {'messages': {'/data': {
+            'fields': {'power': 'active_power'},
+        }}}
+        device_type.save()
+        updated = self.registry.get('HUAWEI', 'SUN2000')
+        self.assertIsNot(updated, compiled)
+        self.assertEqual(updated.match('huawei/123/data')[1]({'active_power': 2.5})[0], 2.5)
+
+    def test_clean_rejects_invalid_format(self):
+        """Test the admin validation of mqtt_payload_format"""
+        device_type = DeviceType(
+            name='Broken', vendor='ACME', model='X', mqtt_topic_template='acme/{serial}',
+            mqtt_payload_format={'messages': {'x': {'kind': 'GAS'}}}
+        )
+        with self.assertRaises(ValidationError):
+            device_type.clean()
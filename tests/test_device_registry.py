@@ -0,0 +1,40 @@
+"""
+Test suite for the DeviceRegistry lookup tables
+"""
+from django.test import SimpleTestCase
+from energy.devices.registry import DeviceRegistry
+from energy.devices.vendors.shelly.pro_3em import ShellyPro3EM
+from energy.devices.vendors.shelly.em_3 import ShellyEM3
+
+
+class DeviceRegistryTest(SimpleTestCase):
+    """Test cases for DeviceRegistry"""
+
+    def test_lookup_returns_shared_instance(self):
+        """Test that lookups return the same stateless driver instance"""
+        device = DeviceRegistry.get_device_by_vendor_model('SHELLY', 'PRO_3EM')
+        self.assertIsInstance(device, ShellyPro3EM)
+        self.assertIs(DeviceRegistry.get_device_by_vendor_model('SHELLY', 'PRO_3EM'), device)
+        self.assertIs(DeviceRegistry.get_device('SHELLY_PRO_3EM'), device)
+
+    def test_normalized_and_alias_lookup(self):
+        """Test case, spacing, underscore-less and alias variants"""
+        device = DeviceRegistry.get_device_by_vendor_model('SHELLY', 'PRO_3EM')
+        self.assertIs(DeviceRegistry.get_device_by_vendor_model(' shelly ', 'pro 3em'), device)
+        self.assertIs(DeviceRegistry.get_device_by_vendor_model('Shelly', 'PRO3EM'), device)
+        self.assertIsInstance(DeviceRegistry.get_device_by_vendor_model('shelly', '3em'), ShellyEM3)
+
+    def test_unknown_device_is_memoized(self):
+        """Test that a miss is logged once and then answered from the memo"""
+        with self.assertLogs('energy.devices.registry', level='WARNING') as logs:
+            self.assertIsNone(DeviceRegistry.get_device_by_vendor_model('ACME', 'X1'))
+            self.assertIsNone(DeviceRegistry.get_device_by_vendor_model('ACME', 'X1'))
+        self.assertEqual(len(logs.output), 1)
+
+    def test_supported_vendors_and_models(self):
+        """Test the precomputed vendor and model lists"""
+        self.assertIn('SHELLY', DeviceRegistry.get_supported_vendors())
+        models = DeviceRegistry.get_supported_models('shelly')
+        self.assertEqual(models, sorted(models))
+        self.assertIn('PRO_3EM', models)
+        self.assertIn(('SHELLY_PRO_3EM', 'SHELLY PRO_3EM'), DeviceRegistry.list_devices())
@@ -0,0 +1,178 @@
+"""
+Test suite for the monthly measurement partitioning helpers
+"""
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import skipIf, skipUnless
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase
+from energy.models import DeviceConfiguration, DeviceMeasurement, DeviceMeasurementDetail, EnergyMeasurement
+from energy.partitioning import (
+    add_months, convert_tables, create_partition_sql, expire_partitions, is_partitioned, list_partitions,
+    month_start, partition_month, partition_name, partitioned_tables
+)
+from core.models import Plant, CERConfiguration
+
+User = get_user_model()
+NOW = datetime(2026, 10, 17, 12, 0, tzinfo=dt_timezone.utc)
+
+
+class PartitionHelpersTest(SimpleTestCase):
+    """Test cases for the partition naming and range helpers"""
+
+    def test_months_and_names(self):
+        """Test month arithmetic, UTC month boundaries and partition names"""
+        self.assertEqual(add_months(date(2026, 11, 1), 2), date(2027, 1, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        # 00:30 ora italiana del 1° novembre è ancora ottobre in UTC
+        local = datetime(2026, 11, 1, 0, 30, tzinfo=dt_timezone(timedelta(hours=1)))
+        self.assertEqual(month_start(local), date(2026, 10, 1))
+        self.assertEqual(month_start(date(2026, 10, 17)), date(2026, 10, 1))
+
+        name = partition_name('energy_devicemeasurement', date(2026, 10, 1))
+        self.assertEqual(name, 'energy_devicemeasurement_p202610')
+        self.assertEqual(partition_month(name), date(2026, 10, 1))
+        self.assertIsNone(partition_month('energy_devicemeasurement_default'))
+        self.assertEqual(
+            create_partition_sql('energy_devicemeasurement', date(2026, 12, 1)),
+            'CREATE TABLE "energy_devicemeasurement_p202612" PARTITION OF "energy_devicemeasurement" '
+            "FOR VALUES FROM ('2026-12-01 00:00:00+00') TO ('2027-01-01 00:00:00+00')"
+        )
+
+    def test_partitioned_tables(self):
+        """Test that details follow their measurement and ORM cascades are cleaned up"""
+        measurement, detail = partitioned_tables()
+        self.assertEqual(measurement.table, 'energy_devicemeasurement')
+        self.assertIn(('energy_energymeasurement', 'device_measurement_id'), measurement.cascades)
+        self.assertEqual(detail.parent, ('energy_devicemeasurement', 'measurement_id'))
+
+
+class PartitionCommandTest(TestCase):
+    """Test cases for the manage_measurement_partitions command"""
+
+    @skipIf(connection.vendor == 'postgresql', 'Verifica il rifiuto degli altri backend')
+    def test_requires_postgresql(self):
+        """Test that the command refuses to run on other database backends"""
+        with self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+            call_command('manage_measurement_partitions', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Il partizionamento richiede PostgreSQL')
+class PartitionConversionTest(TestCase):
+    """Test cases for converting populated measurement tables (PostgreSQL only)"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='partitionowner',
+            email='partition@example.com',
+            password='TestPass123!',
+            first_name='Partition',
+            last_name='Owner'
+        )
+        self.cer = CERConfiguration.objects.create(
+            name='Partition CER',
+            code='CER_PARTITION',
+            primary_substation='Cabina Primaria Test'
+        )
+        self.plant = Plant.objects.create(
+            name='Partition Plant',
+            pod_code='IT001E00000013',
+            plant_type='CONSUMER',
+            nominal_power=6.0,
+            connection_voltage='230V',
+            installation_date='2023-01-01',
+            owner=self.user,
+            cer_configuration=self.cer
+        )
+        self.device = DeviceConfiguration.objects.create(
+            device_id='shellypro3em-partition',
+            device_type='SHELLY_PRO_3EM',
+            plant=self.plant,
+            mqtt_topic_template='cercollettiva/IT001E00000013/shellypro3em-partition'
+        )
+        self.measurements = [self._measurement(NOW - timedelta(days=days)) for days in (70, 40, 2)]
+        for measurement in DeviceMeasurement.objects.bulk_create(self.measurements):
+            # Dettagli storici con un timestamp diverso da quello della misurazione
+            DeviceMeasurementDetail.objects.bulk_create([
+                self._detail(measurement, phase, timestamp=measurement.timestamp + timedelta(seconds=1))
+                for phase in ('a', 'b', 'c')
+            ])
+            EnergyMeasurement.objects.create(
+                device_measurement=measurement, timestamp=measurement.timestamp,
+                measurement_type='ENERGY_TOTAL', value=1.5, unit='kWh', topic='test/energy'
+            )
+        # Come nel comando, la conversione parte senza verifiche FK differite in sospeso
+        self._check_constraints()
+
+    def _measurement(self, timestamp):
+        return DeviceMeasurement(
+            device=self.device,
+            plant=self.plant,
+            timestamp=timestamp,
+            power=-169.8,
+            voltage=230.4,
+            current=3.75,
+            measurement_type='POWER'
+        )
+
+    def _detail(self, measurement, phase, timestamp=None):
+        return DeviceMeasurementDetail(
+            measurement=measurement, timestamp=timestamp or measurement.timestamp,
+            phase=phase, voltage=230.0, current=1.0, power=-56.6, power_factor=0.9
+        )
+
+    def _check_constraints(self):
+        # Le FK sono DEFERRABLE INITIALLY DEFERRED: da qui in poi sono verificate subito, non al commit
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def test_convert_populated_tables(self):
+        """Test that conversion keeps the rows and the tables stay writable through the ORM"""
+        measurement_table, detail_table = (spec.table for spec in partitioned_tables())
+        with connection.cursor() as cursor:
+            converted = convert_tables(cursor, partitioned_tables(), premake_months=1, now=NOW)
+            self.assertEqual(converted, [measurement_table, detail_table])
+            self.assertTrue(is_partitioned(cursor, measurement_table))
+            self.assertTrue(is_partitioned(cursor, detail_table))
+            self.assertEqual(list_partitions(cursor, measurement_table), [
+                f'{measurement_table}_default', f'{measurement_table}_p202608', f'{measurement_table}_p202609',
+                f'{measurement_table}_p202610', f'{measurement_table}_p202611',
+            ])
+            # Una seconda esecuzione non fa nulla
+            self.assertEqual(convert_tables(cursor, partitioned_tables(), now=NOW), [])
+
+        self.assertEqual(DeviceMeasurement.objects.count(), 3)
+        # I dettagli prendono il timestamp della misurazione
+        for measurement in DeviceMeasurement.objects.prefetch_related('phase_details'):
+            self.assertEqual({detail.timestamp for detail in measurement.phase_details.all()},
+                             {measurement.timestamp})
+        self.assertEqual(EnergyMeasurement.objects.count(), 3)
+
+        # setval: i nuovi id proseguono dopo quelli copiati
+        last_id = max(measurement.pk for measurement in self.measurements)
+        created = DeviceMeasurement.objects.bulk_create([self._measurement(NOW), self._measurement(NOW)])
+        self.assertEqual(sorted(measurement.pk for measurement in created), [last_id + 1, last_id + 2])
+        DeviceMeasurementDetail.objects.bulk_create([self._detail(created[0], 'a')])
+
+        # FK composta (measurement_id, timestamp) verso la misurazione
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DeviceMeasurementDetail.objects.bulk_create([
+                self._detail(created[1], 'a', timestamp=NOW - timedelta(days=1))
+            ])
+        self.assertEqual(DeviceMeasurementDetail.objects.count(), 10)
+
+    def test_expire_converted_partitions(self):
+        """Test that expired months are detached after removing their ORM cascades"""
+        measurement_table, detail_table = (spec.table for spec in partitioned_tables())
+        with connection.cursor() as cursor:
+            convert_tables(cursor, partitioned_tables(), premake_months=1, now=NOW)
+            expired = expire_partitions(cursor, partitioned_tables(), retention_months=2, now=NOW)
+        self.assertEqual(expired, [f'{detail_table}_p202608', f'{measurement_table}_p202608'])
+        self.assertEqual(DeviceMeasurement.objects.count(), 2)
+        self.assertEqual(DeviceMeasurementDetail.objects.count(), 6)
+        self.assertEqual(EnergyMeasurement.objects.count(), 2)
+        self._check_constraints()
@@ -0,0 +1,175 @@
+"""
+Test suite for the tiered measurement retention and rollups
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from energy.models import (
+    DeviceConfiguration, DeviceMeasurement, DeviceMeasurementDetail, MeasurementRollup, RollupCheckpoint
+)
+from energy.retention import (
+    RAW, ROLLUP_TIERS, RetentionPolicy, apply_retention, floor_time, read_measurements, rollup_tier,
+    select_resolution
+)
+from core.models import Plant, CERConfiguration
+
+User = get_user_model()
+
+NOW = datetime(2026, 10, 17, 12, 0, tzinfo=dt_timezone.utc)
+OLD = datetime(2026, 10, 10, 10, 0, tzinfo=dt_timezone.utc)
+
+
+class RetentionHelpersTest(SimpleTestCase):
+    """Test cases for the retention time helpers"""
+
+    def test_floor_time(self):
+        """Test that timestamps are floored to UTC bucket boundaries"""
+        local = datetime(2026, 10, 17, 14, 7, 31, tzinfo=dt_timezone(timedelta(hours=2)))
+        self.assertEqual(floor_time(local, 60), datetime(2026, 10, 17, 12, 7, tzinfo=dt_timezone.utc))
+        self.assertEqual(floor_time(local, 900), datetime(2026, 10, 17, 12, 0, tzinfo=dt_timezone.utc))
+
+    def test_select_resolution(self):
+        """Test that the finest tier still covering the range is chosen"""
+        policy = RetentionPolicy(raw_days=30, rollup_1m_days=180)
+        self.assertEqual(select_resolution(NOW - timedelta(hours=24), now=NOW, policy=policy), RAW)
+        self.assertEqual(select_resolution(NOW - timedelta(days=7), now=NOW, policy=policy), '1M')
+        self.assertEqual(select_resolution(NOW - timedelta(days=30), now=NOW, policy=policy), '15M')
+        # Un intervallo breve ma oltre la retention delle grezze legge i rollup
+        start = NOW - timedelta(days=40)
+        self.assertEqual(select_resolution(start, start + timedelta(hours=1), NOW, policy), '1M')
+
+
+class MeasurementRetentionTest(TestCase):
+    """Test cases for the rollup and expiry engine"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='retentionowner',
+            email='retention@example.com',
+            password='TestPass123!',
+            first_name='Retention',
+            last_name='Owner'
+        )
+        self.cer = CERConfiguration.objects.create(
+            name='Retention CER',
+            code='CER_RETENTION',
+            primary_substation='Cabina Primaria Test'
+        )
+        self.plant = Plant.objects.create(
+            name='Retention Plant',
+            pod_code='IT001E00000009',
+            plant_type='CONSUMER',
+            nominal_power=6.0,
+            connection_voltage='230V',
+            installation_date='2023-01-01',
+            owner=self.user,
+            cer_configuration=self.cer
+        )
+        self.device = DeviceConfiguration.objects.create(
+            device_id='shellypro3em-retention',
+            device_type='SHELLY_PRO_3EM',
+            plant=self.plant,
+            mqtt_topic_template='cercollettiva/IT001E00000009/shellypro3em-retention'
+        )
+        self.policy = RetentionPolicy(raw_days=1, rollup_1m_days=3, chunk_hours=24)
+
+        # Due campioni nel minuto 10:00 (media 200) e uno nel minuto 10:01
+        first = self._measurement(OLD + timedelta(seconds=10), 100.0)
+        self._measurement(OLD + timedelta(seconds=40), 300.0)
+        self._measurement(OLD + timedelta(seconds=80), 500.0)
+        self._measurement(OLD + timedelta(seconds=30), 0.0, 'ENERGY', 0.1)
+        self._measurement(OLD + timedelta(minutes=5), 0.0, 'ENERGY', 0.2)
+        DeviceMeasurementDetail.objects.create(
+            measurement=first, phase='a', voltage=230.0, current=0.4, power=100.0, timestamp=first.timestamp)
+        self.recent = self._measurement(NOW - timedelta(hours=1), 700.0)
+
+    def _measurement(self, timestamp, power, measurement_type='POWER', energy=0.0):
+        return DeviceMeasurement.objects.create(
+            device=self.device,
+            plant=self.plant,
+            timestamp=timestamp,
+            power=power,
+            voltage=230.0,
+            current=power / 230.0,
+            energy_total=energy,
+            measurement_type=measurement_type
+        )
+
+    def test_rollups_and_expiry(self):
+        """Test that rollups are computed before raw and 1-minute rows expire"""
+        report = apply_retention(self.policy, NOW)
+
+        # Grezze oltre un giorno cancellate con i dettagli, la recente resta
+        self.assertEqual(list(DeviceMeasurement.objects.values_list('pk', flat=True)), [self.recent.pk])
+        self.assertFalse(DeviceMeasurementDetail.objects.exists())
+        expired = {item.table: item.rows for item in report.expired}
+        self.assertEqual(expired['energy_devicemeasurement'], 5)
+        self.assertEqual(expired['energy_devicemeasurementdetail'], 1)
+
+        # Rollup a 1 minuto scaduti dopo 3 giorni, quelli a 15 minuti restano
+        self.assertFalse(MeasurementRollup.objects.filter(resolution='1M', bucket_start__lt=NOW - timedelta(days=3)).exists())
+        power = MeasurementRollup.objects.get(resolution='15M', bucket_start=OLD, measurement_type='POWER')
+        self.assertEqual(power.sample_count, 3)
+        self.assertEqual((power.power_min, power.power_max), (100.0, 500.0))
+        # Media pesata sui campioni dei minuti (200 x 2 e 500 x 1)
+        self.assertAlmostEqual(power.power_avg, 300.0)
+        energy = MeasurementRollup.objects.get(resolution='15M', bucket_start=OLD, measurement_type='ENERGY')
+        self.assertAlmostEqual(energy.energy_total, 0.3)
+
+        recent = MeasurementRollup.objects.get(resolution='1M', bucket_start=self.recent.timestamp)
+        self.assertEqual((recent.power_avg, recent.plant_id), (700.0, self.plant.pk))
+        checkpoints = dict(RollupCheckpoint.objects.values_list('resolution', 'processed_until'))
+        self.assertEqual(checkpoints['1M'], NOW - timedelta(minutes=5))
+        self.assertEqual(checkpoints['15M'], NOW - timedelta(minutes=15))
+
+    def test_resumable_and_idempotent(self):
+        """Test that chunked rollups resume from the checkpoint and can be recomputed"""
+        tier = ROLLUP_TIERS[0]
+        rollup_tier(tier, self.policy, NOW, max_chunks=1)
+        first_chunk_end = floor_time(OLD, 60) + timedelta(hours=24)
+        self.assertEqual(RollupCheckpoint.objects.get(resolution='1M').processed_until, first_chunk_end)
+        self.assertEqual(MeasurementRollup.objects.count(), 4)
+
+        rollup_tier(tier, self.policy, NOW)
+        rows = list(MeasurementRollup.objects.order_by('bucket_start', 'measurement_type').values_list(
+            'bucket_start', 'measurement_type', 'sample_count', 'power_avg', 'energy_total'))
+        self.assertEqual(len(rows), 5)
+
+        # Ripartendo da zero i rollup vengono aggiornati, non duplicati
+        RollupCheckpoint.objects.all().delete()
+        rollup_tier(tier, self.policy, NOW)
+        self.assertEqual(list(MeasurementRollup.objects.order_by('bucket_start', 'measurement_type').values_list(
+            'bucket_start', 'measurement_type', 'sample_count', 'power_avg', 'energy_total')), rows)
+
+    def test_dry_run(self):
+        """Test that the dry run reports rows and bytes without changing data"""
+        out = StringIO()
+        call_command('apply_measurement_retention', '--dry-run', stdout=out)
+        self.assertEqual(DeviceMeasurement.objects.count(), 6)
+        self.assertFalse(MeasurementRollup.objects.exists())
+
+        report = apply_retention(self.policy, NOW, dry_run=True)
+        expired = {item.table: item for item in report.expired}
+        self.assertEqual(expired['energy_devicemeasurement'].rows, 5)
+        self.assertEqual(expired['energy_devicemeasurementdetail'].rows, 1)
+        self.assertGreater(expired['energy_devicemeasurement'].bytes, 0)
+        self.assertIn('Totale stimato', out.getvalue())
+
+    def test_read_measurements_tiers(self):
+        """Test that chart reads combine rollups with the not yet aggregated raw rows"""
+        apply_retention(self.policy, NOW)
+        latest = self._measurement(NOW - timedelta(minutes=2), 900.0)
+
+        points = read_measurements(NOW - timedelta(days=8), now=NOW, policy=self.policy,
+                                   device=self.device, measurement_type='POWER')
+        self.assertEqual([(p.resolution, p.timestamp, p.power) for p in points], [
+            ('15M', OLD, 300.0),
+            ('15M', NOW - timedelta(hours=1), 700.0),
+            (RAW, latest.timestamp, 900.0),
+        ])
+
+        points = read_measurements(NOW - timedelta(hours=2), now=NOW, policy=self.policy, device=self.device)
+        self.assertEqual([p.resolution for p in points], [RAW, RAW])
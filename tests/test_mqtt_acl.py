@@ -0,0 +1,165 @@
+"""
+Test suite for the broker auth/ACL HTTP backend
+"""
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from energy.models import DeviceConfiguration, MQTTBroker, MQTTConfiguration
+from energy.mqtt import acl, audit
+from energy.mqtt.acl import (
+    ACC_READ,
+    ACC_SUBSCRIBE,
+    ACC_WRITE,
+    MQTTAccessIndex,
+    TopicPrefixTrie,
+)
+from core.models import Plant, CERConfiguration
+
+User = get_user_model()
+
+
+class GoAuthStandIn:
+    """Richieste del backend HTTP di mosquitto-go-auth (params_mode form o json)"""
+
+    def __init__(self, client, params_mode='form'):
+        self.client = client
+        self.params_mode = params_mode
+
+    def _post(self, name, params):
+        url = reverse(f'energy:mqtt-auth-{name}')
+        if self.params_mode == 'json':
+            return self.client.post(url, params, content_type='application/json').status_code == 200
+        return self.client.post(url, params).status_code == 200
+
+    def connect(self, username, password, clientid='device'):
+        return self._post('user', {'username': username, 'password': password, 'clientid': clientid})
+
+    def superuser(self, username):
+        return self._post('superuser', {'username': username})
+
+    def acl(self, username, topic, acc, clientid='device'):
+        return self._post('acl', {'username': username, 'topic': topic, 'clientid': clientid, 'acc': acc})
+
+
+class TopicPrefixTrieTest(SimpleTestCase):
+    """Test cases for TopicPrefixTrie"""
+
+    def test_prefix_levels(self):
+        """Test that only topics below a registered prefix are allowed"""
+        trie = TopicPrefixTrie(['cercollettiva/IT001/', 'cercollettiva/IT002/'])
+        self.assertTrue(trie.allows('cercollettiva/IT001/shelly/status/em:0'))
+        self.assertTrue(trie.allows('cercollettiva/IT002/#'))
+        self.assertFalse(trie.allows('cercollettiva/IT0011/shelly'))
+        self.assertFalse(trie.allows('cercollettiva/IT001'))
+        self.assertFalse(trie.allows('cercollettiva/+/shelly'))
+        self.assertFalse(trie.allows('cercollettiva/#'))
+
+
+@override_settings(MQTT_SETTINGS={'ACL_VERSION_CHECK_INTERVAL': 60})
+class BrokerAuthEndpointTest(TestCase):
+    """Test cases for the mosquitto-go-auth compatible endpoints"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='aclowner',
+            email='acl@example.com',
+            password='TestPass123!',
+            first_name='Acl',
+            last_name='Owner'
+        )
+        self.cer = CERConfiguration.objects.create(
+            name='Acl CER',
+            code='CER_ACL',
+            primary_substation='Cabina Primaria Test'
+        )
+        self.plants = [
+            Plant.objects.create(
+                name=f'Acl Plant {pod}',
+                pod_code=pod,
+                plant_type='CONSUMER',
+                nominal_power=6.0,
+                connection_voltage='230V',
+                installation_date='2023-01-01',
+                owner=self.user,
+                cer_configuration=self.cer
+            )
+            for pod in ('IT001E00000011', 'IT001E00000012')
+        ]
+        self.device = DeviceConfiguration.objects.create(
+            device_id='shellypro3em-acl',
+            device_type='SHELLY_PRO_3EM',
+            plant=self.plants[0],
+            mqtt_topic_template='cercollettiva/IT001E00000011/shellypro3em-acl'
+        )
+        MQTTConfiguration.objects.create(device=self.device, mqtt_username='dev-acl', mqtt_password='s3cret')
+        MQTTBroker.objects.create(name='Broker', host='localhost', username='ingestor',
+                                  password='ingest-pass', use_tls=False)
+
+        self.addCleanup(setattr, acl, '_access_index', acl._access_index)
+        acl._access_index = MQTTAccessIndex()
+        # Eventi di audit solo in memoria durante il test
+        self.addCleanup(setattr, audit, '_audit_writer', audit._audit_writer)
+        audit._audit_writer = audit.AuditEventWriter(flush_interval=3600)
+        self.broker = GoAuthStandIn(self.client)
+
+    def test_connect(self):
+        """Test device and ingestor credentials"""
+        self.assertTrue(self.broker.connect('dev-acl', 's3cret'))
+        self.assertFalse(self.broker.connect('dev-acl', 'wrong'))
+        self.assertFalse(self.broker.connect('unknown', 's3cret'))
+        self.assertTrue(self.broker.connect('ingestor', 'ingest-pass'))
+        self.assertTrue(self.broker.superuser('ingestor'))
+        self.assertFalse(self.broker.superuser('dev-acl'))
+
+    def test_acl_owner_prefixes(self):
+        """Test that a device may use the topics of all the owner's plants"""
+        own = 'cercollettiva/IT001E00000011/shellypro3em-acl/status/em:0'
+        self.assertTrue(self.broker.acl('dev-acl', own, ACC_WRITE))
+        self.assertTrue(self.broker.acl('dev-acl', 'cercollettiva/IT001E00000012/#', ACC_SUBSCRIBE))
+        self.assertFalse(self.broker.acl('dev-acl', 'cercollettiva/IT001E00000099/x/status', ACC_WRITE))
+        self.assertFalse(self.broker.acl('dev-acl', 'cercollettiva/+/#', ACC_SUBSCRIBE))
+        self.assertTrue(self.broker.acl('ingestor', 'cercollettiva/+/#', ACC_SUBSCRIBE))
+
+    def test_json_params(self):
+        """Test the params_mode json variant"""
+        broker = GoAuthStandIn(self.client, params_mode='json')
+        self.assertTrue(broker.connect('dev-acl', 's3cret'))
+        self.assertTrue(broker.acl('dev-acl', 'cercollettiva/IT001E00000011/a', ACC_READ))
+
+    def test_json_body_not_object(self):
+        """Test that a JSON body that is not an object is rejected, not a server error"""
+        url = reverse('energy:mqtt-auth-user')
+        for body in ('[]', '"x"', '1', 'null'):
+            response = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_reconnect_storm_without_queries(self):
+        """Test that repeated connects and ACL checks are answered from memory"""
+        self.broker.connect('dev-acl', 's3cret')
+        topic = 'cercollettiva/IT001E00000011/shellypro3em-acl/status/em:0'
+        with self.assertNumQueries(0):
+            for _ in range(200):
+                self.assertTrue(self.broker.connect('dev-acl', 's3cret'))
+                self.assertTrue(self.broker.acl('dev-acl', topic, ACC_WRITE))
+
+    def test_signals_invalidate_index(self):
+        """Test that credential and plant changes are picked up"""
+        self.assertTrue(self.broker.connect('dev-acl', 's3cret'))
+        config = MQTTConfiguration.objects.get(mqtt_username='dev-acl')
+        config.mqtt_password = 'rotated'
+        config.save()
+        self.assertFalse(self.broker.connect('dev-acl', 's3cret'))
+        self.assertTrue(self.broker.connect('dev-acl', 'rotated'))
+
+        self.plants[1].delete()
+        self.assertFalse(self.broker.acl('dev-acl', 'cercollettiva/IT001E00000012/#', ACC_SUBSCRIBE))
+
+        self.device.is_active = False
+        self.device.save()
+        self.assertFalse(self.broker.connect('dev-acl', 'rotated'))
+
+    @override_settings(MQTT_SETTINGS={'AUTH_ALLOWED_HOSTS': ['10.0.0.5']})
+    def test_rejects_other_hosts(self):
+        """Test that only the broker host may query the endpoint"""
+        self.assertFalse(self.broker.connect('dev-acl', 's3cret'))
@@ -0,0 +1,110 @@
+"""
+Test suite for the buffered MQTT audit writer
+"""
+import random
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from energy.models import MQTTAuditLog
+from energy.mqtt import audit
+from energy.mqtt.audit import AuditEventWriter, get_audit_counters
+
+User = get_user_model()
+
+
+@override_settings(MQTT_SETTINGS={})
+class AuditEventWriterTest(TestCase):
+    """Test cases for AuditEventWriter"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.writer = AuditEventWriter(flush_interval=60, sample_rates={'MESSAGE': 0.1})
+
+    def test_events_written_in_one_insert(self):
+        """Test that queued events are bulk-inserted with retention and masked topic"""
+        for index in range(3):
+            self.writer.record('CONNECT', mqtt_username='ingestor', client_id=f'client-{index}')
+        self.writer.record('SUBSCRIBE', topic='cercollettiva/IT001E00000013/shellypro3em-audit/status')
+        self.assertEqual(MQTTAuditLog.objects.count(), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.writer.flush(), 4)
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+
+        self.assertFalse(MQTTAuditLog.objects.filter(retention_date__isnull=True).exists())
+        topic = MQTTAuditLog.objects.get(operation='SUBSCRIBE').topic
+        self.assertNotIn('shellypro3em-audit', topic)
+
+    def test_sampling_keeps_counters_exact(self):
+        """Test that sampled-out messages are counted but not stored"""
+        random.seed(7)
+        for index in range(1000):
+            self.writer.record('MESSAGE', status=index % 10 != 0, topic='cercollettiva/IT001/dev/status/em:0')
+        self.writer.flush()
+
+        stored = MQTTAuditLog.objects.filter(operation='MESSAGE').count()
+        self.assertTrue(50 <= stored <= 150, stored)
+        self.assertEqual(MQTTAuditLog.objects.filter(operation='MESSAGE').first().details['sample_rate'], 0.1)
+        counters = get_audit_counters()
+        self.assertEqual(counters[('MESSAGE', True)], 900)
+        self.assertEqual(counters[('MESSAGE', False)], 100)
+
+    def test_counters_seeded_from_existing_rows(self):
+        """Test that counters start from the rows already in the table"""
+        MQTTAuditLog.objects.create(mqtt_username='old', operation='CONNECT', status=False)
+        self.writer.record('CONNECT', status=False)
+        self.writer.flush()
+        self.assertEqual(get_audit_counters()[('CONNECT', False)], 2)
+
+    def test_queue_limit(self):
+        """Test that events beyond the queue limit are dropped but counted"""
+        writer = AuditEventWriter(flush_interval=60, max_queue=2)
+        results = [writer.record('AUTH', mqtt_username=f'dev{index}') for index in range(3)]
+        self.assertEqual(results, [True, True, False])
+        writer.flush()
+        self.assertEqual(MQTTAuditLog.objects.count(), 2)
+        self.assertEqual(get_audit_counters()[('AUTH', True)], 3)
+
+
+class MQTTSettingsCountersTest(TestCase):
+    """Test cases for the MQTT settings page statistics"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(
+            username='auditstaff',
+            email='audit@example.com',
+            password='TestPass123!',
+            first_name='Audit',
+            last_name='Staff',
+            is_staff=True
+        )
+        self.writer = AuditEventWriter(flush_interval=60, sample_rates={'MESSAGE': 0})
+        self.addCleanup(setattr, audit, '_audit_writer', audit._audit_writer)
+        audit._audit_writer = self.writer
+
+    def test_page_does_not_count_table(self):
+        """Test that the settings page reads the running counters"""
+        self.writer.record('CONNECT')
+        self.writer.record('CONNECT', status=False)
+        for _ in range(5):
+            self.writer.record('MESSAGE')
+        self.writer.flush()
+        get_audit_counters()
+
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('energy:mqtt_settings'))
+        self.assertEqual(response.status_code, 200)
+        table = MQTTAuditLog._meta.db_table
+        self.assertFalse([q for q in queries.captured_queries
+                          if table in q['sql'] and 'COUNT(' in q['sql'].upper()])
+        stats = response.context['stats']
+        self.assertEqual((stats['total_connections'], stats['failed_connections'], stats['total_messages']),
+                         (1, 1, 5))
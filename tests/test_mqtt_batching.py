@@ -0,0 +1,132 @@
+"""
+Test suite for the MQTT measurement batch writer
+"""
+from unittest import mock
+from django.db import OperationalError
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from datetime import timedelta
+from energy.models import DeviceConfiguration, DeviceMeasurement, DeviceMeasurementDetail
+from energy.mqtt.batching import MeasurementBatchWriter
+from core.models import Plant, CERConfiguration
+
+User = get_user_model()
+
+
+class MeasurementBatchWriterTest(TestCase):
+    """Test cases for MeasurementBatchWriter"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='batchowner',
+            email='batch@example.com',
+            password='TestPass123!',
+            first_name='Batch',
+            last_name='Owner'
+        )
+        self.cer = CERConfiguration.objects.create(
+            name='Batch CER',
+            code='CER_BATCH',
+            primary_substation='Cabina Primaria Test'
+        )
+        self.plant = Plant.objects.create(
+            name='Batch Plant',
+            pod_code='IT001E00000002',
+            plant_type='CONSUMER',
+            nominal_power=6.0,
+            connection_voltage='230V',
+            installation_date='2023-01-01',
+            owner=self.user,
+            cer_configuration=self.cer
+        )
+        self.device = DeviceConfiguration.objects.create(
+            device_id='shellypro3em-batch',
+            device_type='SHELLY_PRO_3EM',
+            plant=self.plant,
+            mqtt_topic_template='cercollettiva/IT001E00000002/shellypro3em-batch'
+        )
+
+    def _measurement(self, timestamp, power=100.0):
+        return DeviceMeasurement(
+            device=self.device,
+            plant=self.plant,
+            timestamp=timestamp,
+            power=power,
+            voltage=230.0,
+            current=power / 230.0,
+            measurement_type='POWER'
+        )
+
+    def _details(self):
+        return [
+            DeviceMeasurementDetail(phase=phase, voltage=230.0, current=1.0, power=230.0)
+            for phase in ('a', 'b', 'c')
+        ]
+
+    def test_flush_writes_parents_and_children(self):
+        """Test that a flush inserts measurements and phase details"""
+        writer = MeasurementBatchWriter(max_rows=1000, max_delay=60)
+        now = timezone.now()
+        for i in range(5):
+            writer.add(self._measurement(now + timedelta(seconds=i)), self._details())
+
+        self.assertEqual(DeviceMeasurement.objects.count(), 0)
+        self.assertEqual(writer.pending_rows, 20)
+
+        # bulk_create parent + bulk_create children + lettura e upsert di
+        # DeviceLatestState dentro un'unica transazione (savepoint incluso)
+        with self.assertNumQueries(6):
+            rows = writer.flush()
+
+        self.assertEqual(rows, 20)
+        self.assertEqual(DeviceMeasurement.objects.count(), 5)
+        self.assertEqual(DeviceMeasurementDetail.objects.count(), 15)
+        for measurement in DeviceMeasurement.objects.all():
+            self.assertEqual(measurement.phase_details.count(), 3)
+            # Stesso timestamp del padre: stessa partizione mensile
+            self.assertEqual(set(measurement.phase_details.values_list('timestamp', flat=True)),
+                             {measurement.timestamp})
+
+    def test_size_trigger(self):
+        """Test that reaching max_rows flushes inline"""
+        writer = MeasurementBatchWriter(max_rows=8, max_delay=60)
+        now = timezone.now()
+        writer.add(self._measurement(now), self._details())
+        self.assertEqual(DeviceMeasurement.objects.count(), 0)
+        writer.add(self._measurement(now + timedelta(seconds=1)), self._details())
+        self.assertEqual(DeviceMeasurement.objects.count(), 2)
+        self.assertEqual(writer.pending_rows, 0)
+
+        stats = writer.get_stats()
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(stats['last_batch_size'], 8)
+
+    def test_stop_flushes_pending(self):
+        """Test the flush-on-shutdown hook"""
+        writer = MeasurementBatchWriter(max_rows=1000, max_delay=60)
+        writer.add(self._measurement(timezone.now()))
+        writer.stop()
+        self.assertEqual(DeviceMeasurement.objects.count(), 1)
+        self.assertEqual(writer.flush(), 0)
+
+    def test_failed_flush_is_retained_and_retried(self):
+        """Test that a batch is kept after a database error and written on retry"""
+        writer = MeasurementBatchWriter(max_rows=1000, max_delay=60)
+        writer.add(self._measurement(timezone.now()), self._details())
+
+        with mock.patch.object(DeviceMeasurement.objects, 'bulk_create',
+                               side_effect=OperationalError('database down')):
+            self.assertEqual(writer.flush(), 0)
+
+        stats = writer.get_stats()
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['retained_batches'], 1)
+        self.assertTrue(stats['retrying'])
+        self.assertEqual(writer.pending_rows, 4)
+
+        self.assertEqual(writer.flush(), 4)
+        self.assertEqual(DeviceMeasurement.objects.count(), 1)
+        self.assertEqual(DeviceMeasurementDetail.objects.count(), 3)
+        self.assertFalse(writer.get_stats()['retrying'])
@@ -0,0 +1,75 @@
+"""
+Test suite for the single-decode MQTT payload codec
+"""
+import json
+from unittest import mock
+from django.test import SimpleTestCase
+from energy.mqtt import codec
+from energy.mqtt.codec import decode_message, KIND_POWER, KIND_ENERGY
+from energy.mqtt.dedup import MessageDeduplicator
+
+POWER_TOPIC = 'cercollettiva/IT001E00000001/shellypro3em-codec/status/em:0'
+ENERGY_TOPIC = 'cercollettiva/IT001E00000001/shellypro3em-codec/status/emdata:0'
+
+POWER_PAYLOAD = {
+    'id': 0, 'total_act_power': 690.5, 'total_act': 1234.5, 'total_pf': 0.95,
+    'a_voltage': 230.0, 'a_current': 1.0, 'a_act_power': 230.0, 'a_pf': 0.9,
+    'b_voltage': 231.0, 'b_current': 1.0, 'b_act_power': 231.0, 'b_freq': 49.9,
+    'c_voltage': 229.0,
+}
+
+
+class DecodeMessageTest(SimpleTestCase):
+    """Test cases for decode_message"""
+
+    def test_power_record(self):
+        """Test that a power payload is reduced to the fields used downstream"""
+        raw = json.dumps(POWER_PAYLOAD).encode('utf-8')
+        record = decode_message(POWER_TOPIC, raw)
+
+        self.assertEqual(record.kind, KIND_POWER)
+        self.assertEqual(record.power, 690.5)
+        self.assertEqual(record.energy_total, 1234.5)
+        self.assertEqual(record.voltage, 230.0)
+        self.assertEqual(record.power_factor, 0.95)
+        self.assertIs(record.raw, raw)
+        # La fase c non ha tutti i valori e viene ignorata
+        self.assertEqual(record.phases, (
+            ('a', 230.0, 1.0, 230.0, 0.9, 50.0),
+            ('b', 231.0, 1.0, 231.0, 1.0, 49.9),
+        ))
+        self.assertIs(decode_message(POWER_TOPIC, record), record)
+
+    def test_energy_record_and_reported_timestamp(self):
+        """Test energy topics and the device-reported timestamp"""
+        record = decode_message(ENERGY_TOPIC, b'{"total_act": 1500.0, "ts": 1700000000.5}')
+        self.assertEqual(record.kind, KIND_ENERGY)
+        self.assertEqual(record.energy_total, 1500.0)
+        self.assertEqual(record.reported_ts, 1700000000.5)
+
+    def test_invalid_payloads(self):
+        """Test that invalid JSON, non-objects and bad values are rejected"""
+        with self.assertLogs('energy.mqtt', level='WARNING'):
+            self.assertIsNone(decode_message(POWER_TOPIC, b'{not json'))
+            self.assertIsNone(decode_message(POWER_TOPIC, b'[1, 2]'))
+            self.assertIsNone(decode_message(POWER_TOPIC, b'{"total_act_power": "n/a"}'))
+            self.assertIsNone(decode_message(POWER_TOPIC, b'\xff\xfe'))
+
+    def test_stdlib_fallback(self):
+        """Test that the codec works without the accelerated backend"""
+        with mock.patch.object(codec, 'orjson', None):
+            self.assertEqual(codec.loads(b'{"a": 1}'), {'a': 1})
+            self.assertEqual(codec.loads('{"a": 1}'), {'a': 1})
+            self.assertEqual(codec.dumps({'a': 1}), b'{"a":1}')
+
+    def test_dedup_key_for_record(self):
+        """Test dedup keys built from records without re-serializing the payload"""
+        dedup = MessageDeduplicator(window=60, max_entries=100, shared=False)
+        with_ts = decode_message(ENERGY_TOPIC, b'{"total_act": 1.0, "ts": 17}')
+        self.assertEqual(dedup.key_for_record('dev-1', with_ts), ('dev-1', ENERGY_TOPIC, 17))
+
+        first = dedup.key_for_record('dev-1', decode_message(POWER_TOPIC, b'{"total_act_power": 1}'))
+        same = dedup.key_for_record('dev-1', decode_message(POWER_TOPIC, b'{"total_act_power": 1}'))
+        other = dedup.key_for_record('dev-1', decode_message(POWER_TOPIC, {'total_act_power': 2}))
+        self.assertEqual(first, same)
+        self.assertNotEqual(first, other)
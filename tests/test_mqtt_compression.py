@@ -0,0 +1,136 @@
+"""
+Test suite for deadband/swinging-door compression of power measurements
+"""
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from django.test import SimpleTestCase, override_settings
+from energy.models import DeviceMeasurement
+from energy.mqtt.compression import (
+    CompressionProfile,
+    MeasurementCompressor,
+    METHOD_DEADBAND,
+    METHOD_SWINGING_DOOR,
+)
+from energy.services.utils import aggregate_power_series
+
+START = datetime(2024, 5, 1, 12, 0, tzinfo=dt_timezone.utc)
+
+
+def power_profile(seconds, step=5):
+    """Steady load with noise, a step at 10 minutes and a ramp from 20 to 25 minutes"""
+    rng = random.Random(42)
+    readings = []
+    for second in range(0, seconds, step):
+        if second < 600:
+            power = 1000
+        elif second < 1200:
+            power = 2500
+        elif second < 1500:
+            power = 2500 + (second - 1200) * 2
+        else:
+            power = 3100
+        readings.append((second, power + rng.uniform(-3, 3)))
+    return readings
+
+
+class MeasurementCompressorTest(SimpleTestCase):
+    """Test cases for MeasurementCompressor"""
+
+    def setUp(self):
+        self.device = SimpleNamespace(pk=1, device_type='SHELLY_PRO_3EM')
+
+    def _compress(self, method, readings, max_interval=60):
+        compressor = MeasurementCompressor({
+            'SHELLY_PRO_3EM': CompressionProfile(method=method, power=10, voltage=2,
+                                                 current=0.05, max_interval=max_interval)
+        })
+        stored = []
+        for second, power in readings:
+            measurement = DeviceMeasurement(
+                timestamp=START + timedelta(seconds=second),
+                power=power, voltage=230.0, current=power / 230.0
+            )
+            stored.extend(compressor.offer(self.device, measurement))
+        stored.extend(compressor.release())
+        return compressor, [(s.timestamp - START.timestamp(), s.measurement.power) for s in stored]
+
+    @staticmethod
+    def _interpolate(points, second):
+        for (t0, v0), (t1, v1) in zip(points, points[1:]):
+            if t0 <= second <= t1:
+                return v0 if t1 == t0 else v0 + (v1 - v0) * (second - t0) / (t1 - t0)
+        raise AssertionError(f"{second} fuori dai punti salvati")
+
+    def _assert_reconstructs(self, method, tolerance, min_ratio):
+        readings = power_profile(1800)
+        compressor, points = self._compress(method, readings)
+        self.assertGreaterEqual(len(readings) / len(points), min_ratio)
+        for second, power in readings:
+            self.assertLessEqual(abs(self._interpolate(points, second) - power), tolerance)
+        gaps = [t1 - t0 for (t0, _), (t1, _) in zip(points, points[1:])]
+        self.assertLessEqual(max(gaps), 60)
+        self.assertEqual(compressor.get_stats()['offered'], len(readings))
+
+    def test_swinging_door_reconstructs_within_tolerance(self):
+        """Test that linear interpolation of stored points stays within tolerance"""
+        self._assert_reconstructs(METHOD_SWINGING_DOOR, tolerance=10, min_ratio=5)
+
+    def test_deadband_reconstructs_step_changes(self):
+        """Test that deadband keeps the held sample before each change"""
+        # La rampa viene salvata a gradini: meno compressione e errore fino a due volte la tolleranza
+        self._assert_reconstructs(METHOD_DEADBAND, tolerance=20, min_ratio=4)
+
+    def test_steady_load_ratio(self):
+        """Test the row reduction for a steady load published every 2 seconds"""
+        readings = [(second, 1000.0) for second in range(0, 3600, 2)]
+        _, points = self._compress(METHOD_SWINGING_DOOR, readings)
+        self.assertGreaterEqual(len(readings) / len(points), 20)
+
+    def test_unconfigured_device_type_passthrough(self):
+        """Test that device types without a profile are stored unchanged"""
+        compressor = MeasurementCompressor({})
+        device = SimpleNamespace(pk=2, device_type='SHELLY_EM')
+        for second in range(3):
+            measurement = DeviceMeasurement(timestamp=START + timedelta(seconds=second),
+                                            power=100.0, voltage=230.0, current=0.4)
+            self.assertEqual(len(compressor.offer(device, measurement)), 1)
+
+    @override_settings(MQTT_SETTINGS={'COMPRESSION_DEVICE_TYPES': ['SHELLY_PRO_3EM'],
+                                      'COMPRESSION_MAX_INTERVAL': 60})
+    def test_chart_series_matches_uncompressed(self):
+        """Test that the energy views' chart series keeps its shape, ramp included"""
+        readings = power_profile(1800)
+        end = START + timedelta(seconds=1795)
+
+        def rows(samples):
+            return [(1, START + timedelta(seconds=second), power) for second, power in samples]
+
+        original = aggregate_power_series(rows(readings), 1, end=end)
+        _, points = self._compress(METHOD_SWINGING_DOOR, readings)
+        # Della rampa (61 letture) restano pochi estremi
+        self.assertLessEqual(len([second for second, _ in points if 1200 <= second <= 1500]), 10)
+        for method in (METHOD_SWINGING_DOOR, METHOD_DEADBAND):
+            _, points = self._compress(method, readings)
+            compressed = aggregate_power_series(rows(points), 1, end=end)
+            self.assertEqual([t for t, _ in original], [t for t, _ in compressed])
+            # Entro la tolleranza di compressione della potenza (10 W) anche durante la rampa
+            for (minute, expected), (_, actual) in zip(original, compressed):
+                self.assertLessEqual(abs(expected - actual), 10, f"{method} {minute:%H:%M}")
+
+    def test_chart_hold_follows_max_interval(self):
+        """Test that the chart repeats a device's last value only up to the configured max interval"""
+        rows = [(1, START, 100.0), (1, START + timedelta(minutes=10), 100.0)]
+        with override_settings(MQTT_SETTINGS={'COMPRESSION_DEVICE_TYPES': ['SHELLY_PRO_3EM'],
+                                              'COMPRESSION_MAX_INTERVAL': 600}):
+            self.assertEqual(len(aggregate_power_series(rows, 1)), 11)
+            # Tra due campioni il valore è interpolato linearmente, non ripetuto
+            ramp = [(1, START, 0.0), (1, START + timedelta(minutes=10), 600.0)]
+            self.assertEqual([round(value) for _, value in aggregate_power_series(ramp, 1)],
+                             [30, 90, 150, 210, 270, 330, 390, 450, 510, 570, 600])
+        with override_settings(MQTT_SETTINGS={'COMPRESSION_DEVICE_TYPES': ['SHELLY_PRO_3EM'],
+                                              'COMPRESSION_MAX_INTERVAL': 120}):
+            self.assertEqual([t.minute for t, _ in aggregate_power_series(rows, 1)], [0, 1, 10])
+        # Senza compressione un periodo senza campioni resta vuoto
+        with override_settings(MQTT_SETTINGS={}):
+            self.assertEqual(len(aggregate_power_series(rows, 1)), 2)
@@ -0,0 +1,170 @@
+"""
+Test suite for persistent MQTT sessions and manual acknowledgements
+"""
+import time
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.contrib.auth import get_user_model
+from energy.models import DeviceConfiguration, DeviceMeasurement
+from energy.mqtt import batching, compression, counters, dedup, latency, pipeline, presence, routing
+from energy.mqtt.batching import MeasurementBatchWriter
+from energy.mqtt.client import EnergyMQTTClient
+from energy.mqtt.compression import MeasurementCompressor
+from energy.mqtt.counters import EnergyCounterStore
+from energy.mqtt.dedup import MessageDeduplicator
+from energy.mqtt.inflight import InflightTracker
+from energy.mqtt.latency import IngestLatencyTracker
+from energy.mqtt.pipeline import IngestPipeline
+from energy.mqtt.presence import PresenceTracker
+from energy.mqtt.routing import TopicRoutingIndex
+from core.models import Plant, CERConfiguration
+from tests.fake_mqtt_broker import FakeMQTTBroker
+
+User = get_user_model()
+
+POWER_PAYLOAD = b'{"ts": 1714564800, "total_act_power": 950.0, "a_voltage": 230.0, "a_current": 4.1}'
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class InflightTrackerTest(SimpleTestCase):
+    """Test cases for InflightTracker"""
+
+    def setUp(self):
+        self.acked = []
+        self.tracker = InflightTracker(lambda mid, qos: self.acked.append(mid))
+
+    def test_acks_follow_receive_order(self):
+        """Test that a completed message waits for the ones received before it"""
+        first, second, third = (self.tracker.track(mid, 1) for mid in (1, 2, 3))
+        third.release()
+        second.release()
+        self.assertEqual(self.acked, [])
+        first.release()
+        self.assertEqual(self.acked, [1, 2, 3])
+        self.assertEqual(self.tracker.in_flight, 0)
+
+    def test_retained_message_waits_for_last_release(self):
+        """Test reference counting between pipeline and batch writer"""
+        message = self.tracker.track(5, 1)
+        message.retain()
+        message.release()
+        self.assertEqual(self.acked, [])
+        message.release()
+        self.assertEqual(self.acked, [5])
+
+    def test_qos0_not_tracked(self):
+        """Test that QoS 0 messages need no acknowledgement"""
+        self.assertIsNone(self.tracker.track(0, 0))
+        self.assertEqual(self.tracker.get_stats()['tracked'], 0)
+
+    def test_discard_drops_pending_acks(self):
+        """Test that messages of a closed connection are not acknowledged on the new one"""
+        stale = self.tracker.track(1, 1)
+        self.assertEqual(self.tracker.discard(), 1)
+        fresh = self.tracker.track(1, 1)
+        stale.release()
+        self.assertEqual(self.acked, [])
+        fresh.release()
+        self.assertEqual(self.acked, [1])
+
+
+@override_settings(MQTT_SETTINGS={'SESSION_EXPIRY': 3600})
+class PersistentSessionTest(TestCase):
+    """Test cases for the ingestion client against an in-process MQTT v5 broker"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='sessionowner',
+            email='session@example.com',
+            password='TestPass123!',
+            first_name='Session',
+            last_name='Owner'
+        )
+        self.cer = CERConfiguration.objects.create(
+            name='Session CER',
+            code='CER_SESSION',
+            primary_substation='Cabina Primaria Test'
+        )
+        self.plant = Plant.objects.create(
+            name='Session Plant',
+            pod_code='IT001E00000010',
+            plant_type='CONSUMER',
+            nominal_power=6.0,
+            connection_voltage='230V',
+            installation_date='2023-01-01',
+            owner=self.user,
+            cer_configuration=self.cer
+        )
+        self.device = DeviceConfiguration.objects.create(
+            device_id='shellypro3em-session',
+            device_type='SHELLY_PRO_3EM',
+            plant=self.plant,
+            mqtt_topic_template='cercollettiva/IT001E00000010/shellypro3em-session'
+        )
+        self.topic = 'cercollettiva/IT001E00000010/shellypro3em-session/status/em:0'
+
+        self.writer = MeasurementBatchWriter(max_rows=1000, max_delay=60)
+        for module, name, value in (
+            (routing, '_routing_index', TopicRoutingIndex()),
+            (batching, '_batch_writer', self.writer),
+            (presence, '_presence_tracker', PresenceTracker(flush_interval=60)),
+            (counters, '_counter_store', EnergyCounterStore(flush_interval=60)),
+            (dedup, '_deduplicator', MessageDeduplicator()),
+            (latency, '_latency_tracker', IngestLatencyTracker(flush_interval=60)),
+            (compression, '_compressor', MeasurementCompressor({})),
+        ):
+            self.addCleanup(setattr, module, name, getattr(module, name))
+            setattr(module, name, value)
+        self.addCleanup(setattr, pipeline, '_ingest_pipeline', pipeline._ingest_pipeline)
+        pipeline._ingest_pipeline = IngestPipeline()
+
+        self.broker = FakeMQTTBroker().start()
+        self.addCleanup(self.broker.stop)
+        self.client = EnergyMQTTClient()
+        self.assertTrue(self.client.configure(host='127.0.0.1', port=self.broker.port,
+                                              client_id='ingestor-test', clean_session=False))
+        self.assertTrue(self.client.start())
+        self.addCleanup(self.client.stop)
+
+    def test_persistent_session_connect(self):
+        """Test that the ingestor resumes a named session instead of starting a clean one"""
+        connect = self.broker.connects[0]
+        self.assertEqual(connect['client_id'], 'ingestor-test')
+        self.assertFalse(connect['clean_start'])
+        self.assertEqual(connect['session_expiry'], 3600)
+
+    def test_ack_after_batch_commit(self):
+        """Test that a QoS 1 message is acknowledged only once its rows are written"""
+        self.broker.publish(self.topic, POWER_PAYLOAD, qos=1, packet_id=7)
+        self.assertTrue(wait_for(lambda: self.writer.pending_rows > 0))
+        time.sleep(0.1)
+        self.assertEqual(self.broker.pubacks, [])
+
+        self.writer.flush()
+        self.assertTrue(wait_for(lambda: self.broker.pubacks == [7]))
+        self.assertEqual(DeviceMeasurement.objects.filter(device=self.device).count(), 1)
+
+        # Messaggi non salvabili: confermati subito, altrimenti verrebbero riconsegnati
+        self.broker.publish('cercollettiva/IT001/unknown/status/em:0', POWER_PAYLOAD, qos=1, packet_id=8)
+        self.assertTrue(wait_for(lambda: self.broker.pubacks == [7, 8]))
+
+    def test_reconnect_resumes_session(self):
+        """Test that paho reconnects alone and a resumed session is not resubscribed"""
+        self.assertTrue(wait_for(lambda: self.broker.subscribe_packets))
+        packets = len(self.broker.subscribe_packets)
+        self.broker.session_present = True
+        self.broker.drop_connections()
+
+        self.assertTrue(wait_for(lambda: len(self.broker.connects) == 2 and self.client.is_connected))
+        self.assertFalse(self.broker.connects[1]['clean_start'])
+        self.assertEqual(self.broker.connects[1]['client_id'], 'ingestor-test')
+        time.sleep(0.1)
+        self.assertEqual(len(self.broker.subscribe_packets), packets)
@@ -0,0 +1,97 @@
+"""
+Test suite for the standalone MQTT ingestion process
+"""
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from energy.apps import mqtt_autostart_enabled
+from energy.mqtt.client import EnergyMQTTClient
+from energy.mqtt.routing import get_config_version
+
+
+class MQTTAutostartTest(TestCase):
+    """Test cases for the web process auto-start switch"""
+
+    @override_settings(TESTING=False, MQTT_SETTINGS={'AUTOSTART': False})
+    def test_autostart_disabled_by_setting(self):
+        self.assertFalse(mqtt_autostart_enabled())
+
+    @override_settings(TESTING=False, MQTT_SETTINGS={})
+    def test_autostart_default_enabled(self):
+        self.assertTrue(mqtt_autostart_enabled())
+
+    @override_settings(TESTING=True, MQTT_SETTINGS={'AUTOSTART': True})
+    def test_autostart_disabled_in_tests(self):
+        self.assertFalse(mqtt_autostart_enabled())
+
+
+class RunMQTTIngestorCommandTest(TestCase):
+    """Test cases for the run_mqtt_ingestor management command"""
+
+    def test_requires_active_broker(self):
+        with self.assertRaises(CommandError):
+            call_command('run_mqtt_ingestor')
+
+
+class ConfigVersionTest(TestCase):
+    """Test cases for cross-process configuration change notification"""
+
+    def test_device_change_bumps_version(self):
+        from django.contrib.auth import get_user_model
+        from core.models import Plant, CERConfiguration
+        from energy.models import DeviceConfiguration
+
+        user = get_user_model().objects.create_user(
+            username='ingestor', email='ingestor@example.com', password='TestPass123!',
+            first_name='Ingestor', last_name='Test'
+        )
+        cer = CERConfiguration.objects.create(
+            name='Ingestor CER', code='CER_INGEST', primary_substation='Cabina Primaria Test'
+        )
+        plant = Plant.objects.create(
+            name='Ingestor Plant', pod_code='IT001E00000003', plant_type='CONSUMER',
+            nominal_power=6.0, connection_voltage='230V', installation_date='2023-01-01',
+            owner=user, cer_configuration=cer
+        )
+        before = get_config_version()
+        device = DeviceConfiguration.objects.create(
+            device_id='shellypro3em-ingest', device_type='SHELLY_PRO_3EM', plant=plant,
+            mqtt_topic_template='cercollettiva/IT001E00000003/shellypro3em-ingest'
+        )
+        after_create = get_config_version()
+        self.assertNotEqual(before, after_create)
+
+        # Gli aggiornamenti di last_seen non invalidano le configurazioni
+        device.save(update_fields=['last_seen'])
+        self.assertEqual(get_config_version(), after_create)
+
+    def test_device_changes_do_not_reload_everything(self):
+        """Test that saving devices never triggers a full configuration reload"""
+        from django.contrib.auth import get_user_model
+        from core.models import Plant, CERConfiguration
+        from energy.models import DeviceConfiguration
+
+        user = get_user_model().objects.create_user(
+            username='ingestorbulk', email='ingestorbulk@example.com', password='TestPass123!',
+            first_name='Ingestor', last_name='Bulk'
+        )
+        cer = CERConfiguration.objects.create(
+            name='Ingestor Bulk CER', code='CER_INGEST_BULK', primary_substation='Cabina Primaria Test'
+        )
+        plant = Plant.objects.create(
+            name='Ingestor Bulk Plant', pod_code='IT001E00000012', plant_type='CONSUMER',
+            nominal_power=6.0, connection_voltage='230V', installation_date='2023-01-01',
+            owner=user, cer_configuration=cer
+        )
+        with mock.patch.object(EnergyMQTTClient, 'is_connected', new_callable=mock.PropertyMock,
+                               return_value=True), \
+                mock.patch.object(EnergyMQTTClient, 'refresh_configurations') as refresh:
+            for index in range(5):
+                before = get_config_version()
+                DeviceConfiguration.objects.create(
+                    device_id=f'shellypro3em-bulk{index}', device_type='SHELLY_PRO_3EM', plant=plant,
+                    mqtt_topic_template=f'cercollettiva/IT001E00000012/shellypro3em-bulk{index}'
+                )
+                self.assertNotEqual(get_config_version(), before)
+        refresh.assert_not_called()
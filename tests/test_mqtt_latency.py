@@ -0,0 +1,161 @@
+"""
+Test suite for the per-topic ingest latency instrumentation
+"""
+import time
+from django.test import TestCase, SimpleTestCase
+from django.contrib.auth import get_user_model
+from energy.models import DeviceConfiguration, TopicMetrics
+from energy.mqtt.codec import decode_message
+from energy.mqtt.latency import IngestLatencyTracker, LatencyHistogram, reported_epoch
+from core.models import Plant, CERConfiguration
+
+User = get_user_model()
+
+
+class LatencyHistogramTest(SimpleTestCase):
+    """Test cases for LatencyHistogram"""
+
+    def test_percentiles(self):
+        """Test percentiles within the bucket resolution"""
+        histogram = LatencyHistogram()
+        for value in range(1, 1001):
+            histogram.record(float(value))
+        self.assertEqual(histogram.count, 1000)
+        self.assertAlmostEqual(histogram.percentile(50), 500, delta=500 * 0.1)
+        self.assertAlmostEqual(histogram.percentile(95), 950, delta=950 * 0.1)
+        self.assertAlmostEqual(histogram.percentile(99), 990, delta=990 * 0.1)
+        self.assertLessEqual(histogram.percentile(99), histogram.max)
+
+    def test_json_round_trip_merge(self):
+        """Test that serialized histograms merge like the originals"""
+        first, second = LatencyHistogram(), LatencyHistogram()
+        for value in (1.0, 2.0, 3.0):
+            first.record(value)
+        second.record(100.0)
+        merged = LatencyHistogram.from_json(first.to_json())
+        merged.merge(second)
+        self.assertEqual(merged.count, 4)
+        self.assertEqual(merged.max, 100.0)
+        self.assertAlmostEqual(merged.percentile(99), 100.0, delta=10)
+
+    def test_reported_epoch(self):
+        """Test device timestamps in seconds, milliseconds and invalid values"""
+        self.assertEqual(reported_epoch(1700000000), 1700000000.0)
+        self.assertEqual(reported_epoch(1700000000500), 1700000000.5)
+        self.assertIsNone(reported_epoch('n/a'))
+
+
+class IngestLatencyTrackerTest(TestCase):
+    """Test cases for IngestLatencyTracker"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='latencyowner',
+            email='latency@example.com',
+            password='TestPass123!',
+            first_name='Latency',
+            last_name='Owner'
+        )
+        self.cer = CERConfiguration.objects.create(
+            name='Latency CER',
+            code='CER_LATENCY',
+            primary_substation='Cabina Primaria Test'
+        )
+        self.plant = Plant.objects.create(
+            name='Latency Plant',
+            pod_code='IT001E00000007',
+            plant_type='CONSUMER',
+            nominal_power=6.0,
+            connection_voltage='230V',
+            installation_date='2023-01-01',
+            owner=self.user,
+            cer_configuration=self.cer
+        )
+        self.device = DeviceConfiguration.objects.create(
+            device_id='shellypro3em-latency',
+            device_type='SHELLY_PRO_3EM',
+            plant=self.plant,
+            mqtt_topic_template='cercollettiva/IT001E00000007/shellypro3em-latency'
+        )
+        self.topic = 'cercollettiva/IT001E00000007/shellypro3em-latency/status/em:0'
+        self.tracker = IngestLatencyTracker(flush_interval=60)
+
+    def _record(self, received_ago, parsed_ago, device_ts=None):
+        payload = b'{"total_act_power": 100}' if device_ts is None else (
+            b'{"total_act_power": 100, "ts": %d}' % device_ts
+        )
+        record = decode_message(self.topic, payload)
+        now = time.time()
+        record.received_at = now - received_ago
+        record.parsed_at = now - parsed_ago
+        return record
+
+    def test_flush_writes_hourly_row(self):
+        """Test that observations become a TopicMetrics row with percentiles"""
+        for _ in range(20):
+            record = self._record(0.050, 0.040, device_ts=int(time.time()) - 2)
+            self.tracker.observe_message(record, self.device)
+            self.tracker.observe_persisted([(record, self.device)])
+        self.tracker.observe_error(self.topic, self.device)
+
+        with self.assertNumQueries(6):  # devices, SAVEPOINT, insert, SELECT, upsert, RELEASE
+            self.assertEqual(self.tracker.flush(), 1)
+
+        row = TopicMetrics.objects.get(topic=self.topic)
+        self.assertEqual(row.period_type, 'HOUR')
+        self.assertEqual(row.device_type, 'SHELLY_PRO_3EM')
+        self.assertEqual(row.messages_count, 20)
+        self.assertEqual(row.errors_count, 1)
+        self.assertAlmostEqual(row.p95_processing_time, 50, delta=10)
+        self.assertAlmostEqual(row.stage_percentile('parse'), 10, delta=2)
+        self.assertAlmostEqual(row.stage_percentile('persist'), 40, delta=8)
+        self.assertGreater(row.stage_percentile('lag'), 1000)
+
+    def test_flushes_merge_into_same_row(self):
+        """Test that successive flushes accumulate into the hourly row"""
+        for _ in range(2):
+            record = self._record(0.010, 0.005)
+            self.tracker.observe_message(record, self.device)
+            self.tracker.observe_persisted([(record, self.device)])
+            self.tracker.flush()
+
+        row = TopicMetrics.objects.get(topic=self.topic)
+        self.assertEqual(row.messages_count, 2)
+        self.assertEqual(row.latency_stats['total']['count'], 2)
+        self.assertEqual(row.latency_stats['lag']['count'], 0)
+
+    def test_ingestors_accumulate_into_same_row(self):
+        """Test that flushes from separate ingestors add up instead of overwriting"""
+        other = IngestLatencyTracker(flush_interval=60)
+        for tracker, messages in ((self.tracker, 3), (other, 2)):
+            for _ in range(messages):
+                record = self._record(0.010, 0.005)
+                tracker.observe_message(record, self.device)
+                tracker.observe_persisted([(record, self.device)])
+        self.tracker.flush()
+        other.flush()
+
+        row = TopicMetrics.objects.get(topic=self.topic)
+        self.assertEqual(row.messages_count, 5)
+        self.assertEqual(row.latency_stats['total']['count'], 5)
+
+    def test_deleted_device_is_skipped(self):
+        """Test that increments of deleted devices do not block the flush"""
+        record = self._record(0.010, 0.005)
+        self.tracker.observe_message(record, self.device)
+        self.device.delete()
+        self.assertEqual(self.tracker.flush(), 0)
+        self.assertEqual(self.tracker.get_stats()['pending_topics'], 0)
+
+    def test_stats_per_device_type(self):
+        """Test published percentiles per device type, reset after publishing"""
+        record = self._record(0.020, 0.010)
+        self.tracker.observe_message(record, self.device)
+        self.tracker.observe_persisted([(record, self.device)])
+
+        stats = self.tracker.get_stats(reset=True)
+        stages = stats['device_types']['SHELLY_PRO_3EM']
+        self.assertEqual(set(stages), {'parse', 'persist', 'total'})
+        self.assertAlmostEqual(stages['total']['p99'], 20, delta=4)
+        self.assertEqual(self.tracker.get_stats()['device_types'], {})
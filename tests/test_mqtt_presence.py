@@ -0,0 +1,91 @@
+"""
+Test suite for the last_seen write-behind presence tracker
+"""
+from datetime import timedelta
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from energy.models import DeviceConfiguration
+from energy.mqtt import presence
+from energy.mqtt.presence import PresenceTracker
+from core.models import Plant, CERConfiguration
+
+User = get_user_model()
+
+
+class PresenceTrackerTest(TestCase):
+    """Test cases for PresenceTracker"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='presenceowner',
+            email='presence@example.com',
+            password='TestPass123!',
+            first_name='Presence',
+            last_name='Owner'
+        )
+        self.cer = CERConfiguration.objects.create(
+            name='Presence CER',
+            code='CER_PRESENCE',
+            primary_substation='Cabina Primaria Test'
+        )
+        self.plant = Plant.objects.create(
+            name='Presence Plant',
+            pod_code='IT001E00000004',
+            plant_type='CONSUMER',
+            nominal_power=6.0,
+            connection_voltage='230V',
+            installation_date='2023-01-01',
+            owner=self.user,
+            cer_configuration=self.cer
+        )
+        self.devices = [
+            DeviceConfiguration.objects.create(
+                device_id=f'shellypro3em-presence-{i}',
+                device_type='SHELLY_PRO_3EM',
+                plant=self.plant,
+                mqtt_topic_template=f'cercollettiva/IT001E00000004/shellypro3em-presence-{i}'
+            )
+            for i in range(3)
+        ]
+        self.tracker = PresenceTracker(flush_interval=60)
+
+    def test_coalesced_flush(self):
+        """Test that many touches become a single UPDATE"""
+        now = timezone.now()
+        for second in range(10):
+            for device in self.devices:
+                self.tracker.touch(device.pk, now + timedelta(seconds=second))
+        self.assertEqual(self.tracker.pending, 3)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.tracker.flush(), 3)
+
+        for device in self.devices:
+            device.refresh_from_db()
+            self.assertEqual(device.last_seen, now + timedelta(seconds=9))
+        self.assertEqual(self.tracker.flush(), 0)
+
+    def test_older_timestamp_ignored(self):
+        """Test that an out-of-order touch does not move last_seen back"""
+        now = timezone.now()
+        device = self.devices[0]
+        self.tracker.touch(device.pk, now)
+        self.tracker.touch(device.pk, now - timedelta(minutes=1))
+        self.assertEqual(self.tracker.last_seen(device.pk), now)
+
+    def test_is_online_reads_tracker(self):
+        """Test that is_online/status use the fresher in-memory timestamp"""
+        original = presence._presence_tracker
+        presence._presence_tracker = self.tracker
+        self.addCleanup(setattr, presence, '_presence_tracker', original)
+
+        device = self.devices[0]
+        self.assertFalse(device.is_online)
+        self.assertEqual(device.status, 'offline')
+
+        self.tracker.touch(device.pk, timezone.now())
+        self.assertIsNone(device.last_seen)
+        self.assertTrue(device.is_online)
+        self.assertEqual(device.status, 'idle')
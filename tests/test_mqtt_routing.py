@@ -0,0 +1,118 @@
+"""
+Test suite for the MQTT topic routing index
+"""
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from energy.models import DeviceConfiguration
+from energy.mqtt.routing import TopicRoutingIndex
+from core.models import Plant, CERConfiguration
+
+User = get_user_model()
+
+
+class TopicRoutingIndexTest(TestCase):
+    """Test cases for TopicRoutingIndex"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='routingowner',
+            email='routing@example.com',
+            password='TestPass123!',
+            first_name='Routing',
+            last_name='Owner'
+        )
+        self.cer = CERConfiguration.objects.create(
+            name='Routing CER',
+            code='CER_ROUTING',
+            primary_substation='Cabina Primaria Test'
+        )
+        self.plant = Plant.objects.create(
+            name='Routing Plant',
+            pod_code='IT001E00000001',
+            plant_type='CONSUMER',
+            nominal_power=6.0,
+            connection_voltage='230V',
+            installation_date='2023-01-01',
+            owner=self.user,
+            cer_configuration=self.cer
+        )
+        self.device = DeviceConfiguration.objects.create(
+            device_id='shellypro3em-001',
+            device_type='SHELLY_PRO_3EM',
+            plant=self.plant,
+            mqtt_topic_template='cercollettiva/IT001E00000001/shellypro3em-001'
+        )
+        self.index = TopicRoutingIndex()
+        self.index.rebuild(DeviceConfiguration.objects.filter(is_active=True))
+
+    def test_exact_topic_match(self):
+        """Test lookup of the Shelly status topics"""
+        base = 'cercollettiva/IT001E00000001/shellypro3em-001'
+        self.assertEqual(self.index.match(f'{base}/status/em:0').device_id, 'shellypro3em-001')
+        self.assertEqual(self.index.match(f'{base}/status/emdata:0').device_id, 'shellypro3em-001')
+
+    def test_wildcard_topic_match(self):
+        """Test lookup through the '#' pattern from get_mqtt_topics"""
+        config = self.index.match('cercollettiva/IT001E00000001/shellypro3em-001/status/sys')
+        self.assertIsNotNone(config)
+        self.assertEqual(config.device_id, 'shellypro3em-001')
+
+    def test_unknown_topic(self):
+        """Test that unknown topics are not routed"""
+        self.assertIsNone(self.index.match('cercollettiva/OTHER/device/status/em:0'))
+        self.assertIsNone(self.index.match('$SYS/broker/uptime'))
+
+    def test_match_needs_no_queries(self):
+        """Test that lookups never hit the database"""
+        with self.assertNumQueries(0):
+            self.index.match('cercollettiva/IT001E00000001/shellypro3em-001/status/em:0')
+            self.index.match('cercollettiva/IT001E00000001/unknown/status/em:0')
+
+    def test_incremental_update_and_remove(self):
+        """Test incremental maintenance of the index"""
+        other = DeviceConfiguration.objects.create(
+            device_id='shellyproem-002',
+            device_type='SHELLY_PRO_EM',
+            plant=self.plant,
+            mqtt_topic_template='VePro/IT001E00000001/shellyproem-002'
+        )
+        self.index.update_device(other)
+        self.assertEqual(
+            self.index.match('VePro/IT001E00000001/shellyproem-002/status/em:0').device_id,
+            'shellyproem-002'
+        )
+
+        other.is_active = False
+        self.index.update_device(other)
+        self.assertIsNone(self.index.match('VePro/IT001E00000001/shellyproem-002/status/em:0'))
+
+        self.index.remove_device('shellypro3em-001')
+        self.assertIsNone(self.index.match('cercollettiva/IT001E00000001/shellypro3em-001/status/em:0'))
+        self.assertIsNone(self.index.match('cercollettiva/IT001E00000001/shellypro3em-001/status/sys'))
+        self.assertEqual(len(self.index), 0)
+
+    def test_template_change_moves_topics(self):
+        """Test that changing the template drops the old topics"""
+        self.device.mqtt_topic_template = 'cercollettiva/IT001E00000001/renamed'
+        self.index.update_device(self.device)
+        self.assertIsNone(self.index.match('cercollettiva/IT001E00000001/shellypro3em-001/status/em:0'))
+        self.assertEqual(
+            self.index.match('cercollettiva/IT001E00000001/renamed/status/em:0').device_id,
+            'shellypro3em-001'
+        )
+
+    def test_rebuild_keeps_routing_during_reload(self):
+        """Test that lookups made while a rebuild runs still see the previous index"""
+        topic = 'cercollettiva/IT001E00000001/shellypro3em-001/status/em:0'
+        seen = []
+
+        def configs():
+            # Lookup concorrente a metà della ricostruzione
+            seen.append(self.index.match(topic))
+            seen.append(self.index.match('cercollettiva/IT001E00000001/shellypro3em-001/status/sys'))
+            yield from DeviceConfiguration.objects.filter(is_active=True)
+
+        self.index.rebuild(configs())
+        self.assertEqual([config.device_id for config in seen], ['shellypro3em-001'] * 2)
+        self.assertEqual(self.index.match(topic).device_id, 'shellypro3em-001')
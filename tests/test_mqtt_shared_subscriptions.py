@@ -0,0 +1,78 @@
+"""
+Test suite for MQTT v5 shared subscriptions
+"""
+import time
+from django.test import TestCase, SimpleTestCase, override_settings
+from energy.mqtt.client import EnergyMQTTClient
+from energy.mqtt.core import MQTTService, shared_topic
+from tests.fake_mqtt_broker import FakeMQTTBroker
+
+SHARED_SETTINGS = {'SHARED_GROUP': 'ingestors'}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class SharedTopicTest(SimpleTestCase):
+    """Test cases for shared_topic"""
+
+    @override_settings(MQTT_SETTINGS={})
+    def test_no_group_keeps_topic(self):
+        self.assertEqual(shared_topic('cercollettiva/+/+/status/em:0'), 'cercollettiva/+/+/status/em:0')
+
+    @override_settings(MQTT_SETTINGS=SHARED_SETTINGS)
+    def test_group_prefix(self):
+        self.assertEqual(
+            shared_topic('cercollettiva/+/+/status/em:0'),
+            '$share/ingestors/cercollettiva/+/+/status/em:0'
+        )
+        # Idempotente sui filtri già condivisi
+        self.assertEqual(
+            shared_topic('$share/ingestors/cercollettiva/#'),
+            '$share/ingestors/cercollettiva/#'
+        )
+
+
+@override_settings(MQTT_SETTINGS=SHARED_SETTINGS)
+class SharedSubscriptionBrokerTest(TestCase):
+    """Test cases against an in-process MQTT v5 broker"""
+
+    def setUp(self):
+        self.broker = FakeMQTTBroker().start()
+        self.addCleanup(self.broker.stop)
+
+    def test_energy_client_uses_v5_shared_subscription(self):
+        client = EnergyMQTTClient()
+        self.assertTrue(client.configure(host='127.0.0.1', port=self.broker.port))
+        self.assertTrue(client.start())
+        self.addCleanup(client.stop)
+
+        self.assertEqual(self.broker.connects[0]['level'], 5)
+
+        client.subscribe('cercollettiva/+/+/status/em:0')
+        self.assertTrue(self.broker.subscribed.wait(5))
+        self.assertIn('$share/ingestors/cercollettiva/+/+/status/em:0', self.broker.subscriptions)
+
+        # Il broker consegna il topic reale, non il filtro condiviso
+        self.broker.publish('cercollettiva/IT001/unknown-device/status/em:0', '{"total_act_power": 10}')
+        self.assertTrue(wait_for(lambda: client._workers.get_stats()['processed'] == 1))
+
+        client.unsubscribe('cercollettiva/+/+/status/em:0')
+        self.assertTrue(wait_for(lambda: self.broker.unsubscriptions))
+        self.assertEqual(self.broker.unsubscriptions, ['$share/ingestors/cercollettiva/+/+/status/em:0'])
+
+    def test_service_register_handler_uses_shared_subscription(self):
+        service = MQTTService()
+        service.configure(host='127.0.0.1', port=self.broker.port)
+        self.addCleanup(service.stop)
+        self.assertTrue(wait_for(lambda: service._connected))
+
+        service.register_handler('VePro/+/+/status/em:0', lambda *args: None)
+        self.assertTrue(self.broker.subscribed.wait(5))
+        self.assertIn('$share/ingestors/VePro/+/+/status/em:0', self.broker.subscriptions)
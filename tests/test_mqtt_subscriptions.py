@@ -0,0 +1,146 @@
+"""
+Test suite for incremental MQTT subscription management
+"""
+import math
+import time
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.reasoncodes import ReasonCode
+from django.test import SimpleTestCase, TestCase, override_settings
+from energy.models import DeviceConfiguration
+from energy.mqtt.client import EnergyMQTTClient
+from energy.mqtt.subscriptions import SubscriptionManager
+from tests.fake_mqtt_broker import FakeMQTTBroker
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class RecordingClient:
+    """Client che registra i pacchetti SUBSCRIBE/UNSUBSCRIBE inviati"""
+
+    def __init__(self):
+        self.subscribe_packets = []
+        self.unsubscribe_packets = []
+        self._mid = 0
+
+    def subscribe(self, topics):
+        self._mid += 1
+        self.subscribe_packets.append([topic for topic, qos in topics])
+        return mqtt.MQTT_ERR_SUCCESS, self._mid
+
+    def unsubscribe(self, topics):
+        self._mid += 1
+        self.unsubscribe_packets.append(list(topics))
+        return mqtt.MQTT_ERR_SUCCESS, self._mid
+
+
+@override_settings(MQTT_SETTINGS={})
+class SubscriptionManagerTest(SimpleTestCase):
+    """Test cases for SubscriptionManager"""
+
+    def setUp(self):
+        self.client = RecordingClient()
+        self.manager = SubscriptionManager(lambda: self.client, batch_size=2, debounce=0.05, max_delay=1)
+
+    def test_sync_sends_only_differences(self):
+        """Test that only added and removed topics are sent, several per packet"""
+        self.manager.set_owner('dev1', ['a/1', 'a/2', 'a/3'])
+        self.assertEqual(self.manager.sync(), 2)
+        self.assertEqual(self.client.subscribe_packets, [['a/1', 'a/2'], ['a/3']])
+
+        self.manager.set_owner('dev1', ['a/2', 'a/3', 'a/4'])
+        self.manager.sync()
+        self.assertEqual(self.client.subscribe_packets[-1], ['a/4'])
+        self.assertEqual(self.client.unsubscribe_packets, [['a/1']])
+        self.assertEqual(self.manager.sync(), 0)
+        self.assertEqual(self.manager.active, {'a/2', 'a/3', 'a/4'})
+
+    def test_shared_topics_are_reference_counted(self):
+        """Test that a topic stays subscribed while another owner still needs it"""
+        self.manager.set_owner('dev1', ['plant/#'])
+        self.manager.set_owner('dev2', ['plant/#'])
+        self.manager.sync()
+        self.manager.remove_owner('dev1')
+        self.assertEqual(self.manager.sync(), 0)
+        self.manager.remove_owner('dev2')
+        self.manager.sync()
+        self.assertEqual(self.client.unsubscribe_packets, [['plant/#']])
+
+    def test_burst_is_debounced(self):
+        """Test that a burst of device changes produces a single sync"""
+        manager = SubscriptionManager(lambda: self.client, batch_size=100, debounce=0.05, max_delay=1)
+        for index in range(50):
+            manager.set_owner(f'dev{index}', [f'plant/dev{index}/status/#'])
+            manager.schedule()
+        self.assertTrue(wait_for(lambda: manager.get_stats()['syncs'] == 1))
+        time.sleep(0.1)
+        self.assertEqual(manager.get_stats()['syncs'], 1)
+        self.assertEqual([len(packet) for packet in self.client.subscribe_packets], [50])
+
+    def test_rejected_topic_is_not_active(self):
+        """Test that topics refused in the SUBACK are retried on the next sync"""
+        self.manager.set_owner('dev1', ['a/1', 'a/2'])
+        self.manager.sync()
+        granted = ReasonCode(PacketTypes.SUBACK, identifier=1)
+        refused = ReasonCode(PacketTypes.SUBACK, identifier=0x87)
+        self.manager.on_subscribe(None, None, 1, [granted, refused], None)
+        self.assertEqual(self.manager.active, {'a/1'})
+        self.manager.sync()
+        self.assertEqual(self.client.subscribe_packets[-1], ['a/2'])
+
+    def test_reset_resubscribes_everything(self):
+        """Test that a new session resubscribes the whole desired set"""
+        self.manager.set_owner('dev1', ['a/1'])
+        self.manager.sync()
+        self.manager.reset()
+        self.manager.sync()
+        self.assertEqual(self.client.subscribe_packets, [['a/1'], ['a/1']])
+
+
+@override_settings(MQTT_SETTINGS={'SUBSCRIBE_DEBOUNCE': 0.05, 'SUBSCRIBE_BATCH_SIZE': 100})
+class BulkDeviceImportTest(TestCase):
+    """Test cases for device changes against an in-process MQTT v5 broker"""
+
+    def setUp(self):
+        self.broker = FakeMQTTBroker().start()
+        self.addCleanup(self.broker.stop)
+
+    def test_bulk_import_batches_subscriptions(self):
+        """Test that importing many devices does not resubscribe everything"""
+        client = EnergyMQTTClient()
+        self.assertTrue(client.configure(host='127.0.0.1', port=self.broker.port))
+        self.assertTrue(client.start())
+        self.addCleanup(client.stop)
+
+        devices = [
+            DeviceConfiguration(
+                device_id=f'shellypro3em-{index:03d}', device_type='SHELLY_PRO_3EM',
+                vendor=DeviceConfiguration.VENDOR_SHELLY, model='pro_3em', is_active=True,
+                mqtt_topic_template=f'cercollettiva/IT001E00000009/shellypro3em-{index:03d}'
+            )
+            for index in range(200)
+        ]
+        for device in devices:
+            client.update_device(device)
+
+        per_device = len(client._device_manager.get_device_topics()[devices[0].device_id])
+        topics = len(client._subscriptions.desired)
+        self.assertEqual(topics, 200 * per_device)
+        self.assertTrue(wait_for(lambda: len(self.broker.subscriptions) == topics))
+        self.assertEqual(len(self.broker.subscribe_packets), math.ceil(topics / 100))
+        self.assertEqual(self.broker.unsubscribe_packets, [])
+
+        # Disattivazione di un dispositivo: solo i suoi topic
+        devices[0].is_active = False
+        client.update_device(devices[0])
+        self.assertTrue(wait_for(lambda: self.broker.unsubscribe_packets))
+        self.assertEqual(len(self.broker.unsubscribe_packets), 1)
+        self.assertEqual(len(self.broker.unsubscribe_packets[0]), per_device)
+        self.assertEqual(len(client.subscribed_topics), topics - per_device)
@@ -0,0 +1,87 @@
+"""
+Test suite for the sharded MQTT ingestion workers
+"""
+import threading
+from collections import defaultdict
+from django.test import SimpleTestCase
+from energy.mqtt.workers import IngestionWorkerPool
+
+
+def device_key(topic):
+    return topic.split('/')[2]
+
+
+class IngestionWorkerPoolTest(SimpleTestCase):
+    """Test cases for IngestionWorkerPool"""
+
+    def setUp(self):
+        self.calls = defaultdict(list)
+        self.threads = defaultdict(set)
+
+    def handler(self, topic, payload):
+        device_id = device_key(topic)
+        self.calls[device_id].append(payload)
+        self.threads[device_id].add(threading.current_thread().name)
+
+    def test_partition_is_stable_per_device(self):
+        """Test that all topics of a device map to the same worker"""
+        pool = IngestionWorkerPool(self.handler, key_func=device_key, num_workers=4)
+        power = pool.partition_for('cercollettiva/POD1/dev-1/status/em:0')
+        energy = pool.partition_for('cercollettiva/POD1/dev-1/status/emdata:0')
+        self.assertEqual(power, energy)
+        self.assertEqual(power, pool.partition_for('cercollettiva/POD1/dev-1/status/em:0'))
+
+    def test_per_device_ordering(self):
+        """Test that messages of each device are processed in arrival order"""
+        pool = IngestionWorkerPool(self.handler, key_func=device_key, num_workers=4)
+        pool.start()
+        devices = [f'dev-{i}' for i in range(20)]
+        for seq in range(50):
+            for device_id in devices:
+                pool.submit(f'cercollettiva/POD/{device_id}/status/em:0', seq)
+        pool.join()
+        pool.stop()
+
+        for device_id in devices:
+            self.assertEqual(self.calls[device_id], list(range(50)))
+            self.assertEqual(len(self.threads[device_id]), 1)
+        # I dispositivi sono distribuiti su più worker
+        used = set().union(*self.threads.values())
+        self.assertGreater(len(used), 1)
+
+        stats = pool.get_stats()
+        self.assertEqual(stats['processed'], 1000)
+        self.assertEqual(stats['dropped'], 0)
+
+    def test_block_policy_drops_after_timeout(self):
+        """Test that a full worker queue drops the message once the block timeout expires"""
+        pool = IngestionWorkerPool(self.handler, key_func=device_key, num_workers=1, queue_size=2,
+                                   overload_policy='block', block_timeout=0)
+        topic = 'cercollettiva/POD/dev-1/status/em:0'
+        self.assertTrue(pool.submit(topic, 1))
+        self.assertTrue(pool.submit(topic, 2))
+        self.assertFalse(pool.submit(topic, 3))
+        self.assertEqual(pool.get_stats()['dropped'], 1)
+
+        # All'avvio i messaggi accodati vengono elaborati, poi stop() ferma i worker
+        pool.start()
+        pool.stop()
+        self.assertEqual(self.calls['dev-1'], [1, 2])
+        self.assertFalse(pool.is_running)
+
+    def test_handler_errors_do_not_stop_worker(self):
+        """Test that an exception in the handler is counted and skipped"""
+        def failing(topic, payload):
+            if payload == 'bad':
+                raise ValueError('bad payload')
+            self.handler(topic, payload)
+
+        pool = IngestionWorkerPool(failing, key_func=device_key, num_workers=2)
+        pool.start()
+        topic = 'cercollettiva/POD/dev-1/status/em:0'
+        for payload in ('ok-1', 'bad', 'ok-2'):
+            pool.submit(topic, payload)
+        pool.join()
+        pool.stop()
+        self.assertEqual(self.calls['dev-1'], ['ok-1', 'ok-2'])
+        self.assertEqual(pool.get_stats()['errors'], 1)
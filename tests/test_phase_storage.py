@@ -0,0 +1,129 @@
+"""
+Test suite for the packed per-phase measurement storage
+"""
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from energy.api.serializers import DeviceMeasurementSerializer
+from energy.models import DeviceConfiguration, DeviceMeasurement, DeviceMeasurementDetail
+from energy.models.device import pack_phase_details, unpack_phase_details
+from energy.mqtt.batching import MeasurementBatchWriter
+from core.models import Plant, CERConfiguration
+
+User = get_user_model()
+
+
+def _details():
+    return [
+        DeviceMeasurementDetail(phase='a', voltage=230.1, current=1.5, power=310.2, power_factor=0.93, frequency=50.01),
+        DeviceMeasurementDetail(phase='b', voltage=229.8, current=0.0, power=0.0, power_factor=None, frequency=50.01),
+        DeviceMeasurementDetail(phase='c', voltage=231.4, current=-2.25, power=-480.0, power_factor=-0.91, frequency=49.99),
+    ]
+
+
+class PhasePackingTest(SimpleTestCase):
+    """Test cases for the phase_data binary format"""
+
+    def test_round_trip(self):
+        """Test that packed values are decoded exactly, including missing values"""
+        data = pack_phase_details(_details())
+        self.assertEqual(len(data), 1 + 3 * 41)
+        self.assertEqual(unpack_phase_details(memoryview(data)), [
+            ('a', 230.1, 1.5, 310.2, 0.93, 50.01),
+            ('b', 229.8, 0.0, 0.0, None, 50.01),
+            ('c', 231.4, -2.25, -480.0, -0.91, 49.99),
+        ])
+        self.assertIsNone(pack_phase_details([]))
+
+    def test_unknown_version(self):
+        """Test that an unsupported format version is rejected"""
+        with self.assertRaises(ValueError):
+            unpack_phase_details(b'\x02')
+
+
+class PackedPhaseStorageTest(TestCase):
+    """Test cases for the packed phase storage mode and the row migration"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='phaseowner',
+            email='phase@example.com',
+            password='TestPass123!',
+            first_name='Phase',
+            last_name='Owner'
+        )
+        self.cer = CERConfiguration.objects.create(
+            name='Phase CER',
+            code='CER_PHASE',
+            primary_substation='Cabina Primaria Test'
+        )
+        self.plant = Plant.objects.create(
+            name='Phase Plant',
+            pod_code='IT001E00000011',
+            plant_type='CONSUMER',
+            nominal_power=6.0,
+            connection_voltage='230V',
+            installation_date='2023-01-01',
+            owner=self.user,
+            cer_configuration=self.cer
+        )
+        self.device = DeviceConfiguration.objects.create(
+            device_id='shellypro3em-phase',
+            device_type='SHELLY_PRO_3EM',
+            plant=self.plant,
+            mqtt_topic_template='cercollettiva/IT001E00000011/shellypro3em-phase'
+        )
+
+    def _measurement(self):
+        return DeviceMeasurement(
+            device=self.device,
+            plant=self.plant,
+            timestamp=timezone.now(),
+            power=-169.8,
+            voltage=230.4,
+            current=3.75,
+            measurement_type='POWER'
+        )
+
+    def _write(self, phase_storage):
+        writer = MeasurementBatchWriter(max_rows=1000, max_delay=60, phase_storage=phase_storage)
+        writer.add(self._measurement(), _details())
+        return writer.flush()
+
+    def _serialized(self, measurement_id):
+        measurement = DeviceMeasurement.objects.prefetch_related('phase_details').get(pk=measurement_id)
+        return DeviceMeasurementSerializer(measurement).data['phase_details']
+
+    def test_packed_writes_single_row(self):
+        """Test that packed mode writes one row and serializes like the row mode"""
+        self.assertEqual(self._write('rows'), 4)
+        rows_id = DeviceMeasurement.objects.get().pk
+        self.assertEqual(self._write('packed'), 1)
+        packed = DeviceMeasurement.objects.exclude(pk=rows_id).get()
+
+        self.assertEqual(DeviceMeasurementDetail.objects.filter(measurement=packed).count(), 0)
+        self.assertEqual(self._serialized(packed.pk), self._serialized(rows_id))
+        phases = packed.phases
+        self.assertEqual([detail.phase for detail in phases], ['a', 'b', 'c'])
+        self.assertEqual(phases[2].get_phase_power_metrics()['active_power'], -480.0)
+        self.assertEqual(phases[0].timestamp, packed.timestamp)
+
+    def test_pack_existing_details(self):
+        """Test that existing detail rows are packed into their measurements and removed"""
+        for _ in range(3):
+            self._write('rows')
+        expected = {pk: self._serialized(pk) for pk in DeviceMeasurement.objects.values_list('pk', flat=True)}
+
+        out = StringIO()
+        call_command('pack_phase_details', '--dry-run', stdout=out)
+        self.assertIn('9 righe di dettaglio in 3 misurazioni', out.getvalue())
+        self.assertEqual(DeviceMeasurementDetail.objects.count(), 9)
+
+        call_command('pack_phase_details', '--batch-size', '2', '--max-batches', '1', stdout=StringIO())
+        self.assertEqual(DeviceMeasurementDetail.objects.count(), 3)
+        call_command('pack_phase_details', '--batch-size', '2', stdout=StringIO())
+        self.assertFalse(DeviceMeasurementDetail.objects.exists())
+        self.assertEqual({pk: self._serialized(pk) for pk in expected}, expected)